@@ -2,8 +2,13 @@
 import eventlet
 eventlet.monkey_patch()
 
+import functools
+import gc
 import os
-from flask import Flask, request, jsonify
+import time
+import click
+import greenlet
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
 from flask_socketio import SocketIO, join_room, leave_room, emit
 from datetime import datetime, timezone
@@ -12,12 +17,53 @@ from datetime import datetime, timezone
 from dotenv import load_dotenv
 load_dotenv()
 
-from routes.boards import boards
+from routes.boards import boards, commit_ops
+from persistence import board_writes
+import db
+from board_cache import board_cache
+from db_pool import DBUnavailable, db_pool
+from serialization import FastJSONProvider, SocketIOJSON
+from compression import (
+    RESPONSE_COMPRESSION, RESPONSE_COMPRESSION_MIN_SIZE, WS_COMPRESSION, WebSocketCompressionMiddleware
+)
+from stroke_codec import StrokeCodecError, decode_stroke, decoded_strokes, encode_stroke, pack_lines, unpack_lines
+from simplify import STROKE_SIMPLIFY_TOLERANCE, compact_board_strokes, simplify_lines
+from scaling import (
+    ROOM_SYNC_CHANNEL, ROOM_SYNC_REPLY, ROOM_SYNC_REQUEST, ROOM_SYNC_TIMEOUT,
+    SOCKETIO_MESSAGE_QUEUE, create_client_manager
+)
+from fanout import ROOM_TICK_HZ, RoomFanout
+from erase import EraseError, parse_erase_path
+from signaling import CandidateRelay, VoiceRooms
+from presence import Presence, parse_presence
+from tiles import line_bounds, parse_viewport
+from room_state import RoomRegistry, RoomState, ROOM_FLUSH_INTERVAL, load_room_from_board
+from history import board_history
+from elements import board_elements
+from thumbnails import board_images
+from jobs import job_runner
+from maintenance import COMPACT_HISTORY, COMPACT_STROKES, MIGRATE_ELEMENTS, RENDER_THUMBNAILS
+from ratelimit import (
+    MAX_BOARD_POINTS, MAX_REQUEST_BYTES, MAX_STROKE_POINTS, ROOM_EVENTS, SOCKET_MAX_MESSAGE_BYTES,
+    count_points, event_scope, rest_limits, socket_limits
+)
+from log import get_logger
+from metrics import (
+    FANOUT_EMIT_SECONDS, GREENLETS, HTTP_REQUEST_BYTES, HTTP_REQUEST_SECONDS, HTTP_REQUESTS_REJECTED,
+    HTTP_RESPONSE_BYTES, HUB_TIMERS, ROOM_MEMBERS, ROOM_MEMBERS_MAX, ROOMS, SOCKET_EVENTS, SOCKET_EVENTS_REJECTED,
+    SOCKET_HANDLER_SECONDS, record_stats, registry
+)
+
+log = get_logger('app')
 
 app = Flask(__name__)
+# ObjectId/datetime aware JSON, encoded with orjson when available
+app.json = FastJSONProvider(app)
 
 # Configuration
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
+# Larger request bodies are refused with 413 before they are read
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BYTES
 
 # --- Start of updated configuration ---
 # CORS origins from environment or defaults.
@@ -25,10 +71,17 @@ app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-i
 # You must set your actual production frontend URL in the CORS_ORIGINS environment variable on Render.
 cors_origins = os.environ.get('CORS_ORIGINS', 'http://localhost:5173,http://localhost:3000,http://localhost:5000').split(',')
 
-print(f"Starting CanvasConnect Backend...")
-print(f"Secret Key: {'SET' if os.environ.get('SECRET_KEY') else 'DEFAULT'}")
-print(f"CORS Origins: {cors_origins}")
-print(f" MongoDB URI: {'SET' if os.environ.get('MONGO_URI') else 'NOT SET'}")
+log.info(
+    "Starting CanvasConnect Backend",
+    secret_key='SET' if os.environ.get('SECRET_KEY') else 'DEFAULT',
+    cors_origins=','.join(cors_origins),
+    mongo_uri='SET' if os.environ.get('MONGO_URI') else 'NOT SET'
+)
+
+# Shared message queue so several processes can serve the same rooms
+client_manager = create_client_manager()
+socketio_options = {'client_manager': client_manager} if client_manager else {}
+log.info("Socket.IO message queue", queue=SOCKETIO_MESSAGE_QUEUE or 'NONE (single process)')
 
 socketio = SocketIO(
     app,
@@ -37,23 +90,53 @@ socketio = SocketIO(
     transports=['websocket', 'polling'],
     allow_upgrades=True,
     ping_timeout=60,
-    ping_interval=25
+    ping_interval=25,
+    json=SocketIOJSON,
+    # Long-polling payloads; WebSocket frames use permessage-deflate below
+    http_compression=RESPONSE_COMPRESSION,
+    compression_threshold=RESPONSE_COMPRESSION_MIN_SIZE,
+    # Larger messages close the connection before they are decoded
+    max_http_buffer_size=SOCKET_MAX_MESSAGE_BYTES,
+    **socketio_options
 )
+app.wsgi_app = WebSocketCompressionMiddleware(app.wsgi_app)
+log.info("WebSocket compression", enabled=WS_COMPRESSION)
 
 # Enable CORS to allow frontend (on different port) to communicate with backend
-CORS(app, resources={r"/api/*": {"origins": cors_origins}})
+CORS(app, resources={r"/api/*": {"origins": cors_origins}}, expose_headers=["X-Next-Cursor"])
+
+# MongoDB is reached in the background, so startup never waits on it
+db.connection.start()
 # --- End of updated configuration ---
 
-# Health check endpoint
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                     method=request.method, route=route, status=str(response.status_code))
+        HTTP_REQUEST_BYTES.observe(request.content_length or 0, method=request.method, route=route)
+        # Streamed bodies have no length up front and are left out
+        if not response.is_streamed:
+            HTTP_RESPONSE_BYTES.observe(response.calculate_content_length() or 0,
+                                        method=request.method, route=route)
+    return response
+
+# Health check endpoint; reads the connector's last result and never touches MongoDB
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    try:
-        # Test database connection safely
-        from db import test_mongodb_connection
-        is_connected, db_message = test_mongodb_connection()
-        db_status = "connected" if is_connected else f"error: {db_message}"
-    except Exception as e:
-        db_status = f"error: {str(e)}"
+    health = db.connection.health()
+    if health['state'] == 'connected':
+        db_status = "connected"
+    elif health['error']:
+        db_status = f"error: {health['error']}"
+    else:
+        db_status = health['state']
 
     return jsonify({
         'status': 'healthy',
@@ -63,6 +146,55 @@ def health_check():
         'version': 'v1.1-mock-data-enabled'
     })
 
+# Liveness: the process and its event loop are responding
+@app.route('/api/health/live', methods=['GET'])
+def liveness():
+    return jsonify({'status': 'alive', 'timestamp': datetime.now(timezone.utc).isoformat()})
+
+# Readiness: MongoDB answered the last background ping and calls are not short-circuited
+@app.route('/api/health/ready', methods=['GET'])
+def readiness():
+    health = db.connection.health()
+    breaker = db_pool.breaker.state
+    ready = health['state'] in ('connected', 'disabled') and breaker == 'closed'
+    return jsonify({
+        'status': 'ready' if ready else 'not_ready',
+        'database': health,
+        'breaker': breaker,
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+    }), 200 if ready else 503
+
+# Write-behind queue metrics
+@app.route('/api/persistence', methods=['GET'])
+def persistence_stats():
+    return jsonify(board_writes.stats())
+
+# Board read cache metrics
+@app.route('/api/cache', methods=['GET'])
+def cache_stats():
+    return jsonify(board_cache.stats())
+
+# MongoDB worker pool and circuit breaker state
+@app.route('/api/db', methods=['GET'])
+def db_pool_stats():
+    return jsonify(db_pool.stats())
+
+# Rate limiter buckets and refusals
+@app.route('/api/limits', methods=['GET'])
+def rate_limit_stats():
+    return jsonify({'socket': socket_limits.stats(), 'rest': rest_limits.stats()})
+
+@app.errorhandler(413)
+def request_too_large(e):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    HTTP_REQUESTS_REJECTED.inc(route=route, reason='too_large')
+    return jsonify({'error': 'Request too large', 'maxBytes': MAX_REQUEST_BYTES}), 413
+
+# Prometheus scrape endpoint
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
 # Quick deployment test endpoint
 @app.route('/api/deployment-test', methods=['GET'])
 def deployment_test():
@@ -98,103 +230,618 @@ def get_user_activity(userId):
 # Register Blueprints
 app.register_blueprint(boards)
 
-@socketio.on('connect')
-def handle_connect():
-    print(f'Client connected: {request.sid}')
+def queue_job(job_type, params):
+    """Queue a maintenance job for the server processes to run instead of running it here."""
+    job = job_runner.enqueue(job_type, params)
+    print(f"Queued {job_type} job {job['_id']}; follow it at /api/jobs/{job['_id']}")
+
+@app.cli.command('compact-strokes')
+@click.option('--board', 'board_id', default=None, help='Only compact this board id')
+@click.option('--tolerance', default=STROKE_SIMPLIFY_TOLERANCE, show_default=True, help='Max deviation in pixels')
+@click.option('--queue', is_flag=True, help='Run as a background job on the server')
+def compact_strokes(board_id, tolerance, queue):
+    """Simplify stored strokes of existing boards and report the points saved."""
+    from bson import ObjectId
+    if db.boards_collection is not None and not db.connection.wait(30):
+        raise click.ClickException(f"MongoDB is not reachable: {db.connection.last_error}")
+    if queue:
+        return queue_job(COMPACT_STROKES, {"board": board_id, "tolerance": tolerance})
+    query = {"_id": ObjectId(board_id)} if board_id else None
+    report = compact_board_strokes(db.boards_collection, query, tolerance)
+    for board in report["boards"]:
+        print(f"{board['id']}: {board['points_before']} -> {board['points_after']} points")
+    print(f"Scanned {report['boards_scanned']} boards, rewrote {report['boards_rewritten']}, "
+          f"skipped {report['boards_skipped']} changed during compaction")
+    print(f"Points: {report['points_before']} -> {report['points_after']}")
+
+@app.cli.command('compact-history')
+@click.option('--board', 'board_id', default=None, help='Only compact this board id')
+@click.option('--queue', is_flag=True, help='Run as a background job on the server')
+def compact_history(board_id, queue):
+    """Drop board history entries past the retention period or entry limit."""
+    if db.history_collection is None:
+        raise click.ClickException("Board history is not configured")
+    if not db.connection.wait(30):
+        raise click.ClickException(f"MongoDB is not reachable: {db.connection.last_error}")
+    if queue:
+        return queue_job(COMPACT_HISTORY, {"board": board_id})
+    result = job_runner.run_now(COMPACT_HISTORY, {"board": board_id})
+    print(f"Compacted {result['boards']} boards, deleted {result['deletedEntries']} history entries")
+
+@app.cli.command('migrate-elements')
+@click.option('--board', 'board_id', default=None, help='Only migrate this board id')
+@click.option('--queue', is_flag=True, help='Run as a background job on the server')
+def migrate_elements(board_id, queue):
+    """Move notes and text boxes embedded in board documents into board_elements."""
+    if db.elements_collection is None:
+        raise click.ClickException("The element store is not configured")
+    if not db.connection.wait(30):
+        raise click.ClickException(f"MongoDB is not reachable: {db.connection.last_error}")
+    if queue:
+        return queue_job(MIGRATE_ELEMENTS, {"board": board_id})
+    result = job_runner.run_now(MIGRATE_ELEMENTS, {"board": board_id})
+    print(f"Migrated {result.get('boards', 0)} boards")
+
+@app.cli.command('render-thumbnails')
+@click.option('--user', 'user_id', default=None, help="Only render this user's boards")
+@click.option('--queue', is_flag=True, help='Run as a background job on the server')
+def render_thumbnails(user_id, queue):
+    """Re-render the stored thumbnails of existing boards."""
+    if db.thumbnails_collection is None:
+        raise click.ClickException("Board thumbnails are not configured")
+    if not db.connection.wait(30):
+        raise click.ClickException(f"MongoDB is not reachable: {db.connection.last_error}")
+    if queue:
+        return queue_job(RENDER_THUMBNAILS, {"userId": user_id})
+    result = job_runner.run_now(RENDER_THUMBNAILS, {"userId": user_id})
+    print(f"Rendered {result.get('boards', 0)} thumbnails")
+
+# Authoritative per-room board state; Mongo is only written by the flusher below
+room_registry = RoomRegistry()
+room_flusher = None
+
+def _boards_collection():
+    return db.boards_collection
+
+def write_room_ops(room, ops):
+    """Write what changed in a room to its board, one element per op, as the board's next version."""
+    from bson import ObjectId
+    if not ObjectId.is_valid(room):
+        return
+    board_id = ObjectId(room)
+    # Added strokes are simplified and packed the same way as full saves
+    ops = [dict(op, element=pack_lines(simplify_lines([op['element']])[0])[0])
+           if op['op'] == 'add' and op['field'] == 'data' else op for op in ops]
+    # Queued full saves land first, so they cannot overwrite the room's changes afterwards
+    board_writes.flush(board_id)
+    commit_ops(board_id, ops)
+
+def flush_rooms_forever():
+    while True:
+        socketio.sleep(ROOM_FLUSH_INTERVAL)
+        room_registry.flush(write_room_ops)
+
+def ensure_room_flusher():
+    global room_flusher
+    if room_flusher is None:
+        room_flusher = socketio.start_background_task(flush_rooms_forever)
+
+def record_room_op(room, kind, payload):
+    state = room_registry.get(room)
+    if state is not None:
+        state.apply(kind, payload)
+
+def room_members(room):
+    try:
+        return [sid for sid, _ in socketio.server.manager.get_participants('/', room)]
+    except KeyError:
+        return []
 
-@socketio.on('disconnect')
-def handle_disconnect():
-    print(f'Client disconnected: {request.sid}')
+def client_backlog(sid):
+    """Packets waiting in a client's outbound engine.io queue."""
+    try:
+        eio_sid = socketio.server.manager.eio_sid_from_sid(sid, '/')
+        return socketio.server.eio.sockets[eio_sid].queue.qsize()
+    except (KeyError, AttributeError):
+        return 0
+
+def emit_room_batch(room, events, skip_sids):
+    with FANOUT_EMIT_SECONDS.time(target='room'):
+        socketio.emit('batch', {'room': room, 'events': events}, to=room, skip_sid=skip_sids or None)
+
+def emit_client_batch(sid, room, events):
+    if events is not None:
+        with FANOUT_EMIT_SECONDS.time(target='client'):
+            socketio.emit('batch', {'room': room, 'events': events}, to=sid)
+        return
+    # The client fell too far behind to replay, so it reloads the room
+    state = room_registry.get(room)
+    if state is not None:
+        socketio.emit('load_board_state', dict(state.join_payload(), resync=True), to=sid)
+
+room_fanout = RoomFanout(emit_room_batch, emit_client_batch, client_backlog, room_members)
+
+def emit_presence_frame(room, frame):
+    socketio.emit('presence', frame, to=room)
+
+# Cursors, tools and viewports per room, sent as one delta frame per room per tick
+presence = Presence(emit_presence_frame)
+presence_ticker = None
+
+def ensure_presence_ticker():
+    global presence_ticker
+    if presence_ticker is None:
+        presence_ticker = socketio.start_background_task(presence.run_forever, socketio.sleep)
+
+@registry.collector
+def collect_room_metrics():
+    members = [len(state.members) for state in list(room_registry.rooms.values())]
+    ROOMS.set(len(members))
+    ROOM_MEMBERS.set(sum(members))
+    ROOM_MEMBERS_MAX.set(max(members, default=0))
+
+@registry.collector
+def collect_component_metrics():
+    record_stats('write_behind', board_writes.stats())
+    record_stats('board_history', board_history.stats())
+    record_stats('socket_limits', socket_limits.stats())
+    record_stats('signaling', candidate_relay.stats())
+    record_stats('presence', presence.stats())
+    record_stats('rest_limits', rest_limits.stats())
+    record_stats('board_cache', board_cache.stats())
+    record_stats('decoded_strokes', decoded_strokes.stats())
+    record_stats('board_images', board_images.stats())
+    record_stats('board_elements', board_elements.stats())
+    record_stats('jobs', job_runner.stats())
+    record_stats('db_pool', db_pool.stats())
+    record_stats('fanout', room_fanout.metrics)
+
+@registry.collector
+def collect_eventlet_metrics():
+    # Walks the heap, so it only runs when the metrics are scraped
+    GREENLETS.set(sum(1 for obj in gc.get_objects() if isinstance(obj, greenlet.greenlet)))
+    HUB_TIMERS.set(eventlet.hubs.get_hub().get_timers_count())
+
+
+room_ticker = None
+
+def relay_room_event(room, event, data, bounds=None):
+    """Send a room event to the other members, batched per tick when enabled.
+
+    `bounds` is the event's canvas rectangle; members whose subscribed
+    viewport does not intersect it are not sent the event.
+    """
+    global room_ticker
+    if ROOM_TICK_HZ <= 0:
+        offscreen = room_fanout.hold_offscreen(room, request.sid, event, data, bounds)
+        emit(event, data, room=room, skip_sid=[request.sid] + offscreen)
+        return
+    if room_ticker is None:
+        room_ticker = socketio.start_background_task(room_fanout.run_forever, socketio.sleep)
+    room_fanout.queue(room, request.sid, event, data, bounds)
+
+# Room events relayed between processes, mapped to the op they record
+def room_op_for(event, data):
+    if event == 'drawing':
+        if data.get('stroke') is not None:
+            return 'line', decode_stroke(data['stroke'])
+        return 'line', data.get('line')
+    if event == 'erase':
+        return 'erase', data.get('lines')
+    if event == 'erased':
+        return 'erased', data
+    if event in ('note_added', 'note_updated'):
+        return event, data.get('note')
+    if event == 'note_deleted':
+        return event, data.get('noteId')
+    return None
+
+room_sync_waiters = {}
+
+def sync_room_from_peers(state):
+    """Wait briefly for another process to hand over its newer copy of a room."""
+    waiter = room_sync_waiters.get(state.room)
+    if waiter is None:
+        waiter = room_sync_waiters[state.room] = socketio.server.eio.create_event()
+        socketio.emit(ROOM_SYNC_REQUEST, {'room': state.room, 'requester': client_manager.host_id},
+                      to=ROOM_SYNC_CHANNEL)
+    waiter.wait(ROOM_SYNC_TIMEOUT)
+    room_sync_waiters.pop(state.room, None)
+
+def handle_remote_room_event(event, data):
+    if not isinstance(data, dict):
+        return
+    if event in ('user-joined', 'user-left'):
+        # Voice membership of other processes' clients, so signaling to them passes validation
+        if not isinstance(data.get('room'), str):
+            return
+        if event == 'user-joined':
+            voice_rooms.join(data.get('room'), data.get('userId'))
+        else:
+            voice_rooms.leave(data.get('room'), data.get('userId'))
+        return
+    room = data.get('room')
+    state = room_registry.get(room)
+    if state is None:
+        return
 
-@socketio.on('join')
+    if event == ROOM_SYNC_REQUEST:
+        if state.synced:
+            socketio.emit(ROOM_SYNC_REPLY, dict(state.join_payload(), requester=data.get('requester')),
+                          to=ROOM_SYNC_CHANNEL)
+    elif event == ROOM_SYNC_REPLY:
+        waiter = room_sync_waiters.get(room)
+        # The first peer to answer wins; later replies carry the same room
+        if data.get('requester') == client_manager.host_id and waiter is not None and not waiter.is_set():
+            state.replace_from(data)
+            waiter.set()
+    elif event == 'load_board_state' and data.get('restored'):
+        state.replace_from(data, saved=True)
+    elif event == 'batch':
+        for batched_event, payload, _sender in data.get('events', []):
+            op = room_op_for(batched_event, payload)
+            if op is not None:
+                state.apply(*op, replicated=True)
+    else:
+        op = room_op_for(event, data)
+        if op is not None:
+            state.apply(*op, replicated=True)
+
+if client_manager is not None:
+    client_manager.on_remote_emit = handle_remote_room_event
+
+def restore_room(board_id, board):
+    """Reset a live room to a restored board version and reload it on every member."""
+    payload = RoomState(board_id, unpack_lines(board.get('data') or []), board.get('notes') or []).join_payload()
+    state = room_registry.get(board_id)
+    if state is not None:
+        state.replace_from(payload, saved=True)
+        payload = state.join_payload()
+    # Other processes adopt the restored state from this broadcast too
+    socketio.emit('load_board_state', dict(payload, resync=True, restored=True), to=board_id)
+
+board_history.on_restore = restore_room
+
+# Every landed board write, from saves, rooms and restores alike, refreshes the board's thumbnail
+board_writes.on_flushed = board_images.schedule
+
+# Note events standing for the element ops of the delta and element endpoints
+NOTE_EVENTS = {'add': 'note_added', 'modify': 'note_updated', 'remove': 'note_deleted'}
+
+def apply_element_change(board_id, op):
+    """Apply a note changed over REST to the live room and send it to the room's members.
+
+    Otherwise members joining later would get the room's stale copy of the
+    notes.
+    """
+    if op.get('field') != 'notes':
+        return
+    event = NOTE_EVENTS[op['op']]
+    if op['op'] == 'add':
+        payload, data = op['element'], {'room': board_id, 'note': op['element']}
+    elif op['op'] == 'modify':
+        payload = dict(op['changes'], id=op['id'])
+        data = {'room': board_id, 'note': payload}
+    else:
+        payload, data = op['id'], {'room': board_id, 'noteId': op['id']}
+    state = room_registry.get(board_id)
+    if state is not None:
+        # Already stored, so the room's flushes do not write it again
+        state.apply(event, payload, saved=True)
+    # Other processes apply the same op to their copy of the room on receipt
+    socketio.emit(event, data, to=board_id)
+
+board_elements.on_change = apply_element_change
+
+def reject_event(event, reason, retry_after=None):
+    SOCKET_EVENTS_REJECTED.inc(event=event, reason=reason)
+    if retry_after is not None:
+        # Sent once per limited streak, so a flooding client is not answered event for event
+        emit('rate_limited', {'event': event, 'retryAfter': round(retry_after, 3)})
+
+def allow_event(event, scope, data):
+    """Whether the sender's and its room's token buckets still hold an event."""
+    wait, first = socket_limits.check(scope, request.sid)
+    if not wait and event in ROOM_EVENTS and isinstance(data, dict) and isinstance(data.get('room'), str):
+        wait, first = socket_limits.check('room', data['room'])
+    if wait:
+        reject_event(event, 'rate_limited', wait if first else None)
+        return False
+    return True
+
+def on_event(event):
+    """socketio.on that also counts the event, times its handler and applies rate limits."""
+    scope = event_scope(event)
+    def decorator(handler):
+        @functools.wraps(handler)
+        def instrumented(*args, **kwargs):
+            SOCKET_EVENTS.inc(event=event)
+            if scope is not None and not allow_event(event, scope, args[0] if args else None):
+                return None
+            with SOCKET_HANDLER_SECONDS.time(event=event):
+                return handler(*args, **kwargs)
+        return socketio.on(event)(instrumented)
+    return decorator
+
+@on_event('connect')
+def handle_connect(auth=None):
+    log.debug("Client connected", sid=request.sid)
+
+@on_event('disconnect')
+def handle_disconnect():
+    room_registry.leave_all(request.sid)
+    room_fanout.forget(request.sid)
+    socket_limits.forget(request.sid)
+    presence.remove_all(request.sid)
+    candidate_relay.forget(request.sid)
+    for room in voice_rooms.leave_all(request.sid):
+        emit('user-left', {'room': room, 'userId': request.sid}, room=f"voice-{room}")
+    log.debug("Client disconnected", sid=request.sid)
+
+@on_event('join')
 def handle_join(data):
     room = data.get('room')
     join_room(room)
-    print(f"User {request.sid} joined room: {room}")
+    log.info("User joined room", sid=request.sid, room=room)
+    ensure_room_flusher()
+    # Only the first join of a room reads the board; later joins get the live state
+    try:
+        state = room_registry.join(room, request.sid, lambda r: load_room_from_board(_boards_collection(), r))
+    except DBUnavailable as e:
+        # Starting the room empty would overwrite the board on the next flush
+        leave_room(room)
+        log.warning("Board unavailable for join", sid=request.sid, room=room, error=str(e))
+        emit('board_unavailable', {'room': room, 'retryAfter': e.retry_after})
+        return
+    if not state.synced:
+        if client_manager is not None:
+            sync_room_from_peers(state)
+        state.synced = True
+    emit('load_board_state', state.join_payload())
+    emit('presence_state', presence.snapshot(room))
     # Notify others in the room that a new user has joined
     emit('user_joined', {'room': room, 'userId': request.sid}, room=room, include_self=False)
 
-@socketio.on('leave')
+@on_event('leave')
 def handle_leave(data):
     room = data.get('room')
     leave_room(room)
-    print(f"User {request.sid} left room: {room}")
+    room_registry.leave(room, request.sid)
+    room_fanout.set_viewport(room, request.sid, None)
+    presence.remove(room, request.sid)
+    log.info("User left room", sid=request.sid, room=room)
     emit('user_left', {'room': room, 'userId': request.sid}, room=room)
 
-@socketio.on('drawing')
+@on_event('drawing')
 def handle_drawing(data):
     room = data.get('room')
-    emit('drawing', data, room=room, include_self=False)
+    if data.get('stroke') is not None:
+        # Binary strokes are validated and re-encoded before they reach peers
+        try:
+            line = decode_stroke(data['stroke'])
+            stroke = encode_stroke(line)
+        except StrokeCodecError as e:
+            log.warning("Rejected binary stroke", sid=request.sid, error=str(e))
+            return
+        if count_points([line]) > MAX_STROKE_POINTS:
+            reject_event('drawing', 'too_many_points')
+            return
+        record_room_op(room, 'line', line)
+        relay_room_event(room, 'drawing', {'room': room, 'stroke': stroke}, line_bounds(line))
+        return
+    line = data.get('line')
+    if count_points([line]) > MAX_STROKE_POINTS:
+        reject_event('drawing', 'too_many_points')
+        return
+    record_room_op(room, 'line', line)
+    relay_room_event(room, 'drawing', data, line_bounds(line) if isinstance(line, dict) else None)
+
+@on_event('viewport')
+def handle_viewport(data):
+    """Only forward strokes inside the sender's visible canvas area; no rectangle clears it."""
+    room = data.get('room')
+    if data.get('x') is None:
+        room_fanout.set_viewport(room, request.sid, None)
+        return
+    try:
+        rect = parse_viewport(data)
+    except ValueError as e:
+        # e.g. zoomed out past MAX_VIEWPORT_SIZE: everything is visible anyway
+        log.debug("Rejected viewport", sid=request.sid, error=str(e))
+        rect = None
+    room_fanout.set_viewport(room, request.sid, rect)
+    if room_member(room):
+        # Peers see the area each user is looking at without a second event
+        presence.update(room, request.sid, {'viewport': rect})
+        ensure_presence_ticker()
+
+def room_member(room):
+    state = room_registry.get(room) if isinstance(room, str) else None
+    return state is not None and request.sid in state.members
+
+@on_event('presence')
+def handle_presence(data):
+    """Cursor position (x, y; null when off the canvas), tool, name and color of the sender."""
+    room = data.get('room')
+    if not room_member(room):
+        return
+    presence.update(room, request.sid, parse_presence(data))
+    ensure_presence_ticker()
+
+@on_event('erase')
+def handle_erase(data):
+    room = data.get('room')
+    lines = data.get('lines')
+    if count_points(lines) > MAX_BOARD_POINTS:
+        reject_event('erase', 'too_many_points')
+        return
+    held = room_fanout.held_offscreen(room, request.sid)
+    if held and isinstance(lines, list):
+        # The eraser never saw these strokes, so they cannot have been erased
+        kept = {line.get('id') for line in lines if isinstance(line, dict)}
+        for payload in held:
+            line = decode_stroke(payload['stroke']) if payload.get('stroke') is not None else payload.get('line')
+            if isinstance(line, dict) and line.get('id') not in kept:
+                lines.append(line)
+        data = dict(data, lines=lines)
+    record_room_op(room, 'erase', lines)
+    relay_room_event(room, 'erase', data)
+
+def held_stroke_id(event, data):
+    if event != 'drawing':
+        return None
+    if data.get('stroke') is not None:
+        try:
+            return decode_stroke(data['stroke'])['id']
+        except StrokeCodecError:
+            return None
+    line = data.get('line')
+    return line.get('id') if isinstance(line, dict) else None
+
+@on_event('erase_path')
+def handle_erase_path(data):
+    """Erase along the sender's eraser path and send only the strokes it removed or split.
+
+    Acknowledged with the removed ids, or False when the room cannot erase
+    (not loaded, a template board, a malformed path); the sender then keeps
+    its own erase and sends the lines left with `erase`.
+    """
+    room = data.get('room')
+    state = room_registry.get(room)
+    if state is None or not state.track_lines:
+        return False
+    try:
+        path, radius = parse_erase_path(data)
+    except EraseError as e:
+        log.warning("Rejected erase path", sid=request.sid, error=str(e))
+        return False
+    op, bounds = state.erase_path(path, radius)
+    if op is None:
+        return {'removed': []}
+    removed = set(op['data']['removed'])
+    # Held-back strokes that were erased are never shown; their pieces arrive with the delta
+    room_fanout.drop_offscreen(room, lambda event, payload: held_stroke_id(event, payload) in removed)
+    payload = dict(op['data'], room=room)
+    # The sender learns the ids of the pieces from the same delta its peers get
+    emit('erased', payload)
+    relay_room_event(room, 'erased', payload, bounds)
+    return {'removed': op['data']['removed']}
+
+@on_event('note_added')
+def handle_note_added(data):
+    room = data.get('room')
+    record_room_op(room, 'note_added', data.get('note'))
+    relay_room_event(room, 'note_added', data)
+
+@on_event('note_updated')
+def handle_note_updated(data):
+    room = data.get('room')
+    record_room_op(room, 'note_updated', data.get('note'))
+    relay_room_event(room, 'note_updated', data)
+
+@on_event('note_deleted')
+def handle_note_deleted(data):
+    room = data.get('room')
+    record_room_op(room, 'note_deleted', data.get('noteId'))
+    relay_room_event(room, 'note_deleted', data)
 
 # WebRTC Voice Chat Signaling
-@socketio.on('voice-join')
+voice_rooms = VoiceRooms()
+signaling_ticker = None
+
+def send_candidates(sender, target, room, candidates):
+    socketio.emit('ice-candidates', {'userId': sender, 'room': room, 'candidates': candidates}, to=target)
+
+candidate_relay = CandidateRelay(send_candidates)
+
+def signaling_target(event, data):
+    """The target of an offer, answer or candidate, if it is in the sender's voice room."""
+    target_id = data.get('targetUserId')
+    if not isinstance(target_id, str) or not target_id:
+        return None
+    if not isinstance(data.get('room'), str) or not voice_rooms.shared(data['room'], request.sid, target_id):
+        reject_event(event, 'not_in_room')
+        log.debug("Rejected signaling outside the voice room", sid=request.sid, event=event)
+        return None
+    return target_id
+
+@on_event('voice-join')
 def handle_voice_join(data):
     room = data.get('room')
+    if not isinstance(room, str):
+        return
     join_room(f"voice-{room}")
-    print(f"User {request.sid} joined voice room: {room}")
+    peers = voice_rooms.join(room, request.sid)
+    log.info("User joined voice room", sid=request.sid, room=room, peers=len(peers))
 
-    # Notify others in the voice room
-    emit('user-joined', {'userId': request.sid}, room=f"voice-{room}", include_self=False)
+    # The joiner gets everyone already in the room in one message
+    emit('voice-peers', {'room': room, 'peers': peers})
+    emit('user-joined', {'room': room, 'userId': request.sid}, room=f"voice-{room}", include_self=False)
 
-@socketio.on('voice-leave')
+@on_event('voice-leave')
 def handle_voice_leave(data):
     room = data.get('room')
+    if not isinstance(room, str):
+        return
     leave_room(f"voice-{room}")
-    print(f"User {request.sid} left voice room: {room}")
-    emit('user-left', {'userId': request.sid}, room=f"voice-{room}")
+    if not voice_rooms.leave(room, request.sid):
+        return
+    candidate_relay.forget(request.sid, voice_rooms.members.get(room, ()))
+    log.info("User left voice room", sid=request.sid, room=room)
+    emit('user-left', {'room': room, 'userId': request.sid}, room=f"voice-{room}")
 
-@socketio.on('voice-offer')
+@on_event('voice-offer')
 def handle_voice_offer(data):
-    target_id = data.get('targetUserId')
-    room = data.get('room')
-    if not target_id:
+    target_id = signaling_target('voice-offer', data)
+    if target_id is None:
         return
-
-    print(f"Forwarding voice offer from {request.sid} to {target_id}")
+    # Candidates of an earlier negotiation go first; the new one may repeat them
+    candidate_relay.restart(request.sid, target_id)
     data['userId'] = request.sid
     emit('voice-offer', data, room=target_id)
 
-@socketio.on('voice-answer')
+@on_event('voice-answer')
 def handle_voice_answer(data):
-    target_id = data.get('targetUserId')
-    room = data.get('room')
-    if not target_id:
+    target_id = signaling_target('voice-answer', data)
+    if target_id is None:
         return
-
-    print(f"Forwarding voice answer from {request.sid} to {target_id}")
+    candidate_relay.flush_pair(request.sid, target_id)
     data['userId'] = request.sid
     emit('voice-answer', data, room=target_id)
 
-@socketio.on('ice-candidate')
+@on_event('ice-candidate')
 def handle_ice_candidate(data):
-    target_id = data.get('targetUserId')
-    room = data.get('room')
-    if not target_id:
+    """Queue one candidate (`candidate`) or several (`candidates`) for the target's next batch."""
+    global signaling_ticker
+    target_id = signaling_target('ice-candidate', data)
+    if target_id is None:
         return
-
-    print(f"Forwarding ICE candidate from {request.sid} to {target_id}")
-    data['userId'] = request.sid
-    emit('ice-candidate', data, room=target_id)
+    candidates = data.get('candidates')
+    if not isinstance(candidates, list):
+        candidates = [data.get('candidate')]
+    candidate_relay.queue(request.sid, target_id, data['room'], candidates)
+    if signaling_ticker is None and candidate_relay.window > 0:
+        signaling_ticker = socketio.start_background_task(candidate_relay.run_forever, socketio.sleep)
 
 # Run the Flask app
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
     debug = os.environ.get("FLASK_ENV") == "development"
 
-    print("Starting CanvasConnect Backend Server...")
-    print(f"Server will be available at: http://0.0.0.0:{port}")
-    print(f"Environment: {'DEVELOPMENT' if debug else 'PRODUCTION'}")
-    print(f"CORS Origins: {', '.join(cors_origins)}")
+    log.info(
+        "Starting CanvasConnect Backend Server",
+        url=f"http://0.0.0.0:{port}",
+        environment='DEVELOPMENT' if debug else 'PRODUCTION',
+        cors_origins=','.join(cors_origins)
+    )
 
     if debug:
-        print("API endpoints:")
-        print("   - GET  /api/health")
-        print("   - POST /api/boards")
-        print("   - GET  /api/boards/user/<userId>")
-        print("   - GET  /api/boards/<boardId>")
-        print("   - PUT  /api/boards/update")
-        print("   - DELETE /api/boards/<boardId>")
-        print("   - GET  /api/activity/user/<userId>")
-        print("🔌 Socket.IO enabled for real-time collaboration")
-
+        # Every registered REST route, so new endpoints show up without editing a list
+        for rule in sorted(app.url_map.iter_rules(), key=lambda r: r.rule):
+            if rule.rule.startswith('/api'):
+                methods = ','.join(sorted(rule.methods - {'HEAD', 'OPTIONS'}))
+                log.info("API endpoint", methods=methods, rule=rule.rule)
+        log.info("Socket.IO enabled for real-time collaboration")
+
+    job_runner.start()
     socketio.run(app, debug=debug, host="0.0.0.0", port=port)
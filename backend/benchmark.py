@@ -0,0 +1,666 @@
+"""Load test for collaboration rooms.
+
+Runs the real app in-process against an in-memory MongoDB stand-in and
+simulates M rooms x N clients drawing, erasing, adding notes and autosaving
+the way the whiteboard editor does. Reports throughput, broadcast latency
+percentiles, memory per connection and database round trips, and compares
+them with a saved baseline:
+
+    python benchmark.py --rooms 4 --clients 8 --duration 10
+    python benchmark.py --save-baseline benchmarks/baseline.json
+    python benchmark.py --baseline benchmarks/baseline.json
+
+Clients are Flask-SocketIO test clients sharing the server's process and
+eventlet hub, so the numbers cover handler, fan-out, encoding and database
+cost but no network. Compare them against baselines taken on the same
+machine.
+"""
+
+import copy
+import gc
+import json
+import os
+import random
+import resource
+import sys
+import time
+import tracemalloc
+from collections import Counter, OrderedDict
+
+import bson
+import click
+import eventlet
+from pymongo import DeleteMany, DeleteOne
+from pymongo.results import UpdateResult
+
+try:
+    import mongomock
+except ImportError:  # pragma: no cover - optional, MemoryCollection is used instead
+    mongomock = None
+
+DEFAULT_SCENARIO = {
+    "rooms": 4,
+    "clients": 8,
+    "duration": 10.0,
+    "seed": 1,
+    # Editor behaviour
+    "pointer_hz": 60,
+    "stroke_points": (10, 40),
+    "think_time": 0.5,
+    "mix": {"draw": 0.85, "note": 0.10, "erase": 0.05},
+    "autosave_interval": 10.0,
+    "strokes": "json",
+    # Board each room starts from
+    "initial_strokes": 200,
+    "initial_notes": 5,
+    # Simulated MongoDB round trip
+    "db_latency_ms": 1.0,
+}
+
+# (section, metric, worse when) checked against a baseline
+REGRESSION_CHECKS = (
+    ("throughput", "events_per_s", "lower"),
+    ("throughput", "deliveries_per_s", "lower"),
+    ("latency_ms", "p50", "higher"),
+    ("latency_ms", "p99", "higher"),
+    ("autosave_ms", "p99", "higher"),
+    ("memory", "bytes_per_connection", "higher"),
+    ("db", "ops_per_event", "higher"),
+)
+# Latency changes below this many milliseconds are scheduling noise
+LATENCY_NOISE_MS = 1.0
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    """Nearest-rank percentiles (plus max) of `samples`, rounded to 3 places."""
+    if not samples:
+        return dict({f"p{p}": 0.0 for p in points}, max=0.0, count=0)
+    ordered = sorted(samples)
+    result = {}
+    for p in points:
+        rank = max(1, -(-p * len(ordered) // 100))
+        result[f"p{p}"] = round(ordered[rank - 1], 3)
+    result["max"] = round(ordered[-1], 3)
+    result["count"] = len(ordered)
+    return result
+
+
+def _matches(doc, query):
+    for key, expected in (query or {}).items():
+        if key.endswith(".id"):
+            # Element of an array field, as in the positional updates of delta ops
+            elements = doc.get(key[:-3])
+            ids = [element.get("id") for element in elements or [] if isinstance(element, dict)]
+            if isinstance(expected, dict) and "$nin" in expected:
+                # Adds of delta ops, skipped once their elements are stored
+                if any(element_id in expected["$nin"] for element_id in ids):
+                    return False
+            elif not isinstance(elements, list) or expected not in ids:
+                return False
+        elif isinstance(expected, dict) and any(k.startswith('$') for k in expected):
+            for op, arg in expected.items():
+                if op == "$in" and doc.get(key) not in arg:
+                    return False
+                if op == "$ne" and doc.get(key) == arg:
+                    return False
+                if op not in ("$in", "$ne"):
+                    raise NotImplementedError(f"MemoryCollection does not support {op} ({key})")
+        elif doc.get(key) != expected:
+            return False
+    return True
+
+
+def _project(doc, projection):
+    if not projection:
+        return doc
+    included = {key for key, value in projection.items() if value}
+    if included:
+        keep = {key.split(".")[0] for key in included} | ({"_id"} if projection.get("_id", 1) else set())
+        projected = {key: value for key, value in doc.items() if key in keep}
+        for key in included:
+            # "field.sub" keeps only `sub` of each sub-document of an array field
+            field, _, sub = key.partition(".")
+            if sub and isinstance(projected.get(field), list):
+                projected[field] = [{sub: item[sub]} for item in projected[field]
+                                    if isinstance(item, dict) and sub in item]
+        return projected
+    return {key: value for key, value in doc.items() if key not in projection}
+
+
+class MemoryCollection:
+    """The slice of a pymongo collection the room and autosave paths use.
+
+    Documents are kept BSON-encoded, so reads and writes pay the same
+    encode/decode cost (and Binary strokes round-trip the same way) as
+    against a real server.
+    """
+
+    def __init__(self):
+        self.docs = OrderedDict()
+        self.bytes_written = 0
+
+    def _load(self, doc_id):
+        return bson.decode(self.docs[doc_id])
+
+    def _store(self, doc):
+        data = bson.encode(doc)
+        self.docs[doc["_id"]] = data
+        self.bytes_written += len(data)
+
+    def _find(self, query):
+        if "_id" in (query or {}) and not isinstance(query["_id"], dict):
+            candidates = [query["_id"]] if query["_id"] in self.docs else []
+        else:
+            candidates = list(self.docs)
+        for doc_id in candidates:
+            doc = self._load(doc_id)
+            if _matches(doc, query):
+                yield doc
+
+    def find_one(self, query=None, projection=None):
+        doc = next(self._find(query), None)
+        return _project(doc, projection) if doc is not None else None
+
+    def find(self, query=None, projection=None):
+        return [_project(doc, projection) for doc in self._find(query)]
+
+    def insert_one(self, doc):
+        doc.setdefault("_id", bson.ObjectId())
+        self._store(doc)
+
+    def update_one(self, query, update, upsert=False):
+        doc = next(self._find(query), None)
+        if doc is None:
+            if not upsert:
+                return UpdateResult({"n": 0}, True)
+            doc = {key: value for key, value in query.items() if not isinstance(value, dict)}
+            doc.update(copy.deepcopy(update.get("$setOnInsert", {})))
+            doc.setdefault("_id", bson.ObjectId())
+        self._apply(doc, query, update)
+        self._store(doc)
+        return UpdateResult({"n": 1}, True)
+
+    def find_one_and_update(self, query, update, projection=None, return_document=False):
+        doc = next(self._find(query), None)
+        if doc is None:
+            return None
+        before = copy.deepcopy(doc)
+        self._apply(doc, query, update)
+        self._store(doc)
+        return _project(doc if return_document else before, projection)
+
+    @staticmethod
+    def _apply(doc, query, update):
+        def positional(key):
+            # "field.$.key" of the array element the query matched by id
+            field, _, sub_key = key.partition(".$.")
+            for element in doc.get(field) or []:
+                if isinstance(element, dict) and element.get("id") == query.get(f"{field}.id"):
+                    return element, sub_key
+            return {}, sub_key
+
+        for key, value in update.get("$set", {}).items():
+            target, key = positional(key) if ".$." in key else (doc, key)
+            target[key] = value
+        for key, amount in update.get("$inc", {}).items():
+            doc[key] = doc.get(key, 0) + amount
+        for key in update.get("$unset", {}):
+            target, key = positional(key) if ".$." in key else (doc, key)
+            target.pop(key, None)
+        for key, value in update.get("$push", {}).items():
+            doc.setdefault(key, []).extend(value.get("$each", [value]) if isinstance(value, dict) else [value])
+        for key, match in update.get("$pull", {}).items():
+            doc[key] = [element for element in doc.get(key) or []
+                        if not (isinstance(element, dict) and all(element.get(k) == v for k, v in match.items()))]
+
+    def bulk_write(self, requests, ordered=True):
+        for request in requests:
+            if isinstance(request, DeleteOne):
+                self.delete_one(request._filter)
+            elif isinstance(request, DeleteMany):
+                self.delete_many(request._filter)
+            else:
+                self.update_one(request._filter, request._doc, upsert=bool(request._upsert))
+
+    def delete_one(self, query):
+        doc = next(self._find(query), None)
+        if doc is not None:
+            del self.docs[doc["_id"]]
+
+    def delete_many(self, query):
+        for doc in list(self._find(query)):
+            del self.docs[doc["_id"]]
+
+    def create_index(self, keys, **kwargs):
+        return kwargs.get("name")
+
+
+class CountingCollection:
+    """Counts round trips by command and adds a simulated network delay."""
+
+    COMMANDS = ("find_one", "find", "insert_one", "update_one", "bulk_write", "delete_one", "aggregate",
+                "find_one_and_update")
+
+    def __init__(self, collection, latency=0.0):
+        self.collection = collection
+        self.latency = latency
+        self.ops = Counter()
+
+    def __getattr__(self, name):
+        attr = getattr(self.collection, name)
+        if name not in self.COMMANDS:
+            return attr
+
+        def command(*args, **kwargs):
+            self.ops[name] += 1
+            if self.latency:
+                # Monkey-patched by eventlet, so other greenlets run meanwhile
+                time.sleep(self.latency)
+            return attr(*args, **kwargs)
+        return command
+
+
+def make_collection(latency, name="whiteboards"):
+    if mongomock is not None:
+        backing = mongomock.MongoClient()["canvasconnect"][name]
+    else:
+        backing = MemoryCollection()
+    return CountingCollection(backing, latency)
+
+
+def install_collection(collection, elements=None):
+    """Point every module that reads the boards and elements collections at `collection` and `elements`.
+
+    Returns the collections that were installed before.
+    """
+    import db
+    import routes.boards
+    previous = db.boards_collection, db.elements_collection
+    db.boards_collection = db.whiteboards = collection
+    db.elements_collection = elements
+    routes.boards.boards_collection = routes.boards.whiteboards = collection
+    return previous
+
+
+def random_line(rng, line_id, points, origin=None):
+    x, y = origin or (rng.uniform(0, 4000), rng.uniform(0, 3000))
+    coords = []
+    for _ in range(points):
+        x += rng.uniform(-6, 6)
+        y += rng.uniform(-6, 6)
+        coords.extend((round(x, 1), round(y, 1)))
+    return {"id": line_id, "points": coords, "color": "#222222", "strokeWidth": 3, "tool": "pen"}
+
+
+def seed_board(collection, rng, scenario):
+    from stroke_codec import pack_lines
+    lines = [random_line(rng, f"seed-{i}", rng.randint(*scenario["stroke_points"]))
+             for i in range(scenario["initial_strokes"])]
+    notes = [{"id": f"note-seed-{i}", "x": rng.uniform(0, 4000), "y": rng.uniform(0, 3000),
+              "text": "Seed note", "color": "#fff59d", "width": 180, "height": 120}
+             for i in range(scenario["initial_notes"])]
+    board_id = bson.ObjectId()
+    collection.collection.insert_one({
+        "_id": board_id, "title": "Benchmark board", "type": "whiteboard", "userId": "bench",
+        "data": pack_lines(lines), "notes": notes, "textBoxes": [], "version": 1,
+    })
+    return str(board_id)
+
+
+class DeliveryQueue(list):
+    """Test client inbox that timestamps each packet as the server emits it."""
+
+    def append(self, item):
+        item["received_at"] = time.perf_counter()
+        super().append(item)
+
+
+class Stats:
+    def __init__(self):
+        self.sent = Counter()
+        self.sent_at = {}
+        self.deliveries = 0
+        self.latencies = []
+        self.autosaves = []
+        self.autosave_errors = 0
+
+    def record_send(self, key, sent_at=None):
+        self.sent[key[0]] += 1
+        self.sent_at[key] = sent_at or time.perf_counter()
+
+    def record_delivery(self, key, received_at):
+        self.deliveries += 1
+        sent_at = self.sent_at.get(key)
+        if sent_at is not None:
+            self.latencies.append((received_at - sent_at) * 1000)
+
+
+class SimulatedClient:
+    """One editor tab: joins a room and replays the editor's emits and autosaves."""
+
+    def __init__(self, server, room, index, scenario, stats):
+        self.server = server
+        self.room = room
+        self.index = index
+        self.scenario = scenario
+        self.stats = stats
+        self.rng = random.Random(f"{scenario['seed']}-{room}-{index}")
+        self.http = server.app.test_client()
+        self.socket = None
+        self.lines = OrderedDict()
+        self.notes = OrderedDict()
+        self.own_lines = []
+        self.seq = 0
+
+    def connect(self):
+        self.socket = self.server.socketio.test_client(self.server.app)
+        self.socket.queue = DeliveryQueue()
+        self.socket.emit('join', {'room': self.room})
+        # Dropped so only server-side state counts towards memory per connection
+        del self.socket.queue[:]
+
+    def load(self):
+        board = self.http.get(f"/api/boards/{self.room}").get_json()
+        self.lines = OrderedDict((line['id'], line) for line in board['data'])
+        self.notes = OrderedDict((note['id'], note) for note in board['notes'])
+
+    def disconnect(self):
+        from flask_socketio.test_client import SocketIOTestClient
+        if self.socket.is_connected():
+            self.socket.disconnect()
+        SocketIOTestClient.clients.pop(self.socket.eio_sid, None)
+
+    def drain(self):
+        packets = list(self.socket.queue)
+        del self.socket.queue[:]
+        for packet in packets:
+            name, args = packet['name'], packet['args']
+            if name == 'load_board_state':
+                snapshot = args[0]['snapshot']
+                self.lines = OrderedDict((line['id'], line) for line in snapshot['lines'])
+                self.notes = OrderedDict((note['id'], note) for note in snapshot['notes'])
+                for op in args[0]['ops']:
+                    self.apply(op['op'], op['data'])
+            elif name == 'batch':
+                for event, data, sender in args[0]['events']:
+                    self.receive(event, data, packet['received_at'])
+            elif name in ('drawing', 'erase', 'erased', 'note_added'):
+                self.receive(name, args[0], packet['received_at'])
+
+    def receive(self, event, data, received_at):
+        from stroke_codec import decode_stroke
+        if event == 'drawing':
+            line = decode_stroke(data['stroke']) if data.get('stroke') is not None else data['line']
+            self.apply('line', line)
+            self.stats.record_delivery(('drawing', line['id'], len(line['points'])), received_at)
+        elif event == 'erase':
+            self.lines = OrderedDict((line['id'], line) for line in data['lines'])
+            self.stats.record_delivery(('erase', data.get('benchSeq')), received_at)
+        elif event == 'erased':
+            self.apply('erased', data)
+            self.stats.record_delivery(('erase', data['removed'][0]), received_at)
+        elif event == 'note_added':
+            self.apply('note_added', data['note'])
+            self.stats.record_delivery(('note_added', data['note']['id']), received_at)
+
+    def apply(self, kind, data):
+        if kind == 'line':
+            self.lines[data['id']] = data
+        elif kind == 'note_added':
+            self.notes[data['id']] = data
+        elif kind == 'erased':
+            removed = set(data['removed'])
+            lines = OrderedDict()
+            for line_id, line in self.lines.items():
+                if line_id not in removed:
+                    lines[line_id] = line
+                    continue
+                for piece in data['fragments'].get(str(line_id), ()):
+                    lines[piece['id']] = piece
+            self.lines = lines
+
+    def emit(self, event, data, key):
+        self.stats.record_send(key)
+        self.socket.emit(event, data)
+
+    def draw(self, sleep):
+        from stroke_codec import encode_stroke
+        self.seq += 1
+        line_id = f"c{self.index}-{self.room[-6:]}-{self.seq}"
+        full = random_line(self.rng, line_id, self.rng.randint(*self.scenario["stroke_points"]))
+        # Like the editor: every pointer move sends the stroke drawn so far
+        for end in range(2, len(full["points"]) + 1, 2):
+            line = dict(full, points=full["points"][:end])
+            if self.scenario["strokes"] == "binary":
+                data = {'room': self.room, 'stroke': encode_stroke(line)}
+            else:
+                data = {'room': self.room, 'line': line}
+            self.emit('drawing', data, ('drawing', line_id, end))
+            self.lines[line_id] = line
+            sleep(1 / self.scenario["pointer_hz"])
+        self.own_lines.append(line_id)
+
+    def add_note(self):
+        self.seq += 1
+        note = {"id": f"note-c{self.index}-{self.room[-6:]}-{self.seq}", "x": self.rng.uniform(0, 4000),
+                "y": self.rng.uniform(0, 3000), "text": "Click to edit...", "color": "#fff59d",
+                "fontSize": 14, "width": 180, "height": 120}
+        self.notes[note["id"]] = note
+        self.emit('note_added', {'room': self.room, 'note': note}, ('note_added', note["id"]))
+
+    def erase(self):
+        erasable = [line_id for line_id in self.own_lines if line_id in self.lines] or list(self.lines)
+        if not erasable:
+            return
+        points = self.lines[self.rng.choice(erasable)]['points']
+        middle = len(points) // 4 * 2
+        sent_at = time.perf_counter()
+        queued = len(self.socket.queue)
+        # Like the editor: send the eraser's path; the server splits the stroke and replies with the delta
+        self.socket.emit('erase_path', {'room': self.room, 'path': points[middle:middle + 2], 'radius': 10})
+        for position in range(queued, len(self.socket.queue)):
+            if self.socket.queue[position]['name'] == 'erased':
+                reply = self.socket.queue.pop(position)['args'][0]
+                self.apply('erased', reply)
+                self.stats.record_send(('erase', reply['removed'][0]), sent_at)
+                break
+
+    def autosave(self):
+        started = time.perf_counter()
+        response = self.http.put('/api/boards/update', json={
+            'boardId': self.room, 'data': list(self.lines.values()), 'notes': list(self.notes.values()),
+            'textBoxes': [], 'background': '#ffffff', 'templateType': None,
+        })
+        if response.status_code != 200:
+            self.stats.autosave_errors += 1
+        self.stats.autosaves.append((time.perf_counter() - started) * 1000)
+
+    def run(self, sleep, deadline):
+        scenario = self.scenario
+        actions, weights = zip(*scenario["mix"].items())
+        next_save = time.monotonic() + self.rng.uniform(0, scenario["autosave_interval"])
+        while time.monotonic() < deadline:
+            self.drain()
+            action = self.rng.choices(actions, weights)[0]
+            if action == "draw":
+                self.draw(sleep)
+            elif action == "note":
+                self.add_note()
+            else:
+                self.erase()
+            if time.monotonic() >= next_save:
+                self.autosave()
+                next_save += scenario["autosave_interval"]
+            pause = self.rng.expovariate(1 / scenario["think_time"]) if scenario["think_time"] else 0
+            sleep(max(0, min(pause, deadline - time.monotonic())))
+        self.drain()
+
+
+def run_benchmark(overrides=None):
+    """Run one scenario and return its report (a JSON-serializable dict)."""
+    import app as server
+    import serialization
+    from db_pool import PooledCollection, db_pool
+    from persistence import board_writes
+
+    scenario = dict(DEFAULT_SCENARIO, **(overrides or {}))
+    rng = random.Random(scenario["seed"])
+    collection = make_collection(scenario["db_latency_ms"] / 1000)
+    elements = make_collection(scenario["db_latency_ms"] / 1000, "board_elements")
+    # Through the DB worker pool, like the real collections
+    previous = install_collection(PooledCollection(collection, db_pool), PooledCollection(elements, db_pool))
+    try:
+        rooms = [seed_board(collection, rng, scenario) for _ in range(scenario["rooms"])]
+        stats = Stats()
+        clients = [SimulatedClient(server, room, index, scenario, stats)
+                   for room in rooms for index in range(scenario["clients"])]
+
+        gc.collect()
+        tracemalloc.start()
+        baseline_bytes = tracemalloc.get_traced_memory()[0]
+        for client in clients:
+            client.connect()
+        gc.collect()
+        connected_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        for client in clients:
+            client.load()
+
+        fanout_before = dict(server.room_fanout.metrics)
+        collection.ops.clear()
+        elements.ops.clear()
+        started = time.perf_counter()
+        deadline = time.monotonic() + scenario["duration"]
+        tasks = [eventlet.spawn(client.run, eventlet.sleep, deadline) for client in clients]
+        for task in tasks:
+            task.wait()
+        # Let the last tick go out before counting deliveries
+        eventlet.sleep(2 / server.ROOM_TICK_HZ if server.ROOM_TICK_HZ > 0 else 0)
+        for client in clients:
+            client.drain()
+        elapsed = time.perf_counter() - started
+
+        server.room_registry.flush(server.write_room_ops, idle_ttl=0)
+        board_writes.flush()
+        for client in clients:
+            client.disconnect()
+    finally:
+        install_collection(*previous)
+
+    events = sum(stats.sent.values())
+    db_ops = sum(collection.ops.values()) + sum(elements.ops.values())
+    fanout = {key: value - fanout_before.get(key, 0) for key, value in server.room_fanout.metrics.items()}
+    return {
+        "scenario": {key: (list(value) if isinstance(value, tuple) else value) for key, value in scenario.items()},
+        "environment": {
+            "python": sys.version.split()[0],
+            "json_backend": serialization.backend.name,
+            "room_tick_hz": server.ROOM_TICK_HZ,
+            "store": "mongomock" if mongomock is not None else "memory",
+        },
+        "elapsed_s": round(elapsed, 3),
+        "events_sent": dict(stats.sent),
+        "throughput": {
+            "events_per_s": round(events / elapsed, 1),
+            "deliveries_per_s": round(stats.deliveries / elapsed, 1),
+            "autosaves_per_s": round(len(stats.autosaves) / elapsed, 2),
+        },
+        "latency_ms": percentiles(stats.latencies),
+        "autosave_ms": dict(percentiles(stats.autosaves), errors=stats.autosave_errors),
+        "memory": {
+            "bytes_per_connection": round((connected_bytes - baseline_bytes) / len(clients)),
+            "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        },
+        "db": {
+            "ops": dict(collection.ops + elements.ops),
+            "ops_per_s": round(db_ops / elapsed, 1),
+            "ops_per_event": round(db_ops / events, 4) if events else 0.0,
+        },
+        "fanout": fanout,
+    }
+
+
+def compare(report, baseline, tolerance=0.25):
+    """Regressions of `report` against `baseline`, as human-readable strings."""
+    if report["scenario"] != baseline["scenario"]:
+        return ["scenario differs from the baseline; re-run with the baseline's options"]
+    regressions = []
+    for section, metric, worse in REGRESSION_CHECKS:
+        old = baseline.get(section, {}).get(metric)
+        new = report.get(section, {}).get(metric)
+        if old is None or new is None:
+            continue
+        if worse == "lower":
+            regressed = new < old * (1 - tolerance)
+        else:
+            regressed = new > old * (1 + tolerance)
+            if section.endswith("_ms"):
+                regressed = regressed and new - old > LATENCY_NOISE_MS
+        if regressed:
+            regressions.append(f"{section}.{metric}: {old} -> {new}")
+    return regressions
+
+
+def format_report(report):
+    throughput, latency, autosave = report["throughput"], report["latency_ms"], report["autosave_ms"]
+    scenario = report["scenario"]
+    return "\n".join([
+        f"{scenario['rooms']} rooms x {scenario['clients']} clients for {report['elapsed_s']}s "
+        f"({report['environment']['store']} store, {scenario['db_latency_ms']} ms simulated latency)",
+        f"events sent:     {report['events_sent']}",
+        f"throughput:      {throughput['events_per_s']} events/s in, {throughput['deliveries_per_s']} deliveries/s out",
+        f"broadcast ms:    p50 {latency['p50']}  p90 {latency['p90']}  p99 {latency['p99']}  max {latency['max']}",
+        f"autosave ms:     p50 {autosave['p50']}  p99 {autosave['p99']}  ({autosave['count']} saves, "
+        f"{autosave['errors']} errors)",
+        f"memory:          {report['memory']['bytes_per_connection']} bytes/connection, "
+        f"max RSS {report['memory']['max_rss_mb']} MB",
+        f"database:        {report['db']['ops_per_s']} ops/s, {report['db']['ops_per_event']} per event "
+        f"{report['db']['ops']}",
+    ])
+
+
+@click.command()
+@click.option('--rooms', default=DEFAULT_SCENARIO["rooms"], show_default=True)
+@click.option('--clients', default=DEFAULT_SCENARIO["clients"], show_default=True, help='Clients per room')
+@click.option('--duration', default=DEFAULT_SCENARIO["duration"], show_default=True, help='Seconds of load')
+@click.option('--seed', default=DEFAULT_SCENARIO["seed"], show_default=True)
+@click.option('--think-time', default=DEFAULT_SCENARIO["think_time"], show_default=True,
+              help='Mean pause between actions in seconds; 0 drives the server as hard as it goes')
+@click.option('--strokes', type=click.Choice(['json', 'binary']), default=DEFAULT_SCENARIO["strokes"],
+              show_default=True)
+@click.option('--initial-strokes', default=DEFAULT_SCENARIO["initial_strokes"], show_default=True)
+@click.option('--db-latency-ms', default=DEFAULT_SCENARIO["db_latency_ms"], show_default=True)
+@click.option('--output', type=click.Path(dir_okay=False), help='Write the full report as JSON')
+@click.option('--save-baseline', type=click.Path(dir_okay=False), help='Store the report as the new baseline')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False),
+              help='Fail if the run regressed against this baseline')
+@click.option('--tolerance', default=0.25, show_default=True, help='Allowed relative change before failing')
+def main(rooms, clients, duration, seed, think_time, strokes, initial_strokes, db_latency_ms,
+         output, save_baseline, baseline, tolerance):
+    """Simulate rooms of collaborating clients and report server performance."""
+    report = run_benchmark({
+        "rooms": rooms, "clients": clients, "duration": duration, "seed": seed, "think_time": think_time,
+        "strokes": strokes, "initial_strokes": initial_strokes, "db_latency_ms": db_latency_ms,
+    })
+    click.echo(format_report(report))
+    for path in filter(None, (output, save_baseline)):
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write('\n')
+    if baseline:
+        with open(baseline) as f:
+            regressions = compare(report, json.load(f), tolerance)
+        if regressions:
+            click.echo("Regressions against the baseline:", err=True)
+            for regression in regressions:
+                click.echo(f"  {regression}", err=True)
+            sys.exit(1)
+        click.echo("No regressions against the baseline")
+
+
+if __name__ == '__main__':
+    # Never point the harness at a real deployment's database or message queue
+    os.environ['MONGO_URI'] = ''
+    os.environ['SOCKETIO_MESSAGE_QUEUE'] = ''
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    main()
@@ -0,0 +1,127 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Serialized boards kept in memory by GET /api/boards/<boardId>
+BOARD_CACHE_MAX_ENTRIES = int(os.environ.get('BOARD_CACHE_MAX_ENTRIES', 256))
+BOARD_CACHE_MAX_BYTES = int(os.environ.get('BOARD_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+# Upper bound on staleness for writes this process does not see (other processes)
+BOARD_CACHE_TTL = float(os.environ.get('BOARD_CACHE_TTL', 30))
+
+
+def etag_for(body):
+    return hashlib.sha1(body).hexdigest()
+
+
+class CachedBoard:
+    __slots__ = ('body', 'etag', 'updated_at', 'stored_at', 'encoded')
+
+    def __init__(self, body, updated_at, stored_at):
+        self.body = body
+        self.etag = etag_for(body)
+        self.updated_at = updated_at
+        self.stored_at = stored_at
+        # Compressed copies of body by content encoding, made on first request
+        self.encoded = {}
+
+    def size(self):
+        return len(self.body) + sum(len(data) for data in self.encoded.values())
+
+
+class BoardCache:
+    """LRU of serialized board payloads, bounded by entry count, bytes and age.
+
+    Every write path that changes a board's content calls `invalidate`, so a
+    hit is served without touching MongoDB or re-serializing the board. Readers
+    take a `generation()` before reading MongoDB and pass it to `put`; if any
+    invalidation happened in between, the possibly stale payload is not cached.
+    """
+
+    def __init__(self, max_entries=BOARD_CACHE_MAX_ENTRIES, max_bytes=BOARD_CACHE_MAX_BYTES,
+                 ttl=BOARD_CACHE_TTL, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.invalidated = 0
+        self.counters = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, board_id):
+        with self.lock:
+            entry = self.entries.get(board_id)
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            if self.clock() - entry.stored_at > self.ttl:
+                self._drop(board_id)
+                self.counters["expired"] += 1
+                self.counters["misses"] += 1
+                return None
+            self.entries.move_to_end(board_id)
+            self.counters["hits"] += 1
+            return entry
+
+    def generation(self):
+        return self.invalidated
+
+    def put(self, board_id, body, updated_at=None, generation=None):
+        entry = CachedBoard(body, updated_at, self.clock())
+        if self.max_entries <= 0 or len(body) > self.max_bytes:
+            return entry
+        with self.lock:
+            if generation is not None and generation != self.invalidated:
+                return entry
+            self._drop(board_id)
+            self.entries[board_id] = entry
+            self.bytes += len(body)
+            self._evict()
+        return entry
+
+    def encoded(self, board_id, entry, encoding, compress):
+        """`entry.body` compressed with `encoding`, compressing it only once per entry."""
+        data = entry.encoded.get(encoding)
+        if data is not None:
+            return data
+        data = compress(entry.body, encoding)
+        with self.lock:
+            if self.entries.get(board_id) is entry and encoding not in entry.encoded:
+                entry.encoded[encoding] = data
+                self.bytes += len(data)
+                self._evict()
+        return data
+
+    def invalidate(self, board_id):
+        with self.lock:
+            self.invalidated += 1
+            if self._drop(board_id):
+                self.counters["invalidations"] += 1
+
+    def clear(self):
+        with self.lock:
+            self.invalidated += 1
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, entries=len(self.entries), bytes=self.bytes)
+
+    def _evict(self):
+        while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+            self._drop(next(iter(self.entries)))
+            self.counters["evictions"] += 1
+
+    def _drop(self, board_id):
+        entry = self.entries.pop(board_id, None)
+        if entry is None:
+            return False
+        self.bytes -= entry.size()
+        return True
+
+
+board_cache = BoardCache()
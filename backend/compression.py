@@ -0,0 +1,127 @@
+import gzip
+import os
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+# REST responses at least this large are compressed when the client accepts it
+RESPONSE_COMPRESSION_MIN_SIZE = int(os.environ.get('RESPONSE_COMPRESSION_MIN_SIZE', 1024))
+RESPONSE_COMPRESSION = os.environ.get('RESPONSE_COMPRESSION', 'on').lower() != 'off'
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 5))
+# permessage-deflate for WebSocket frames: "on" or "off"
+WS_COMPRESSION = os.environ.get('WS_COMPRESSION', 'on').lower() != 'off'
+# Deflate window for WebSocket frames (9-15); smaller windows use less memory per connection
+WS_COMPRESSION_WINDOW_BITS = int(os.environ.get('WS_COMPRESSION_WINDOW_BITS', 15))
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/plain', 'text/html', 'image/svg+xml')
+
+
+def choose_encoding():
+    """Best encoding the client accepts ("br", "gzip") or None."""
+    if not RESPONSE_COMPRESSION:
+        return None
+    accepted = request.accept_encodings
+    candidates = (('br', 'gzip') if brotli is not None else ('gzip',))
+    best = max(candidates, key=lambda encoding: accepted[encoding])
+    return best if accepted[best] > 0 else None
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def gzip_stream(chunks):
+    """Gzip a streamed body chunk by chunk instead of buffering it."""
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def compress_response(response):
+    """after_request hook compressing JSON responses past the size threshold."""
+    if (response.status_code != 200 or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    if response.is_streamed:
+        # Size is unknown up front, so streamed listings are always gzipped
+        response.vary.add('Accept-Encoding')
+        if not RESPONSE_COMPRESSION or request.accept_encodings['gzip'] <= 0:
+            return response
+        response.response = gzip_stream(response.response)
+        response.headers['Content-Encoding'] = 'gzip'
+        return response
+
+    body = response.get_data()
+    if len(body) < RESPONSE_COMPRESSION_MIN_SIZE:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding()
+    if encoding is None:
+        return response
+    response.set_data(compress(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        # A different representation needs a different validator
+        response.set_etag(f"{etag}-{encoding}", weak)
+    return response
+
+
+class WebSocketCompressionMiddleware:
+    """Applies WS_COMPRESSION settings to the permessage-deflate offer of upgrades.
+
+    eventlet accepts whatever the browser offers, so the offer is rewritten
+    before it gets there: dropped to turn compression off, or given a smaller
+    server_max_window_bits to bound the per-connection deflate memory.
+    """
+
+    def __init__(self, wsgi_app, enabled=WS_COMPRESSION, window_bits=WS_COMPRESSION_WINDOW_BITS):
+        self.wsgi_app = wsgi_app
+        self.enabled = enabled
+        # zlib cannot produce raw deflate streams with an 8-bit window
+        self.window_bits = max(9, min(window_bits, 15))
+
+    def __call__(self, environ, start_response):
+        offer = environ.get('HTTP_SEC_WEBSOCKET_EXTENSIONS')
+        if offer:
+            rewritten = self.rewrite_offer(offer)
+            if rewritten:
+                environ['HTTP_SEC_WEBSOCKET_EXTENSIONS'] = rewritten
+            else:
+                del environ['HTTP_SEC_WEBSOCKET_EXTENSIONS']
+        return self.wsgi_app(environ, start_response)
+
+    def rewrite_offer(self, offer):
+        extensions = []
+        for extension in offer.split(','):
+            params = [p.strip() for p in extension.split(';')]
+            if params[0].lower() != 'permessage-deflate':
+                extensions.append(extension.strip())
+                continue
+            if not self.enabled:
+                continue
+            if self.window_bits < 15:
+                requested = [p for p in params[1:] if p.lower().startswith('server_max_window_bits')]
+                params = [params[0]] + [p for p in params[1:] if p not in requested]
+                bits = self.window_bits
+                for p in requested:
+                    value = p.partition('=')[2].strip().strip('"')
+                    if value.isdigit():
+                        bits = min(bits, int(value))
+                params.append(f'server_max_window_bits={bits}')
+            extensions.append('; '.join(params))
+        return ', '.join(extensions)
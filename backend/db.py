@@ -1,68 +1,240 @@
 import os
-from pymongo import MongoClient
+import threading
+import time
+from datetime import datetime, timezone
+
+import pymongo
+from pymongo import MongoClient, ASCENDING, DESCENDING, monitoring
 from dotenv import load_dotenv
 
+from db_pool import DB_POOL_SIZE, DBUnavailable, PooledCollection, db_pool
+from log import get_logger
+from metrics import MONGO_COMMAND_SECONDS
+
 load_dotenv()
+log = get_logger('db')
+
+MONGO_URI = os.getenv("MONGO_URI")
+# Seconds between connection attempts while MongoDB is unreachable; doubles up to the max
+MONGO_CONNECT_RETRY = float(os.environ.get('MONGO_CONNECT_RETRY', 1))
+MONGO_CONNECT_RETRY_MAX = float(os.environ.get('MONGO_CONNECT_RETRY_MAX', 30))
+# Seconds between background pings once connected; health endpoints read the last result
+HEALTH_CHECK_INTERVAL = float(os.environ.get('HEALTH_CHECK_INTERVAL', 15))
+MONGO_PING_TIMEOUT = float(os.environ.get('MONGO_PING_TIMEOUT', 5))
+
+
+class CommandTimer(monitoring.CommandListener):
+    """Feeds every MongoDB command's round trip time into the metrics."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_COMMAND_SECONDS.observe(event.duration_micros / 1e6, command=event.command_name, outcome='ok')
+
+    def failed(self, event):
+        MONGO_COMMAND_SECONDS.observe(event.duration_micros / 1e6, command=event.command_name, outcome='error')
+
+class MongoConnection:
+    """Connects to MongoDB in the background and keeps the last health check result.
+
+    Nothing here blocks importing the app: the client is created and pinged
+    by a background thread, retried with backoff until it answers, then
+    pinged every HEALTH_CHECK_INTERVAL seconds. Health endpoints read the
+    cached state instead of pinging on every probe.
+
+    States: "disabled" (no MONGO_URI), "connecting" (never reached yet),
+    "connected", "unreachable" (was connected, last ping failed).
+    """
+
+    def __init__(self, uri=MONGO_URI, interval=HEALTH_CHECK_INTERVAL, retry=MONGO_CONNECT_RETRY,
+                 retry_max=MONGO_CONNECT_RETRY_MAX, client_factory=None):
+        self.uri = uri
+        self.interval = interval
+        self.retry = retry
+        self.retry_max = retry_max
+        self.client_factory = client_factory or create_client
+        self.state = "connecting" if uri else "disabled"
+        self.client = None
+        self.database = None
+        self.last_error = None
+        self.last_ok = None
+        self.checked_at = None
+        self.latency_ms = None
+        self.attempts = 0
+        self.thread = None
+        self.lock = threading.Lock()
+        self.connected = threading.Event()
+
+    def start(self):
+        if self.state == "disabled" or self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run_forever, daemon=True)
+                self.thread.start()
+
+    def wait(self, timeout):
+        """Start connecting if needed and wait up to `timeout` seconds for the first success."""
+        self.start()
+        return self.connected.wait(timeout)
+
+    def collection(self, name):
+        if self.database is None:
+            self.start()
+            raise DBUnavailable(f"MongoDB is not connected yet ({self.state})")
+        return self.database[name]
 
-client = None
-db = None
-boards_collection = None
-whiteboards = None
-
-def connect_to_mongodb():
-    global client, db, boards_collection, whiteboards
-
-    mongo_uri = os.getenv("MONGO_URI")
-    print(f"MONGO_URI exists: {'Yes' if mongo_uri else 'No'}")
-    
-    if not mongo_uri:
-        print("MONGO_URI not found in environment variables.")
-        return False
-
-    try:
-        print("Attempting MongoDB connection...")
-        client = MongoClient(
-            mongo_uri,
-            serverSelectionTimeoutMS=10000,  # Reduced timeout for faster feedback
-            connectTimeoutMS=10000,
-            socketTimeoutMS=60000,
-            maxPoolSize=10,
-            minPoolSize=1,
-            maxIdleTimeMS=45000,
-            retryWrites=True,
-            tz_aware=True
-        )
-
-        # Ping to check connection
-        print("Testing connection with ping...")
-        client.admin.command("ping")
-        print("MongoDB connection successful")
-
-        db = client["canvasconnect"]
-        boards_collection = db["whiteboards"]
-        whiteboards = db["whiteboards"]
+    def check(self):
+        """Create the client if needed and ping it; returns whether MongoDB answered."""
+        self.attempts += 1
+        started = time.perf_counter()
+        try:
+            if self.client is None:
+                self.client = self.client_factory(self.uri)
+            with pymongo.timeout(MONGO_PING_TIMEOUT):
+                self.client.admin.command("ping")
+        except Exception as e:
+            self.checked_at = datetime.now(timezone.utc)
+            self.last_error = str(e)
+            if self.state == "connected":
+                log.warning("MongoDB ping failed", error=self.last_error)
+                self.state = "unreachable"
+            else:
+                log.warning("MongoDB connection attempt failed", attempt=self.attempts, error=self.last_error)
+            return False
+
+        self.checked_at = self.last_ok = datetime.now(timezone.utc)
+        self.latency_ms = round((time.perf_counter() - started) * 1000, 3)
+        self.last_error = None
+        if self.database is None:
+            self.database = self.client["canvasconnect"]
+            log.info("MongoDB connection successful", attempts=self.attempts, latency_ms=self.latency_ms)
+            ensure_indexes(self.database)
+            self.connected.set()
+        elif self.state != "connected":
+            log.info("MongoDB reachable again")
+        self.state = "connected"
         return True
 
-    except Exception as e:
-        print(f"MongoDB connection failed: {e}")
-        client = None
-        db = None
-        return False
-
-def test_mongodb_connection():
-    """Test MongoDB connection without crashing the app"""
-    try:
-        if client is None:
-            print("Client is None, attempting reconnection...")
-            success = connect_to_mongodb()
-            if not success:
-                return False, "Failed to connect"
-        
-        client.admin.command("ping")
-        return True, "Connected"
-    except Exception as e:
-        return False, str(e)
-
-print("Initializing MongoDB connection...")
-connection_success = connect_to_mongodb()
-print(f"Initial connection result: {'SUCCESS' if connection_success else 'FAILED'}")
\ No newline at end of file
+    def run_forever(self):
+        delay = self.retry
+        while True:
+            if self.check():
+                delay = self.retry
+                time.sleep(self.interval)
+            else:
+                time.sleep(delay)
+                delay = min(delay * 2, self.retry_max)
+
+    def health(self):
+        return {
+            "state": self.state,
+            "lastOk": self.last_ok,
+            "checkedAt": self.checked_at,
+            "latencyMs": self.latency_ms,
+            "error": self.last_error,
+            "attempts": self.attempts,
+        }
+
+
+class LazyCollection:
+    """A collection of the database the background connector will open.
+
+    Route modules import their collections once; this lets them do so before
+    MongoDB has been reached. Calls fail with DBUnavailable until it has.
+    """
+
+    def __init__(self, connection, name):
+        self.connection = connection
+        self.name = name
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.connection.collection(self.name), name)
+
+
+def create_client(uri):
+    return MongoClient(
+        uri,
+        serverSelectionTimeoutMS=10000,  # Reduced timeout for faster feedback
+        connectTimeoutMS=10000,
+        socketTimeoutMS=60000,
+        # Every command runs on a DB pool worker, so one connection per worker
+        maxPoolSize=DB_POOL_SIZE,
+        minPoolSize=1,
+        maxIdleTimeMS=45000,
+        retryWrites=True,
+        tz_aware=True,
+        event_listeners=[CommandTimer()]
+    )
+
+
+connection = MongoConnection()
+
+if MONGO_URI:
+    boards_collection = PooledCollection(LazyCollection(connection, "whiteboards"), db_pool)
+    whiteboards = PooledCollection(LazyCollection(connection, "whiteboards"), db_pool)
+    # Per-board journal of changes and checkpoints, see history.py
+    history_collection = PooledCollection(LazyCollection(connection, "board_history"), db_pool)
+    # One rendered PNG thumbnail per board, see thumbnails.py
+    thumbnails_collection = PooledCollection(LazyCollection(connection, "board_thumbnails"), db_pool)
+    # Notes and text boxes, one document per element, see elements.py
+    elements_collection = PooledCollection(LazyCollection(connection, "board_elements"), db_pool)
+    # Queued and finished background jobs, see jobs.py
+    jobs_collection = PooledCollection(LazyCollection(connection, "jobs"), db_pool)
+else:
+    log.warning("MONGO_URI not found in environment variables")
+    boards_collection = None
+    whiteboards = None
+    history_collection = None
+    thumbnails_collection = None
+    elements_collection = None
+    jobs_collection = None
+
+# (collection, keys, options) of the indexes the board and history queries rely on
+INDEXES = (
+    # Dashboard listing: filter by user, newest first, _id as tie-breaker for cursors
+    ("whiteboards", [("userId", ASCENDING), ("updatedAt", DESCENDING), ("_id", DESCENDING)],
+     {"name": "userId_updatedAt"}),
+    # One index per $or branch of the whiteboard listing; the trailing _id
+    # lets MongoDB merge both branches already sorted instead of sorting in memory
+    ("whiteboards", [("owner", ASCENDING), ("_id", DESCENDING)], {"name": "owner_id"}),
+    ("whiteboards", [("sharedWith", ASCENDING), ("_id", DESCENDING)], {"name": "sharedWith_id"}),
+    ("whiteboards", [("boardId", ASCENDING), ("userEmail", ASCENDING)], {"name": "boardId_userEmail"}),
+    # One journal entry per board, kind and version; replays walk a board's versions in order
+    ("board_history", [("boardId", ASCENDING), ("type", ASCENDING), ("version", DESCENDING)],
+     {"name": "boardId_type_version", "unique": True}),
+    ("board_history", [("boardId", ASCENDING), ("version", DESCENDING)], {"name": "boardId_version"}),
+    # One document per board, field and element; boards load their elements in order
+    ("board_elements", [("boardId", ASCENDING), ("field", ASCENDING), ("elementId", ASCENDING)],
+     {"name": "boardId_field_elementId", "unique": True}),
+    ("board_elements", [("boardId", ASCENDING), ("order", ASCENDING)], {"name": "boardId_order"}),
+    # Workers claim the oldest due job; enqueue looks for an active job with the same key
+    ("jobs", [("status", ASCENDING), ("runAfter", ASCENDING)], {"name": "status_runAfter"}),
+    ("jobs", [("key", ASCENDING), ("status", ASCENDING)], {"name": "key_status"}),
+    ("jobs", [("createdAt", DESCENDING)], {"name": "createdAt"}),
+    # Finished jobs are dropped by MongoDB once their expiresAt passes
+    ("jobs", "expiresAt", {"name": "expiresAt_ttl", "expireAfterSeconds": 0}),
+)
+
+def ensure_indexes(database):
+    """Create the indexes the board and history queries rely on (no-op if they exist).
+
+    Each index is created on its own, so one that fails (e.g. a unique index
+    over duplicate documents) does not keep the others from being built.
+    Returns the names of the indexes that could not be created.
+    """
+    failed = []
+    for collection, keys, options in INDEXES:
+        try:
+            database[collection].create_index(keys, **options)
+        except Exception as e:
+            failed.append(options["name"])
+            log.error("Failed to create MongoDB index", collection=collection, index=options["name"], error=str(e))
+    if failed:
+        log.warning("Some MongoDB indexes are missing", failed=','.join(failed))
+    else:
+        log.info("MongoDB indexes ensured")
+    return failed
@@ -0,0 +1,302 @@
+import itertools
+import os
+import queue
+import threading
+import time
+
+import pymongo
+from pymongo.errors import ConnectionFailure, PyMongoError
+
+from log import get_logger
+
+log = get_logger('db_pool')
+
+# Workers running MongoDB calls; also the MongoClient's maxPoolSize
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+# Calls waiting for a free worker before new ones are rejected outright
+DB_QUEUE_LIMIT = int(os.environ.get('DB_QUEUE_LIMIT', 100))
+# Seconds a caller waits for its call, queueing included
+DB_TIMEOUT = float(os.environ.get('DB_TIMEOUT', 5))
+# Consecutive outage errors or timeouts that open the circuit breaker
+DB_BREAKER_FAILURES = int(os.environ.get('DB_BREAKER_FAILURES', 5))
+# Seconds the breaker stays open before one trial call is let through
+DB_BREAKER_RESET = float(os.environ.get('DB_BREAKER_RESET', 10))
+
+# Cursor documents fetched per worker round trip when iterating a find()
+CURSOR_CHUNK = 100
+
+
+class DBUnavailable(Exception):
+    """MongoDB cannot serve the call right now; the caller should retry later."""
+
+    retry_after = 1
+
+
+class DBTimeout(DBUnavailable):
+    pass
+
+
+class DBOverloaded(DBUnavailable):
+    pass
+
+
+class DBCircuitOpen(DBUnavailable):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_outage(error):
+    """Errors that mean MongoDB is unreachable or slow, as opposed to a bad query."""
+    return isinstance(error, ConnectionFailure) or (isinstance(error, PyMongoError) and error.timeout)
+
+
+class CircuitBreaker:
+    """Fails calls fast after repeated outages instead of queueing them.
+
+    closed: calls go through. open: calls are rejected until `reset_after`
+    has passed. half_open: one trial call goes through; its outcome closes
+    or re-opens the breaker.
+    """
+
+    def __init__(self, failures=DB_BREAKER_FAILURES, reset_after=DB_BREAKER_RESET, clock=time.monotonic):
+        self.failures = failures
+        self.reset_after = reset_after
+        self.clock = clock
+        self.state = 'closed'
+        self.consecutive = 0
+        self.opened_at = 0.0
+        self.trial_running = False
+        self.opened = 0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and self.clock() - self.opened_at >= self.reset_after:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def success(self):
+        with self.lock:
+            if self.state != 'closed':
+                log.info("MongoDB circuit closed")
+            self.state = 'closed'
+            self.consecutive = 0
+            self.trial_running = False
+
+    def failure(self):
+        with self.lock:
+            self.consecutive += 1
+            self.trial_running = False
+            if self.state == 'half_open' or (self.state == 'closed' and self.consecutive >= self.failures):
+                self.state = 'open'
+                self.opened_at = self.clock()
+                self.opened += 1
+                log.warning("MongoDB circuit opened", consecutive_failures=self.consecutive,
+                            reset_after=self.reset_after)
+
+    def retry_after(self):
+        """Seconds until the breaker lets a trial call through."""
+        with self.lock:
+            return max(1.0, self.reset_after - (self.clock() - self.opened_at))
+
+    def release(self):
+        """A trial call ended without telling anything about MongoDB's health."""
+        with self.lock:
+            self.trial_running = False
+
+
+class _Call:
+    __slots__ = ('fn', 'args', 'kwargs', 'deadline', 'done', 'result', 'error', 'abandoned')
+
+    def __init__(self, fn, args, kwargs, deadline):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.deadline = deadline
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.abandoned = False
+
+
+class DBPool:
+    """Runs MongoDB calls on a fixed set of workers so callers never wait unboundedly.
+
+    At most `size` calls run at once and at most `queue_limit` wait for a
+    worker; beyond that calls fail with DBOverloaded at once. A caller waits
+    `timeout` seconds in total and then gets DBTimeout; the call itself runs
+    under pymongo's client-side timeout for the time left, so abandoned
+    calls end too. Outage errors and timeouts feed the circuit breaker,
+    which rejects calls with DBCircuitOpen while MongoDB is down.
+
+    With eventlet the workers are green threads: a slow or failing MongoDB
+    occupies at most `size` greenlets and socket traffic keeps flowing.
+    """
+
+    def __init__(self, size=DB_POOL_SIZE, queue_limit=DB_QUEUE_LIMIT, timeout=DB_TIMEOUT, breaker=None):
+        self.size = size
+        self.timeout = timeout
+        self.calls = queue.Queue(maxsize=queue_limit)
+        self.queue_limit = queue_limit
+        self.breaker = breaker or CircuitBreaker()
+        self.workers = []
+        self.in_flight = 0
+        self.lock = threading.Lock()
+        self.metrics = {
+            "calls": 0,
+            "completed": 0,
+            "errors": 0,
+            "timeouts": 0,
+            "rejected": 0,
+            "short_circuited": 0,
+            "expired_in_queue": 0,
+        }
+
+    def call(self, fn, *args, **kwargs):
+        """Run `fn(*args, **kwargs)` on a worker and return its result."""
+        self.metrics["calls"] += 1
+        if not self.breaker.allow():
+            self.metrics["short_circuited"] += 1
+            raise DBCircuitOpen("MongoDB circuit breaker is open", self.breaker.retry_after())
+
+        call = _Call(fn, args, kwargs, time.monotonic() + self.timeout)
+        self._start_workers()
+        try:
+            self.calls.put_nowait(call)
+        except queue.Full:
+            self.metrics["rejected"] += 1
+            self.breaker.release()
+            raise DBOverloaded(f"{self.queue_limit} MongoDB calls already waiting") from None
+
+        if not call.done.wait(self.timeout):
+            call.abandoned = True
+            self.metrics["timeouts"] += 1
+            self.breaker.failure()
+            raise DBTimeout(f"MongoDB call did not finish within {self.timeout}s")
+
+        if call.error is not None:
+            self.metrics["errors"] += 1
+            if is_outage(call.error):
+                self.breaker.failure()
+                error = DBTimeout if call.error.timeout else DBUnavailable
+                raise error(str(call.error)) from call.error
+            # The server answered, so it is up even if the query was bad
+            self.breaker.success()
+            raise call.error
+        self.metrics["completed"] += 1
+        self.breaker.success()
+        return call.result
+
+    def stats(self):
+        return dict(
+            self.metrics,
+            pool_size=self.size,
+            queue_limit=self.queue_limit,
+            queued=self.calls.qsize(),
+            in_flight=self.in_flight,
+            timeout_s=self.timeout,
+            breaker=self.breaker.state,
+            breaker_open=int(self.breaker.state != 'closed'),
+            breaker_opened=self.breaker.opened,
+        )
+
+    def _start_workers(self):
+        if len(self.workers) >= self.size:
+            return
+        with self.lock:
+            while len(self.workers) < self.size:
+                worker = threading.Thread(target=self._work, daemon=True)
+                worker.start()
+                self.workers.append(worker)
+
+    def _work(self):
+        while True:
+            call = self.calls.get()
+            remaining = call.deadline - time.monotonic()
+            if call.abandoned or remaining <= 0:
+                self.metrics["expired_in_queue"] += 1
+                continue
+            self.in_flight += 1
+            try:
+                with pymongo.timeout(remaining):
+                    call.result = call.fn(*call.args, **call.kwargs)
+            except Exception as e:
+                call.error = e
+            finally:
+                self.in_flight -= 1
+                call.done.set()
+
+
+class PooledCursor:
+    """A find() cursor whose round trips run on the pool, a chunk of documents at a time."""
+
+    def __init__(self, pool, cursor):
+        self.pool = pool
+        self.cursor = cursor
+        self.chunk = CURSOR_CHUNK
+
+    def sort(self, *args, **kwargs):
+        self.cursor.sort(*args, **kwargs)
+        return self
+
+    def limit(self, limit):
+        self.cursor.limit(limit)
+        if limit:
+            # A page is read in one round trip
+            self.chunk = limit
+        return self
+
+    def skip(self, skip):
+        self.cursor.skip(skip)
+        return self
+
+    def batch_size(self, batch_size):
+        self.cursor.batch_size(batch_size)
+        self.chunk = batch_size or CURSOR_CHUNK
+        return self
+
+    def close(self):
+        self.cursor.close()
+
+    def __iter__(self):
+        while True:
+            documents = self.pool.call(lambda: list(itertools.islice(self.cursor, self.chunk)))
+            yield from documents
+            if len(documents) < self.chunk:
+                return
+
+
+class PooledCollection:
+    """A pymongo Collection whose commands run on a DBPool."""
+
+    COMMANDS = (
+        'find_one', 'insert_one', 'insert_many', 'update_one', 'update_many', 'delete_one', 'delete_many',
+        'bulk_write', 'count_documents', 'distinct', 'find_one_and_update', 'find_one_and_delete',
+        'create_index',
+    )
+
+    def __init__(self, collection, pool):
+        self.collection = collection
+        self.pool = pool
+
+    def find(self, *args, **kwargs):
+        # Building a cursor does no I/O; iterating it does
+        return PooledCursor(self.pool, self.collection.find(*args, **kwargs))
+
+    def aggregate(self, pipeline, **kwargs):
+        return self.pool.call(lambda: list(self.collection.aggregate(pipeline, **kwargs)))
+
+    def __getattr__(self, name):
+        attr = getattr(self.collection, name)
+        if name not in self.COMMANDS:
+            return attr
+        return lambda *args, **kwargs: self.pool.call(attr, *args, **kwargs)
+
+
+db_pool = DBPool()
@@ -0,0 +1,131 @@
+from pymongo import UpdateOne
+
+# Board fields that hold arrays of elements keyed by "id"
+DELTA_FIELDS = ("data", "notes", "textBoxes")
+DELTA_OPS = ("add", "remove", "modify")
+MAX_DELTA_OPS = 500
+# Stroke fields a packed line's stored bbox is computed from
+GEOMETRY_KEYS = {"points", "strokeWidth"}
+
+
+class DeltaError(ValueError):
+    """Raised when a delta payload is malformed."""
+
+
+def version_filter(version):
+    """Match a board at `version`; boards saved before versioning count as 0."""
+    if version == 0:
+        return {"$in": [0, None]}
+    return version
+
+
+def validate_ops(ops):
+    if not isinstance(ops, list) or not ops:
+        raise DeltaError("ops must be a non-empty list")
+    if len(ops) > MAX_DELTA_OPS:
+        raise DeltaError(f"Too many ops (max {MAX_DELTA_OPS})")
+
+    for index, op in enumerate(ops):
+        if not isinstance(op, dict):
+            raise DeltaError(f"Op {index} must be an object")
+        if op.get("op") not in DELTA_OPS:
+            raise DeltaError(f"Op {index} has unknown type: {op.get('op')}")
+        if op.get("field", "data") not in DELTA_FIELDS:
+            raise DeltaError(f"Op {index} targets unknown field: {op.get('field')}")
+
+        if op["op"] == "add":
+            element = op.get("element")
+            if not isinstance(element, dict) or element.get("id") is None:
+                raise DeltaError(f"Op {index} must carry an element with an id")
+        elif op.get("id") is None:
+            raise DeltaError(f"Op {index} is missing the element id")
+
+        if op["op"] == "modify":
+            changes = op.get("changes")
+            if not isinstance(changes, dict) or not changes:
+                raise DeltaError(f"Op {index} must carry a non-empty changes object")
+            for key in changes:
+                if key == "id" or "." in key or key.startswith("$"):
+                    raise DeltaError(f"Op {index} cannot change key: {key}")
+
+
+def version_guard(board_id, base_version, now):
+    """Filter and update that claim the next version of a board.
+
+    The update only matches while the board is still at `base_version`, so a
+    stale client's batch is rejected before any of its ops are written.
+    """
+    return (
+        {"_id": board_id, "version": version_filter(base_version)},
+        {"$inc": {"version": 1}, "$set": {"updatedAt": now}}
+    )
+
+
+def build_delta_requests(board_id, next_version, ops):
+    """Translate delta ops into an ordered list of bulk_write requests.
+
+    Every request filters on `next_version` (the version claimed through
+    `version_guard`), so a concurrent writer that bumps the version again
+    stops the remaining ops from landing on top of its changes. With
+    `next_version` None they only filter on the board, for ops that each
+    touch one element and so never conflict with other writers.
+
+    Every request can be repeated: adds skip once their elements are on the
+    board, so a batch retried after a partial failure lands each op once.
+    """
+    validate_ops(ops)
+    guarded = {"_id": board_id} if next_version is None else {"_id": board_id, "version": next_version}
+    requests = []
+
+    # Boards created without content store "" (or nothing) instead of a list
+    added_fields = {op.get("field", "data") for op in ops if op["op"] == "add"}
+    for field in DELTA_FIELDS:
+        if field in added_fields:
+            requests.append(UpdateOne(
+                dict(guarded, **{field: {"$in": [None, ""]}}),
+                {"$set": {field: []}}
+            ))
+
+    pending_field = None
+    pending_adds = []
+
+    def flush_adds():
+        if pending_adds:
+            ids = [element["id"] for element in pending_adds]
+            requests.append(UpdateOne(
+                dict(guarded, **{f"{pending_field}.id": {"$nin": ids}}),
+                {"$push": {pending_field: {"$each": list(pending_adds)}}}
+            ))
+            pending_adds.clear()
+
+    for op in ops:
+        field = op.get("field", "data")
+
+        # Consecutive adds to the same array collapse into one $push/$each
+        if op["op"] == "add":
+            if field != pending_field:
+                flush_adds()
+                pending_field = field
+            pending_adds.append(op["element"])
+            continue
+
+        flush_adds()
+        pending_field = None
+
+        if op["op"] == "remove":
+            requests.append(UpdateOne(
+                guarded,
+                {"$pull": {field: {"id": op["id"]}}}
+            ))
+        else:
+            update = {"$set": {f"{field}.$.{key}": value for key, value in op["changes"].items()}}
+            if field == "data" and GEOMETRY_KEYS & set(op["changes"]):
+                # A stale bbox would hide the stroke from viewport queries
+                update["$unset"] = {f"{field}.$.bbox": ""}
+            requests.append(UpdateOne(
+                dict(guarded, **{f"{field}.id": op["id"]}),
+                update
+            ))
+
+    flush_adds()
+    return requests
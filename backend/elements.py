@@ -0,0 +1,363 @@
+import os
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from pymongo import DeleteMany, DeleteOne, UpdateOne
+
+import db
+from log import get_logger
+
+log = get_logger('elements')
+
+# "on" (default) or "off"; whether writes move notes and text boxes out of the board document.
+# Boards already moved are read from board_elements either way
+BOARD_ELEMENT_STORE = os.environ.get('BOARD_ELEMENT_STORE', 'on').lower() != 'off'
+
+# Board fields whose elements are stored as documents of their own
+ELEMENT_FIELDS = ("notes", "textBoxes")
+# Set on boards whose notes and text boxes live in board_elements; older boards embed them as arrays
+STORED_FLAG = "elementsStored"
+# What moving a board's elements reads from it
+MIGRATE_PROJECTION = dict({field: 1 for field in ELEMENT_FIELDS}, **{STORED_FLAG: 1})
+
+# Boards remembered as already moved before the set is cleared
+MAX_KNOWN_BOARDS = 10000
+# Smallest gap left between the orders of neighbouring elements before a list is renumbered
+MIN_ORDER_GAP = 1e-6
+
+
+def element_key(board_id, field, element_id):
+    return {"boardId": board_id, "field": field, "elementId": element_id}
+
+
+def element_id_candidates(raw):
+    """Stored ids an element id taken from a URL may stand for; text boxes use numeric ids."""
+    candidates = [raw]
+    try:
+        number = int(raw)
+    except (TypeError, ValueError):
+        return candidates
+    if str(number) == raw:
+        candidates.append(number)
+    return candidates
+
+
+def _keyed(elements):
+    """{id: element} in list order; elements without an id, or repeating one, are left out."""
+    keyed = {}
+    if not isinstance(elements, list):
+        return keyed
+    for element in elements:
+        if isinstance(element, dict) and element.get("id") is not None and element["id"] not in keyed:
+            keyed[element["id"]] = element
+    return keyed
+
+
+def _orders(new_ids, kept):
+    """Orders for `new_ids` that keep the stored order of `kept` ({id: order}) elements.
+
+    Added elements get orders between their kept neighbours. Returns None
+    when that is impossible (kept elements were reordered, or the gap
+    between neighbours is used up), in which case the list is renumbered.
+    """
+    kept_orders = [kept[element_id] for element_id in new_ids if element_id in kept]
+    if kept_orders != sorted(kept_orders):
+        return None
+    orders = {}
+    run = []
+    low = None
+    for element_id in list(new_ids) + [None]:
+        if element_id is not None and element_id not in kept:
+            run.append(element_id)
+            continue
+        high = kept[element_id] if element_id is not None else None
+        if run:
+            if low is None and high is None:
+                spaced = range(len(run))
+            elif high is None:
+                spaced = [low + 1 + i for i in range(len(run))]
+            elif low is None:
+                spaced = [high - len(run) + i for i in range(len(run))]
+            else:
+                gap = (high - low) / (len(run) + 1)
+                if gap < MIN_ORDER_GAP:
+                    return None
+                spaced = [low + gap * (i + 1) for i in range(len(run))]
+            orders.update(zip(run, spaced))
+            run = []
+        if element_id is not None:
+            orders[element_id] = high
+            low = high
+    return orders
+
+
+def sync_requests(board_id, field, stored, elements, now):
+    """bulk_write requests turning the stored elements of a field into the list `elements`.
+
+    `stored` is [(element id, order, element)] as read from board_elements.
+    Only elements that were added, changed or moved are written; removed
+    ones are deleted with one DeleteMany. Returns (requests, unchanged
+    count, removed count).
+    """
+    wanted = _keyed(elements)
+    before = {element_id: (order, element) for element_id, order, element in stored}
+    kept = {element_id: before[element_id][0] for element_id in wanted if element_id in before}
+    orders = _orders(list(wanted), kept)
+    if orders is None:
+        orders = {element_id: index for index, element_id in enumerate(wanted)}
+
+    requests = []
+    removed = [element_id for element_id in before if element_id not in wanted]
+    if removed:
+        requests.append(DeleteMany(dict(element_key(board_id, field, None), elementId={"$in": removed})))
+    unchanged = 0
+    for element_id, element in wanted.items():
+        order = orders[element_id]
+        if element_id in before and before[element_id] == (order, element):
+            unchanged += 1
+            continue
+        # Upserts keep a retried flush from inserting the same element twice
+        requests.append(UpdateOne(element_key(board_id, field, element_id),
+                                  {"$set": {"order": order, "element": element, "updatedAt": now}}, upsert=True))
+    return requests, unchanged, len(removed)
+
+
+class ElementStore:
+    """Notes and text boxes of boards, one document per element in board_elements.
+
+    A board's element lists are rebuilt from `{boardId, field, elementId,
+    order, element}` documents, so the board document stays small however
+    many notes it has. Full saves are diffed against the stored elements and
+    write only the elements that changed; delta ops and the per-element
+    endpoints write a single document. Boards still embedding their arrays
+    are moved over on their first write that touches them.
+    """
+
+    def __init__(self, collection_getter, enabled=BOARD_ELEMENT_STORE):
+        self.collection_getter = collection_getter
+        self.enabled = enabled
+        # Boards known to have their elements stored here
+        self.stored = set()
+        # Called with (board id, op) after a delta or element endpoint changed a stored element
+        self.on_change = None
+        self.metrics = {
+            "reads": 0,
+            "written": 0,
+            "unchanged": 0,
+            "removed": 0,
+            "migrated": 0,
+        }
+
+    def collection(self):
+        return self.collection_getter()
+
+    def load(self, board_ids):
+        """{board id: {field: [element, ...]}} of boards whose elements are stored here."""
+        found = {board_id: {field: [] for field in ELEMENT_FIELDS} for board_id in board_ids}
+        if not found:
+            return found
+        docs = self.collection().find({"boardId": {"$in": list(found)}},
+                                      {"boardId": 1, "field": 1, "element": 1, "order": 1})
+        self.metrics["reads"] += 1
+        for doc in sorted(docs, key=lambda doc: doc["order"]):
+            found[doc["boardId"]][doc["field"]].append(doc["element"])
+        return found
+
+    def attach(self, boards):
+        """Fill in the notes and text boxes of stored boards, in place; returns `boards`."""
+        stored = [board for board in boards if board and board.get(STORED_FLAG)]
+        if stored:
+            loaded = self.load([board["_id"] for board in stored])
+            for board in stored:
+                board.update(loaded[board["_id"]])
+        return boards
+
+    def attach_one(self, board):
+        return self.attach([board])[0]
+
+    def count_into(self, summaries):
+        """Set noteCount / textBoxCount of dashboard summaries of stored boards, in place."""
+        stored = {board["_id"]: board for board in summaries if board.get(STORED_FLAG)}
+        if not stored:
+            return summaries
+        counts = self.collection().aggregate([
+            {"$match": {"boardId": {"$in": list(stored)}}},
+            {"$group": {"_id": {"boardId": "$boardId", "field": "$field"}, "count": {"$sum": 1}}},
+        ])
+        for board in stored.values():
+            board["noteCount"] = board["textBoxCount"] = 0
+        for count in counts:
+            name = "noteCount" if count["_id"]["field"] == "notes" else "textBoxCount"
+            stored[count["_id"]["boardId"]][name] = count["count"]
+        return summaries
+
+    def prepare(self, boards, writes):
+        """Element writes for a batch of queued board writes ({board id: PendingWrite}).
+
+        Returns (requests, ids of the boards whose elements they store). The
+        board writes of those boards leave the element fields out. Runs
+        before the batch is written.
+        """
+        if not self.enabled or self.collection() is None:
+            return [], set()
+        touched, updates = {}, []
+        for board_id, pending in writes.items():
+            if pending.insert_doc is not None:
+                if any(field in pending.insert_doc for field in ELEMENT_FIELDS):
+                    touched[board_id] = {field: pending.insert_doc.get(field) for field in ELEMENT_FIELDS}
+            elif any(field in pending.set_fields for field in ELEMENT_FIELDS):
+                touched[board_id] = {field: pending.set_fields[field]
+                                     for field in ELEMENT_FIELDS if field in pending.set_fields}
+                updates.append(board_id)
+        if not touched:
+            return [], set()
+
+        stored, legacy = set(), {}
+        if updates:
+            for board in boards.find({"_id": {"$in": updates}}, MIGRATE_PROJECTION):
+                if board.get(STORED_FLAG):
+                    stored.add(board["_id"])
+                else:
+                    legacy[board["_id"]] = board
+        current = self._stored_elements(list(stored) + list(legacy))
+
+        now = datetime.utcnow()
+        requests, moved = [], set()
+        for board_id, fields in touched.items():
+            if board_id in updates and board_id not in stored and board_id not in legacy:
+                # Deleted since the write was queued
+                continue
+            if board_id in legacy:
+                # The fields this write leaves alone move over along with it
+                fields = dict({field: legacy[board_id].get(field) for field in ELEMENT_FIELDS}, **fields)
+                self.metrics["migrated"] += 1
+            for field, elements in fields.items():
+                requests.extend(self._sync(board_id, field, current.get((board_id, field), []), elements, now))
+            moved.add(board_id)
+        return requests, moved
+
+    def write(self, requests):
+        if requests:
+            self.collection().bulk_write(requests, ordered=False)
+
+    def mark_stored(self, board_ids):
+        """Remember boards whose flagged board document has been written."""
+        for board_id in board_ids:
+            self._remember(board_id)
+
+    def ensure_stored(self, boards, board_id):
+        """Whether a board's elements live here, moving them over first if the store is enabled.
+
+        None when the board does not exist.
+        """
+        if board_id in self.stored:
+            return True
+        board = boards.find_one({"_id": board_id}, MIGRATE_PROJECTION)
+        if board is None:
+            return None
+        if not board.get(STORED_FLAG):
+            if not self.enabled or self.collection() is None:
+                return False
+            self.migrate(boards, board)
+        self._remember(board_id)
+        return True
+
+    def migrate(self, boards, board):
+        """Move a board's embedded notes and text boxes into the store and drop the arrays."""
+        board_id = board["_id"]
+        current = self._stored_elements([board_id])
+        now = datetime.utcnow()
+        requests = []
+        for field in ELEMENT_FIELDS:
+            requests.extend(self._sync(board_id, field, current.get((board_id, field), []), board.get(field), now))
+        self.write(requests)
+        boards.update_one({"_id": board_id, STORED_FLAG: {"$ne": True}},
+                          {"$set": {STORED_FLAG: True}, "$unset": {field: "" for field in ELEMENT_FIELDS}})
+        self.metrics["migrated"] += 1
+        log.info("Moved board elements", board=board_id, elements=len(requests))
+
+    def find_id(self, board_id, field, candidates):
+        """The stored id among `candidates` of an element of a board, or None."""
+        doc = self.collection().find_one(dict(element_key(board_id, field, None), elementId={"$in": candidates}),
+                                         {"elementId": 1})
+        return doc["elementId"] if doc is not None else None
+
+    def apply_ops(self, board_id, ops):
+        """Write validated delta ops on notes and text boxes, one element document each.
+
+        Unlike ops on the board document these are not guarded by the board
+        version: each touches a single element, so concurrent ops on other
+        elements never conflict.
+        """
+        if not ops:
+            return
+        now = datetime.utcnow()
+        requests = []
+        for op in ops:
+            field = op["field"]
+            if op["op"] == "add":
+                # Added elements go after every stored one
+                requests.append(UpdateOne(
+                    element_key(board_id, field, op["element"]["id"]),
+                    {"$set": {"order": time.time() * 1000, "element": op["element"], "updatedAt": now}},
+                    upsert=True
+                ))
+            elif op["op"] == "remove":
+                requests.append(DeleteOne(element_key(board_id, field, op["id"])))
+            else:
+                changes = {f"element.{key}": value for key, value in op["changes"].items()}
+                requests.append(UpdateOne(element_key(board_id, field, op["id"]),
+                                          {"$set": dict(changes, updatedAt=now)}))
+        self.collection().bulk_write(requests, ordered=True)
+        self.metrics["written"] += sum(1 for op in ops if op["op"] != "remove")
+        self.metrics["removed"] += sum(1 for op in ops if op["op"] == "remove")
+
+    def changed(self, board_id, ops):
+        """Tell `on_change` about ops applied to a board's elements."""
+        if self.on_change is None:
+            return
+        for op in ops:
+            try:
+                self.on_change(board_id, op)
+            except Exception as e:
+                log.error("Element change callback failed", board=board_id, error=str(e))
+
+    def forget(self, board_ids):
+        """Delete the elements of deleted boards."""
+        board_ids = list(board_ids)
+        collection = self.collection()
+        if collection is None or not board_ids:
+            return
+        collection.delete_many({"boardId": {"$in": board_ids}})
+        self.stored.difference_update(board_ids)
+
+    def stats(self):
+        return dict(self.metrics, enabled=int(self.enabled), known_boards=len(self.stored))
+
+    def _stored_elements(self, board_ids):
+        """{(board id, field): [(element id, order, element)]} of stored elements, in order."""
+        current = defaultdict(list)
+        if not board_ids:
+            return current
+        docs = self.collection().find({"boardId": {"$in": board_ids}},
+                                      {"boardId": 1, "field": 1, "elementId": 1, "order": 1, "element": 1})
+        self.metrics["reads"] += 1
+        for doc in sorted(docs, key=lambda doc: doc["order"]):
+            current[(doc["boardId"], doc["field"])].append((doc["elementId"], doc["order"], doc["element"]))
+        return current
+
+    def _sync(self, board_id, field, stored, elements, now):
+        requests, unchanged, removed = sync_requests(board_id, field, stored, elements, now)
+        self.metrics["unchanged"] += unchanged
+        self.metrics["removed"] += removed
+        self.metrics["written"] += len(requests) - (1 if removed else 0)
+        return requests
+
+    def _remember(self, board_id):
+        if len(self.stored) >= MAX_KNOWN_BOARDS:
+            self.stored.clear()
+        self.stored.add(board_id)
+
+
+board_elements = ElementStore(lambda: db.elements_collection)
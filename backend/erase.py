@@ -0,0 +1,298 @@
+import math
+import os
+import uuid
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - exercised when numpy is not installed
+    np = None
+
+# Eraser points accepted in one erase_path event
+ERASE_MAX_PATH_POINTS = int(os.environ.get('ERASE_MAX_PATH_POINTS', 256))
+# Largest eraser radius accepted, in canvas units
+ERASE_MAX_RADIUS = float(os.environ.get('ERASE_MAX_RADIUS', 500))
+
+# Pieces of a split stroke shorter than this, in canvas units, are dropped
+MIN_FRAGMENT_LENGTH = 0.5
+# Strokes with at least this many points are hit-tested with numpy; shorter ones are cheaper in plain Python
+VECTORIZE_MIN_POINTS = 64
+
+
+class EraseError(ValueError):
+    """Raised when an erase payload is malformed."""
+
+
+def _finite(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def _all_finite(values):
+    if np is not None and len(values) >= 2 * VECTORIZE_MIN_POINTS:
+        array = np.asarray(values)
+        # Strings, bools and other objects leave the array without a numeric dtype
+        return array.dtype.kind in 'iuf' and bool(np.isfinite(array).all())
+    return all(_finite(v) for v in values)
+
+
+def parse_erase_path(data):
+    """Eraser centre points [(x, y), ...] and radius of an erase_path payload."""
+    path = data.get('path')
+    radius = data.get('radius')
+    if not isinstance(path, list) or len(path) < 2 or len(path) % 2:
+        raise EraseError("path must be a flat list of x, y pairs")
+    if len(path) // 2 > ERASE_MAX_PATH_POINTS:
+        raise EraseError(f"path is too long (max {ERASE_MAX_PATH_POINTS} points)")
+    if not all(_finite(v) for v in path):
+        raise EraseError("path must hold finite numbers")
+    if not _finite(radius) or not 0 < radius <= ERASE_MAX_RADIUS:
+        raise EraseError(f"radius must be between 0 and {ERASE_MAX_RADIUS}")
+    return list(zip(path[0::2], path[1::2])), float(radius)
+
+
+def _capsules(path):
+    """(ax, ay, ex, ey, min_x, min_y, max_x, max_y) per eraser segment; a lone point is a zero-length one."""
+    if len(path) == 1:
+        path = path * 2
+    capsules = []
+    for (ax, ay), (bx, by) in zip(path, path[1:]):
+        capsules.append((ax, ay, bx - ax, by - ay, min(ax, bx), min(ay, by), max(ax, bx), max(ay, by)))
+    return capsules
+
+
+def _clip(lo, hi, v0, dv, vmin, vmax):
+    """Narrow [lo, hi] to the t where vmin <= v0 + t * dv <= vmax."""
+    if dv == 0:
+        return (lo, hi) if vmin <= v0 <= vmax else (1.0, 0.0)
+    t0, t1 = (vmin - v0) / dv, (vmax - v0) / dv
+    if t0 > t1:
+        t0, t1 = t1, t0
+    return max(lo, t0), min(hi, t1)
+
+
+def _disk_interval(px, py, dx, dy, cx, cy, r):
+    """t range where P + t * d lies within r of C."""
+    fx, fy = px - cx, py - cy
+    a = dx * dx + dy * dy
+    c = fx * fx + fy * fy - r * r
+    if a == 0:
+        return (-math.inf, math.inf) if c <= 0 else None
+    b = 2 * (fx * dx + fy * dy)
+    disc = b * b - 4 * a * c
+    if disc < 0:
+        return None
+    root = math.sqrt(disc)
+    return (-b - root) / (2 * a), (-b + root) / (2 * a)
+
+
+def _capsule_interval(px, py, dx, dy, capsule, r):
+    """t range in [0, 1] where segment P + t * d lies within r of an eraser segment, or None.
+
+    The capsule is two end disks and the rectangle between them; it is
+    convex, so the union of the three ranges is a single range.
+    """
+    ax, ay, ex, ey = capsule[:4]
+    ranges = [_disk_interval(px, py, dx, dy, ax, ay, r)]
+    length_sq = ex * ex + ey * ey
+    if length_sq:
+        ranges.append(_disk_interval(px, py, dx, dy, ax + ex, ay + ey, r))
+        lo, hi = -math.inf, math.inf
+        # Projection onto the eraser segment stays within it...
+        lo, hi = _clip(lo, hi, ((px - ax) * ex + (py - ay) * ey) / length_sq,
+                       (dx * ex + dy * ey) / length_sq, 0.0, 1.0)
+        # ...and the distance from its line stays within r
+        length = math.sqrt(length_sq)
+        lo, hi = _clip(lo, hi, ((px - ax) * ey - (py - ay) * ex) / length, (dx * ey - dy * ex) / length, -r, r)
+        if lo <= hi:
+            ranges.append((lo, hi))
+    ranges = [span for span in ranges if span is not None]
+    if not ranges:
+        return None
+    lo = max(0.0, min(span[0] for span in ranges))
+    hi = min(1.0, max(span[1] for span in ranges))
+    return (lo, hi) if lo <= hi else None
+
+
+def _spans(xs, ys, capsules, reach):
+    spans = []
+    single = len(xs) == 1
+    for i in range(1 if single else len(xs) - 1):
+        px, py = xs[i], ys[i]
+        qx, qy = (px, py) if single else (xs[i + 1], ys[i + 1])
+        min_x, max_x = min(px, qx) - reach, max(px, qx) + reach
+        min_y, max_y = min(py, qy) - reach, max(py, qy) + reach
+        for capsule in capsules:
+            if capsule[4] > max_x or capsule[6] < min_x or capsule[5] > max_y or capsule[7] < min_y:
+                continue
+            span = _capsule_interval(px, py, qx - px, qy - py, capsule, reach)
+            if span is not None:
+                spans.append((i + span[0], i + span[1]))
+    return spans
+
+
+def _disk_intervals(px, py, dx, dy, cx, cy, r):
+    """_disk_interval over arrays: (lo, hi, hit)."""
+    fx, fy = px - cx, py - cy
+    a = dx * dx + dy * dy
+    c = fx * fx + fy * fy - r * r
+    b = 2 * (fx * dx + fy * dy)
+    disc = b * b - 4 * a * c
+    root = np.sqrt(np.maximum(disc, 0.0))
+    point = a == 0
+    lo = np.where(point, -np.inf, (-b - root) / (2 * a))
+    hi = np.where(point, np.inf, (-b + root) / (2 * a))
+    return lo, hi, np.where(point, c <= 0, disc >= 0)
+
+
+def _clip_intervals(lo, hi, v0, dv, vmin, vmax):
+    """_clip over arrays."""
+    t0, t1 = (vmin - v0) / dv, (vmax - v0) / dv
+    t0, t1 = np.minimum(t0, t1), np.maximum(t0, t1)
+    inside = (vmin <= v0) & (v0 <= vmax)
+    still = dv == 0
+    return (np.where(still, np.where(inside, lo, 1.0), np.maximum(lo, t0)),
+            np.where(still, np.where(inside, hi, 0.0), np.minimum(hi, t1)))
+
+
+def _spans_numpy(xs, ys, capsules, reach):
+    # _spans for a stroke of two or more points: the box tests pick the (segment, capsule)
+    # pairs, then _capsule_interval runs on all of them at once with the same arithmetic
+    x, y = np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64)
+    min_x, max_x = np.minimum(x[:-1], x[1:]) - reach, np.maximum(x[:-1], x[1:]) + reach
+    min_y, max_y = np.minimum(y[:-1], y[1:]) - reach, np.maximum(y[:-1], y[1:]) + reach
+    # Capsules outside the whole stroke's box need no per-segment test
+    left, top, right, bottom = min_x.min(), min_y.min(), max_x.max(), max_y.max()
+    near = np.array([c for c in capsules if not (c[4] > right or c[6] < left or c[5] > bottom or c[7] < top)],
+                    dtype=np.float64).reshape(-1, 8)
+    overlap = ((near[:, 4] <= max_x[:, None]) & (near[:, 6] >= min_x[:, None])
+               & (near[:, 5] <= max_y[:, None]) & (near[:, 7] >= min_y[:, None]))
+    seg, cap = np.nonzero(overlap)
+    if not len(seg):
+        return []
+
+    px, py = x[seg], y[seg]
+    dx, dy = x[seg + 1] - px, y[seg + 1] - py
+    ax, ay, ex, ey = near[cap, 0], near[cap, 1], near[cap, 2], near[cap, 3]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ranges = [_disk_intervals(px, py, dx, dy, ax, ay, reach)]
+        length_sq = ex * ex + ey * ey
+        segment = length_sq != 0
+        lo, hi, hit = _disk_intervals(px, py, dx, dy, ax + ex, ay + ey, reach)
+        ranges.append((lo, hi, hit & segment))
+        lo, hi = _clip_intervals(-np.inf, np.inf, ((px - ax) * ex + (py - ay) * ey) / length_sq,
+                                 (dx * ex + dy * ey) / length_sq, 0.0, 1.0)
+        length = np.sqrt(length_sq)
+        lo, hi = _clip_intervals(lo, hi, ((px - ax) * ey - (py - ay) * ex) / length,
+                                 (dx * ey - dy * ex) / length, -reach, reach)
+        ranges.append((lo, hi, segment & (lo <= hi)))
+
+    lo = np.maximum(0.0, np.min([np.where(hit, lo, np.inf) for lo, hi, hit in ranges], axis=0))
+    hi = np.minimum(1.0, np.max([np.where(hit, hi, -np.inf) for lo, hi, hit in ranges], axis=0))
+    erased = np.flatnonzero(lo <= hi)
+    return list(zip((seg[erased] + lo[erased]).tolist(), (seg[erased] + hi[erased]).tolist()))
+
+
+def erased_spans(xs, ys, capsules, reach):
+    """Merged ranges of a polyline erased by the capsules, as segment index + t.
+
+    Segments and capsules are paired only when their boxes, grown by
+    `reach`, overlap, so long strokes crossed once cost one exact test.
+    Strokes of VECTORIZE_MIN_POINTS or more points are tested with numpy.
+    """
+    if np is not None and len(xs) >= VECTORIZE_MIN_POINTS:
+        spans = _spans_numpy(xs, ys, capsules, reach)
+    else:
+        spans = _spans(xs, ys, capsules, reach)
+    spans.sort()
+    merged = []
+    for start, end in spans:
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def _point_at(xs, ys, s):
+    i = min(int(s), len(xs) - 2)
+    t = s - i
+    return round(xs[i] + (xs[i + 1] - xs[i]) * t, 2), round(ys[i] + (ys[i + 1] - ys[i]) * t, 2)
+
+
+def _piece(points, xs, ys, start, end):
+    """Flat points of the polyline between path parameters start and end."""
+    return [*_point_at(xs, ys, start), *points[2 * (math.floor(start) + 1):2 * math.ceil(end)],
+            *_point_at(xs, ys, end)]
+
+
+def _long_enough(flat):
+    # Stops at MIN_FRAGMENT_LENGTH instead of measuring a whole long piece
+    length = 0.0
+    for i in range(0, len(flat) - 2, 2):
+        length += math.hypot(flat[i + 2] - flat[i], flat[i + 3] - flat[i + 1])
+        if length >= MIN_FRAGMENT_LENGTH:
+            return True
+    return False
+
+
+def split_line(line, capsules, radius):
+    """What is left of a stroke after erasing: None if untouched, else its pieces ([] if erased whole).
+
+    Pieces are copies of the stroke with a new id and the points outside
+    the eraser; cuts fall where the stroke's edge meets the eraser's.
+    """
+    points = line.get('points')
+    if not isinstance(points, list) or len(points) < 2:
+        return None
+    xs, ys = points[0:len(points) - 1:2], points[1::2]
+    if not _all_finite(points):
+        return None
+    width = line.get('strokeWidth', 0)
+    reach = radius + (width / 2 if _finite(width) else 0)
+
+    spans = erased_spans(xs, ys, capsules, reach)
+    if not spans:
+        return None
+    if len(xs) == 1:
+        return []
+
+    pieces = []
+    kept_from = 0.0
+    for start, end in spans + [[len(xs) - 1, len(xs) - 1]]:
+        if start > kept_from:
+            flat = _piece(points, xs, ys, kept_from, start)
+            if _long_enough(flat):
+                piece = {key: value for key, value in line.items() if key != 'bbox'}
+                piece.update(id=str(uuid.uuid4()), points=flat)
+                pieces.append(piece)
+        kept_from = max(kept_from, end)
+    return pieces
+
+
+def erase_strokes(lines, index, path, radius):
+    """Erase along an eraser path from `lines` (id -> stroke), whose bounds are in `index`.
+
+    Only strokes the TileIndex returns for the path's box are tested.
+    Returns (removed ids, {str(id): pieces} for strokes that were split,
+    bounds covering every removed stroke or None).
+    """
+    capsules = _capsules(path)
+    area = [min(c[4] for c in capsules) - radius, min(c[5] for c in capsules) - radius,
+            max(c[6] for c in capsules) + radius, max(c[7] for c in capsules) + radius]
+    removed = []
+    fragments = {}
+    bounds = None
+    for line_id in index.query(area):
+        line = lines.get(line_id)
+        if not isinstance(line, dict):
+            continue
+        pieces = split_line(line, capsules, radius)
+        if pieces is None:
+            continue
+        removed.append(line_id)
+        if pieces:
+            fragments[str(line_id)] = pieces
+        rect = index.rects[line_id]
+        bounds = list(rect) if bounds is None else [
+            min(bounds[0], rect[0]), min(bounds[1], rect[1]), max(bounds[2], rect[2]), max(bounds[3], rect[3])
+        ]
+    return removed, fragments, bounds
@@ -0,0 +1,240 @@
+import os
+import time
+
+from log import get_logger
+from metrics import FANOUT_TICK_SECONDS
+from tiles import TileIndex, intersects
+
+log = get_logger('fanout')
+
+# Batch frames sent per room per second; 0 relays every event as it arrives
+ROOM_TICK_HZ = float(os.environ.get('ROOM_TICK_HZ', 30))
+# Outbound packets queued for a client before it is treated as slow
+FANOUT_MAX_BACKLOG = int(os.environ.get('FANOUT_MAX_BACKLOG', 32))
+# Events held for a slow client before it is sent a fresh snapshot instead
+FANOUT_MAX_DEFERRED = int(os.environ.get('FANOUT_MAX_DEFERRED', 500))
+
+
+def merge_key_for(event, data):
+    """Key under which a later event supersedes an earlier one, or None.
+
+    In-progress stroke updates carry all points so far and erase carries the
+    full surviving line list, so only the newest of each needs to be sent.
+    """
+    if event == 'drawing':
+        line = data.get('line')
+        if isinstance(line, dict) and line.get('id') is not None:
+            return ('drawing', line['id'])
+    elif event == 'erase':
+        return ('erase',)
+    elif event == 'note_updated':
+        note = data.get('note')
+        if isinstance(note, dict) and note.get('id') is not None:
+            return ('note_updated', note['id'])
+    return None
+
+
+def _append_merged(events, entry):
+    key = entry[3]
+    if key is not None:
+        for index, existing in enumerate(events):
+            if existing[3] == key:
+                del events[index]
+                break
+    events.append(entry)
+
+
+class RoomFanout:
+    """Coalesces room events into one `batch` frame per room per tick.
+
+    Each event is tagged with its sender so clients can skip their own; the
+    frame is emitted once to the room instead of once per incoming event.
+    Clients whose outbound queue is backed up are skipped, and their events
+    are merged (superseded stroke updates dropped) until they catch up.
+
+    Clients that subscribed a viewport get their own frame instead, holding
+    only the events whose bounds intersect it (events without bounds, such
+    as notes or erase, always go through). Events kept back are sent once the
+    viewport moves over them, so panning never shows a stale canvas.
+    """
+
+    def __init__(self, emit_room, emit_client, backlog, members,
+                 max_backlog=FANOUT_MAX_BACKLOG, max_deferred=FANOUT_MAX_DEFERRED):
+        self.emit_room = emit_room
+        self.emit_client = emit_client
+        self.backlog = backlog
+        self.members = members
+        self.max_backlog = max_backlog
+        self.max_deferred = max_deferred
+        self.pending = {}
+        self.deferred = {}
+        self.viewports = {}
+        self.offscreen = {}
+        self.metrics = {
+            "events_in": 0,
+            "events_merged": 0,
+            "frames_out": 0,
+            "deferred_frames": 0,
+            "slow_skips": 0,
+            "resyncs": 0,
+            "viewport_frames": 0,
+            "viewport_skips": 0,
+        }
+
+    def queue(self, room, sender, event, data, bounds=None):
+        self.metrics["events_in"] += 1
+        events = self.pending.setdefault(room, [])
+        before = len(events)
+        _append_merged(events, (event, data, sender, merge_key_for(event, data), bounds))
+        if len(events) == before:
+            self.metrics["events_merged"] += 1
+
+    def set_viewport(self, room, sid, rect):
+        """Limit what `sid` receives in `room` to `rect`; None lifts the limit."""
+        if rect is None:
+            index = self.viewports.get(room)
+            if index is not None:
+                index.remove(sid)
+                if not len(index):
+                    del self.viewports[room]
+        else:
+            self.viewports.setdefault(room, TileIndex()).insert(sid, rect)
+        self._reveal(room, sid, rect)
+
+    def _reveal(self, room, sid, rect):
+        """Send held-back events that the new viewport (or no viewport) now covers."""
+        if (sid, room) not in self.offscreen:
+            return
+        held = self.offscreen.pop((sid, room))
+        visible = []
+        for entry in held:
+            if rect is None or intersects(entry[4], rect):
+                visible.append(list(entry[:3]))
+            else:
+                _append_merged(self.offscreen.setdefault((sid, room), []), entry)
+        if visible:
+            self.emit_client(sid, room, visible)
+            self.metrics["viewport_frames"] += 1
+
+    def _hold_offscreen(self, sid, room, entry):
+        # Merged per stroke, so this never outgrows the room's own line list
+        _append_merged(self.offscreen.setdefault((sid, room), []), entry)
+
+    def _pass_through(self, sid, room, entry):
+        if entry[0] == 'erase':
+            # Erase carries every surviving line, held-back strokes included
+            self.offscreen.pop((sid, room), None)
+
+    def held_offscreen(self, room, sid):
+        """Payloads of the stroke events `sid` has not been shown yet."""
+        return [entry[1] for entry in self.offscreen.get((sid, room), []) if entry[0] == 'drawing']
+
+    def drop_offscreen(self, room, matches):
+        """Discard held-back events of `room` for which `matches(event, data)` is true."""
+        for key in [key for key in self.offscreen if key[1] == room]:
+            kept = [entry for entry in self.offscreen[key] if not matches(entry[0], entry[1])]
+            if kept:
+                self.offscreen[key] = kept
+            else:
+                del self.offscreen[key]
+
+    def hold_offscreen(self, room, sender, event, data, bounds):
+        """For unbatched relays: hold the event for subscribers it is off-screen for.
+
+        Returns those subscribers so the caller can skip them.
+        """
+        index = self.viewports.get(room)
+        if index is None:
+            return []
+        if bounds is None:
+            entry = (event, data, sender, None, None)
+            for sid in index.keys():
+                if sid != sender:
+                    self._pass_through(sid, room, entry)
+            return []
+        inside = index.query(bounds)
+        entry = (event, data, sender, merge_key_for(event, data), bounds)
+        outside = [sid for sid in index.keys() if sid not in inside and sid != sender]
+        for sid in outside:
+            self._hold_offscreen(sid, room, entry)
+        self.metrics["viewport_skips"] += len(outside)
+        return outside
+
+    def forget(self, sid):
+        for key in [key for key in self.deferred if key[0] == sid]:
+            del self.deferred[key]
+        for key in [key for key in self.offscreen if key[0] == sid]:
+            del self.offscreen[key]
+        for room in list(self.viewports):
+            self.set_viewport(room, sid, None)
+
+    def tick(self):
+        """Send one frame per room with pending events; returns frames emitted."""
+        frames = 0
+        pending, self.pending = self.pending, {}
+
+        for room, events in pending.items():
+            slow = [sid for sid in self.members(room) if self.backlog(sid) > self.max_backlog]
+            for sid in slow:
+                held = self.deferred.setdefault((sid, room), [])
+                for entry in events:
+                    if entry[2] != sid:
+                        _append_merged(held, entry)
+                self.metrics["slow_skips"] += 1
+            index = self.viewports.get(room)
+            if index is None or all(entry[4] is None for entry in events):
+                if index is not None:
+                    for sid in index.keys():
+                        for entry in events:
+                            if entry[2] != sid:
+                                self._pass_through(sid, room, entry)
+                self.emit_room(room, [list(entry[:3]) for entry in events], slow)
+                frames += 1
+                continue
+
+            viewers = [sid for sid in index.keys() if sid not in slow]
+            self.emit_room(room, [list(entry[:3]) for entry in events], slow + viewers)
+            frames += 1
+            seen_by = [None if entry[4] is None else index.query(entry[4]) for entry in events]
+            for sid in viewers:
+                visible = []
+                for entry, seen in zip(events, seen_by):
+                    if entry[2] == sid:
+                        continue
+                    if seen is None or sid in seen:
+                        self._pass_through(sid, room, entry)
+                        visible.append(list(entry[:3]))
+                    else:
+                        self._hold_offscreen(sid, room, entry)
+                        self.metrics["viewport_skips"] += 1
+                if visible:
+                    self.emit_client(sid, room, visible)
+                    self.metrics["viewport_frames"] += 1
+                    frames += 1
+
+        for (sid, room), held in list(self.deferred.items()):
+            if self.backlog(sid) > self.max_backlog:
+                if len(held) > self.max_deferred:
+                    # Too far behind to replay; the client reloads the room instead
+                    del self.deferred[(sid, room)]
+                    self.emit_client(sid, room, None)
+                    self.metrics["resyncs"] += 1
+                continue
+            del self.deferred[(sid, room)]
+            self.emit_client(sid, room, [list(entry[:3]) for entry in held])
+            self.metrics["deferred_frames"] += 1
+            frames += 1
+
+        self.metrics["frames_out"] += frames
+        return frames
+
+    def run_forever(self, sleep, tick_hz=ROOM_TICK_HZ):
+        interval = 1.0 / tick_hz
+        while True:
+            started = time.monotonic()
+            try:
+                if self.tick():
+                    FANOUT_TICK_SECONDS.observe(time.monotonic() - started)
+            except Exception as e:
+                log.exception("Error sending room batches", error=str(e))
+            sleep(max(interval - (time.monotonic() - started), 0))
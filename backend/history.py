@@ -0,0 +1,358 @@
+import os
+from datetime import datetime, timedelta
+
+from pymongo.errors import BulkWriteError
+
+import db
+from deltas import DELTA_FIELDS, GEOMETRY_KEYS
+from elements import STORED_FLAG, board_elements
+from log import get_logger
+
+log = get_logger('history')
+
+# "on" (default) or "off"; whether board writes are journaled
+BOARD_HISTORY = os.environ.get('BOARD_HISTORY', 'on').lower() != 'off'
+# Versions between full checkpoints; rebuilding a version replays at most this many entries
+BOARD_HISTORY_CHECKPOINT_EVERY = int(os.environ.get('BOARD_HISTORY_CHECKPOINT_EVERY', 50))
+# Days of history kept per board; older versions can no longer be rebuilt
+BOARD_HISTORY_RETENTION_DAYS = float(os.environ.get('BOARD_HISTORY_RETENTION_DAYS', 30))
+# Journal entries kept per board regardless of age
+BOARD_HISTORY_MAX_ENTRIES = int(os.environ.get('BOARD_HISTORY_MAX_ENTRIES', 1000))
+
+# Board fields whose changes are journaled
+META_FIELDS = ("title", "background", "templateType")
+STATE_FIELDS = DELTA_FIELDS + META_FIELDS
+STATE_PROJECTION = dict({field: 1 for field in STATE_FIELDS}, version=1, **{STORED_FLAG: 1})
+
+# Boards remembered as having a checkpoint before the set is cleared
+MAX_KNOWN_BOARDS = 10000
+
+_MISSING = object()
+
+
+def _by_id(elements):
+    keyed = {}
+    for element in elements:
+        if not isinstance(element, dict) or element.get("id") is None or element["id"] in keyed:
+            return None
+        keyed[element["id"]] = element
+    return keyed
+
+
+def diff_elements(field, old, new):
+    """Ops turning the element list `old` into `new`.
+
+    Uses the delta ops of PATCH /delta, with adds placed by their final
+    index ("at"). Lists the ops cannot describe (elements without unique
+    ids, reordered elements, legacy non-list values) get one "set" op
+    carrying the whole new value.
+    """
+    if old == new:
+        return []
+    whole = [{"op": "set", "field": field, "value": new}]
+    if not isinstance(old, list) or not isinstance(new, list):
+        return whole
+    old_keyed, new_keyed = _by_id(old), _by_id(new)
+    if old_keyed is None or new_keyed is None:
+        return whole
+    if [key for key in new_keyed if key in old_keyed] != [key for key in old_keyed if key in new_keyed]:
+        return whole
+
+    removes, modifies, replaced = [], [], set()
+    for key, before in old_keyed.items():
+        after = new_keyed.get(key, _MISSING)
+        if after is _MISSING:
+            removes.append({"op": "remove", "field": field, "id": key})
+        elif after != before:
+            if set(before) - set(after):
+                # Keys cannot be dropped by a modify, so the element is swapped whole
+                replaced.add(key)
+                removes.append({"op": "remove", "field": field, "id": key})
+            else:
+                changes = {k: v for k, v in after.items() if before.get(k, _MISSING) != v}
+                modifies.append({"op": "modify", "field": field, "id": key, "changes": changes})
+    adds = [
+        {"op": "add", "field": field, "element": element, "at": index}
+        for index, (key, element) in enumerate(new_keyed.items())
+        if key not in old_keyed or key in replaced
+    ]
+    return removes + modifies + adds
+
+
+def diff_state(before, after):
+    """(element ops, changed metadata) between two board states."""
+    ops = []
+    for field in DELTA_FIELDS:
+        if field in after:
+            ops.extend(diff_elements(field, before.get(field), after[field]))
+    changed = {field: after[field] for field in META_FIELDS if field in after and after[field] != before.get(field)}
+    return ops, changed
+
+
+def apply_ops(state, ops):
+    """Apply journal or delta ops to a board state in place, the way MongoDB applies delta updates."""
+    removed = {}
+    for op in ops:
+        field = op.get("field", "data")
+        if op["op"] == "remove":
+            # Runs of removes are applied in one pass over the list
+            removed.setdefault(field, set()).add(op["id"])
+            continue
+        _apply_removes(state, removed)
+        if op["op"] == "set":
+            state[field] = op["value"]
+            continue
+        elements = state.get(field)
+        if not isinstance(elements, list):
+            elements = state[field] = []
+        if op["op"] == "add":
+            at = op.get("at")
+            elements.insert(len(elements) if at is None else at, op["element"])
+        elif op["op"] == "modify":
+            for index, element in enumerate(elements):
+                if isinstance(element, dict) and element.get("id") == op["id"]:
+                    element = dict(element, **op["changes"])
+                    if field == "data" and GEOMETRY_KEYS & set(op["changes"]):
+                        element.pop("bbox", None)
+                    elements[index] = element
+                    break
+    _apply_removes(state, removed)
+    return state
+
+
+def _apply_removes(state, removed):
+    for field, ids in removed.items():
+        elements = state.get(field)
+        if isinstance(elements, list):
+            state[field] = [e for e in elements if not (isinstance(e, dict) and e.get("id") in ids)]
+    removed.clear()
+
+
+class BoardHistory:
+    """Append-only journal of board changes, one entry per version.
+
+    Entries hold only what a write changed: element ops for data, notes and
+    textBoxes plus the new values of changed metadata fields. A full copy of
+    the board (a checkpoint) is stored every `checkpoint_every` versions, so
+    rebuilding any version reads one checkpoint and replays at most that
+    many entries. Entries older than the retention period, or beyond
+    `max_entries` per board, are dropped up to the checkpoint they follow.
+    """
+
+    def __init__(self, collection_getter, checkpoint_every=BOARD_HISTORY_CHECKPOINT_EVERY,
+                 retention_days=BOARD_HISTORY_RETENTION_DAYS, max_entries=BOARD_HISTORY_MAX_ENTRIES,
+                 enabled=BOARD_HISTORY):
+        self.collection_getter = collection_getter
+        self.checkpoint_every = max(1, checkpoint_every)
+        self.retention = timedelta(days=retention_days)
+        self.max_entries = max_entries
+        self.enabled = enabled
+        # Boards known to have a checkpoint to replay from
+        self.checkpointed = set()
+        # Called with (board id, state) after a board was restored to an earlier version
+        self.on_restore = None
+        self.metrics = {
+            "entries": 0,
+            "checkpoints": 0,
+            "unchanged_writes": 0,
+            "errors": 0,
+            "compacted_entries": 0,
+        }
+
+    def collection(self):
+        return self.collection_getter() if self.enabled else None
+
+    def prepare(self, boards, writes):
+        """Journal entries for a batch of queued writes ({board id: PendingWrite}).
+
+        Reads the boards' current content, so it runs before the batch is written.
+        """
+        history = self.collection()
+        if history is None:
+            return []
+        now = datetime.utcnow()
+        entries = []
+        updates = {}
+        for board_id, pending in writes.items():
+            if pending.insert_doc is not None:
+                self.checkpointed.add(board_id)
+                entries.append(self._checkpoint(board_id, pending.insert_doc.get("version", 0), pending.insert_doc, now))
+            elif set(STATE_FIELDS) & set(pending.set_fields):
+                updates[board_id] = pending
+        if updates:
+            # Notes and text boxes of boards that store them apart are read in one query
+            current = board_elements.attach(list(boards.find({"_id": {"$in": list(updates)}}, STATE_PROJECTION)))
+            for before in current:
+                pending = updates[before["_id"]]
+                after = dict(before, **{k: v for k, v in pending.set_fields.items() if k in STATE_FIELDS})
+                entries.extend(self._entries(history, before["_id"], before, after,
+                                             pending.inc_fields.get("version", 0), now))
+        return entries
+
+    def baseline(self, boards, board_id, version):
+        """Checkpoint to journal before a delta lands, if the board has none yet."""
+        history = self.collection()
+        if history is None or not self._needs_baseline(history, board_id):
+            return []
+        before = board_elements.attach_one(boards.find_one({"_id": board_id}, STATE_PROJECTION))
+        return [self._checkpoint(board_id, version, before, datetime.utcnow())] if before else []
+
+    def record_delta(self, boards, board_id, base_version, ops, baseline=()):
+        """Journal a PATCH /delta batch that moved a board from `base_version` to the next version."""
+        history = self.collection()
+        if history is None:
+            return
+        now = datetime.utcnow()
+        version = base_version + 1
+        entries = list(baseline) + [{"boardId": board_id, "version": version, "type": "ops",
+                                     "ops": ops, "set": {}, "at": now}]
+        if self._checkpoint_due(base_version, version):
+            after = board_elements.attach_one(boards.find_one({"_id": board_id}, STATE_PROJECTION))
+            if after:
+                entries.append(self._checkpoint(board_id, version, after, now))
+        self.commit(entries)
+
+    def commit(self, entries):
+        """Store prepared entries; failures are logged and never fail the board write."""
+        history = self.collection()
+        if history is None or not entries:
+            return
+        try:
+            history.insert_many(entries, ordered=False)
+        except BulkWriteError as e:
+            # Duplicates come from flushes retried after a partial failure
+            errors = [error for error in e.details.get("writeErrors", []) if error.get("code") != 11000]
+            if errors:
+                self._failed(entries, errors[0].get("errmsg"))
+                return
+        except Exception as e:
+            self._failed(entries, str(e))
+            return
+
+        for entry in entries:
+            self.metrics["checkpoints" if entry["type"] == "checkpoint" else "entries"] += 1
+        for board_id in {entry["boardId"] for entry in entries if entry["type"] == "checkpoint"}:
+            try:
+                self.compact(board_id)
+            except Exception as e:
+                log.warning("History compaction failed", board=board_id, error=str(e))
+
+    def board_at(self, board_id, version):
+        """The board's content at `version` ({field: value}), or None when the journal does not reach it."""
+        history = self.collection()
+        if history is None:
+            return None
+        checkpoint = history.find_one(
+            {"boardId": board_id, "type": "checkpoint", "version": {"$lte": version}}, sort=[("version", -1)]
+        )
+        if checkpoint is None:
+            return None
+        state = checkpoint["state"]
+        entries = history.find(
+            {"boardId": board_id, "type": "ops", "version": {"$gt": checkpoint["version"], "$lte": version}}
+        ).sort("version", 1)
+        for entry in entries:
+            apply_ops(state, entry.get("ops") or [])
+            state.update(entry.get("set") or {})
+        return state
+
+    def entries(self, board_id, limit, before=None):
+        """Journaled versions of a board, newest first, with a count of ops per kind."""
+        query = {"boardId": board_id, "type": "ops"}
+        if before is not None:
+            query["version"] = {"$lt": before}
+        found = self.collection().find(query, {"version": 1, "at": 1, "set": 1, "ops.op": 1}).sort("version", -1)
+        versions = []
+        for entry in found.limit(limit):
+            ops = {}
+            for op in entry.get("ops") or []:
+                ops[op["op"]] = ops.get(op["op"], 0) + 1
+            versions.append({"version": entry["version"], "at": entry.get("at"), "ops": ops,
+                             "set": sorted(entry.get("set") or {})})
+        return versions
+
+    def compact(self, board_id, now=None):
+        """Drop entries no longer needed under the retention policy; returns how many were deleted.
+
+        Everything before the newest checkpoint older than the retention
+        period goes, and so does everything before the newest checkpoint
+        that leaves at least `max_entries` entries.
+        """
+        history = self.collection()
+        if history is None:
+            return 0
+        horizon = (now or datetime.utcnow()) - self.retention
+        cutoff = None
+        expired = history.find_one({"boardId": board_id, "type": "checkpoint", "at": {"$lte": horizon}},
+                                   sort=[("version", -1)])
+        if expired is not None:
+            cutoff = expired["version"]
+        oldest_kept = list(history.find({"boardId": board_id}, {"version": 1}).sort("version", -1)
+                           .skip(self.max_entries).limit(1))
+        if oldest_kept:
+            over = history.find_one(
+                {"boardId": board_id, "type": "checkpoint", "version": {"$lte": oldest_kept[0]["version"]}},
+                sort=[("version", -1)]
+            )
+            if over is not None:
+                cutoff = max(cutoff or 0, over["version"])
+        if cutoff is None:
+            return 0
+        deleted = history.delete_many({"boardId": board_id, "version": {"$lt": cutoff}}).deleted_count
+        self.metrics["compacted_entries"] += deleted
+        return deleted
+
+    def forget(self, board_ids):
+        """Delete the history of deleted boards."""
+        history = self.collection()
+        if history is None or not board_ids:
+            return
+        history.delete_many({"boardId": {"$in": list(board_ids)}})
+        self.checkpointed.difference_update(board_ids)
+
+    def stats(self):
+        return dict(self.metrics, enabled=int(self.enabled), checkpoint_every=self.checkpoint_every,
+                    retention_days=self.retention.total_seconds() / 86400, max_entries=self.max_entries)
+
+    def _entries(self, history, board_id, before, after, version_step, now):
+        version = before.get("version") or 0
+        next_version = version + version_step
+        entries = []
+        if self._needs_baseline(history, board_id):
+            entries.append(self._checkpoint(board_id, version, before, now))
+        ops, changed = diff_state(before, after)
+        if ops or changed:
+            entries.append({"boardId": board_id, "version": next_version, "type": "ops",
+                            "ops": ops, "set": changed, "at": now})
+        else:
+            # Periodic autosaves of an unchanged board leave no entry
+            self.metrics["unchanged_writes"] += 1
+        if self._checkpoint_due(version, next_version):
+            entries.append(self._checkpoint(board_id, next_version, after, now))
+        return entries
+
+    def _checkpoint_due(self, version, next_version):
+        return next_version // self.checkpoint_every > version // self.checkpoint_every
+
+    def _checkpoint(self, board_id, version, board, now):
+        state = {field: board[field] for field in STATE_FIELDS if field in board}
+        return {"boardId": board_id, "version": version, "type": "checkpoint", "state": state, "at": now}
+
+    def _needs_baseline(self, history, board_id):
+        """Whether a board has no checkpoint yet (boards saved before journaling started)."""
+        if board_id in self.checkpointed:
+            return False
+        if len(self.checkpointed) >= MAX_KNOWN_BOARDS:
+            self.checkpointed.clear()
+        self.checkpointed.add(board_id)
+        return history.count_documents({"boardId": board_id, "type": "checkpoint"}, limit=1) == 0
+
+    def _failed(self, entries, error):
+        self.metrics["errors"] += 1
+        boards = {entry["boardId"] for entry in entries}
+        # Their next write checks for a checkpoint again instead of trusting this one landed
+        self.checkpointed.difference_update(boards)
+        log.error("Failed to journal board history", boards=len(boards), error=error)
+
+
+board_history = BoardHistory(lambda: db.history_collection)
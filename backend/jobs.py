@@ -0,0 +1,279 @@
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+import db
+from db_pool import DBUnavailable
+from log import get_logger
+
+log = get_logger('jobs')
+
+# Seconds the job runner waits between looks for queued jobs while idle
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 5))
+# Seconds a claimed job stays locked without reporting progress before another worker may take it over
+JOB_LEASE = float(os.environ.get('JOB_LEASE', 120))
+# Attempts before a failing job is marked failed
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+# Seconds before the first retry of a failed job; doubles with every further attempt
+JOB_RETRY_DELAY = float(os.environ.get('JOB_RETRY_DELAY', 30))
+# Days finished jobs are kept for status queries
+JOB_RETENTION_DAYS = float(os.environ.get('JOB_RETENTION_DAYS', 7))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+
+class JobLost(Exception):
+    """The job's lease ran out and another worker took it over."""
+
+
+class Job:
+    """A claimed job as its handler sees it.
+
+    `params` are what the job was queued with. `progress` is shown by the
+    status endpoint; `state` is a checkpoint for the handler itself, kept
+    across retries so a job that failed halfway resumes where it stopped.
+    """
+
+    def __init__(self, runner, doc):
+        self.runner = runner
+        self.id = doc["_id"]
+        self.type = doc["type"]
+        self.params = doc.get("params") or {}
+        self.attempts = doc.get("attempts", 0)
+        self.lock = doc.get("lockedBy")
+        self.progress = dict(doc.get("progress") or {})
+        self.state = dict(doc.get("state") or {})
+
+    def update(self, progress=None, **state):
+        """Save progress and checkpoint state, and extend the lease; raises JobLost if it already ran out."""
+        self.progress.update(progress or {})
+        self.state.update(state)
+        if self.runner is not None:
+            self.runner.heartbeat(self, progress or {}, state)
+
+
+class JobRunner:
+    """Runs maintenance jobs queued in MongoDB on a background thread.
+
+    A job is a document in the `jobs` collection naming a registered
+    handler and its parameters. Any process may queue jobs; each job is
+    claimed by one worker, which holds a lease on it that every progress
+    update extends. A job whose worker died is picked up again once the
+    lease runs out. A handler that raises is retried with exponential
+    backoff up to `max_attempts` times, then marked failed. Finished jobs
+    expire after `retention_days`.
+    """
+
+    def __init__(self, collection_getter, poll_interval=JOB_POLL_INTERVAL, lease=JOB_LEASE,
+                 max_attempts=JOB_MAX_ATTEMPTS, retry_delay=JOB_RETRY_DELAY,
+                 retention_days=JOB_RETENTION_DAYS, clock=datetime.utcnow):
+        self.collection = collection_getter
+        self.poll_interval = poll_interval
+        self.lease = timedelta(seconds=lease)
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.retention = timedelta(days=retention_days)
+        self.clock = clock
+        self.worker_name = f"{socket.gethostname()}:{os.getpid()}"
+        self.handlers = {}
+        self.worker = None
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.running = None
+        self.metrics = {
+            "enqueued": 0,
+            "started": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "retried": 0,
+            "lost": 0,
+        }
+
+    def handler(self, job_type):
+        """Decorator registering the function that runs jobs of `job_type`."""
+        def register(fn):
+            self.handlers[job_type] = fn
+            return fn
+        return register
+
+    def enqueue(self, job_type, params=None, key=None, max_attempts=None):
+        """Queue a job and return its document.
+
+        With a `key`, a queued or running job with the same key is returned
+        instead of queueing another one. Queueing never starts a worker, so
+        a short-lived process such as a CLI command can queue jobs for the
+        server; a worker already running in this process is woken at once.
+        """
+        if job_type not in self.handlers:
+            raise ValueError(f"Unknown job type: {job_type}")
+        collection = self.collection()
+        if collection is None:
+            raise RuntimeError("The job queue is not configured")
+        if key is not None:
+            existing = collection.find_one({"key": key, "status": {"$in": list(ACTIVE_STATUSES)}})
+            if existing is not None:
+                return existing
+
+        now = self.clock()
+        doc = {
+            "_id": ObjectId(),
+            "type": job_type,
+            "params": params or {},
+            "key": key,
+            "status": QUEUED,
+            "attempts": 0,
+            "maxAttempts": max_attempts or self.max_attempts,
+            "progress": {},
+            "state": {},
+            "result": None,
+            "error": None,
+            "createdAt": now,
+            "updatedAt": now,
+            "runAfter": now,
+            "startedAt": None,
+            "finishedAt": None,
+            "lockedBy": None,
+            "lockedUntil": None,
+        }
+        collection.insert_one(doc)
+        self.metrics["enqueued"] += 1
+        log.info("Job queued", job=str(doc["_id"]), type=job_type)
+        self.wakeup.set()
+        return doc
+
+    def get(self, job_id):
+        collection = self.collection()
+        if collection is None:
+            return None
+        return collection.find_one({"_id": ObjectId(job_id)})
+
+    def claim(self):
+        """Lock the next due job this process has a handler for; returns its document or None."""
+        collection = self.collection()
+        if collection is None or not self.handlers:
+            return None
+        now = self.clock()
+        return collection.find_one_and_update(
+            {
+                "type": {"$in": list(self.handlers)},
+                "$or": [
+                    {"status": QUEUED, "runAfter": {"$lte": now}},
+                    # A worker that stopped reporting progress has died or hung
+                    {"status": RUNNING, "lockedUntil": {"$lt": now}},
+                ],
+            },
+            {
+                "$set": {"status": RUNNING, "lockedBy": f"{self.worker_name}:{ObjectId()}",
+                         "lockedUntil": now + self.lease, "startedAt": now, "updatedAt": now},
+                "$inc": {"attempts": 1},
+            },
+            sort=[("runAfter", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def run_one(self):
+        """Claim and run one job; returns whether there was one."""
+        doc = self.claim()
+        if doc is None:
+            return False
+        job = Job(self, doc)
+        if job.attempts > doc.get("maxAttempts", self.max_attempts):
+            self._finish(job, FAILED, error=doc.get("error") or "Worker lost the job too many times")
+            return True
+
+        self.running = job
+        self.metrics["started"] += 1
+        log.info("Job started", job=str(job.id), type=job.type, attempt=job.attempts)
+        started = time.perf_counter()
+        try:
+            result = self.handlers[job.type](job)
+        except JobLost:
+            self.metrics["lost"] += 1
+            log.warning("Job lease lost", job=str(job.id), type=job.type)
+        except Exception as e:
+            if job.attempts < doc.get("maxAttempts", self.max_attempts):
+                self._retry(job, e)
+            else:
+                self._finish(job, FAILED, error=str(e))
+                log.error("Job failed", job=str(job.id), type=job.type, attempts=job.attempts, error=str(e))
+        else:
+            self._finish(job, SUCCEEDED, result=result)
+            log.info("Job finished", job=str(job.id), type=job.type,
+                     duration_ms=round((time.perf_counter() - started) * 1000, 3))
+        finally:
+            self.running = None
+        return True
+
+    def run_now(self, job_type, params=None):
+        """Run a handler in the calling thread without queueing it, e.g. from a CLI command."""
+        return self.handlers[job_type](Job(None, {"_id": None, "type": job_type, "params": params}))
+
+    def heartbeat(self, job, progress, state):
+        now = self.clock()
+        update = {"lockedUntil": now + self.lease, "updatedAt": now}
+        update.update({f"progress.{key}": value for key, value in progress.items()})
+        update.update({f"state.{key}": value for key, value in state.items()})
+        result = self.collection().update_one({"_id": job.id, "lockedBy": job.lock}, {"$set": update})
+        if result.matched_count == 0:
+            raise JobLost(str(job.id))
+
+    def start(self):
+        """Start the worker thread; only server processes call this."""
+        if self.worker is None:
+            with self.lock:
+                if self.worker is None:
+                    self.worker = threading.Thread(target=self.run_forever, daemon=True)
+                    self.worker.start()
+
+    def run_forever(self):
+        while True:
+            try:
+                ran = self.run_one()
+            except DBUnavailable as e:
+                log.warning("Job queue unavailable", error=str(e))
+                ran = False
+            except Exception as e:
+                log.exception("Error running jobs", error=str(e))
+                ran = False
+            if not ran:
+                self.wakeup.wait(self.poll_interval)
+                self.wakeup.clear()
+
+    def stats(self):
+        running = self.running
+        return dict(self.metrics, handlers=len(self.handlers), running=int(running is not None),
+                    worker_started=int(self.worker is not None))
+
+    def _retry(self, job, error):
+        delay = self.retry_delay * 2 ** (job.attempts - 1)
+        now = self.clock()
+        self.metrics["retried"] += 1
+        log.warning("Job will be retried", job=str(job.id), type=job.type, attempt=job.attempts,
+                    delay_s=delay, error=str(error))
+        self.collection().update_one(
+            {"_id": job.id, "lockedBy": job.lock},
+            {"$set": {"status": QUEUED, "error": str(error), "runAfter": now + timedelta(seconds=delay),
+                      "updatedAt": now, "lockedBy": None, "lockedUntil": None}}
+        )
+
+    def _finish(self, job, status, result=None, error=None):
+        now = self.clock()
+        self.metrics[status] += 1
+        self.collection().update_one(
+            {"_id": job.id, "lockedBy": job.lock},
+            {"$set": {"status": status, "result": result, "error": error, "finishedAt": now,
+                      "updatedAt": now, "expiresAt": now + self.retention,
+                      "lockedBy": None, "lockedUntil": None}}
+        )
+
+
+job_runner = JobRunner(lambda: db.jobs_collection)
@@ -0,0 +1,97 @@
+import json
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+
+# DEBUG, INFO, WARNING, ERROR
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# "text" for key=value lines, "json" for one JSON object per line
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text').lower()
+
+
+def _fields(record):
+    return getattr(record, 'fields', {})
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        line = (f"{datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds')} "
+                f"{record.levelname} {record.name}: {record.getMessage()}")
+        fields = _fields(record)
+        if fields:
+            line += ' ' + ' '.join(f"{key}={_text(value)}" for key, value in fields.items())
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+
+def _text(value):
+    text = str(value)
+    return json.dumps(text) if (' ' in text or not text) else text
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        entry.update(_fields(record))
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class StructuredLogger:
+    """Leveled logger taking context as keyword fields.
+
+        log.info("Board updated", board=board_id, fields=3)
+
+    Fields are rendered as key=value pairs (or JSON keys with LOG_FORMAT=json)
+    so log lines stay greppable without formatting them into the message.
+    """
+
+    def __init__(self, logger):
+        self.logger = logger
+
+    def _log(self, level, msg, exc_info=None, **fields):
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, msg, exc_info=exc_info, extra={'fields': fields}, stacklevel=3)
+
+    def debug(self, msg, **fields):
+        self._log(logging.DEBUG, msg, **fields)
+
+    def info(self, msg, **fields):
+        self._log(logging.INFO, msg, **fields)
+
+    def warning(self, msg, **fields):
+        self._log(logging.WARNING, msg, **fields)
+
+    def error(self, msg, **fields):
+        self._log(logging.ERROR, msg, **fields)
+
+    def exception(self, msg, **fields):
+        self._log(logging.ERROR, msg, exc_info=True, **fields)
+
+    def is_debug(self):
+        return self.logger.isEnabledFor(logging.DEBUG)
+
+
+def configure_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, stream=None):
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(JSONFormatter() if fmt == 'json' else TextFormatter())
+    root = logging.getLogger('canvasconnect')
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+    root.propagate = False
+    return root
+
+
+def get_logger(name):
+    return StructuredLogger(logging.getLogger(f'canvasconnect.{name}'))
+
+
+configure_logging()
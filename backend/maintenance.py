@@ -0,0 +1,148 @@
+import os
+import time
+
+from bson import ObjectId
+
+import db
+from board_cache import board_cache
+from elements import ELEMENT_FIELDS, MIGRATE_PROJECTION, STORED_FLAG, board_elements
+from history import board_history
+from jobs import job_runner
+from log import get_logger
+from persistence import board_writes
+from simplify import STROKE_SIMPLIFY_TOLERANCE, compact_board_strokes
+from thumbnails import board_images
+
+log = get_logger('maintenance')
+
+# Documents a maintenance job deletes or rewrites per chunk; progress is saved after each chunk
+JOB_BATCH_SIZE = int(os.environ.get('JOB_BATCH_SIZE', 500))
+# Boards re-rendered per chunk by render_thumbnails, kept small so progress outpaces the job lease
+THUMBNAIL_JOB_BATCH_SIZE = 20
+
+DELETE_USER_DATA = 'delete_user_data'
+COMPACT_HISTORY = 'compact_history'
+COMPACT_STROKES = 'compact_strokes'
+MIGRATE_ELEMENTS = 'migrate_elements'
+RENDER_THUMBNAILS = 'render_thumbnails'
+
+
+def in_id_chunks(job, collection, query, name, process, projection=None, batch_size=JOB_BATCH_SIZE):
+    """Hand the documents matching `query` to `process` in chunks, in ascending _id order.
+
+    `process` returns counters to add to the job's progress. The last _id
+    of every finished chunk is saved as `name` in the job state, so a
+    retried job carries on after it. Returns the job's progress.
+    """
+    after = job.state.get(name)
+    while True:
+        ranged = query if after is None else {"$and": [query, {"_id": {"$gt": after}}]}
+        docs = list(collection.find(ranged, projection or {"_id": 1}).sort("_id", 1).limit(batch_size))
+        if not docs:
+            return job.progress
+        counts = process(docs) or {}
+        after = docs[-1]["_id"]
+        job.update({key: job.progress.get(key, 0) + value for key, value in counts.items()}, **{name: after})
+        # Let sockets and requests run between chunks
+        time.sleep(0)
+
+
+def delete_in_chunks(job, collection, query, name, before_delete=None, batch_size=JOB_BATCH_SIZE):
+    """Delete the documents matching `query` one _id range at a time; counts them as `name` in the progress.
+
+    `before_delete` gets each chunk's ids before it is deleted, so whatever
+    it cleans up is retried along with the chunk.
+    """
+    def delete(docs):
+        ids = [doc["_id"] for doc in docs]
+        if before_delete is not None:
+            before_delete(ids)
+        result = collection.delete_many({"$and": [query, {"_id": {"$gte": ids[0], "$lte": ids[-1]}}]})
+        return {name: result.deleted_count}
+
+    return in_id_chunks(job, collection, query, f"{name}After", delete, batch_size=batch_size)
+
+
+@job_runner.handler(DELETE_USER_DATA)
+def delete_user_data(job):
+    """Delete a user's boards with their history, elements and images, then the whiteboards they own."""
+    user_id = job.params["userId"]
+    # Land queued creates first so they are deleted too
+    board_writes.flush()
+
+    def forget_boards(board_ids):
+        for board_id in board_ids:
+            board_writes.discard(board_id)
+            board_cache.invalidate(str(board_id))
+        board_history.forget(board_ids)
+        board_elements.forget(board_ids)
+        board_images.forget(board_ids)
+
+    delete_in_chunks(job, db.boards_collection, {"userId": user_id}, "deletedBoards", forget_boards)
+    delete_in_chunks(job, db.whiteboards, {"owner": user_id}, "deletedWhiteboards")
+    board_cache.clear()
+    return {"deletedBoards": job.progress.get("deletedBoards", 0),
+            "deletedWhiteboards": job.progress.get("deletedWhiteboards", 0)}
+
+
+@job_runner.handler(COMPACT_HISTORY)
+def compact_history(job):
+    """Drop board history entries past the retention period or entry limit."""
+    board = job.params.get("board")
+    board_ids = [ObjectId(board)] if board else sorted(db.history_collection.distinct("boardId"))
+    after = job.state.get("after")
+    for board_id in board_ids:
+        if after is not None and board_id <= after:
+            continue
+        deleted = board_history.compact(board_id)
+        job.update({"boards": job.progress.get("boards", 0) + 1,
+                    "deletedEntries": job.progress.get("deletedEntries", 0) + deleted}, after=board_id)
+    return {"boards": job.progress.get("boards", 0), "deletedEntries": job.progress.get("deletedEntries", 0)}
+
+
+@job_runner.handler(COMPACT_STROKES)
+def compact_strokes(job):
+    """Simplify the stored strokes of existing boards."""
+    board = job.params.get("board")
+    tolerance = job.params.get("tolerance", STROKE_SIMPLIFY_TOLERANCE)
+    query = {"_id": ObjectId(board)} if board else {}
+
+    def compact(docs):
+        report = compact_board_strokes(db.boards_collection, {"_id": {"$in": [doc["_id"] for doc in docs]}},
+                                       tolerance)
+        return {"boardsScanned": report["boards_scanned"], "boardsRewritten": report["boards_rewritten"],
+                "boardsSkipped": report["boards_skipped"], "pointsBefore": report["points_before"],
+                "pointsAfter": report["points_after"]}
+
+    return dict(in_id_chunks(job, db.boards_collection, query, "after", compact))
+
+
+@job_runner.handler(MIGRATE_ELEMENTS)
+def migrate_elements(job):
+    """Move notes and text boxes embedded in board documents into board_elements."""
+    query = {STORED_FLAG: {"$ne": True}, "$or": [{field: {"$exists": True}} for field in ELEMENT_FIELDS]}
+    board = job.params.get("board")
+    if board:
+        query["_id"] = ObjectId(board)
+
+    def migrate(boards):
+        for board in boards:
+            board_elements.migrate(db.boards_collection, board)
+        return {"boards": len(boards)}
+
+    return dict(in_id_chunks(job, db.boards_collection, query, "after", migrate, MIGRATE_PROJECTION))
+
+
+@job_runner.handler(RENDER_THUMBNAILS)
+def render_thumbnails(job):
+    """Re-render the stored thumbnails of every board, or of one user's boards."""
+    user_id = job.params.get("userId")
+    query = {"userId": user_id} if user_id else {"userId": {"$exists": True}}
+
+    def render(boards):
+        for board in boards:
+            board_images.render_thumbnail(board["_id"])
+        return {"boards": len(boards)}
+
+    return dict(in_id_chunks(job, db.boards_collection, query, "after", render,
+                             batch_size=THUMBNAIL_JOB_BATCH_SIZE))
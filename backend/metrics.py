@@ -0,0 +1,207 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+from log import get_logger
+
+log = get_logger('metrics')
+
+# Seconds; covers sub-millisecond socket handlers up to slow Mongo scans
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Bytes; from tiny acks to multi-megabyte boards
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {sorted(labels)}")
+        return tuple((name, labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            items = list(self.values.items())
+        for key, value in items:
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key, value):
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}"]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                # Per-bucket (not cumulative) counts, then sum and count
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self, key, state):
+        counts, total, count = state
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket_count
+            labels = key + (('le', _format_value(float(bound))),)
+            lines.append(f"{self.name}_bucket{_format_labels(labels)} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+        lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class Registry:
+    """Metrics rendered in the Prometheus text exposition format.
+
+    Collectors are callables run at scrape time for values that already live
+    elsewhere (queue stats, room registry); they set gauges just before the
+    metrics are rendered.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._add(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def collector(self, fn):
+        self.collectors.append(fn)
+        return fn
+
+    def render(self):
+        for collect in self.collectors:
+            try:
+                collect()
+            except Exception as e:
+                # A broken collector must not take the whole scrape down
+                name = getattr(collect, '__name__', 'collector')
+                SCRAPE_ERRORS.inc(collector=name)
+                log.error("Metrics collector failed", collector=name, error=str(e))
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+SCRAPE_ERRORS = registry.counter(
+    'canvas_metrics_collector_errors_total', 'Metrics collectors that raised during a scrape', ['collector'])
+
+HTTP_REQUEST_SECONDS = registry.histogram(
+    'canvas_http_request_duration_seconds', 'REST request latency', ['method', 'route', 'status'])
+HTTP_REQUEST_BYTES = registry.histogram(
+    'canvas_http_request_size_bytes', 'REST request body size', ['method', 'route'], SIZE_BUCKETS)
+HTTP_RESPONSE_BYTES = registry.histogram(
+    'canvas_http_response_size_bytes', 'REST response body size as sent', ['method', 'route'], SIZE_BUCKETS)
+
+MONGO_COMMAND_SECONDS = registry.histogram(
+    'canvas_mongo_command_duration_seconds', 'MongoDB command round trip time', ['command', 'outcome'])
+
+SOCKET_EVENTS = registry.counter(
+    'canvas_socketio_events_total', 'Socket.IO events received, by event', ['event'])
+SOCKET_HANDLER_SECONDS = registry.histogram(
+    'canvas_socketio_handler_duration_seconds', 'Time spent in Socket.IO event handlers', ['event'])
+SOCKET_EVENTS_REJECTED = registry.counter(
+    'canvas_socketio_events_rejected_total', 'Socket.IO events dropped by rate limits or size caps',
+    ['event', 'reason'])
+HTTP_REQUESTS_REJECTED = registry.counter(
+    'canvas_http_requests_rejected_total', 'REST requests refused by rate limits or size caps', ['route', 'reason'])
+
+FANOUT_TICK_SECONDS = registry.histogram(
+    'canvas_fanout_tick_duration_seconds', 'Time to emit one tick of room batch frames')
+FANOUT_EMIT_SECONDS = registry.histogram(
+    'canvas_fanout_emit_duration_seconds', 'Time to emit one frame to a room or client', ['target'])
+
+ROOMS = registry.gauge('canvas_rooms', 'Rooms held in memory by this process')
+ROOM_MEMBERS = registry.gauge('canvas_room_members', 'Clients joined to rooms on this process')
+ROOM_MEMBERS_MAX = registry.gauge('canvas_room_members_max', 'Members of the largest room')
+GREENLETS = registry.gauge('canvas_greenlets', 'Live greenlets in this process')
+HUB_TIMERS = registry.gauge('canvas_eventlet_hub_timers', 'Timers scheduled on the eventlet hub')
+
+COMPONENT_STATS = registry.gauge(
+    'canvas_component_stat', 'Internal counters of the write-behind queue, board cache and fan-out',
+    ['component', 'stat'])
+
+
+def record_stats(component, stats):
+    """Expose a component's stats() dict, skipping non-numeric entries."""
+    for stat, value in stats.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            COMPONENT_STATS.set(value, component=component, stat=stat)
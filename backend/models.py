@@ -1,12 +1,99 @@
+from elements import STORED_FLAG
+from stroke_codec import unpack_lines
+
+
 def board_to_dict(board):
     return {
         "id": str(board["_id"]),
         "userId": board["userId"],
         "title": board["title"],
-        "data": board.get("data", []),
+        "data": unpack_lines(board.get("data", [])),
         "notes": board.get("notes", []),  # ✅ Include notes in output
         "textBoxes": board.get("textBoxes", []),  # ✅ Include textBoxes in output
         "background": board.get("background", "#ffffff"),  # ✅ Include background
         "templateType": board.get("templateType", "whiteboard"),  # ✅ Include templateType
+        "version": board.get("version", 0),
         "createdAt": board.get("createdAt")
     }
+
+
+def _count_of(field):
+    # Legacy boards may hold "" or a JSON string instead of an array
+    return {"$cond": [{"$isArray": f"${field}"}, {"$size": f"${field}"}, 0]}
+
+
+# Projection for dashboard listings: metadata plus element counts, no content
+BOARD_SUMMARY_PROJECTION = {
+    "userId": 1,
+    "title": 1,
+    "description": 1,
+    "type": 1,
+    "templateType": 1,
+    "background": 1,
+    "isPublic": 1,
+    "createdAt": 1,
+    "updatedAt": 1,
+    "version": 1,
+    "lineCount": _count_of("data"),
+    "noteCount": _count_of("notes"),
+    "textBoxCount": _count_of("textBoxes"),
+    # Boards storing their notes and text boxes apart are counted from board_elements
+    STORED_FLAG: 1,
+}
+
+
+def board_summary_to_dict(board):
+    return {
+        "id": str(board["_id"]),
+        "userId": board.get("userId"),
+        "title": board.get("title", "Untitled"),
+        "description": board.get("description", ""),
+        "type": board.get("type", "whiteboard"),
+        "templateType": board.get("templateType", "whiteboard"),
+        "background": board.get("background", "#ffffff"),
+        "isPublic": board.get("isPublic", False),
+        "createdAt": board.get("createdAt"),
+        "updatedAt": board.get("updatedAt"),
+        "version": board.get("version", 0),
+        "counts": {
+            "lines": board.get("lineCount", 0),
+            "notes": board.get("noteCount", 0),
+            "textBoxes": board.get("textBoxCount", 0),
+        }
+    }
+
+
+# Whiteboard listings leave out the canvas data
+WHITEBOARD_SUMMARY_PROJECTION = {
+    "owner": 1,
+    "name": 1,
+    "sharedWith": 1,
+}
+
+
+def whiteboard_summary_to_dict(board, user_id):
+    return {
+        "_id": str(board["_id"]),
+        "owner": board.get("owner"),
+        "name": board.get("name"),
+        "sharedWith": board.get("sharedWith", []),
+        "role": "owner" if board.get("owner") == user_id else "shared",
+    }
+
+
+def job_to_dict(job):
+    return {
+        "id": str(job["_id"]),
+        "type": job["type"],
+        "params": job.get("params", {}),
+        "status": job["status"],
+        "attempts": job.get("attempts", 0),
+        "maxAttempts": job.get("maxAttempts"),
+        "progress": job.get("progress", {}),
+        "result": job.get("result"),
+        "error": job.get("error"),
+        "createdAt": job.get("createdAt"),
+        "startedAt": job.get("startedAt"),
+        "finishedAt": job.get("finishedAt"),
+        "runAfter": job.get("runAfter"),
+    }
@@ -0,0 +1,75 @@
+from datetime import datetime, timezone
+
+from bson import ObjectId
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Newest first, _id breaks ties between boards saved in the same millisecond
+PAGE_SORT = [("updatedAt", -1), ("_id", -1)]
+
+
+def parse_limit(value, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    if value in (None, ""):
+        return default
+    limit = int(value)
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    return min(limit, maximum)
+
+
+def encode_cursor(doc):
+    """Opaque cursor pointing just past `doc` in PAGE_SORT order."""
+    updated_at = doc.get("updatedAt")
+    if not isinstance(updated_at, datetime):
+        return f"null_{doc['_id']}"
+    if updated_at.tzinfo is None:
+        updated_at = updated_at.replace(tzinfo=timezone.utc)
+    return f"{int(updated_at.timestamp() * 1000)}_{doc['_id']}"
+
+
+def decode_cursor(cursor):
+    millis, _, oid = cursor.partition("_")
+    if not ObjectId.is_valid(oid):
+        raise ValueError("Invalid cursor")
+    if millis == "null":
+        return None, ObjectId(oid)
+    return datetime.fromtimestamp(int(millis) / 1000, tz=timezone.utc), ObjectId(oid)
+
+
+def cursor_filter(cursor):
+    """Query clause selecting the documents after `cursor` (None for the first page).
+
+    Documents without updatedAt sort last in PAGE_SORT, so they follow every
+    dated page and are then paged by _id alone.
+    """
+    if not cursor:
+        return {}
+    updated_at, oid = decode_cursor(cursor)
+    if updated_at is None:
+        return {"updatedAt": None, "_id": {"$lt": oid}}
+    return {"$or": [
+        {"updatedAt": {"$lt": updated_at}},
+        {"updatedAt": updated_at, "_id": {"$lt": oid}},
+        {"updatedAt": None},
+    ]}
+
+
+def with_cursor(query, cursor):
+    after = cursor_filter(cursor)
+    if not after:
+        return query
+    return {"$and": [query, after]}
+
+
+# Listings without an updatedAt field page on _id alone (newest first)
+ID_SORT = [("_id", -1)]
+
+
+def after_id(query, cursor):
+    """`query` restricted to documents after the _id cursor in ID_SORT order."""
+    if not cursor:
+        return query
+    if not ObjectId.is_valid(cursor):
+        raise ValueError("Invalid cursor")
+    return {"$and": [query, {"_id": {"$lt": ObjectId(cursor)}}]}
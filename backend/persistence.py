@@ -0,0 +1,302 @@
+import atexit
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+import db
+from board_cache import board_cache
+from elements import ELEMENT_FIELDS, STORED_FLAG, board_elements
+from history import board_history
+from log import get_logger
+
+log = get_logger('persistence')
+
+# Seconds updates to the same board are coalesced before they are written; 0 writes inline
+WRITE_BEHIND_WINDOW = float(os.environ.get('WRITE_BEHIND_WINDOW', 1.0))
+# Queue depth at which callers flush inline instead of waiting for the window
+WRITE_BEHIND_MAX_PENDING = int(os.environ.get('WRITE_BEHIND_MAX_PENDING', 5000))
+
+# Write error codes a retry can get past (failovers, shutdowns, timeouts, write conflicts).
+# Any other write error, e.g. a document over 16 MB or a failed validation, fails the same way every time
+TRANSIENT_WRITE_ERRORS = {6, 7, 50, 89, 91, 112, 189, 262, 9001, 10107, 11600, 11602, 13435, 13436}
+
+
+class PendingWrite:
+    """Coalesced update for one document."""
+
+    def __init__(self):
+        self.set_fields = {}
+        self.inc_fields = {}
+        # Full document for boards created but not yet written
+        self.insert_doc = None
+        self.first_queued = time.monotonic()
+
+    def merge(self, set_fields=None, inc_fields=None):
+        if self.insert_doc is not None:
+            # Nothing stored yet, so fold the change straight into the new document
+            self.insert_doc.update(set_fields or {})
+            for key, amount in (inc_fields or {}).items():
+                self.insert_doc[key] = self.insert_doc.get(key, 0) + amount
+            return
+        self.set_fields.update(set_fields or {})
+        for key, amount in (inc_fields or {}).items():
+            self.inc_fields[key] = self.inc_fields.get(key, 0) + amount
+
+    def to_request(self, doc_id, elements_stored=False):
+        """UpdateOne for the coalesced write; with `elements_stored` notes and text boxes are left out."""
+        if self.insert_doc is not None:
+            doc = {k: v for k, v in self.insert_doc.items() if k != "_id"}
+            if elements_stored:
+                doc = {k: v for k, v in doc.items() if k not in ELEMENT_FIELDS}
+                doc[STORED_FLAG] = True
+            # Upserting on the pre-generated _id keeps retried flushes idempotent
+            return UpdateOne({"_id": doc_id}, {"$setOnInsert": doc}, upsert=True)
+        update = {}
+        set_fields = self.set_fields
+        if elements_stored:
+            # The elements were written to board_elements; embedded copies of older boards go
+            set_fields = dict({k: v for k, v in set_fields.items() if k not in ELEMENT_FIELDS}, **{STORED_FLAG: True})
+            update["$unset"] = {field: "" for field in ELEMENT_FIELDS}
+        if set_fields:
+            update["$set"] = set_fields
+        if self.inc_fields:
+            update["$inc"] = self.inc_fields
+        return UpdateOne({"_id": doc_id}, update)
+
+
+class WriteBehindQueue:
+    """Coalesces board writes per document and flushes them with bulk_write.
+
+    Writes queued within `window` seconds of the first pending write for a
+    board are merged ($set keys overwrite, $inc amounts add up) and sent as a
+    single UpdateOne; all boards due at a tick share one bulk_write round trip.
+    An optional `journal` (see history.py) records what each flush changed,
+    `elements` (see elements.py) takes the notes and text boxes of the batch
+    and writes only those that changed, `cache` (see board_cache.py) drops
+    the documents of a batch once its write has finished, and `on_flushed`,
+    when set, is called with the ids of every written batch.
+    """
+
+    def __init__(self, collection_getter, window=WRITE_BEHIND_WINDOW, max_pending=WRITE_BEHIND_MAX_PENDING,
+                 journal=None, elements=None, cache=None):
+        self.collection_getter = collection_getter
+        self.journal = journal
+        self.elements = elements
+        self.cache = cache
+        # on_flushed(doc ids), e.g. to re-render thumbnails of changed boards
+        self.on_flushed = None
+        self.window = window
+        self.max_pending = max_pending
+        self.pending = OrderedDict()
+        self.lock = threading.Lock()
+        self.flusher = None
+        self.metrics = {
+            "enqueued": 0,
+            "coalesced": 0,
+            "flushes": 0,
+            "flushed_writes": 0,
+            "flush_errors": 0,
+            "dropped_writes": 0,
+            "max_depth": 0,
+            "last_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+
+    def enqueue(self, doc_id, set_fields=None, inc_fields=None):
+        """Queue a $set / $inc update for `doc_id`."""
+        with self.lock:
+            pending = self.pending.get(doc_id)
+            if pending is None:
+                pending = self.pending[doc_id] = PendingWrite()
+            else:
+                self.metrics["coalesced"] += 1
+            pending.merge(set_fields, inc_fields)
+            self._queued()
+        self._after_enqueue()
+
+    def enqueue_insert(self, doc):
+        """Queue a new document; its _id must already be assigned."""
+        with self.lock:
+            pending = self.pending[doc["_id"]] = PendingWrite()
+            pending.insert_doc = dict(doc)
+            self._queued()
+        self._after_enqueue()
+
+    def discard(self, doc_id):
+        """Drop queued writes for a document that is being deleted."""
+        with self.lock:
+            self.pending.pop(doc_id, None)
+
+    def apply_pending(self, doc_id, doc):
+        """Overlay queued changes on a document read from Mongo (or None)."""
+        with self.lock:
+            pending = self.pending.get(doc_id)
+            if pending is None:
+                return doc
+            if pending.insert_doc is not None:
+                return dict(pending.insert_doc)
+            if doc is None:
+                return None
+            merged = dict(doc)
+            merged.update(pending.set_fields)
+            for key, amount in pending.inc_fields.items():
+                merged[key] = merged.get(key, 0) + amount
+            return merged
+
+    def flush(self, doc_id=None, due_only=False):
+        """Write pending updates; one document, every due document, or everything."""
+        now = time.monotonic()
+        with self.lock:
+            if doc_id is not None:
+                batch = {doc_id: self.pending.pop(doc_id)} if doc_id in self.pending else {}
+            elif due_only:
+                batch = {k: p for k, p in self.pending.items() if now - p.first_queued >= self.window}
+                for key in batch:
+                    del self.pending[key]
+            else:
+                batch = dict(self.pending)
+                self.pending.clear()
+
+        if not batch:
+            return 0
+
+        collection = self.collection_getter()
+        if collection is None:
+            self._requeue(batch)
+            return 0
+
+        try:
+            return self._write(collection, batch)
+        finally:
+            if self.cache is not None:
+                # Reads made while the batch was in flight saw neither the queue
+                # nor the written documents; drop whatever they cached
+                for key in batch:
+                    self.cache.invalidate(str(key))
+
+    def _write(self, collection, batch):
+        entries = self._journal_entries(collection, batch)
+        started = time.perf_counter()
+        try:
+            moved = set()
+            if self.elements is not None:
+                # Elements land first, so a board flagged as storing them never reads as empty.
+                # Their writes are upserts and deletes, so a retried batch may repeat them
+                element_requests, moved = self.elements.prepare(collection, batch)
+                self.elements.write(element_requests)
+            try:
+                collection.bulk_write([p.to_request(k, k in moved) for k, p in batch.items()], ordered=False)
+            except BulkWriteError as e:
+                batch = self._partial_failure(batch, e)
+                if not batch:
+                    return 0
+                entries = [entry for entry in entries if entry["boardId"] in batch]
+                moved &= set(batch)
+        except Exception as e:
+            self.metrics["flush_errors"] += 1
+            log.error("Write-behind flush failed", boards=len(batch), error=str(e))
+            self._requeue(batch)
+            return 0
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.metrics["flushes"] += 1
+        self.metrics["flushed_writes"] += len(batch)
+        self.metrics["last_flush_ms"] = round(elapsed_ms, 3)
+        self.metrics["total_flush_ms"] += elapsed_ms
+        if moved:
+            self.elements.mark_stored(moved)
+        if entries:
+            self.journal.commit(entries)
+        if self.on_flushed is not None:
+            try:
+                self.on_flushed(list(batch))
+            except Exception as e:
+                log.error("Write-behind flush callback failed", boards=len(batch), error=str(e))
+        return len(batch)
+
+    def run_forever(self):
+        while True:
+            time.sleep(max(self.window / 2, 0.05))
+            self.flush(due_only=True)
+
+    def stats(self):
+        with self.lock:
+            depth = len(self.pending)
+            oldest = min((p.first_queued for p in self.pending.values()), default=None)
+        flushes = self.metrics["flushes"]
+        return dict(
+            self.metrics,
+            total_flush_ms=round(self.metrics["total_flush_ms"], 3),
+            avg_flush_ms=round(self.metrics["total_flush_ms"] / flushes, 3) if flushes else 0.0,
+            queue_depth=depth,
+            oldest_pending_s=round(time.monotonic() - oldest, 3) if oldest is not None else 0.0,
+            window_s=self.window,
+        )
+
+    def _journal_entries(self, collection, batch):
+        if self.journal is None:
+            return []
+        try:
+            # Diffs are taken against the stored documents, so before they are overwritten
+            return self.journal.prepare(collection, batch)
+        except Exception as e:
+            log.error("Failed to prepare board history", boards=len(batch), error=str(e))
+            return []
+
+    def _partial_failure(self, batch, error):
+        """Requeue the writes of a bulk_write that failed with a transient error; returns the writes that landed.
+
+        The bulk_write is unordered, so every write without an error of its
+        own was applied; sending it again would apply its $inc twice. Writes
+        that failed for good are dropped, or they would block their board's
+        later writes forever.
+        """
+        self.metrics["flush_errors"] += 1
+        keys = list(batch)
+        failed, retry = set(), {}
+        for write_error in error.details.get("writeErrors", []):
+            key = keys[write_error["index"]]
+            failed.add(key)
+            if write_error.get("code") in TRANSIENT_WRITE_ERRORS:
+                retry[key] = batch[key]
+            else:
+                self.metrics["dropped_writes"] += 1
+                log.error("Dropped board write", board=str(key), code=write_error.get("code"),
+                          error=write_error.get("errmsg"))
+        if retry:
+            log.warning("Write-behind flush partly failed", boards=len(retry))
+            self._requeue(retry)
+        return {key: pending for key, pending in batch.items() if key not in failed}
+
+    def _queued(self):
+        self.metrics["enqueued"] += 1
+        self.metrics["max_depth"] = max(self.metrics["max_depth"], len(self.pending))
+
+    def _requeue(self, batch):
+        with self.lock:
+            for key, pending in batch.items():
+                newer = self.pending.get(key)
+                if newer is not None:
+                    # Replay later edits on top of the write that failed to land
+                    pending.merge(newer.set_fields, newer.inc_fields)
+                    pending.first_queued = min(pending.first_queued, newer.first_queued)
+                self.pending[key] = pending
+
+    def _after_enqueue(self):
+        if self.window <= 0 or len(self.pending) >= self.max_pending:
+            self.flush()
+            return
+        if self.flusher is None:
+            self.flusher = threading.Thread(target=self.run_forever, daemon=True)
+            self.flusher.start()
+
+
+board_writes = WriteBehindQueue(lambda: db.boards_collection, journal=board_history, elements=board_elements,
+                                cache=board_cache)
+
+# Don't drop queued autosaves when the worker shuts down
+atexit.register(board_writes.flush)
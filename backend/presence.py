@@ -0,0 +1,142 @@
+import math
+import os
+import time
+
+from log import get_logger
+
+log = get_logger('presence')
+
+# Presence frames sent per room per second
+PRESENCE_TICK_HZ = float(os.environ.get('PRESENCE_TICK_HZ', 10))
+# Seconds without an update before a user is dropped from the room's presence
+PRESENCE_IDLE_TTL = float(os.environ.get('PRESENCE_IDLE_TTL', 30))
+
+# Fields a client may set, with the longest string accepted for each text field
+TEXT_FIELDS = {'tool': 24, 'name': 64, 'color': 32}
+# Cursor positions are sent rounded to this many canvas units
+CURSOR_PRECISION = 1
+
+
+def _finite(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def parse_presence(data):
+    """The presence fields of a `presence` payload; malformed fields are left out."""
+    fields = {}
+    if _finite(data.get('x')) and _finite(data.get('y')):
+        fields['x'] = round(data['x'] / CURSOR_PRECISION) * CURSOR_PRECISION
+        fields['y'] = round(data['y'] / CURSOR_PRECISION) * CURSOR_PRECISION
+    elif 'x' in data and data['x'] is None:
+        # The cursor left the canvas
+        fields['x'] = fields['y'] = None
+    for field, limit in TEXT_FIELDS.items():
+        value = data.get(field)
+        if isinstance(value, str):
+            fields[field] = value[:limit]
+    return fields
+
+
+class RoomPresence:
+    """One room's presence table: sid -> fields, plus the changes not yet sent."""
+
+    __slots__ = ('users', 'updated', 'changes', 'removed', 'seq')
+
+    def __init__(self):
+        self.users = {}
+        self.updated = {}
+        self.changes = {}
+        self.removed = set()
+        self.seq = 0
+
+
+class Presence:
+    """Cursor, tool and viewport of every user in a room, sent as one delta frame per tick.
+
+    Updates only record the fields that changed since the last frame, so a
+    user moving the cursor ten times between ticks costs one entry with the
+    final x and y. Every room with changes gets a single `presence` frame
+    per tick instead of one relay per update per member, and users that
+    stop sending updates are dropped after `idle_ttl` seconds.
+    """
+
+    def __init__(self, emit, idle_ttl=PRESENCE_IDLE_TTL, clock=time.monotonic):
+        # emit(room, frame)
+        self.emit = emit
+        self.idle_ttl = idle_ttl
+        self.clock = clock
+        self.rooms = {}
+        self.metrics = {
+            "updates": 0,
+            "unchanged_updates": 0,
+            "frames_sent": 0,
+            "expired": 0,
+        }
+
+    def update(self, room, sid, fields):
+        """Merge fields into a user's entry; returns whether anything changed."""
+        state = self.rooms.setdefault(room, RoomPresence())
+        entry = state.users.setdefault(sid, {})
+        state.updated[sid] = self.clock()
+        state.removed.discard(sid)
+        self.metrics["updates"] += 1
+        changed = {key: value for key, value in fields.items() if entry.get(key, ()) != value}
+        if not changed:
+            self.metrics["unchanged_updates"] += 1
+            return False
+        entry.update(changed)
+        state.changes.setdefault(sid, {}).update(changed)
+        return True
+
+    def remove(self, room, sid):
+        state = self.rooms.get(room)
+        if state is None or sid not in state.users:
+            return
+        del state.users[sid]
+        del state.updated[sid]
+        state.changes.pop(sid, None)
+        state.removed.add(sid)
+
+    def remove_all(self, sid):
+        for room in [room for room, state in self.rooms.items() if sid in state.users]:
+            self.remove(room, sid)
+
+    def snapshot(self, room):
+        """Full table of a room for a joiner, at the sequence number of the last frame."""
+        state = self.rooms.get(room)
+        if state is None:
+            return {'room': room, 'seq': 0, 'users': {}}
+        return {'room': room, 'seq': state.seq, 'users': {sid: dict(entry) for sid, entry in state.users.items()}}
+
+    def tick(self):
+        """Expire idle users and send one frame per room with changes; returns frames sent."""
+        now = self.clock()
+        frames = 0
+        for room, state in list(self.rooms.items()):
+            for sid in [sid for sid, updated in state.updated.items() if now - updated >= self.idle_ttl]:
+                self.remove(room, sid)
+                self.metrics["expired"] += 1
+            if state.changes or state.removed:
+                state.seq += 1
+                frame = {'room': room, 'seq': state.seq, 'users': state.changes, 'removed': sorted(state.removed)}
+                state.changes, state.removed = {}, set()
+                self.emit(room, frame)
+                frames += 1
+            if not state.users:
+                del self.rooms[room]
+        self.metrics["frames_sent"] += frames
+        return frames
+
+    def run_forever(self, sleep, tick_hz=PRESENCE_TICK_HZ):
+        interval = 1.0 / tick_hz
+        while True:
+            started = time.monotonic()
+            try:
+                self.tick()
+            except Exception as e:
+                log.exception("Error sending presence frames", error=str(e))
+            sleep(max(interval - (time.monotonic() - started), 0))
+
+    def stats(self):
+        return dict(self.metrics, rooms=len(self.rooms),
+                    users=sum(len(state.users) for state in self.rooms.values()))
@@ -0,0 +1,186 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from log import get_logger
+
+log = get_logger('ratelimit')
+
+# "on" (default) or "off"; whether event and request rates are limited at all
+RATE_LIMITS = os.environ.get('RATE_LIMITS', 'on').lower() != 'off'
+# Per connection: drawing and erasing events per second, and the burst allowed on top
+SOCKET_DRAWING_RATE = float(os.environ.get('SOCKET_DRAWING_RATE', 120))
+SOCKET_DRAWING_BURST = float(os.environ.get('SOCKET_DRAWING_BURST', 240))
+# Per connection: WebRTC signaling events (offers, answers, ICE candidates) per second and burst
+SOCKET_SIGNALING_RATE = float(os.environ.get('SOCKET_SIGNALING_RATE', 20))
+SOCKET_SIGNALING_BURST = float(os.environ.get('SOCKET_SIGNALING_BURST', 60))
+# Per connection: presence (cursor) updates per second and burst
+SOCKET_PRESENCE_RATE = float(os.environ.get('SOCKET_PRESENCE_RATE', 30))
+SOCKET_PRESENCE_BURST = float(os.environ.get('SOCKET_PRESENCE_BURST', 60))
+# Per connection: every other event per second and burst
+SOCKET_EVENT_RATE = float(os.environ.get('SOCKET_EVENT_RATE', 30))
+SOCKET_EVENT_BURST = float(os.environ.get('SOCKET_EVENT_BURST', 60))
+# Per room: events relayed to the room per second and burst, summed over its members
+ROOM_EVENT_RATE = float(os.environ.get('ROOM_EVENT_RATE', 1000))
+ROOM_EVENT_BURST = float(os.environ.get('ROOM_EVENT_BURST', 2000))
+# Per client address: REST writes (POST/PUT/PATCH/DELETE) per second and burst
+REST_WRITE_RATE = float(os.environ.get('REST_WRITE_RATE', 5))
+REST_WRITE_BURST = float(os.environ.get('REST_WRITE_BURST', 30))
+# Proxies in front of the app that append to X-Forwarded-For; 0 keys REST limits on the socket peer
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', 0))
+
+# Largest REST request body, in bytes; larger bodies get 413
+MAX_REQUEST_BYTES = int(os.environ.get('MAX_REQUEST_BYTES', 8 * 1024 * 1024))
+# Largest Socket.IO message, in bytes; larger messages close the connection
+SOCKET_MAX_MESSAGE_BYTES = int(os.environ.get('SOCKET_MAX_MESSAGE_BYTES', 1024 * 1024))
+# Points accepted in a single stroke
+MAX_STROKE_POINTS = int(os.environ.get('MAX_STROKE_POINTS', 10000))
+# Points accepted across all strokes of a full board save
+MAX_BOARD_POINTS = int(os.environ.get('MAX_BOARD_POINTS', 1000000))
+
+# Buckets tracked per limiter before the least recently used are dropped
+MAX_BUCKETS = 50000
+
+# Socket events grouped by the per-connection limit they draw from
+DRAWING_EVENTS = ('drawing', 'erase', 'erase_path', 'viewport')
+SIGNALING_EVENTS = ('voice-offer', 'voice-answer', 'ice-candidate')
+# Events that are never limited: dropping them would leave server state inconsistent
+UNLIMITED_EVENTS = ('connect', 'disconnect', 'leave', 'voice-leave')
+# Events relayed to the whole room, which also draw from the room's limit
+ROOM_EVENTS = ('drawing', 'erase', 'erase_path', 'note_added', 'note_updated', 'note_deleted')
+# REST methods counted against the write limit
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+
+class TokenBucket:
+    """`rate` tokens per second, holding at most `burst`; each call takes one."""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated', 'limited')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.updated = now
+        # Whether the last take was refused, so a limited streak is reported once
+        self.limited = False
+
+    def take(self, now, cost=1):
+        """0 if the tokens were taken, else seconds until they would be available."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            self.limited = False
+            return 0
+        return (cost - self.tokens) / self.rate if self.rate > 0 else math.inf
+
+
+class RateLimiter:
+    """Token buckets keyed by (scope, key), e.g. ('drawing', sid) or ('room', room id).
+
+    `limits` maps each scope to its (rate, burst). Buckets are created on
+    first use and the least recently used are dropped past `max_buckets`;
+    a dropped bucket starts full again, which only ever errs on allowing.
+    """
+
+    def __init__(self, limits, enabled=RATE_LIMITS, max_buckets=MAX_BUCKETS, clock=time.monotonic):
+        self.limits = limits
+        self.enabled = enabled
+        self.max_buckets = max_buckets
+        self.clock = clock
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+        self.metrics = {"allowed": 0, "limited": 0}
+        self.limited_by_scope = {}
+
+    def hit(self, scope, key, cost=1):
+        """0 if allowed, else seconds until it would be."""
+        return self.check(scope, key, cost)[0]
+
+    def check(self, scope, key, cost=1):
+        """(seconds to wait or 0, whether this refusal starts a limited streak)."""
+        if not self.enabled or scope not in self.limits:
+            return 0, False
+        now = self.clock()
+        with self.lock:
+            bucket = self.buckets.get((scope, key))
+            if bucket is None:
+                rate, burst = self.limits[scope]
+                bucket = self.buckets[(scope, key)] = TokenBucket(rate, burst, now)
+                if len(self.buckets) > self.max_buckets:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end((scope, key))
+            wait = bucket.take(now, cost)
+            if not wait:
+                self.metrics["allowed"] += 1
+                return 0, False
+            self.metrics["limited"] += 1
+            self.limited_by_scope[scope] = self.limited_by_scope.get(scope, 0) + 1
+            first = not bucket.limited
+            bucket.limited = True
+        if first:
+            log.warning("Rate limited", scope=scope, key=key, retry_after=round(wait, 3))
+        return wait, first
+
+    def forget(self, key):
+        """Drop every bucket of `key`, e.g. a disconnected sid."""
+        with self.lock:
+            for bucket_key in [k for k in self.buckets if k[1] == key]:
+                del self.buckets[bucket_key]
+
+    def reset(self):
+        with self.lock:
+            self.buckets.clear()
+
+    def stats(self):
+        with self.lock:
+            buckets = len(self.buckets)
+        stats = dict(self.metrics, buckets=buckets, enabled=int(self.enabled))
+        stats.update({f"limited_{scope}": count for scope, count in self.limited_by_scope.items()})
+        return stats
+
+
+def event_scope(event):
+    """Per-connection limit a socket event draws from, or None when it is never limited."""
+    if event in UNLIMITED_EVENTS:
+        return None
+    if event in DRAWING_EVENTS:
+        return 'drawing'
+    if event in SIGNALING_EVENTS:
+        return 'signaling'
+    if event == 'presence':
+        return 'presence'
+    return 'event'
+
+
+def client_address(request):
+    """Address REST limits are keyed on: the peer, or the client as seen by the outermost trusted proxy."""
+    route = request.access_route
+    if TRUSTED_PROXY_HOPS and len(route) >= TRUSTED_PROXY_HOPS:
+        return route[-TRUSTED_PROXY_HOPS]
+    return request.remote_addr
+
+
+def count_points(lines):
+    """Coordinate pairs across a list of strokes; malformed entries count as none."""
+    total = 0
+    for line in lines if isinstance(lines, list) else ():
+        points = line.get('points') if isinstance(line, dict) else None
+        if isinstance(points, list):
+            total += len(points) // 2
+    return total
+
+
+socket_limits = RateLimiter({
+    'drawing': (SOCKET_DRAWING_RATE, SOCKET_DRAWING_BURST),
+    'signaling': (SOCKET_SIGNALING_RATE, SOCKET_SIGNALING_BURST),
+    'presence': (SOCKET_PRESENCE_RATE, SOCKET_PRESENCE_BURST),
+    'event': (SOCKET_EVENT_RATE, SOCKET_EVENT_BURST),
+    'room': (ROOM_EVENT_RATE, ROOM_EVENT_BURST),
+})
+
+rest_limits = RateLimiter({'write': (REST_WRITE_RATE, REST_WRITE_BURST)})
@@ -0,0 +1,349 @@
+import math
+import os
+import struct
+import zlib
+
+from stroke_codec import unpack_lines
+from tiles import line_bounds
+
+# Size, in pixels, of dashboard thumbnails; the board is scaled to fit and centered
+THUMBNAIL_WIDTH = int(os.environ.get('THUMBNAIL_WIDTH', 320))
+THUMBNAIL_HEIGHT = int(os.environ.get('THUMBNAIL_HEIGHT', 180))
+# Longest side, in pixels, of a full-size export; larger boards are scaled down to fit
+EXPORT_MAX_SIDE = int(os.environ.get('EXPORT_MAX_SIDE', 4096))
+# zlib level of rendered PNGs, 0-9
+PNG_COMPRESSION = int(os.environ.get('PNG_COMPRESSION', 6))
+
+# Canvas units of empty space kept around the content
+RENDER_MARGIN = 24
+# Size of an export of a board with nothing on it
+EMPTY_SIZE = (800, 450)
+# Element defaults, matching how the editor draws them
+NOTE_SIZE = (180, 120)
+NOTE_COLOR = '#fef08a'
+NOTE_BORDER = '#eab308'
+NOTE_TEXT = '#92400e'
+TEXT_BOX_WIDTH = 200
+TEXT_BOX_FILL = (255, 255, 255, 0.85)
+TEXT_COLOR = '#1f2937'
+FONT_SIZE = 16
+# Average glyph width and line height as a fraction of the font size
+GLYPH_WIDTH = 0.55
+LINE_HEIGHT = 1.6
+
+NAMED_COLORS = {
+    'black': (0, 0, 0), 'white': (255, 255, 255), 'red': (255, 0, 0), 'green': (0, 128, 0),
+    'blue': (0, 0, 255), 'yellow': (255, 255, 0), 'orange': (255, 165, 0), 'purple': (128, 0, 128),
+    'gray': (128, 128, 128), 'grey': (128, 128, 128), 'pink': (255, 192, 203),
+}
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def parse_color(value, default=(0, 0, 0, 1.0)):
+    """(r, g, b, alpha) of a CSS hex, rgb()/rgba() or basic named color; `default` for anything else."""
+    if not isinstance(value, str):
+        return default
+    value = value.strip().lower()
+    if value == 'transparent':
+        return (0, 0, 0, 0.0)
+    if value in NAMED_COLORS:
+        return NAMED_COLORS[value] + (1.0,)
+    try:
+        if value.startswith('#'):
+            digits = value[1:]
+            if len(digits) in (3, 4):
+                digits = ''.join(c * 2 for c in digits)
+            if len(digits) not in (6, 8):
+                return default
+            channels = bytes.fromhex(digits)
+            return tuple(channels[:3]) + ((channels[3] / 255 if len(channels) == 4 else 1.0),)
+        if value.startswith(('rgb(', 'rgba(')) and value.endswith(')'):
+            parts = [part.strip() for part in value[value.index('(') + 1:-1].split(',')]
+            if len(parts) not in (3, 4):
+                return default
+            rgb = tuple(min(max(int(float(part)), 0), 255) for part in parts[:3])
+            alpha = min(max(float(parts[3]), 0.0), 1.0) if len(parts) == 4 else 1.0
+            return rgb + (alpha,)
+    except ValueError:
+        pass
+    return default
+
+
+def _number(value, default=0):
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value):
+        return value
+    if isinstance(value, str):
+        # CSS lengths such as "16px"
+        try:
+            return float(value.strip().removesuffix('px'))
+        except ValueError:
+            pass
+    return default
+
+
+def encode_png(width, height, pixels, level=PNG_COMPRESSION):
+    """8-bit RGB PNG of `pixels`, a bytearray of width * height * 3 bytes."""
+    stride = width * 3
+    raw = b''.join(b'\x00' + pixels[row * stride:(row + 1) * stride] for row in range(height))
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return PNG_SIGNATURE + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(raw, level)) + chunk(b'IEND', b'')
+
+
+class Canvas:
+    """RGB raster that elements are drawn onto in canvas coordinates.
+
+    A point (x, y) lands on pixel ((x - origin_x) * scale + offset_x, ...),
+    so the same drawing code serves thumbnails and full-size exports.
+    """
+
+    def __init__(self, width, height, background, scale=1.0, origin=(0, 0), offset=(0, 0)):
+        self.width = width
+        self.height = height
+        self.background = background[:3]
+        self.scale = scale
+        self.origin = origin
+        self.offset = offset
+        self.pixels = bytearray(bytes(self.background) * (width * height))
+
+    def to_pixels(self, x, y):
+        return ((x - self.origin[0]) * self.scale + self.offset[0],
+                (y - self.origin[1]) * self.scale + self.offset[1])
+
+    def blend(self, coverage, color, alpha):
+        """Blend `color` into the pixels of `coverage` (pixel index -> 0..1) at `alpha`."""
+        if alpha <= 0:
+            return
+        r, g, b = color[:3]
+        pixels = self.pixels
+        for index, amount in coverage.items():
+            a = amount * alpha
+            offset = index * 3
+            if a >= 0.999:
+                pixels[offset] = r
+                pixels[offset + 1] = g
+                pixels[offset + 2] = b
+            else:
+                keep = 1 - a
+                pixels[offset] = int(pixels[offset] * keep + r * a + 0.5)
+                pixels[offset + 1] = int(pixels[offset + 1] * keep + g * a + 0.5)
+                pixels[offset + 2] = int(pixels[offset + 2] * keep + b * a + 0.5)
+
+    def rect_coverage(self, x, y, width, height):
+        """Pixels covered by a canvas-space rectangle, with partial coverage on its edges."""
+        left, top = self.to_pixels(x, y)
+        right, bottom = left + width * self.scale, top + height * self.scale
+        coverage = {}
+        for row in range(max(int(top), 0), min(int(math.ceil(bottom)), self.height)):
+            cover_y = min(bottom, row + 1) - max(top, row)
+            if cover_y <= 0:
+                continue
+            base = row * self.width
+            for col in range(max(int(left), 0), min(int(math.ceil(right)), self.width)):
+                cover = cover_y * (min(right, col + 1) - max(left, col))
+                if cover > 0:
+                    coverage[base + col] = min(cover, 1.0)
+        return coverage
+
+    def fill_rect(self, x, y, width, height, color, alpha=1.0):
+        self.blend(self.rect_coverage(x, y, width, height), color, alpha)
+
+    def outline_rect(self, x, y, width, height, color, thickness):
+        for edge in ((x, y, width, thickness), (x, y + height - thickness, width, thickness),
+                     (x, y, thickness, height), (x + width - thickness, y, thickness, height)):
+            self.fill_rect(*edge, color)
+
+    def stroke_coverage(self, points, stroke_width):
+        """Anti-aliased pixels of a polyline of flat [x0, y0, x1, y1, ...] points.
+
+        Coverage is kept per pixel as the maximum over the stroke's segments,
+        so a translucent stroke is blended once even where it overlaps itself.
+        """
+        radius = stroke_width * self.scale / 2
+        # Hairlines are drawn half a pixel wide and faded instead of vanishing
+        fade = min(radius * 2, 1.0)
+        radius = max(radius, 0.5)
+        path = []
+        for i in range(0, len(points) - 1, 2):
+            px, py = self.to_pixels(points[i], points[i + 1])
+            # Pointer samples closer than a pixel apart add nothing at this scale
+            if not path or abs(px - path[-1][0]) + abs(py - path[-1][1]) >= 0.5:
+                path.append((px, py))
+        if len(path) == 1:
+            path.append(path[0])
+
+        coverage = {}
+        width, height = self.width, self.height
+        for (ax, ay), (bx, by) in zip(path, path[1:]):
+            x0 = max(int(min(ax, bx) - radius), 0)
+            x1 = min(int(max(ax, bx) + radius) + 1, width - 1)
+            y0 = max(int(min(ay, by) - radius), 0)
+            y1 = min(int(max(ay, by) + radius) + 1, height - 1)
+            if x0 > x1 or y0 > y1:
+                continue
+            dx, dy = bx - ax, by - ay
+            length2 = dx * dx + dy * dy
+            for row in range(y0, y1 + 1):
+                cy = row + 0.5
+                base = row * width
+                for col in range(x0, x1 + 1):
+                    cx = col + 0.5
+                    t = ((cx - ax) * dx + (cy - ay) * dy) / length2 if length2 else 0.0
+                    t = 0.0 if t < 0 else 1.0 if t > 1 else t
+                    ex, ey = cx - ax - t * dx, cy - ay - t * dy
+                    cover = radius + 0.5 - math.sqrt(ex * ex + ey * ey)
+                    if cover <= 0:
+                        continue
+                    cover = fade if cover >= 1 else cover * fade
+                    index = base + col
+                    if coverage.get(index, 0) < cover:
+                        coverage[index] = cover
+        return coverage
+
+    def draw_line(self, line):
+        points = line.get('points')
+        if not isinstance(points, list) or len(points) < 2:
+            return
+        if not all(_number(value, None) is not None for value in points):
+            return
+        coverage = self.stroke_coverage(points, _number(line.get('strokeWidth'), 2))
+        if line.get('globalCompositeOperation') == 'destination-out':
+            # Eraser strokes uncover the background
+            self.blend(coverage, self.background, 1.0)
+            return
+        color = parse_color(line.get('color'))
+        self.blend(coverage, color, color[3] * _number(line.get('opacity'), 1))
+
+    def draw_text(self, text, x, y, width, height, font_size, color):
+        """Text as one bar per wrapped line; there are no fonts to draw glyphs with.
+
+        Bars keep the layout readable at thumbnail size, where glyphs would
+        not be legible anyway.
+        """
+        if not isinstance(text, str) or not text.strip() or width <= 0:
+            return
+        per_line = max(int(width / (font_size * GLYPH_WIDTH)), 1)
+        line_height = font_size * LINE_HEIGHT
+        row = 0
+        for paragraph in text.split('\n'):
+            remaining = len(paragraph.rstrip())
+            while True:
+                top = y + row * line_height
+                if top + font_size > y + height:
+                    return
+                chars = min(remaining, per_line)
+                if chars:
+                    self.fill_rect(x, top + font_size * 0.25, chars * font_size * GLYPH_WIDTH, font_size * 0.6,
+                                   color, color[3] * 0.7)
+                row += 1
+                remaining -= chars
+                if remaining <= 0:
+                    break
+
+    def draw_note(self, note):
+        x, y = _number(note.get('x'), None), _number(note.get('y'), None)
+        if x is None or y is None:
+            return
+        width, height = note_size(note)
+        self.fill_rect(x, y, width, height, parse_color(note.get('color'), parse_color(NOTE_COLOR)))
+        self.outline_rect(x, y, width, height, parse_color(NOTE_BORDER), 1 / max(self.scale, 1e-6))
+        self.draw_text(note.get('text'), x + 12, y + 12, width - 24, height - 24,
+                       _number(note.get('fontSize'), 14), parse_color(NOTE_TEXT))
+
+    def draw_text_box(self, box):
+        x, y = _number(box.get('x'), None), _number(box.get('y'), None)
+        if x is None or y is None:
+            return
+        style = box.get('style') if isinstance(box.get('style'), dict) else {}
+        font_size = _number(style.get('fontSize'), FONT_SIZE)
+        width, height = text_box_size(box, font_size)
+        self.fill_rect(x, y, width, height, TEXT_BOX_FILL, TEXT_BOX_FILL[3])
+        self.draw_text(box.get('text'), x + 16, y + 12, width - 32, height - 24, font_size,
+                       parse_color(style.get('color'), parse_color(TEXT_COLOR)))
+
+
+def note_size(note):
+    return _number(note.get('width'), NOTE_SIZE[0]) or NOTE_SIZE[0], \
+        _number(note.get('height'), NOTE_SIZE[1]) or NOTE_SIZE[1]
+
+
+def text_box_size(box, font_size=FONT_SIZE):
+    width = _number(box.get('width'), TEXT_BOX_WIDTH) or TEXT_BOX_WIDTH
+    height = _number(box.get('height'), None)
+    if height is None:
+        # Auto height: as many lines as the text wraps to, plus padding
+        text = box.get('text') if isinstance(box.get('text'), str) else ''
+        per_line = max(int((width - 32) / (font_size * GLYPH_WIDTH)), 1)
+        lines = sum(max(math.ceil(len(part) / per_line), 1) for part in text.split('\n'))
+        height = lines * font_size * LINE_HEIGHT + 24
+    return width, height
+
+
+def _elements(board, field):
+    elements = board.get(field)
+    return [element for element in elements if isinstance(element, dict)] if isinstance(elements, list) else []
+
+
+def content_bounds(lines, notes, text_boxes):
+    """[min_x, min_y, max_x, max_y] around everything drawn, or None for an empty board."""
+    boxes = [line_bounds(line) for line in lines]
+    for note in notes:
+        x, y = _number(note.get('x'), None), _number(note.get('y'), None)
+        if x is not None and y is not None:
+            width, height = note_size(note)
+            boxes.append([x, y, x + width, y + height])
+    for box in text_boxes:
+        x, y = _number(box.get('x'), None), _number(box.get('y'), None)
+        if x is not None and y is not None:
+            style = box.get('style') if isinstance(box.get('style'), dict) else {}
+            width, height = text_box_size(box, _number(style.get('fontSize'), FONT_SIZE))
+            boxes.append([x, y, x + width, y + height])
+    boxes = [box for box in boxes if box is not None]
+    if not boxes:
+        return None
+    return [min(b[0] for b in boxes) - RENDER_MARGIN, min(b[1] for b in boxes) - RENDER_MARGIN,
+            max(b[2] for b in boxes) + RENDER_MARGIN, max(b[3] for b in boxes) + RENDER_MARGIN]
+
+
+def render_board(board, width=None, height=None, scale=1.0, max_side=EXPORT_MAX_SIDE, level=PNG_COMPRESSION):
+    """PNG of a board's strokes, notes and text boxes; returns (png bytes, width, height).
+
+    With `width` and `height` the content is scaled down to fit that frame
+    and centered (thumbnails). Without, the image is the content's bounding
+    box at `scale`, reduced so neither side exceeds `max_side` (exports).
+    Strokes may be packed (see stroke_codec.py); they are unpacked here so
+    callers can hand over the stored document as it is.
+    """
+    lines = [line for line in unpack_lines(_elements(board, 'data')) if isinstance(line, dict)]
+    notes = _elements(board, 'notes')
+    text_boxes = _elements(board, 'textBoxes')
+    background = parse_color(board.get('background'), (255, 255, 255, 1.0))
+    bounds = content_bounds(lines, notes, text_boxes)
+
+    if width and height:
+        if bounds is None:
+            scale, bounds = 1.0, [0, 0, width, height]
+        else:
+            # Never magnify: a small sketch stays its size in the middle of the card
+            scale = min(width / (bounds[2] - bounds[0]), height / (bounds[3] - bounds[1]), 1.0)
+        offset = ((width - (bounds[2] - bounds[0]) * scale) / 2, (height - (bounds[3] - bounds[1]) * scale) / 2)
+    else:
+        if bounds is None:
+            bounds = [0, 0, EMPTY_SIZE[0] / scale, EMPTY_SIZE[1] / scale]
+        scale = min(scale, max_side / max(bounds[2] - bounds[0], bounds[3] - bounds[1]))
+        width = max(int(math.ceil((bounds[2] - bounds[0]) * scale)), 1)
+        height = max(int(math.ceil((bounds[3] - bounds[1]) * scale)), 1)
+        offset = (0, 0)
+
+    canvas = Canvas(width, height, background, scale, (bounds[0], bounds[1]), offset)
+    for line in lines:
+        canvas.draw_line(line)
+    for note in notes:
+        canvas.draw_note(note)
+    for box in text_boxes:
+        canvas.draw_text_box(box)
+    return encode_png(width, height, canvas.pixels, level), width, height
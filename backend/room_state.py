@@ -0,0 +1,385 @@
+import os
+import time
+from collections import OrderedDict
+
+from bson import ObjectId
+
+from board_cache import board_cache
+from deltas import version_filter
+from elements import STORED_FLAG, board_elements
+from erase import erase_strokes
+from log import get_logger
+from persistence import board_writes
+from stroke_codec import unpack_lines
+from tiles import TileIndex, line_bounds
+
+log = get_logger('room_state')
+
+# Op log entries folded into the snapshot once the tail grows past this size
+ROOM_COMPACT_EVERY = int(os.environ.get('ROOM_COMPACT_EVERY', 200))
+# Seconds between background flushes of dirty rooms to Mongo
+ROOM_FLUSH_INTERVAL = float(os.environ.get('ROOM_FLUSH_INTERVAL', 5))
+# Seconds an empty, flushed room is kept in memory before eviction
+ROOM_IDLE_TTL = float(os.environ.get('ROOM_IDLE_TTL', 60))
+
+ROOM_OPS = ('line', 'erase', 'erased', 'note_added', 'note_updated', 'note_deleted')
+# Attempts at storing the ids given to strokes of a board that is being written concurrently
+ASSIGN_ID_ATTEMPTS = 3
+
+
+def _keyed(elements):
+    keyed = OrderedDict()
+    for element in elements or []:
+        if not isinstance(element, dict):
+            continue
+        if element.get('id') is None:
+            # Strokes drawn before they carried ids; see assign_ids
+            element = dict(element, id=str(ObjectId()))
+        keyed[element['id']] = element
+    return keyed
+
+
+def assign_ids(elements):
+    """Give elements without an id one of their own; returns the new list, or None if all had one."""
+    if not any(isinstance(element, dict) and element.get('id') is None for element in elements):
+        return None
+    return [dict(element, id=str(ObjectId())) if isinstance(element, dict) and element.get('id') is None
+            else element for element in elements]
+
+
+def _modifiable(before, after):
+    # A modify can neither drop keys nor set ones MongoDB would read as paths or operators
+    return not set(before) - set(after) and not any('.' in key or key.startswith('$') for key in after)
+
+
+def element_ops(field, saved, current, modify=False):
+    """Delta ops turning the saved elements of a field ({id: element}) into the current ones.
+
+    Changed elements are removed and added again, or modified in place
+    when `modify` is set and a modify can express the change. Every add
+    follows a remove of the same id, so writing the ops twice, or on top of
+    a board that already got them from another process, stores each element
+    once. Added elements go to the end of the stored list.
+    """
+    ops = [{'op': 'remove', 'field': field, 'id': element_id} for element_id in saved if element_id not in current]
+    for element_id, element in current.items():
+        before = saved.get(element_id)
+        if before is element or before == element:
+            continue
+        if before is not None and modify and _modifiable(before, element):
+            changes = {key: value for key, value in element.items() if key != 'id' and before.get(key) != value}
+            ops.append({'op': 'modify', 'field': field, 'id': element_id, 'changes': changes})
+            continue
+        ops.append({'op': 'remove', 'field': field, 'id': element_id})
+        ops.append({'op': 'add', 'field': field, 'element': element})
+    return ops
+
+
+def _is_stroke_list(data):
+    # Template boards store typed nodes (e.g. "kanban-card") rather than strokes
+    return isinstance(data, list) and not any(
+        isinstance(item, dict) and '-' in str(item.get('type', '')) for item in data
+    )
+
+
+class RoomState:
+    """Authoritative in-memory state of one board room.
+
+    Lines and notes live in a snapshot keyed by element id plus a tail of ops
+    recorded since the last compaction; a joining client receives both and
+    replays the tail, which is always consistent with what peers have seen.
+    The bounds of the current lines are kept in a TileIndex for erasing.
+    The lines and notes last written to the board are kept too, so a flush
+    writes only the elements that changed since.
+    """
+
+    def __init__(self, room, lines=None, notes=None, compact_every=ROOM_COMPACT_EVERY):
+        self.room = room
+        # Rooms seeded from template boards never write strokes back
+        self.track_lines = lines is not None
+        self.lines = _keyed(lines)
+        self.notes = _keyed(notes)
+        self.saved_lines = dict(self.lines)
+        self.saved_notes = dict(self.notes)
+        self._reindex()
+        self.compact_every = compact_every
+        self.seq = 0
+        self.snapshot_seq = 0
+        self.ops = []
+        self.members = set()
+        # False until peers on other processes had a chance to hand over newer state
+        self.synced = False
+        self.dirty = False
+        self.last_active = time.monotonic()
+
+    def apply(self, kind, payload, replicated=False, saved=False):
+        """Record an op; returns it, or None if the payload carries nothing to keep.
+
+        Replicated ops arrive from other processes, which persist them
+        themselves; `saved` ops were already written to the board, e.g. by
+        the element endpoints, so flushes leave them out.
+        """
+        if kind not in ROOM_OPS:
+            raise ValueError(f"Unknown room op: {kind}")
+
+        if kind == 'erase':
+            # Clients send the full surviving line list, so it becomes the snapshot
+            if not isinstance(payload, list):
+                return None
+            self.compact()
+            self.lines = _keyed(payload)
+            self._reindex()
+            self.seq += 1
+            self.snapshot_seq = self.seq
+            self._touch(replicated)
+            return {'seq': self.seq, 'op': kind}
+
+        if kind == 'note_deleted':
+            if payload is None:
+                return None
+        elif kind == 'erased':
+            if not isinstance(payload, dict) or not isinstance(payload.get('removed'), list):
+                return None
+            payload = {'removed': payload['removed'], 'fragments': payload.get('fragments') or {}}
+        elif not isinstance(payload, dict) or payload.get('id') is None:
+            return None
+
+        self.seq += 1
+        op = {'seq': self.seq, 'op': kind, 'data': payload}
+        self.ops.append(op)
+        self._touch(replicated or saved)
+        if saved:
+            self._fold(self.saved_lines, self.saved_notes, op)
+
+        if kind == 'line':
+            self._index_line(payload)
+        elif kind == 'erased':
+            for line_id in payload['removed']:
+                self.line_index.remove(line_id)
+            for pieces in payload['fragments'].values():
+                for piece in pieces:
+                    self._index_line(piece)
+
+        if len(self.ops) >= self.compact_every:
+            self.compact()
+        return op
+
+    def erase_path(self, path, radius):
+        """Erase along an eraser path; returns the recorded op and the bounds it affects.
+
+        Returns (None, None) when nothing was hit or the room does not own
+        its board's strokes.
+        """
+        if not self.track_lines:
+            return None, None
+        # Strokes drawn since the last compaction must be in the snapshot to be hit
+        self.compact()
+        removed, fragments, bounds = erase_strokes(self.lines, self.line_index, path, radius)
+        if not removed:
+            return None, None
+        return self.apply('erased', {'removed': removed, 'fragments': fragments}), bounds
+
+    def compact(self):
+        """Fold the op tail into the snapshot."""
+        for op in self.ops:
+            self._fold(self.lines, self.notes, op)
+        self.ops = []
+        self.snapshot_seq = self.seq
+
+    def join_payload(self):
+        return {
+            'room': self.room,
+            'seq': self.seq,
+            'snapshot': {
+                'seq': self.snapshot_seq,
+                'lines': list(self.lines.values()),
+                'notes': list(self.notes.values()),
+            },
+            'ops': list(self.ops),
+        }
+
+    def materialize(self):
+        """Current lines and notes with the tail applied, without compacting.
+
+        Lines are None for rooms that do not own their board's "data" field.
+        """
+        lines, notes = self._materialized()
+        return (list(lines.values()) if self.track_lines else None), list(notes.values())
+
+    def changes(self):
+        """(delta ops writing what changed since the last save, the state they write) for the flusher.
+
+        Hand the state to mark_saved once the ops have landed.
+        """
+        lines, notes = self._materialized()
+        ops = element_ops('data', self.saved_lines, lines) if self.track_lines else []
+        ops.extend(element_ops('notes', self.saved_notes, notes, modify=True))
+        return ops, (lines, notes)
+
+    def mark_saved(self, saved):
+        lines, notes = saved
+        self.saved_lines = dict(lines)
+        self.saved_notes = dict(notes)
+
+    def replace_from(self, payload, saved=False):
+        """Adopt another process's view of the room (its join payload).
+
+        With `saved`, e.g. after a restore, the board already holds that state.
+        """
+        peer = RoomState(self.room, payload['snapshot']['lines'], payload['snapshot']['notes'])
+        peer.ops = list(payload['ops'])
+        lines, notes = peer._materialized()
+        self.lines = lines
+        self.notes = notes
+        self._reindex()
+        self.ops = []
+        self.seq += 1
+        self.snapshot_seq = self.seq
+        if saved:
+            self.mark_saved((lines, notes))
+
+    def _materialized(self):
+        lines = OrderedDict(self.lines)
+        notes = OrderedDict(self.notes)
+        for op in self.ops:
+            self._fold(lines, notes, op)
+        return lines, notes
+
+    def _reindex(self):
+        self.line_index = TileIndex()
+        if self.track_lines:
+            for line in self.lines.values():
+                self._index_line(line)
+
+    def _index_line(self, line):
+        if not self.track_lines or not isinstance(line, dict) or line.get('id') is None:
+            return
+        bounds = line_bounds(line)
+        if bounds is None:
+            self.line_index.remove(line['id'])
+        else:
+            self.line_index.insert(line['id'], bounds)
+
+    def _touch(self, replicated=False):
+        if not replicated:
+            self.dirty = True
+        self.last_active = time.monotonic()
+
+    @staticmethod
+    def _fold(lines, notes, op):
+        kind, data = op['op'], op['data']
+        if kind == 'line':
+            lines[data['id']] = data
+        elif kind == 'note_added':
+            notes[data['id']] = data
+        elif kind == 'note_updated':
+            notes[data['id']] = dict(notes.get(data['id'], {}), **data)
+        elif kind == 'note_deleted':
+            notes.pop(data, None)
+        elif kind == 'erased':
+            removed = set(data['removed'])
+            fragments = data['fragments']
+            if not fragments:
+                for line_id in removed:
+                    lines.pop(line_id, None)
+                return
+            # Pieces take the place of the stroke they were cut from, keeping the stacking order
+            kept = []
+            for line_id, line in lines.items():
+                if line_id in removed:
+                    kept.extend((piece['id'], piece) for piece in fragments.get(str(line_id), ()))
+                else:
+                    kept.append((line_id, line))
+            lines.clear()
+            lines.update(kept)
+
+
+class RoomRegistry:
+    """Room states of this process, loaded on first join and flushed in the background."""
+
+    def __init__(self):
+        self.rooms = {}
+
+    def get(self, room):
+        return self.rooms.get(room)
+
+    def join(self, room, sid, loader=None):
+        state = self.rooms.get(room)
+        if state is None:
+            lines, notes = loader(room) if loader else ([], [])
+            # Another join may have loaded the room while the loader was waiting on I/O
+            state = self.rooms.setdefault(room, RoomState(room, lines, notes))
+        state.members.add(sid)
+        state.last_active = time.monotonic()
+        return state
+
+    def leave(self, room, sid):
+        state = self.rooms.get(room)
+        if state is not None:
+            state.members.discard(sid)
+            state.last_active = time.monotonic()
+
+    def leave_all(self, sid):
+        for state in self.rooms.values():
+            state.members.discard(sid)
+
+    def flush(self, writer, idle_ttl=ROOM_IDLE_TTL):
+        """Persist what changed in dirty rooms through `writer(room, ops)` and evict idle ones.
+
+        Returns the number of rooms written.
+        """
+        written = 0
+        now = time.monotonic()
+        for room, state in list(self.rooms.items()):
+            if state.dirty:
+                ops, saved = state.changes()
+                state.dirty = False
+                try:
+                    if ops:
+                        writer(room, ops)
+                        written += 1
+                    state.mark_saved(saved)
+                except Exception as e:
+                    state.dirty = True
+                    log.error("Error flushing room", room=room, error=str(e))
+                    continue
+            if not state.members and not state.dirty and now - state.last_active > idle_ttl:
+                self.rooms.pop(room, None)
+        return written
+
+
+def load_room_from_board(collection, room):
+    """Seed a room from its board document; lines are None for template boards.
+
+    Strokes stored without an id are given one, and the ids are stored
+    with the board, so the room's later per-element writes can find them.
+    """
+    if collection is None or not ObjectId.is_valid(room):
+        return [], []
+    for _ in range(ASSIGN_ID_ATTEMPTS):
+        board = collection.find_one({"_id": ObjectId(room)}, {"data": 1, "notes": 1, "version": 1, STORED_FLAG: 1})
+        # Include saves that are still waiting in the write-behind queue
+        board = board_writes.apply_pending(ObjectId(room), board_elements.attach_one(board))
+        if not board:
+            return [], []
+        data = unpack_lines(board.get("data") or [])
+        if not _is_stroke_list(data):
+            return None, (board.get("notes") or [])
+        stored = assign_ids(board.get("data") or [])
+        if stored is None:
+            break
+        if board_writes.flush(ObjectId(room)):
+            # The ids are stored against the written board, not the queued save
+            continue
+        # Only the ids change, so the board keeps its version; a concurrent write makes this read again
+        result = collection.update_one({"_id": board["_id"], "version": version_filter(board.get("version", 0))},
+                                       {"$set": {"data": stored}})
+        if result.matched_count:
+            board_cache.invalidate(room)
+            log.info("Assigned ids to strokes", board=room,
+                     strokes=sum(1 for line in data if isinstance(line, dict) and line.get("id") is None))
+            data = unpack_lines(stored)
+            break
+    else:
+        log.warning("Could not store ids of strokes; erasing them will not be saved", board=room)
+    return data, (board.get("notes") or [])
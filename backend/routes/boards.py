@@ -1,18 +1,79 @@
-from flask import Blueprint, request, jsonify
+import itertools
+import math
+
+from flask import Blueprint, Response, json, request, jsonify, stream_with_context
 from bson import ObjectId
+from pymongo import ReturnDocument
 from datetime import datetime
 from db import boards_collection, whiteboards
-from models import board_to_dict
+from db_pool import DBUnavailable
+from models import (
+    board_to_dict, board_summary_to_dict, whiteboard_summary_to_dict, job_to_dict,
+    BOARD_SUMMARY_PROJECTION, WHITEBOARD_SUMMARY_PROJECTION
+)
+from pagination import ID_SORT, PAGE_SORT, after_id, encode_cursor, parse_limit, with_cursor
+from deltas import DELTA_FIELDS, MAX_DELTA_OPS, DeltaError, validate_ops, version_guard, build_delta_requests
+from elements import ELEMENT_FIELDS, board_elements, element_id_candidates
+from persistence import board_writes
+from history import board_history
+from jobs import job_runner
+from maintenance import DELETE_USER_DATA
+from board_cache import board_cache
+from thumbnails import EXPORT_MAX_SCALE, EXPORT_MIN_SCALE, board_images
+from serialization import dumps_bytes
+from compression import RESPONSE_COMPRESSION_MIN_SIZE, choose_encoding, compress, compress_response
+from stroke_codec import pack_lines
+from simplify import simplify_lines, tolerance_for_zoom
+from tiles import in_viewport, parse_viewport, viewport_filter
+from ratelimit import MAX_BOARD_POINTS, MAX_STROKE_POINTS, WRITE_METHODS, client_address, count_points, rest_limits
+from metrics import HTTP_REQUESTS_REJECTED
+from log import get_logger
 
 # boards = Blueprint("boards", __name__)
 boards = Blueprint('boards', __name__, url_prefix='/api')
+boards.after_request(compress_response)
+
+log = get_logger('boards')
+
+
+def db_unavailable(e):
+    """503 for calls the DB pool timed out, rejected or short-circuited."""
+    log.warning("Database unavailable", path=request.path, error=str(e))
+    response = jsonify({"error": "Database unavailable", "details": str(e)})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(int(math.ceil(e.retry_after)))
+    return response
+
+
+boards.register_error_handler(DBUnavailable, db_unavailable)
+
+
+@boards.before_request
+def limit_writes():
+    """429 for clients writing faster than REST_WRITE_RATE allows."""
+    if request.method not in WRITE_METHODS:
+        return None
+    wait = rest_limits.hit('write', client_address(request))
+    if not wait:
+        return None
+    HTTP_REQUESTS_REJECTED.inc(route=request.url_rule.rule if request.url_rule else 'unmatched',
+                               reason='rate_limited')
+    response = jsonify({"error": "Too many requests", "retryAfter": round(wait, 3)})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(int(math.ceil(wait)))
+    return response
+
+
+def too_many_points(points, limit):
+    HTTP_REQUESTS_REJECTED.inc(route=request.url_rule.rule, reason='too_many_points')
+    return jsonify({"error": "Too many points", "points": points, "maxPoints": limit}), 413
 
 # Create a new board
 @boards.route("/boards", methods=["POST"])
 def create_board():
     try:
         if boards_collection is None:
-            print("⚠️ Database not available - returning mock success")
+            log.warning("Database not available - returning mock success")
             data = request.json
             return jsonify({
                 "id": "mock-board-" + str(hash(data.get('title', 'untitled'))),
@@ -23,9 +84,8 @@ def create_board():
                 "status": "success_mock"
             }), 201
             
-        print(f"Creating board - Request received at {datetime.utcnow()}")
         data = request.json
-        print(f"Board data: {data.get('title', 'Untitled')} - Type: {data.get('type', 'whiteboard')}")
+        log.debug("Creating board", title=data.get('title', 'Untitled'), type=data.get('type', 'whiteboard'))
         
         board = {
             "userId": data["userId"],
@@ -37,21 +97,22 @@ def create_board():
             "isPublic": data.get("isPublic", False),
             "createdAt": datetime.utcnow(),
             "updatedAt": datetime.utcnow(),
-            "data": data.get("data", ""),  # optional board content
+            "data": pack_lines(simplify_lines(data.get("data", ""), tolerance_for_zoom(data.get("zoom", 1)))[0]),  # optional board content
             "notes": data.get("notes", []),  # optional notes
             "textBoxes": data.get("textBoxes", []),  # ✅ Add textBoxes support
+            "version": 0,  # Bumped on every write, checked by delta updates
             "ownerId": data["userId"]  # Add ownerId for compatibility
         }
         
-        print("Inserting board into database...")
-        result = boards_collection.insert_one(board)
-        board["_id"] = result.inserted_id
-        print(f"Board created successfully with ID: {result.inserted_id}")
+        # The id is assigned here so the write can be queued and coalesced
+        board["_id"] = ObjectId()
+        board_writes.enqueue_insert(board)
+        log.info("Board created", board=board['_id'])
         
         return jsonify(board_to_dict(board)), 201
         
     except Exception as e:
-        print(f"Error creating board: {str(e)}")
+        log.error("Error creating board", error=str(e))
         return jsonify({"error": "Failed to create board", "details": str(e)}), 500
 
 # Get all boards for a user
@@ -59,7 +120,7 @@ def create_board():
 def get_boards(userId):
     try:
         if boards_collection is None:
-            print("⚠️ Database not available - returning mock boards")
+            log.warning("Database not available - returning mock boards")
             # Return mock boards so the frontend can function
             mock_boards = [
                 {
@@ -91,14 +152,30 @@ def get_boards(userId):
             ]
             return jsonify(mock_boards)
             
-        print(f"Getting boards for user: {userId}")
-        user_boards = boards_collection.find({"userId": userId})
-        boards_list = [board_to_dict(b) for b in user_boards]
-        print(f"Found {len(boards_list)} boards for user {userId}")
-        return jsonify(boards_list)
+        try:
+            limit = parse_limit(request.args.get("limit"))
+            query = with_cursor({"userId": userId}, request.args.get("cursor"))
+        except ValueError as e:
+            return jsonify({"error": "Invalid pagination parameters", "details": str(e)}), 400
+
+        # Summaries only: board content is fetched per board when it is opened
+        user_boards = list(
+            boards_collection.find(query, BOARD_SUMMARY_PROJECTION).sort(PAGE_SORT).limit(limit + 1)
+        )
+        has_more = len(user_boards) > limit
+        user_boards = board_elements.count_into(user_boards[:limit])
+        boards_list = [board_summary_to_dict(b) for b in user_boards]
+        log.debug("Listed boards", user=userId, count=len(boards_list))
+
+        response = jsonify(boards_list)
+        if has_more:
+            response.headers["X-Next-Cursor"] = encode_cursor(user_boards[-1])
+        return response
         
+    except DBUnavailable as e:
+        return db_unavailable(e)
     except Exception as e:
-        print(f"Error getting boards for user {userId}: {str(e)}")
+        log.error("Error getting boards", user=userId, error=str(e))
         return jsonify({"error": "Failed to get boards", "details": str(e)}), 500
 
 # Delete a board
@@ -108,46 +185,128 @@ def delete_board(boardId):
         if boards_collection is None:
             return jsonify({"error": "Database connection not available"}), 503
             
+        board_writes.discard(ObjectId(boardId))
         boards_collection.delete_one({"_id": ObjectId(boardId)})
+        board_history.forget([ObjectId(boardId)])
+        board_elements.forget([ObjectId(boardId)])
+        board_images.forget([ObjectId(boardId)])
+        board_cache.invalidate(boardId)
         return jsonify({"message": "Deleted"}), 200
         
+    except DBUnavailable as e:
+        return db_unavailable(e)
     except Exception as e:
-        print(f"Error deleting board {boardId}: {str(e)}")
+        log.error("Error deleting board", board=boardId, error=str(e))
         return jsonify({"error": "Failed to delete board", "details": str(e)}), 500
 
-# Delete all user data (for account deletion)
+# Delete all user data (for account deletion). The deletion runs as a
+# background job; poll the returned statusUrl to see it finish
 @boards.route("/user/<userId>/delete-all-data", methods=["DELETE"])
 def delete_user_data(userId):
+    if job_runner.collection() is None:
+        return jsonify({"error": "Job queue not available"}), 503
     try:
-        # Delete all boards owned by the user
-        boards_result = boards_collection.delete_many({"userId": userId})
-        
-        # Delete all whiteboard data for this user
-        whiteboards_result = whiteboards.delete_many({"userId": userId})
-        
-        # You can add more collections here as needed
-        # For example: comments, shared boards, etc.
-        
+        # A repeated request while the deletion runs gets the same job back
+        job = job_runner.enqueue(DELETE_USER_DATA, {"userId": userId}, key=f"{DELETE_USER_DATA}:{userId}")
         return jsonify({
-            "message": "All user data deleted successfully",
-            "deleted_boards": boards_result.deleted_count,
-            "deleted_whiteboards": whiteboards_result.deleted_count
-        }), 200
-        
+            "message": "User data deletion started",
+            "job": job_to_dict(job),
+            "statusUrl": f"/api/jobs/{job['_id']}"
+        }), 202
+
+    except DBUnavailable as e:
+        return db_unavailable(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# Status and progress of a background job
+@boards.route("/jobs/<jobId>", methods=["GET"])
+def get_job(jobId):
+    if not ObjectId.is_valid(jobId):
+        return jsonify({'error': 'Invalid job ID'}), 400
+    if job_runner.collection() is None:
+        return jsonify({"error": "Job queue not available"}), 503
+    try:
+        job = job_runner.get(jobId)
+        if job is None:
+            return jsonify({"error": "Job not found"}), 404
+        return jsonify(job_to_dict(job)), 200
+
+    except DBUnavailable as e:
+        return db_unavailable(e)
+    except Exception as e:
+        log.error("Error getting job", job=jobId, error=str(e))
+        return jsonify({"error": "Failed to get job", "details": str(e)}), 500
+
 # Get saved board
 @boards.route("/boards/<boardId>", methods=["GET"])
 def get_board(boardId):
-    board = boards_collection.find_one({"_id": ObjectId(boardId)})
-    if not board:
-        return jsonify({'error': 'Board not found'}), 404
-    
-    print(f"Retrieved board from DB: {board}")
-    print(f"TextBoxes in DB: {board.get('textBoxes', 'NOT FOUND')}")
-    
-    return jsonify(board_to_dict(board)), 200
+    cached = board_cache.get(boardId)
+    if cached is None:
+        generation = board_cache.generation()
+        board = board_elements.attach_one(boards_collection.find_one({"_id": ObjectId(boardId)}))
+        # Include autosaves that are still waiting in the write-behind queue
+        board = board_writes.apply_pending(ObjectId(boardId), board)
+        if not board:
+            return jsonify({'error': 'Board not found'}), 404
+
+        log.debug("Retrieved board", board=boardId, strokes=len(board.get('data') or []),
+                  text_boxes=len(board.get('textBoxes') or []))
+
+        body = dumps_bytes(board_to_dict(board))
+        cached = board_cache.put(boardId, body, board.get("updatedAt"), generation)
+
+    # Hot boards are compressed once and the compressed copy is cached with them
+    encoding = choose_encoding() if len(cached.body) >= RESPONSE_COMPRESSION_MIN_SIZE else None
+    if encoding is None:
+        response = Response(cached.body, mimetype="application/json")
+        response.set_etag(cached.etag)
+    else:
+        response = Response(board_cache.encoded(boardId, cached, encoding, compress),
+                            mimetype="application/json")
+        response.headers["Content-Encoding"] = encoding
+        response.set_etag(f"{cached.etag}-{encoding}")
+    response.vary.add("Accept-Encoding")
+
+    # Clients revalidate every time; unchanged boards are answered with 304
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+# Get the part of a board inside a viewport rectangle
+@boards.route("/boards/<boardId>/viewport", methods=["GET"])
+def get_board_viewport(boardId):
+    try:
+        rect = parse_viewport(request.args)
+    except ValueError as e:
+        return jsonify({"error": "Invalid viewport", "details": str(e)}), 400
+
+    if boards_collection is None:
+        return jsonify({"error": "Database connection not available"}), 503
+
+    try:
+        board_id = ObjectId(boardId)
+        # Strokes are filtered by their stored bbox inside MongoDB, so off-screen
+        # strokes are neither transferred nor decoded
+        boards_found = list(boards_collection.aggregate([
+            {"$match": {"_id": board_id}},
+            {"$addFields": {"data": viewport_filter("data", rect)}},
+        ]))
+        board_elements.attach(boards_found)
+        board = board_writes.apply_pending(board_id, boards_found[0] if boards_found else None)
+        if not board:
+            return jsonify({'error': 'Board not found'}), 404
+
+        result = board_to_dict(board)
+        for field in ("data", "notes", "textBoxes"):
+            result[field] = in_viewport(result[field], rect)
+        result["viewport"] = rect
+        return jsonify(result), 200
+
+    except DBUnavailable as e:
+        return db_unavailable(e)
+    except Exception as e:
+        log.error("Error getting board viewport", board=boardId, error=str(e))
+        return jsonify({"error": "Failed to get board viewport", "details": str(e)}), 500
 
 # Update a board
 @boards.route("/boards/update", methods=["PUT"])
@@ -160,23 +319,35 @@ def update_board():
     background = data.get('background')  # Background color
     template_type = data.get('templateType')  # Template type
 
-    print(f"Updating board {board_id}")
-    print(f"Received textBoxes: {text_boxes}")
-    print(f"Number of textBoxes: {len(text_boxes) if text_boxes else 0}")
+    log.debug("Updating board", board=board_id, text_boxes=len(text_boxes) if text_boxes else 0)
 
     if not board_id or not ObjectId.is_valid(board_id):
         return jsonify({'error': 'Invalid or missing board ID'}), 400
 
+    points = count_points(new_data)
+    if points > MAX_BOARD_POINTS:
+        return too_many_points(points, MAX_BOARD_POINTS)
+
+    # Saves are queued, so a missing board has to be caught before queueing
+    stored = board_writes.apply_pending(ObjectId(board_id), boards_collection.find_one(
+        {"_id": ObjectId(board_id)}, {"data.id": 1} if new_data is not None else {"_id": 1}))
+    if not stored:
+        return jsonify({'error': 'Board not found'}), 404
+
     update_fields = {}
     if new_data is not None:
-        update_fields["data"] = new_data
+        # Only strokes new in this save are thinned out, at the zoom they were
+        # drawn at; strokes already stored keep the detail they were saved with
+        new_data, points_before, points_after = simplify_lines(
+            new_data, tolerance_for_zoom(data.get('zoom', 1)), keep=stroke_ids(stored))
+        log.debug("Simplified strokes", board=board_id, points_before=points_before, points_after=points_after)
+        update_fields["data"] = pack_lines(new_data)
     if "title" in data:
         update_fields["title"] = data["title"]
     if notes is not None:
         update_fields["notes"] = notes
     if text_boxes is not None:  # ✅ Add textBoxes support
         update_fields["textBoxes"] = text_boxes
-        print(f"Adding textBoxes to update_fields: {text_boxes}")
     if background is not None:
         update_fields["background"] = background
     if template_type is not None:
@@ -185,19 +356,376 @@ def update_board():
     # Always update the updatedAt timestamp
     update_fields["updatedAt"] = datetime.utcnow()
 
-    result = boards_collection.update_one(
-        {"_id": ObjectId(board_id)},
-        {"$set": update_fields}
-    )
-
-    print(f"Database update result - matched: {result.matched_count}, modified: {result.modified_count}")
-    print(f"Update fields sent to DB: {update_fields}")
+    # Queued and coalesced with other saves of this board; written by the flusher
+    board_writes.enqueue(ObjectId(board_id), update_fields, {"version": 1})
+    board_cache.invalidate(board_id)
+    log.debug("Update queued", board=board_id, fields=','.join(update_fields))
 
-    if result.matched_count == 0:
-        return jsonify({'error': 'Board not found'}), 404
-    
     return jsonify({'message': 'Board updated successfully'}), 200
+
+def stroke_ids(board):
+    """Ids of the strokes in a board's "data"."""
+    lines = board.get("data")
+    if not isinstance(lines, list):
+        return set()
+    return {line.get("id") for line in lines if isinstance(line, dict)}
+
+# Apply a batch of element-level changes instead of rewriting whole arrays
+@boards.route("/boards/<boardId>/delta", methods=["PATCH"])
+def apply_board_delta(boardId):
+    data = request.get_json(silent=True) or {}
+    base_version = data.get('version')
+    ops = data.get('ops')
+
+    if not ObjectId.is_valid(boardId):
+        return jsonify({'error': 'Invalid board ID'}), 400
+    if not isinstance(base_version, int) or isinstance(base_version, bool) or base_version < 0:
+        return jsonify({'error': 'Missing or invalid base version'}), 400
+    try:
+        validate_ops(ops)
+    except DeltaError as e:
+        return jsonify({'error': 'Invalid delta', 'details': str(e)}), 400
+    for op in ops:
+        if op["op"] == "add" and op.get("field", "data") == "data":
+            points = count_points([op["element"]])
+            if points > MAX_STROKE_POINTS:
+                return too_many_points(points, MAX_STROKE_POINTS)
+
+    if boards_collection is None:
+        return jsonify({"error": "Database connection not available"}), 503
+
+    try:
+        board_id = ObjectId(boardId)
+        # Queued full saves must land before the version check
+        board_writes.flush(board_id)
+        guard_filter, guard_update = version_guard(board_id, base_version, datetime.utcnow())
+        result = boards_collection.update_one(guard_filter, guard_update)
+
+        if result.matched_count == 0:
+            current = boards_collection.find_one({"_id": board_id}, {"version": 1})
+            if not current:
+                return jsonify({'error': 'Board not found'}), 404
+            return jsonify({
+                'error': 'Version conflict',
+                'version': current.get('version', 0)
+            }), 409
+
+        # Added strokes are simplified and packed the same way as full saves
+        tolerance = tolerance_for_zoom(data.get('zoom', 1))
+        for op in ops:
+            if op["op"] == "add" and op.get("field", "data") == "data":
+                op["element"] = pack_lines(simplify_lines([op["element"]], tolerance)[0])[0]
+
+        next_version = base_version + 1
+        baseline = journal_step(board_history.baseline, boards_collection, board_id, base_version) or []
+        try:
+            write_ops(board_id, next_version, ops)
+        except Exception:
+            # Hand the version back so the client's retry passes the version
+            # check; ops that did land are skipped when the batch is repeated
+            released = boards_collection.update_one({"_id": board_id, "version": next_version},
+                                                    {"$inc": {"version": -1}})
+            log.warning("Released version of failed delta", board=boardId, version=next_version,
+                        released=bool(released.matched_count))
+            raise
+        journal_step(board_history.record_delta, boards_collection, board_id, base_version, ops, baseline)
+        board_images.schedule([board_id])
+        board_elements.changed(boardId, [op for op in ops if op.get("field", "data") in ELEMENT_FIELDS])
+
+        return jsonify({
+            'message': 'Board delta applied',
+            'version': next_version,
+            'applied': len(ops)
+        }), 200
+
+    except DBUnavailable as e:
+        return db_unavailable(e)
+    except Exception as e:
+        log.error("Error applying board delta", board=boardId, error=str(e))
+        return jsonify({"error": "Failed to apply board delta", "details": str(e)}), 500
     
+def write_ops(board_id, next_version, ops):
+    """Write validated ops claimed as `next_version` (None writes them whatever the board's version).
+
+    Ops on notes and text boxes of boards that store them apart write one
+    element document each; the rest update the board document.
+    """
+    stored = False
+    if any(op.get("field", "data") in ELEMENT_FIELDS for op in ops):
+        stored = board_elements.ensure_stored(boards_collection, board_id)
+    element_ops = [op for op in ops if stored and op.get("field", "data") in ELEMENT_FIELDS]
+    board_ops = [op for op in ops if not (stored and op.get("field", "data") in ELEMENT_FIELDS)]
+    try:
+        if board_ops:
+            boards_collection.bulk_write(build_delta_requests(board_id, next_version, board_ops), ordered=True)
+        board_elements.apply_ops(board_id, element_ops)
+    finally:
+        board_cache.invalidate(str(board_id))
+
+def commit_ops(board_id, ops):
+    """Write ops as the next version of a board, without checking the version they were made against.
+
+    Only for ops that each touch a single element, which never conflict
+    with concurrent writes to other elements. Returns the new version, or
+    None when the board does not exist.
+    """
+    board = boards_collection.find_one_and_update(
+        {"_id": board_id}, {"$inc": {"version": 1}, "$set": {"updatedAt": datetime.utcnow()}},
+        projection={"version": 1}, return_document=ReturnDocument.AFTER
+    )
+    if board is None:
+        return None
+    version = board["version"]
+    baseline = journal_step(board_history.baseline, boards_collection, board_id, version - 1) or []
+    for start in range(0, len(ops), MAX_DELTA_OPS):
+        write_ops(board_id, None, ops[start:start + MAX_DELTA_OPS])
+    journal_step(board_history.record_delta, boards_collection, board_id, version - 1, ops, baseline)
+    board_images.schedule([board_id])
+    return version
+
+def find_element_id(board_id, field, raw, stored):
+    """The stored id of a board's note or text box from its URL form, or None."""
+    candidates = element_id_candidates(raw)
+    if stored:
+        return board_elements.find_id(board_id, field, candidates)
+    board = boards_collection.find_one({"_id": board_id, f"{field}.id": {"$in": candidates}}, {f"{field}.$": 1})
+    return board[field][0]["id"] if board else None
+
+def apply_element_op(boardId, op, status=200):
+    """Apply one op on a note or text box as a new board version, writing only that element."""
+    if not ObjectId.is_valid(boardId):
+        return jsonify({'error': 'Invalid board ID'}), 400
+    if op["field"] not in ELEMENT_FIELDS:
+        return jsonify({'error': 'Unknown element field', 'fields': list(ELEMENT_FIELDS)}), 404
+    try:
+        validate_ops([op])
+    except DeltaError as e:
+        return jsonify({'error': 'Invalid element change', 'details': str(e)}), 400
+    if boards_collection is None:
+        return jsonify({"error": "Database connection not available"}), 503
+
+    try:
+        board_id = ObjectId(boardId)
+        # Queued full saves land first, so they cannot overwrite this change afterwards
+        board_writes.flush(board_id)
+        stored = board_elements.ensure_stored(boards_collection, board_id)
+        if stored is None:
+            return jsonify({'error': 'Board not found'}), 404
+        if op["op"] == "add":
+            if find_element_id(board_id, op["field"], str(op["element"]["id"]), stored) is not None:
+                return jsonify({'error': 'Element already exists', 'id': op["element"]["id"]}), 409
+        else:
+            op["id"] = find_element_id(board_id, op["field"], op["id"], stored)
+            if op["id"] is None:
+                return jsonify({'error': 'Element not found'}), 404
+
+        # Single-element changes never conflict with each other, so they take the next version unconditionally
+        version = commit_ops(board_id, [op])
+        if version is None:
+            return jsonify({'error': 'Board not found'}), 404
+        board_elements.changed(boardId, [op])
+
+        messages = {"add": "Board element added", "modify": "Board element updated", "remove": "Board element deleted"}
+        result = {'message': messages[op["op"]], 'version': version, 'field': op["field"],
+                  'id': op["element"]["id"] if op["op"] == "add" else op["id"]}
+        if op["op"] == "add":
+            result["element"] = op["element"]
+        return jsonify(result), status
+
+    except DBUnavailable as e:
+        return db_unavailable(e)
+    except Exception as e:
+        log.error("Error updating board element", board=boardId, field=op["field"], error=str(e))
+        return jsonify({"error": "Failed to update board element", "details": str(e)}), 500
+
+# Add one note or text box
+@boards.route("/boards/<boardId>/elements/<field>", methods=["POST"])
+def add_board_element(boardId, field):
+    data = request.get_json(silent=True) or {}
+    return apply_element_op(boardId, {"op": "add", "field": field, "element": data.get("element")}, 201)
+
+# Change some keys of one note or text box
+@boards.route("/boards/<boardId>/elements/<field>/<elementId>", methods=["PATCH"])
+def update_board_element(boardId, field, elementId):
+    data = request.get_json(silent=True) or {}
+    return apply_element_op(boardId, {"op": "modify", "field": field, "id": elementId, "changes": data.get("changes")})
+
+# Delete one note or text box
+@boards.route("/boards/<boardId>/elements/<field>/<elementId>", methods=["DELETE"])
+def delete_board_element(boardId, field, elementId):
+    return apply_element_op(boardId, {"op": "remove", "field": field, "id": elementId})
+
+def journal_step(step, *args):
+    """Run a history step; journaling failures never fail the write itself."""
+    try:
+        return step(*args)
+    except DBUnavailable:
+        raise
+    except Exception as e:
+        log.error("Failed to journal board history", step=step.__name__, error=str(e))
+        return None
+
+# List the journaled versions of a board, newest first
+@boards.route("/boards/<boardId>/history", methods=["GET"])
+def get_board_history(boardId):
+    if not ObjectId.is_valid(boardId):
+        return jsonify({'error': 'Invalid board ID'}), 400
+    if board_history.collection() is None:
+        return jsonify({"error": "Board history not available"}), 503
+    try:
+        limit = parse_limit(request.args.get("limit"))
+        before = request.args.get("cursor")
+        before = int(before) if before is not None else None
+    except ValueError as e:
+        return jsonify({"error": "Invalid pagination parameters", "details": str(e)}), 400
+
+    try:
+        board_writes.flush(ObjectId(boardId))
+        versions = board_history.entries(ObjectId(boardId), limit + 1, before)
+        next_cursor = str(versions[limit - 1]["version"]) if len(versions) > limit else None
+        return jsonify({"versions": versions[:limit], "nextCursor": next_cursor}), 200
+
+    except DBUnavailable as e:
+        return db_unavailable(e)
+    except Exception as e:
+        log.error("Error getting board history", board=boardId, error=str(e))
+        return jsonify({"error": "Failed to get board history", "details": str(e)}), 500
+
+def board_version(board_id, version):
+    """(current board, its content at `version`); the content is None when the journal cannot rebuild it."""
+    board_writes.flush(board_id)
+    board = boards_collection.find_one({"_id": board_id}, {"userId": 1, "title": 1, "version": 1, "createdAt": 1})
+    if not board or version > board.get("version", 0):
+        return board, None
+    return board, board_history.board_at(board_id, version)
+
+# Rebuild a board as it was at an earlier version
+@boards.route("/boards/<boardId>/versions/<int:version>", methods=["GET"])
+def get_board_version(boardId, version):
+    if not ObjectId.is_valid(boardId):
+        return jsonify({'error': 'Invalid board ID'}), 400
+    if boards_collection is None or board_history.collection() is None:
+        return jsonify({"error": "Board history not available"}), 503
+
+    try:
+        board, state = board_version(ObjectId(boardId), version)
+        if not board:
+            return jsonify({'error': 'Board not found'}), 404
+        if state is None:
+            return jsonify({'error': 'Version not available', 'version': board.get("version", 0)}), 404
+        return jsonify(board_to_dict(dict(board, **state, version=version))), 200
+
+    except DBUnavailable as e:
+        return db_unavailable(e)
+    except Exception as e:
+        log.error("Error getting board version", board=boardId, version=version, error=str(e))
+        return jsonify({"error": "Failed to get board version", "details": str(e)}), 500
+
+# Restore a board to an earlier version; the restore is itself a new version
+@boards.route("/boards/<boardId>/restore", methods=["POST"])
+def restore_board_version(boardId):
+    data = request.get_json(silent=True) or {}
+    version = data.get('version')
+    if not ObjectId.is_valid(boardId):
+        return jsonify({'error': 'Invalid board ID'}), 400
+    if not isinstance(version, int) or isinstance(version, bool) or version < 0:
+        return jsonify({'error': 'Missing or invalid version'}), 400
+    if boards_collection is None or board_history.collection() is None:
+        return jsonify({"error": "Board history not available"}), 503
+
+    try:
+        board_id = ObjectId(boardId)
+        board, state = board_version(board_id, version)
+        if not board:
+            return jsonify({'error': 'Board not found'}), 404
+        if state is None:
+            return jsonify({'error': 'Version not available', 'version': board.get("version", 0)}), 404
+
+        # Element lists the old version did not have yet are emptied, not kept
+        state = dict({field: [] for field in DELTA_FIELDS}, **state)
+        board_writes.enqueue(board_id, dict(state, updatedAt=datetime.utcnow()), {"version": 1})
+        board_cache.invalidate(boardId)
+        if board_history.on_restore is not None:
+            # Live rooms on this board are reset to the restored content
+            board_history.on_restore(boardId, state)
+        log.info("Board restored", board=boardId, version=version)
+        return jsonify({
+            'message': 'Board restored',
+            'restoredVersion': version,
+            'version': board.get("version", 0) + 1
+        }), 200
+
+    except DBUnavailable as e:
+        return db_unavailable(e)
+    except Exception as e:
+        log.error("Error restoring board", board=boardId, version=version, error=str(e))
+        return jsonify({"error": "Failed to restore board", "details": str(e)}), 500
+
+def image_response(png, etag, filename=None):
+    response = Response(png, mimetype="image/png")
+    response.set_etag(etag)
+    # Clients revalidate every time; an unchanged board is answered with 304
+    response.cache_control.no_cache = True
+    if filename is not None:
+        response.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response.make_conditional(request)
+
+def render_timed_out(boardId):
+    log.warning("Board render timed out", board=boardId)
+    response = jsonify({"error": "Rendering the board timed out"})
+    response.status_code = 503
+    response.headers["Retry-After"] = "5"
+    return response
+
+# Small PNG of a board for dashboard cards; `v` asks for at least that board version
+@boards.route("/boards/<boardId>/thumbnail", methods=["GET"])
+def get_board_thumbnail(boardId):
+    if not ObjectId.is_valid(boardId):
+        return jsonify({'error': 'Invalid board ID'}), 400
+    if boards_collection is None:
+        return jsonify({"error": "Database connection not available"}), 503
+
+    try:
+        thumbnail = board_images.thumbnail(ObjectId(boardId), request.args.get("v", type=int))
+        if thumbnail is None:
+            return jsonify({'error': 'Board not found'}), 404
+        return image_response(thumbnail["png"], f"{boardId}-{thumbnail['version']}")
+
+    except DBUnavailable as e:
+        return db_unavailable(e)
+    except TimeoutError:
+        return render_timed_out(boardId)
+    except Exception as e:
+        log.error("Error rendering board thumbnail", board=boardId, error=str(e))
+        return jsonify({"error": "Failed to render board thumbnail", "details": str(e)}), 500
+
+# The whole board as a PNG at `scale` (default 1)
+@boards.route("/boards/<boardId>/export.png", methods=["GET"])
+def export_board_image(boardId):
+    if not ObjectId.is_valid(boardId):
+        return jsonify({'error': 'Invalid board ID'}), 400
+    scale = request.args.get("scale", 1.0, type=float)
+    if not EXPORT_MIN_SCALE <= scale <= EXPORT_MAX_SCALE:
+        return jsonify({'error': 'Invalid scale', 'min': EXPORT_MIN_SCALE, 'max': EXPORT_MAX_SCALE}), 400
+    if boards_collection is None:
+        return jsonify({"error": "Database connection not available"}), 503
+
+    try:
+        exported = board_images.export(ObjectId(boardId), scale)
+        if exported is None:
+            return jsonify({'error': 'Board not found'}), 404
+        version, png = exported
+        filename = f"board-{boardId}.png" if request.args.get("download") else None
+        return image_response(png, f"{boardId}-{version}-{scale:g}", filename)
+
+    except DBUnavailable as e:
+        return db_unavailable(e)
+    except TimeoutError:
+        return render_timed_out(boardId)
+    except Exception as e:
+        log.error("Error exporting board image", board=boardId, error=str(e))
+        return jsonify({"error": "Failed to export board image", "details": str(e)}), 500
+
 @boards.route('/save-shared-board', methods=['POST'])
 def save_shared_board():
     data = request.get_json()
@@ -225,18 +753,53 @@ def save_shared_board():
     
 @boards.route('/whiteboards/<user_id>', methods=['GET'])
 def get_whiteboards(user_id):
-    owned = list(whiteboards.find({"owner": user_id}))
-    shared = list(whiteboards.find({"sharedWith": {"$in": [user_id]}}))
-    all_boards = owned + shared
-    for board in all_boards:
-        board['_id'] = str(board['_id'])
-    return jsonify(all_boards)
+    if whiteboards is None:
+        return jsonify({"error": "Database connection not available"}), 503
+
+    try:
+        limit = parse_limit(request.args.get("limit"))
+        # A board that is both owned and shared matches once, so no duplicates
+        query = after_id({"$or": [{"owner": user_id}, {"sharedWith": user_id}]},
+                         request.args.get("cursor"))
+    except ValueError as e:
+        return jsonify({"error": "Invalid pagination parameters", "details": str(e)}), 400
+
+    cursor = whiteboards.find(query, WHITEBOARD_SUMMARY_PROJECTION).sort(ID_SORT).limit(limit + 1)
+    # Read the first document before the response starts, so an unavailable
+    # database is still answered with a 503 rather than a truncated body
+    documents = iter(cursor)
+    first = next(documents, None)
+
+    def generate():
+        # Documents are written out as the cursor yields them; the next-page
+        # cursor goes last since it is only known once the page has been read
+        yield '{"whiteboards": ['
+        next_cursor = None
+        last_id = None
+        sent = 0
+        try:
+            for board in itertools.chain([first] if first is not None else [], documents):
+                if sent == limit:
+                    # The extra document only signals that another page exists
+                    next_cursor = str(last_id)
+                    break
+                if sent:
+                    yield ","
+                yield json.dumps(whiteboard_summary_to_dict(board, user_id))
+                last_id = board["_id"]
+                sent += 1
+        finally:
+            cursor.close()
+        yield '], "nextCursor": ' + json.dumps(next_cursor) + "}"
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
 
 # POST new board
 @boards.route('/whiteboards', methods=['POST'])
 def save_whiteboard():
     data = request.json
-    whiteboards.insert_one({
+    board_writes.enqueue_insert({
+        "_id": ObjectId(),
         "owner": data["owner"],
         "name": data["name"],
         "data": data["canvasData"],
@@ -252,6 +815,7 @@ def share_board(board_id):
         {"_id": ObjectId(board_id)},
         {"$addToSet": {"sharedWith": data["userIdToShare"]}}  # avoid duplicates
     )
+    board_cache.invalidate(board_id)
     if result.modified_count:
         return jsonify({"message": "Board shared successfully"})
     return jsonify({"message": "Board not found or already shared"}), 404
\ No newline at end of file
@@ -0,0 +1,96 @@
+import base64
+import copy
+import os
+
+import socketio
+from socketio.packet import Packet
+
+from log import get_logger
+
+log = get_logger('scaling')
+
+# Message queue shared by all Socket.IO processes: redis://..., amqp://... or
+# local:// for an in-process stand-in; unset runs a single process on its own
+SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE', '')
+SOCKETIO_CHANNEL = os.environ.get('SOCKETIO_CHANNEL', 'flask-socketio')
+# Seconds a process waits for peers to hand over a room it is loading
+ROOM_SYNC_TIMEOUT = float(os.environ.get('ROOM_SYNC_TIMEOUT', 0.25))
+
+# Internal room no client joins; emits to it only travel between processes
+ROOM_SYNC_CHANNEL = '__room_state__'
+ROOM_SYNC_REQUEST = '__room_sync_request__'
+ROOM_SYNC_REPLY = '__room_sync_reply__'
+
+
+class RoomSyncMixin:
+    """Hands emits published by other processes to `on_remote_emit`.
+
+    Room broadcasts already travel through the queue to reach clients on
+    other processes; peeking at them lets every process keep its copy of the
+    room state current without a second replication channel.
+    """
+
+    on_remote_emit = None
+
+    def _handle_emit(self, message):
+        if self.on_remote_emit is not None and message.get('host_id') != self.host_id:
+            try:
+                self.on_remote_emit(message.get('event'), _message_data(message))
+            except Exception as e:
+                log.error("Error applying remote room event", event=message.get('event'), error=str(e))
+        return super()._handle_emit(message)
+
+
+def _message_data(message):
+    data = message.get('data')
+    if 'binary' not in message:
+        # Older python-socketio publishes the payload unwrapped
+        return data
+    if message['binary']:
+        attachments = [base64.b64decode(a) for a in data[1:]]
+        data = Packet.reconstruct_binary(data[0], attachments)
+    if isinstance(data, list) and len(data) == 1:
+        return data[0]
+    return data
+
+
+class LocalPubSubManager(RoomSyncMixin, socketio.PubSubManager):
+    """In-process message queue for tests and single-machine development.
+
+    Every manager created with the same channel in this process shares one
+    broker, so several SocketIO servers can exercise the multi-process paths
+    without Redis.
+    """
+
+    name = 'local'
+    brokers = {}
+
+    def _publish(self, data):
+        # Copy like a real queue would serialize, so hosts never share payloads
+        for queue in self.brokers.get(self.channel, []):
+            queue.put(copy.deepcopy(data))
+
+    def _listen(self):
+        queue = self.server.eio.create_queue()
+        self.brokers.setdefault(self.channel, []).append(queue)
+        while True:
+            yield queue.get()
+
+
+class RoomSyncRedisManager(RoomSyncMixin, socketio.RedisManager):
+    pass
+
+
+class RoomSyncKombuManager(RoomSyncMixin, socketio.KombuManager):
+    pass
+
+
+def create_client_manager(url=SOCKETIO_MESSAGE_QUEUE, channel=SOCKETIO_CHANNEL):
+    """Client manager for the configured queue, or None for a single process."""
+    if not url:
+        return None
+    if url.startswith('local://'):
+        return LocalPubSubManager(channel=channel)
+    if url.startswith(('redis://', 'rediss://')):
+        return RoomSyncRedisManager(url, channel=channel)
+    return RoomSyncKombuManager(url, channel=channel)
@@ -0,0 +1,106 @@
+import json
+import os
+from datetime import date, datetime, timezone
+
+from bson import ObjectId
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - exercised when orjson is not installed
+    orjson = None
+
+# "orjson" (default when installed) or "stdlib"
+JSON_BACKEND = os.environ.get('JSON_BACKEND', 'orjson' if orjson is not None else 'stdlib')
+
+
+def _naive_utc(value):
+    # Timestamps are stored with datetime.utcnow(), so naive values are UTC
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def _default(obj):
+    """Types orjson/json do not encode on their own."""
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, datetime):
+        return _naive_utc(obj).isoformat()
+    if isinstance(obj, date):
+        return obj.isoformat()
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class OrjsonBackend:
+    name = 'orjson'
+
+    @staticmethod
+    def dumps_bytes(obj):
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS)
+
+    @staticmethod
+    def loads(data):
+        return orjson.loads(data)
+
+
+class StdlibBackend:
+    name = 'stdlib'
+
+    @staticmethod
+    def dumps_bytes(obj):
+        return json.dumps(obj, default=_default, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+    @staticmethod
+    def loads(data):
+        return json.loads(data)
+
+
+def _backend(name=JSON_BACKEND):
+    if name == 'orjson' and orjson is not None:
+        return OrjsonBackend
+    return StdlibBackend
+
+
+backend = _backend()
+
+
+def dumps_bytes(obj):
+    """UTF-8 JSON for `obj`; ObjectIds become strings and datetimes ISO 8601 UTC."""
+    return backend.dumps_bytes(obj)
+
+
+def dumps(obj, **kwargs):
+    # Formatting options (indent, separators, ...) from callers are ignored on purpose
+    return backend.dumps_bytes(obj).decode('utf-8')
+
+
+def loads(data, **kwargs):
+    return backend.loads(data)
+
+
+class FastJSONProvider(JSONProvider):
+    """Flask JSON provider backed by `dumps_bytes`.
+
+    Responses are built from the encoded bytes directly instead of going
+    through an intermediate str.
+    """
+
+    mimetype = 'application/json'
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj)
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj), mimetype=self.mimetype)
+
+
+class SocketIOJSON:
+    """The `json` module stand-in python-socketio and engine.io encode packets with."""
+
+    dumps = staticmethod(dumps)
+    loads = staticmethod(loads)
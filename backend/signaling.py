@@ -0,0 +1,165 @@
+import os
+import time
+
+from log import get_logger
+
+log = get_logger('signaling')
+
+# Seconds ICE candidates for one peer pair are collected before they are sent as one message; 0 sends at once
+SIGNALING_BATCH_WINDOW = float(os.environ.get('SIGNALING_BATCH_WINDOW', 0.05))
+# Candidates accepted per peer pair and negotiation; more are dropped
+SIGNALING_MAX_CANDIDATES = int(os.environ.get('SIGNALING_MAX_CANDIDATES', 100))
+
+
+class VoiceRooms:
+    """Which connections are in which voice room.
+
+    Offers, answers and candidates are only relayed between members of the
+    same room, and a joiner is sent the current members in one message.
+    """
+
+    def __init__(self):
+        self.members = {}
+        self.rooms_of = {}
+
+    def join(self, room, sid):
+        """Add `sid` to `room`; returns the members that were already there."""
+        members = self.members.setdefault(room, set())
+        peers = sorted(members - {sid})
+        members.add(sid)
+        self.rooms_of.setdefault(sid, set()).add(room)
+        return peers
+
+    def leave(self, room, sid):
+        """Remove `sid` from `room`; returns whether it was a member."""
+        members = self.members.get(room)
+        if members is None or sid not in members:
+            return False
+        members.discard(sid)
+        if not members:
+            del self.members[room]
+        rooms = self.rooms_of.get(sid)
+        if rooms is not None:
+            rooms.discard(room)
+            if not rooms:
+                del self.rooms_of[sid]
+        return True
+
+    def leave_all(self, sid):
+        """Remove a disconnected `sid` everywhere; returns the rooms it was in."""
+        rooms = sorted(self.rooms_of.get(sid, ()))
+        for room in rooms:
+            self.leave(room, sid)
+        return rooms
+
+    def shared(self, room, sid, target):
+        members = self.members.get(room)
+        return members is not None and sid in members and target in members and sid != target
+
+
+def candidate_key(candidate):
+    """Identity of an ICE candidate; the same candidate sent twice has the same key."""
+    if isinstance(candidate, dict):
+        return (candidate.get('candidate'), candidate.get('sdpMid'), candidate.get('sdpMLineIndex'))
+    return candidate if isinstance(candidate, str) else None
+
+
+class CandidateRelay:
+    """Collects ICE candidates per (sender, target) and sends each pair's batch as one message.
+
+    Trickle ICE produces several candidates per peer within milliseconds of
+    an offer or answer, and with N peers every join produces O(N^2) of them.
+    Candidates queued within `window` seconds of a pair's first pending one
+    are sent together, and candidates the target was already sent in the
+    current negotiation are dropped.
+    """
+
+    def __init__(self, send, window=SIGNALING_BATCH_WINDOW, max_candidates=SIGNALING_MAX_CANDIDATES,
+                 clock=time.monotonic):
+        # send(sender sid, target sid, room, candidates)
+        self.send = send
+        self.window = window
+        self.max_candidates = max_candidates
+        self.clock = clock
+        # (sender, target) -> [room, candidates, first queued]
+        self.pending = {}
+        # (sender, target) -> candidate keys relayed in the current negotiation
+        self.seen = {}
+        self.metrics = {
+            "candidates_in": 0,
+            "duplicates": 0,
+            "dropped": 0,
+            "batches_sent": 0,
+            "candidates_sent": 0,
+        }
+
+    def queue(self, sender, target, room, candidates):
+        """Queue candidates from `sender` for `target`; returns how many were new."""
+        pair = (sender, target)
+        seen = self.seen.setdefault(pair, set())
+        batch = self.pending.get(pair)
+        added = 0
+        for candidate in candidates:
+            self.metrics["candidates_in"] += 1
+            key = candidate_key(candidate)
+            if key is None or key in seen:
+                self.metrics["duplicates"] += 1
+                continue
+            if len(seen) >= self.max_candidates:
+                self.metrics["dropped"] += 1
+                continue
+            seen.add(key)
+            if batch is None or batch[0] != room:
+                if batch is not None:
+                    self.flush_pair(sender, target)
+                batch = self.pending[pair] = [room, [], self.clock()]
+            batch[1].append(candidate)
+            added += 1
+        if added and self.window <= 0:
+            self.flush_pair(sender, target)
+        return added
+
+    def flush_pair(self, sender, target):
+        """Send a pair's pending candidates now, e.g. ahead of an offer that must follow them."""
+        batch = self.pending.pop((sender, target), None)
+        if batch is not None:
+            self._send(sender, target, batch)
+
+    def restart(self, sender, target):
+        """A new offer starts a new negotiation, in which earlier candidates may be sent again."""
+        self.flush_pair(sender, target)
+        self.seen.pop((sender, target), None)
+
+    def forget(self, sid, peers=None):
+        """Drop pending and seen candidates between `sid` and `peers` (every peer when None)."""
+        for pairs in (self.pending, self.seen):
+            for pair in [pair for pair in pairs if sid in pair]:
+                if peers is None or pair[0] in peers or pair[1] in peers:
+                    del pairs[pair]
+
+    def tick(self):
+        """Send every batch whose window has passed; returns batches sent."""
+        now = self.clock()
+        due = [pair for pair, batch in self.pending.items() if now - batch[2] >= self.window]
+        for pair in due:
+            self._send(pair[0], pair[1], self.pending.pop(pair))
+        return len(due)
+
+    def run_forever(self, sleep):
+        interval = max(self.window / 2, 0.01)
+        while True:
+            try:
+                self.tick()
+            except Exception as e:
+                log.exception("Error sending ICE candidate batches", error=str(e))
+            sleep(interval)
+
+    def stats(self):
+        return dict(self.metrics, pending_pairs=len(self.pending), tracked_pairs=len(self.seen),
+                    window_s=self.window)
+
+    def _send(self, sender, target, batch):
+        room, candidates, _ = batch
+        self.metrics["batches_sent"] += 1
+        self.metrics["candidates_sent"] += len(candidates)
+        self.send(sender, target, room, candidates)
@@ -0,0 +1,202 @@
+import os
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - exercised when numpy is not installed
+    np = None
+
+from board_cache import board_cache
+from deltas import version_filter
+from stroke_codec import pack_lines, unpack_lines
+
+# Max deviation in canvas pixels at zoom 1; 0 turns simplification off
+STROKE_SIMPLIFY_TOLERANCE = float(os.environ.get('STROKE_SIMPLIFY_TOLERANCE', 0.5))
+# Spans of a stroke with at least this many points are measured with numpy; shorter ones are cheaper in plain Python
+VECTORIZE_MIN_POINTS = 64
+
+
+def tolerance_for_zoom(zoom, base=STROKE_SIMPLIFY_TOLERANCE):
+    """Screen-space tolerance mapped to canvas units for the zoom a stroke was drawn at."""
+    try:
+        zoom = float(zoom)
+    except (TypeError, ValueError):
+        zoom = 1.0
+    if not zoom > 0:
+        zoom = 1.0
+    return base / zoom
+
+
+def radial_distance(points, tolerance):
+    """Drop consecutive points closer than `tolerance` to the last kept point."""
+    count = len(points) // 2
+    if count < 3 or tolerance <= 0:
+        return list(points)
+
+    sq_tolerance = tolerance * tolerance
+    kept = [points[0], points[1]]
+    px, py = points[0], points[1]
+    for i in range(2, count * 2 - 2, 2):
+        x, y = points[i], points[i + 1]
+        dx, dy = x - px, y - py
+        if dx * dx + dy * dy > sq_tolerance:
+            kept.append(x)
+            kept.append(y)
+            px, py = x, y
+    # The end point is always kept so strokes never get shorter
+    kept.append(points[-2])
+    kept.append(points[-1])
+    return kept
+
+
+def _farthest(points, first, last):
+    """Squared distance and index of the point between `first` and `last` farthest from their chord."""
+    ax, ay = points[2 * first], points[2 * first + 1]
+    bx, by = points[2 * last], points[2 * last + 1]
+    dx, dy = bx - ax, by - ay
+    seg_sq = dx * dx + dy * dy
+
+    max_sq = -1.0
+    index = first
+    for i in range(first + 1, last):
+        x, y = points[2 * i], points[2 * i + 1]
+        if seg_sq == 0:
+            ex, ey = x - ax, y - ay
+        else:
+            t = ((x - ax) * dx + (y - ay) * dy) / seg_sq
+            t = 0.0 if t < 0 else 1.0 if t > 1 else t
+            ex, ey = x - (ax + t * dx), y - (ay + t * dy)
+        sq = ex * ex + ey * ey
+        if sq > max_sq:
+            max_sq = sq
+            index = i
+    return max_sq, index
+
+
+def _farthest_numpy(xy, first, last):
+    # The same arithmetic as _farthest over a whole span at once, so both pick the same point
+    ax, ay = xy[first]
+    dx, dy = xy[last] - xy[first]
+    seg_sq = dx * dx + dy * dy
+
+    xs, ys = xy[first + 1:last, 0], xy[first + 1:last, 1]
+    if seg_sq == 0:
+        ex, ey = xs - ax, ys - ay
+    else:
+        t = np.clip(((xs - ax) * dx + (ys - ay) * dy) / seg_sq, 0.0, 1.0)
+        ex, ey = xs - (ax + t * dx), ys - (ay + t * dy)
+    sq = ex * ex + ey * ey
+    offset = int(sq.argmax())
+    return float(sq[offset]), first + 1 + offset
+
+
+def douglas_peucker(points, tolerance):
+    """Ramer-Douglas-Peucker on a flat [x0, y0, x1, y1, ...] list.
+
+    Iterative with an explicit stack so long strokes don't hit the recursion
+    limit; distances are compared squared to avoid square roots. Spans of
+    at least VECTORIZE_MIN_POINTS points are measured with numpy.
+    """
+    count = len(points) // 2
+    if count < 3 or tolerance <= 0:
+        return list(points)
+
+    sq_tolerance = tolerance * tolerance
+    xy = None
+    if np is not None and count >= VECTORIZE_MIN_POINTS:
+        xy = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    keep = bytearray(count)
+    keep[0] = keep[count - 1] = 1
+    stack = [(0, count - 1)]
+
+    while stack:
+        first, last = stack.pop()
+        if xy is not None and last - first >= VECTORIZE_MIN_POINTS:
+            max_sq, index = _farthest_numpy(xy, first, last)
+        else:
+            max_sq, index = _farthest(points, first, last)
+
+        if max_sq > sq_tolerance:
+            keep[index] = 1
+            if index - first > 1:
+                stack.append((first, index))
+            if last - index > 1:
+                stack.append((index, last))
+
+    simplified = []
+    for i in range(count):
+        if keep[i]:
+            simplified.append(points[2 * i])
+            simplified.append(points[2 * i + 1])
+    return simplified
+
+
+def simplify_points(points, tolerance):
+    # The cheap radial pass thins dense pointer samples before the costlier RDP pass
+    return douglas_peucker(radial_distance(points, tolerance), tolerance)
+
+
+def _is_simplifiable(line):
+    points = line.get('points') if isinstance(line, dict) else None
+    return isinstance(points, list) and len(points) > 4 and all(
+        isinstance(p, (int, float)) and not isinstance(p, bool) for p in points
+    )
+
+
+def simplify_lines(data, tolerance=STROKE_SIMPLIFY_TOLERANCE, keep=None):
+    """Simplify every freehand stroke of a board's data.
+
+    Strokes whose id is in `keep` are passed through as-is. Returns
+    (data, points_before, points_after); anything that is not a plain
+    stroke list (template data, legacy strings) is returned untouched.
+    """
+    if not isinstance(data, list) or tolerance <= 0:
+        return data, 0, 0
+
+    before = after = 0
+    simplified = []
+    for line in data:
+        if not _is_simplifiable(line) or (keep and line.get('id') in keep):
+            simplified.append(line)
+            continue
+        points = simplify_points(line['points'], tolerance)
+        before += len(line['points']) // 2
+        after += len(points) // 2
+        simplified.append(dict(line, points=points) if len(points) != len(line['points']) else line)
+    return simplified, before, after
+
+
+def compact_board_strokes(collection, query=None, tolerance=STROKE_SIMPLIFY_TOLERANCE, batch_size=100):
+    """Offline pass that simplifies the stored strokes of existing boards.
+
+    Only boards whose point count actually drops are rewritten, and only if
+    nobody saved them in the meantime. Returns a report with per-board and
+    total points before/after.
+    """
+    report = {
+        "boards_scanned": 0, "boards_rewritten": 0, "boards_skipped": 0,
+        "points_before": 0, "points_after": 0, "boards": []
+    }
+    if collection is None:
+        return report
+
+    cursor = collection.find(query or {}, {"data": 1, "version": 1}).batch_size(batch_size)
+    for board in cursor:
+        report["boards_scanned"] += 1
+        data, before, after = simplify_lines(unpack_lines(board.get("data")), tolerance)
+        report["points_before"] += before
+        report["points_after"] += after
+        if after >= before:
+            continue
+
+        result = collection.update_one(
+            {"_id": board["_id"], "version": version_filter(board.get("version", 0))},
+            {"$set": {"data": pack_lines(data)}, "$inc": {"version": 1}}
+        )
+        if result.matched_count == 0:
+            report["boards_skipped"] += 1
+            continue
+        board_cache.invalidate(str(board["_id"]))
+        report["boards_rewritten"] += 1
+        report["boards"].append({"id": str(board["_id"]), "points_before": before, "points_after": after})
+    return report
+
@@ -0,0 +1,275 @@
+import math
+import os
+import struct
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+
+from bson import Binary
+
+from ratelimit import MAX_STROKE_POINTS
+from tiles import line_bounds
+
+# Stored form of strokes in a board's "data": "binary" packs them, "json" keeps dicts
+STROKE_STORAGE = os.environ.get('STROKE_STORAGE', 'binary')
+# Quantization steps per canvas pixel (10 keeps a tenth of a pixel)
+STROKE_QUANTUM = int(os.environ.get('STROKE_QUANTUM', 10))
+# Points of decoded strokes kept by their packed bytes, so a board re-read after a write decodes only new strokes
+DECODED_STROKE_CACHE_POINTS = int(os.environ.get('DECODED_STROKE_CACHE_POINTS', 500000))
+
+MAGIC = b'CS'
+FORMAT_VERSION = 1
+FLAG_WIDE_DELTAS = 0x01
+FLAG_HIGHLIGHT = 0x02
+
+# magic, version, flags, composite op, r, g, b, a, width, opacity, quantum, id length
+HEADER = struct.Struct('<2sBBB4Bff HB')
+COUNT = struct.Struct('<I')
+ORIGIN = struct.Struct('<ii')
+
+COMPOSITE_OPS = (
+    'source-over', 'multiply', 'destination-out', 'screen', 'overlay',
+    'darken', 'lighten', 'xor', 'source-atop', 'destination-over',
+)
+STROKE_KEYS = {'id', 'points', 'color', 'strokeWidth', 'opacity', 'isHighlight', 'globalCompositeOperation'}
+INT16_MIN, INT16_MAX = -2 ** 15, 2 ** 15 - 1
+INT32_MIN, INT32_MAX = -2 ** 31, 2 ** 31 - 1
+
+
+class StrokeCodecError(ValueError):
+    """Raised when a stroke cannot be encoded or a payload is not a valid stroke."""
+
+
+def _parse_color(color):
+    # Only canonical lowercase hex round-trips exactly, anything else stays JSON
+    if not isinstance(color, str) or len(color) not in (7, 9) or color[0] != '#' or color != color.lower():
+        raise StrokeCodecError(f"Unsupported color: {color!r}")
+    try:
+        channels = bytes.fromhex(color[1:])
+    except ValueError:
+        raise StrokeCodecError(f"Unsupported color: {color!r}")
+    return tuple(channels) + ((255,) if len(channels) == 3 else ())
+
+
+def _format_color(r, g, b, a):
+    color = f"#{r:02x}{g:02x}{b:02x}"
+    return color if a == 255 else color + f"{a:02x}"
+
+
+def encode_stroke(line, quantum=STROKE_QUANTUM):
+    """Pack a committed line into the compact binary stroke format.
+
+    Points are quantized to 1/quantum px and delta-encoded as int16 pairs,
+    widening to int32 when a jump does not fit. Raises StrokeCodecError for
+    lines that carry keys or values the format cannot represent.
+    """
+    if not isinstance(line, dict) or set(line) - STROKE_KEYS:
+        raise StrokeCodecError("Line has fields outside the binary stroke format")
+
+    stroke_id = line.get('id')
+    if not isinstance(stroke_id, str):
+        raise StrokeCodecError("Stroke id must be a string")
+    id_bytes = stroke_id.encode('utf-8')
+    if len(id_bytes) > 255:
+        raise StrokeCodecError("Stroke id is too long")
+
+    points = line.get('points')
+    if not isinstance(points, list) or len(points) % 2 or len(points) // 2 > MAX_STROKE_POINTS:
+        raise StrokeCodecError("Points must be a flat list of x, y pairs")
+
+    composite = line.get('globalCompositeOperation', 'source-over')
+    if composite not in COMPOSITE_OPS:
+        raise StrokeCodecError(f"Unsupported composite operation: {composite!r}")
+
+    width = line.get('strokeWidth', 2)
+    opacity = line.get('opacity', 1)
+    for value in (width, opacity):
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+            raise StrokeCodecError("Width and opacity must be finite numbers")
+    # float32 must hold them exactly for the round trip to be lossless
+    if struct.unpack('<ff', struct.pack('<ff', width, opacity)) != (width, opacity):
+        raise StrokeCodecError("Width and opacity must fit a float32")
+
+    try:
+        quantized = [round(p * quantum) for p in points]
+    except (TypeError, ValueError, OverflowError):
+        raise StrokeCodecError("Points must be finite numbers")
+
+    deltas = array('i')
+    for i in range(2, len(quantized)):
+        deltas.append(quantized[i] - quantized[i - 2])
+    if quantized and not all(INT32_MIN <= q <= INT32_MAX for q in quantized[:2]):
+        raise StrokeCodecError("Stroke origin is out of range")
+
+    flags = FLAG_HIGHLIGHT if line.get('isHighlight') else 0
+    if any(d < INT16_MIN or d > INT16_MAX for d in deltas):
+        flags |= FLAG_WIDE_DELTAS
+        if any(d < INT32_MIN or d > INT32_MAX for d in deltas):
+            raise StrokeCodecError("Stroke point jump is out of range")
+    else:
+        deltas = array('h', deltas)
+    if sys.byteorder != 'little':
+        deltas.byteswap()
+
+    r, g, b, a = _parse_color(line.get('color', '#000000'))
+    parts = [
+        HEADER.pack(MAGIC, FORMAT_VERSION, flags, COMPOSITE_OPS.index(composite),
+                    r, g, b, a, width, opacity, quantum, len(id_bytes)),
+        id_bytes,
+        COUNT.pack(len(quantized) // 2),
+    ]
+    if quantized:
+        parts.append(ORIGIN.pack(quantized[0], quantized[1]))
+        parts.append(deltas.tobytes())
+    return b''.join(parts)
+
+
+def decode_stroke(payload):
+    """Unpack and validate a binary stroke, returning the equivalent line dict."""
+    payload = bytes(payload)
+    if len(payload) < HEADER.size:
+        raise StrokeCodecError("Stroke payload is truncated")
+
+    (magic, version, flags, composite, r, g, b, a,
+     width, opacity, quantum, id_length) = HEADER.unpack_from(payload)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise StrokeCodecError("Not a binary stroke")
+    if composite >= len(COMPOSITE_OPS) or quantum == 0:
+        raise StrokeCodecError("Invalid stroke header")
+    if not (math.isfinite(width) and math.isfinite(opacity)):
+        raise StrokeCodecError("Invalid stroke width or opacity")
+
+    offset = HEADER.size
+    try:
+        stroke_id = payload[offset:offset + id_length].decode('utf-8')
+    except UnicodeDecodeError:
+        raise StrokeCodecError("Invalid stroke id")
+    offset += id_length
+    if len(payload) < offset + COUNT.size:
+        raise StrokeCodecError("Stroke payload is truncated")
+    (count,) = COUNT.unpack_from(payload, offset)
+    offset += COUNT.size
+    # No MAX_STROKE_POINTS check here: strokes stored under an older, larger cap must still load.
+    # The exact length check below rejects a bogus count before anything is allocated
+
+    points = []
+    if count:
+        item = 'i' if flags & FLAG_WIDE_DELTAS else 'h'
+        deltas = array(item)
+        expected = offset + ORIGIN.size + (count - 1) * 2 * deltas.itemsize
+        if len(payload) != expected:
+            raise StrokeCodecError("Stroke point data has the wrong length")
+        x, y = ORIGIN.unpack_from(payload, offset)
+        deltas.frombytes(payload[offset + ORIGIN.size:])
+        if sys.byteorder != 'little':
+            deltas.byteswap()
+
+        quantized = [x, y]
+        for i in range(0, len(deltas), 2):
+            x += deltas[i]
+            y += deltas[i + 1]
+            quantized.append(x)
+            quantized.append(y)
+        points = [q / quantum for q in quantized]
+    elif len(payload) != offset:
+        raise StrokeCodecError("Stroke point data has the wrong length")
+
+    return {
+        'id': stroke_id,
+        'points': [int(p) if p.is_integer() else p for p in points],
+        'color': _format_color(r, g, b, a),
+        'strokeWidth': int(width) if width.is_integer() else width,
+        'opacity': int(opacity) if opacity.is_integer() else opacity,
+        'isHighlight': bool(flags & FLAG_HIGHLIGHT),
+        'globalCompositeOperation': COMPOSITE_OPS[composite],
+    }
+
+
+class DecodedStrokes:
+    """LRU of decoded strokes keyed by their packed bytes, bounded by the points it holds.
+
+    Packed strokes never change in place; an edit stores new bytes. So
+    the bytes identify a decoded stroke no matter which board or version
+    they were read from. Cached lines are shared: callers copy the dict
+    and never modify the points list.
+    """
+
+    def __init__(self, max_points=DECODED_STROKE_CACHE_POINTS):
+        self.max_points = max_points
+        self.entries = OrderedDict()
+        self.points = 0
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def decode(self, payload):
+        # Binary compares its subtype too, so keys are plain bytes
+        key = payload if type(payload) is bytes else bytes(payload)
+        with self.lock:
+            line = self.entries.get(key)
+            if line is not None:
+                self.entries.move_to_end(key)
+                self.counters["hits"] += 1
+                return line
+            self.counters["misses"] += 1
+
+        line = decode_stroke(key)
+        size = len(line['points']) // 2 or 1
+        if size > self.max_points:
+            return line
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = line
+                self.points += size
+                while self.points > self.max_points:
+                    _, dropped = self.entries.popitem(last=False)
+                    self.points -= len(dropped['points']) // 2 or 1
+                    self.counters["evictions"] += 1
+        return line
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, entries=len(self.entries), points=self.points)
+
+
+decoded_strokes = DecodedStrokes()
+
+
+def pack_lines(data):
+    """Store strokes of a board's "data" as {"id", "stroke": Binary, "bbox"} sub-documents.
+
+    The id stays a plain field so element-level $pull / positional updates keep
+    matching, and bbox lets viewport queries skip strokes without decoding them;
+    lines the format cannot represent are stored as they are.
+    """
+    if STROKE_STORAGE != 'binary' or not isinstance(data, list):
+        return data
+    packed = []
+    for line in data:
+        try:
+            element = {'id': line['id'], 'stroke': Binary(encode_stroke(line))}
+            bounds = line_bounds(line)
+            if bounds is not None:
+                element['bbox'] = bounds
+            packed.append(element)
+        except (StrokeCodecError, KeyError, TypeError):
+            packed.append(line)
+    return packed
+
+
+def unpack_line(element):
+    if isinstance(element, dict) and isinstance(element.get('stroke'), bytes):
+        line = dict(decoded_strokes.decode(element['stroke']))
+        # Positional updates may have set plain fields next to the packed stroke
+        line.update({k: v for k, v in element.items() if k not in ('stroke', 'bbox')})
+        return line
+    return element
+
+
+def unpack_lines(data):
+    if not isinstance(data, list):
+        return data
+    if not any(isinstance(element, dict) and 'stroke' in element for element in data):
+        # Nothing packed: hand back the stored list instead of copying it
+        return data
+    return [unpack_line(element) for element in data]
@@ -42,3 +42,12 @@ def app_context():
     """Create an application context for testing."""
     with app.app_context():
         yield app
+
+
+@pytest.fixture(autouse=True)
+def reset_rate_limits():
+    """Every test starts with full token buckets; all test clients share one address."""
+    from ratelimit import rest_limits, socket_limits
+    socket_limits.reset()
+    rest_limits.reset()
+    yield
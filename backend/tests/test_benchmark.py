@@ -0,0 +1,101 @@
+"""
+Benchmark harness tests.
+These tests run a tiny load scenario and check the baseline comparison.
+"""
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+import db
+from benchmark import MemoryCollection, compare, percentiles, run_benchmark
+
+TINY_SCENARIO = {
+    "rooms": 1,
+    "clients": 3,
+    "duration": 0.5,
+    "think_time": 0.02,
+    "stroke_points": (3, 6),
+    "autosave_interval": 0.2,
+    "initial_strokes": 10,
+    "db_latency_ms": 0,
+}
+
+
+class TestMemoryCollection:
+    """Test the MongoDB stand-in."""
+
+    def test_bulk_write_upserts_and_updates(self):
+        """$setOnInsert upserts create documents; $set / $inc update them."""
+        collection = MemoryCollection()
+        board_id = ObjectId()
+        collection.bulk_write([UpdateOne({"_id": board_id}, {"$setOnInsert": {"title": "A", "version": 1}},
+                                         upsert=True)])
+        collection.bulk_write([UpdateOne({"_id": board_id}, {"$set": {"title": "B"}, "$inc": {"version": 1}})])
+        assert collection.find_one({"_id": board_id}) == {"_id": board_id, "title": "B", "version": 2}
+        assert collection.find_one({"_id": board_id}, {"title": 1}) == {"_id": board_id, "title": "B"}
+
+    def test_reads_return_copies(self):
+        """Changing a returned document does not change the stored one."""
+        collection = MemoryCollection()
+        collection.insert_one({"_id": 1, "notes": []})
+        collection.find_one({"_id": 1})["notes"].append("x")
+        assert collection.find_one({"_id": 1})["notes"] == []
+
+
+class TestRun:
+    """Test a full in-process run."""
+
+    def test_tiny_scenario(self):
+        """Events are sent, delivered to the other clients and saved."""
+        before = db.boards_collection
+        report = run_benchmark(TINY_SCENARIO)
+
+        assert report["events_sent"]["drawing"] > 0
+        assert report["throughput"]["deliveries_per_s"] > 0
+        assert report["latency_ms"]["count"] > 0
+        assert report["latency_ms"]["p50"] <= report["latency_ms"]["p99"]
+        assert report["autosave_ms"]["count"] > 0
+        assert report["autosave_ms"]["errors"] == 0
+        assert report["memory"]["bytes_per_connection"] > 0
+        assert report["db"]["ops"].get("bulk_write", 0) > 0
+        # The stand-in is only installed for the run
+        assert db.boards_collection is before
+
+
+class TestCompare:
+    """Test baseline comparison."""
+
+    def _report(self, **sections):
+        report = {
+            "scenario": {"rooms": 1},
+            "throughput": {"events_per_s": 100.0, "deliveries_per_s": 300.0},
+            "latency_ms": {"p50": 5.0, "p99": 20.0},
+            "memory": {"bytes_per_connection": 50000},
+            "db": {"ops_per_event": 0.01},
+        }
+        for section, values in sections.items():
+            report[section] = dict(report[section], **values)
+        return report
+
+    def test_within_tolerance(self):
+        """Small changes pass."""
+        assert compare(self._report(throughput={"events_per_s": 90.0}), self._report()) == []
+
+    def test_regressions_reported(self):
+        """Lower throughput and higher latency beyond the tolerance fail."""
+        regressions = compare(
+            self._report(throughput={"events_per_s": 50.0}, latency_ms={"p99": 40.0}), self._report())
+        assert regressions == ["throughput.events_per_s: 100.0 -> 50.0", "latency_ms.p99: 20.0 -> 40.0"]
+
+    def test_latency_noise_ignored(self):
+        """Sub-millisecond latency changes are not regressions."""
+        assert compare(self._report(latency_ms={"p50": 0.5}), self._report(latency_ms={"p50": 0.2})) == []
+
+    def test_scenario_mismatch(self):
+        """Baselines only apply to the same scenario."""
+        assert compare(self._report(scenario={"rooms": 2}), self._report()) != []
+
+    def test_percentiles(self):
+        """Nearest-rank percentiles."""
+        result = percentiles(list(range(1, 101)))
+        assert (result["p50"], result["p90"], result["p99"], result["max"]) == (50, 90, 99, 100)
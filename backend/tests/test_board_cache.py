@@ -0,0 +1,119 @@
+"""
+Board read cache tests.
+These tests verify LRU bounds, invalidation and conditional GETs.
+"""
+
+import pytest
+from bson import ObjectId
+
+from board_cache import BoardCache, board_cache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestBoardCache:
+    """Test the bounded LRU."""
+
+    def test_entry_limit_evicts_least_recently_used(self):
+        """The oldest untouched board is evicted first."""
+        cache = BoardCache(max_entries=2, max_bytes=1000, ttl=60)
+        cache.put('a', b'1')
+        cache.put('b', b'2')
+        cache.get('a')
+        cache.put('c', b'3')
+
+        assert cache.get('b') is None
+        assert cache.get('a').body == b'1'
+        assert cache.stats()['evictions'] == 1
+
+    def test_byte_limit(self):
+        """Entries are evicted to stay under the byte bound; oversized bodies are not cached."""
+        cache = BoardCache(max_entries=10, max_bytes=10, ttl=60)
+        cache.put('a', b'123456')
+        cache.put('b', b'123456')
+        assert cache.get('a') is None
+        assert cache.stats()['bytes'] == 6
+
+        cache.put('huge', b'x' * 11)
+        assert cache.get('huge') is None
+
+    def test_ttl(self):
+        """Entries older than the TTL are refetched."""
+        clock = FakeClock()
+        cache = BoardCache(max_entries=10, max_bytes=1000, ttl=5, clock=clock)
+        cache.put('a', b'1')
+        clock.now = 6
+        assert cache.get('a') is None
+        assert cache.stats()['expired'] == 1
+
+    def test_read_racing_a_write_is_not_cached(self):
+        """A payload read before an invalidation is not stored."""
+        cache = BoardCache(max_entries=10, max_bytes=1000, ttl=60)
+        generation = cache.generation()
+        cache.invalidate('a')
+        cache.put('a', b'stale', generation=generation)
+        assert cache.get('a') is None
+
+
+class FakeBoards:
+    """Collection double counting find_one calls."""
+
+    def __init__(self, board):
+        self.board = board
+        self.reads = 0
+
+    def find_one(self, query, projection=None):
+        self.reads += 1
+        return dict(self.board) if query.get('_id') == self.board['_id'] else None
+
+
+class TestConditionalGet:
+    """Test ETag handling on GET /api/boards/<boardId>."""
+
+    @pytest.fixture
+    def boards(self, monkeypatch):
+        import routes.boards
+        board = {'_id': ObjectId(), 'userId': 'u1', 'title': 'Cached', 'data': [], 'version': 3}
+        fake = FakeBoards(board)
+        monkeypatch.setattr(routes.boards, 'boards_collection', fake)
+        board_cache.clear()
+        yield fake
+        board_cache.clear()
+
+    def test_second_read_is_served_from_cache(self, client, boards):
+        """Repeated opens of a board read MongoDB once."""
+        board_id = str(boards.board['_id'])
+        first = client.get(f'/api/boards/{board_id}')
+        second = client.get(f'/api/boards/{board_id}')
+
+        assert first.status_code == second.status_code == 200
+        assert first.get_json()['title'] == 'Cached'
+        assert second.data == first.data
+        assert boards.reads == 1
+
+    def test_matching_etag_returns_304(self, client, boards):
+        """If-None-Match with the current ETag gets an empty 304."""
+        board_id = str(boards.board['_id'])
+        etag = client.get(f'/api/boards/{board_id}').headers['ETag']
+        response = client.get(f'/api/boards/{board_id}', headers={'If-None-Match': etag})
+
+        assert response.status_code == 304
+        assert response.data == b''
+
+    def test_invalidation_changes_etag(self, client, boards):
+        """After a write the board is re-read and gets a new ETag."""
+        board_id = str(boards.board['_id'])
+        etag = client.get(f'/api/boards/{board_id}').headers['ETag']
+        boards.board['title'] = 'Renamed'
+        board_cache.invalidate(board_id)
+
+        response = client.get(f'/api/boards/{board_id}', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.get_json()['title'] == 'Renamed'
+        assert boards.reads == 2
@@ -0,0 +1,85 @@
+"""
+Response compression tests.
+These tests verify REST compression, the precompressed board cache and WebSocket offers.
+"""
+
+import gzip
+
+import pytest
+from bson import ObjectId
+
+from board_cache import board_cache
+from compression import WebSocketCompressionMiddleware
+from tests.test_board_cache import FakeBoards
+from tests.test_pagination import FakeWhiteboards
+
+
+@pytest.fixture
+def large_board(monkeypatch):
+    import routes.boards
+    lines = [{'id': f'l{i}', 'points': [i, i, i + 1, i + 1], 'color': '#000000'} for i in range(200)]
+    board = {'_id': ObjectId(), 'userId': 'u1', 'title': 'Big', 'data': lines}
+    fake = FakeBoards(board)
+    monkeypatch.setattr(routes.boards, 'boards_collection', fake)
+    board_cache.clear()
+    yield str(board['_id'])
+    board_cache.clear()
+
+
+class TestResponseCompression:
+    """Test gzip on REST responses."""
+
+    def test_large_board_is_gzipped_once(self, client, large_board):
+        """The compressed copy is cached alongside the board."""
+        first = client.get(f'/api/boards/{large_board}', headers={'Accept-Encoding': 'gzip'})
+        second = client.get(f'/api/boards/{large_board}', headers={'Accept-Encoding': 'gzip'})
+
+        assert first.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in first.headers['Vary']
+        assert first.headers['ETag'].endswith('-gzip"')
+        assert len(gzip.decompress(first.data)) > len(first.data)
+        assert second.data == first.data
+        assert list(board_cache.get(large_board).encoded) == ['gzip']
+
+    def test_gzip_etag_revalidates(self, client, large_board):
+        """The compressed representation's ETag still yields 304."""
+        headers = {'Accept-Encoding': 'gzip'}
+        etag = client.get(f'/api/boards/{large_board}', headers=headers).headers['ETag']
+        response = client.get(f'/api/boards/{large_board}', headers=dict(headers, **{'If-None-Match': etag}))
+        assert response.status_code == 304
+
+    def test_identity_without_accept_encoding(self, client, large_board):
+        """Clients that do not accept gzip get the plain body."""
+        response = client.get(f'/api/boards/{large_board}')
+        assert 'Content-Encoding' not in response.headers
+        assert response.get_json()['title'] == 'Big'
+
+    def test_streamed_listing_is_gzipped(self, client, monkeypatch):
+        """Streamed whiteboard listings are compressed chunk by chunk."""
+        import routes.boards
+        docs = [{'_id': ObjectId(), 'owner': 'u1', 'name': f'Board {i}', 'sharedWith': []} for i in range(5)]
+        monkeypatch.setattr(routes.boards, 'whiteboards', FakeWhiteboards(docs))
+
+        response = client.get('/api/whiteboards/u1', headers={'Accept-Encoding': 'gzip'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert b'Board 4' in gzip.decompress(response.data)
+
+
+class TestWebSocketOffer:
+    """Test rewriting of permessage-deflate offers."""
+
+    def test_disabled_drops_deflate(self):
+        """With compression off only other extensions remain."""
+        middleware = WebSocketCompressionMiddleware(None, enabled=False)
+        assert middleware.rewrite_offer('permessage-deflate; client_max_window_bits') == ''
+
+    def test_window_bits_are_capped(self):
+        """A smaller window is requested for the server's compressor."""
+        middleware = WebSocketCompressionMiddleware(None, window_bits=10)
+        assert middleware.rewrite_offer('permessage-deflate; client_max_window_bits') == \
+            'permessage-deflate; client_max_window_bits; server_max_window_bits=10'
+
+    def test_default_keeps_offer(self):
+        """Default settings pass the browser's offer through."""
+        offer = 'permessage-deflate; client_max_window_bits'
+        assert WebSocketCompressionMiddleware(None).rewrite_offer(offer) == offer
@@ -0,0 +1,226 @@
+"""
+MongoDB worker pool tests.
+These tests verify timeouts, queue limits and the circuit breaker around DB calls.
+"""
+
+import threading
+import time
+
+import pytest
+from bson import ObjectId
+from pymongo.errors import AutoReconnect, NetworkTimeout, OperationFailure
+
+from db_pool import (
+    CircuitBreaker, DBCircuitOpen, DBOverloaded, DBPool, DBTimeout, DBUnavailable, PooledCollection
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def open_breaker_pool():
+    pool = DBPool(size=1, queue_limit=1, timeout=1, breaker=CircuitBreaker(failures=1, reset_after=60))
+    pool.breaker.failure()
+    return pool
+
+
+class TestDBPool:
+    """Test calls running on the pool."""
+
+    def test_returns_results(self):
+        """Results come back to the caller."""
+        pool = DBPool(size=2, queue_limit=10, timeout=1)
+        assert pool.call(lambda a, b=0: a + b, 1, b=2) == 3
+        assert pool.stats()["completed"] == 1
+
+    def test_query_errors_propagate(self):
+        """Errors of a bad query are raised as-is and do not trip the breaker."""
+        pool = DBPool(size=1, queue_limit=10, timeout=1, breaker=CircuitBreaker(failures=1))
+
+        def bad_query():
+            raise OperationFailure("unknown operator")
+
+        with pytest.raises(OperationFailure):
+            pool.call(bad_query)
+        assert pool.breaker.state == 'closed'
+
+    def test_outage_errors_become_unavailable(self):
+        """Connection errors and pymongo timeouts map to DBUnavailable / DBTimeout."""
+        pool = DBPool(size=1, queue_limit=10, timeout=1, breaker=CircuitBreaker(failures=10))
+
+        def unreachable():
+            raise AutoReconnect("connection refused")
+
+        def slow():
+            raise NetworkTimeout("timed out")
+
+        with pytest.raises(DBUnavailable) as unavailable:
+            pool.call(unreachable)
+        assert not isinstance(unavailable.value, DBTimeout)
+        with pytest.raises(DBTimeout):
+            pool.call(slow)
+        assert pool.breaker.consecutive == 2
+
+    def test_caller_timeout(self):
+        """A caller stops waiting after the pool timeout."""
+        pool = DBPool(size=1, queue_limit=10, timeout=0.05)
+        started = time.monotonic()
+        with pytest.raises(DBTimeout):
+            pool.call(time.sleep, 1)
+        assert time.monotonic() - started < 0.5
+        assert pool.stats()["timeouts"] == 1
+
+    def test_queue_limit(self):
+        """Calls beyond the queue limit are rejected at once."""
+        pool = DBPool(size=1, queue_limit=1, timeout=2)
+        release = threading.Event()
+        results = []
+        running = threading.Thread(target=lambda: results.append(pool.call(release.wait, 2)))
+        queued = threading.Thread(target=lambda: results.append(pool.call(lambda: 'queued')))
+        running.start()
+        time.sleep(0.01)
+        queued.start()
+        time.sleep(0.01)
+
+        with pytest.raises(DBOverloaded):
+            pool.call(lambda: 'rejected')
+        release.set()
+        running.join()
+        queued.join()
+        assert sorted(map(str, results)) == ['True', 'queued']
+        assert pool.stats()["rejected"] == 1
+
+
+class TestCircuitBreaker:
+    """Test the breaker states."""
+
+    def test_opens_after_consecutive_failures(self):
+        """Calls are short-circuited once the breaker opens."""
+        pool = DBPool(size=1, queue_limit=10, timeout=1, breaker=CircuitBreaker(failures=2, reset_after=60))
+
+        def unreachable():
+            raise AutoReconnect("down")
+
+        for _ in range(2):
+            with pytest.raises(DBUnavailable):
+                pool.call(unreachable)
+        with pytest.raises(DBCircuitOpen):
+            pool.call(lambda: 'never runs')
+        assert pool.stats()["breaker"] == 'open'
+        assert pool.stats()["short_circuited"] == 1
+
+    def test_half_open_trial(self):
+        """After the reset period one trial call decides the state."""
+        clock = FakeClock()
+        breaker = CircuitBreaker(failures=1, reset_after=10, clock=clock)
+        breaker.failure()
+        assert not breaker.allow()
+
+        clock.now = 10
+        assert breaker.allow()
+        # Only one trial at a time
+        assert not breaker.allow()
+        breaker.failure()
+        assert breaker.state == 'open'
+
+        clock.now = 20
+        assert breaker.allow()
+        breaker.success()
+        assert breaker.state == 'closed' and breaker.allow()
+
+    def test_success_resets_count(self):
+        """Failures must be consecutive to open the breaker."""
+        breaker = CircuitBreaker(failures=2)
+        breaker.failure()
+        breaker.success()
+        breaker.failure()
+        assert breaker.state == 'closed'
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = iter(docs)
+        self.closed = False
+
+    def sort(self, *args):
+        return self
+
+    def limit(self, n):
+        return self
+
+    def batch_size(self, n):
+        return self
+
+    def close(self):
+        self.closed = True
+
+    def __iter__(self):
+        return self.docs
+
+
+class FakeCollection:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, query=None, projection=None):
+        return FakeCursor(self.docs)
+
+    def find_one(self, query=None, projection=None):
+        return self.docs[0] if self.docs else None
+
+
+class TestPooledCollection:
+    """Test collections whose commands run on the pool."""
+
+    def test_commands_run_on_pool(self):
+        """Commands go through the pool; other attributes pass through."""
+        pool = DBPool(size=1, queue_limit=10, timeout=1)
+        collection = PooledCollection(FakeCollection([{"_id": 1}]), pool)
+        assert collection.find_one({"_id": 1}) == {"_id": 1}
+        assert collection.docs == [{"_id": 1}]
+        assert pool.stats()["calls"] == 1
+
+    def test_cursor_reads_in_chunks(self):
+        """Iterating a find() takes one pool call per chunk."""
+        pool = DBPool(size=1, queue_limit=10, timeout=1)
+        collection = PooledCollection(FakeCollection([{"_id": i} for i in range(5)]), pool)
+        cursor = collection.find({}).sort([("_id", -1)]).batch_size(2)
+        assert [doc["_id"] for doc in cursor] == [0, 1, 2, 3, 4]
+        assert pool.stats()["calls"] == 3
+
+
+class TestDegradedDatabase:
+    """Test how routes and sockets behave while the database is unavailable."""
+
+    def test_rest_answers_503(self, client, monkeypatch):
+        """Routes answer 503 with Retry-After instead of hanging or failing with 500."""
+        import routes.boards
+        monkeypatch.setattr(routes.boards, "boards_collection",
+                            PooledCollection(FakeCollection([]), open_breaker_pool()))
+        response = client.get(f"/api/boards/{ObjectId()}")
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "60"
+        assert response.get_json()["error"] == "Database unavailable"
+
+    def test_join_reports_unavailable_board(self, socketio_client, monkeypatch):
+        """A room is not started empty when its board cannot be read."""
+        import app
+        import db
+        monkeypatch.setattr(db, "boards_collection", PooledCollection(FakeCollection([]), open_breaker_pool()))
+        room = str(ObjectId())
+        socketio_client.emit('join', {'room': room})
+        received = socketio_client.get_received()
+        assert [message['name'] for message in received] == ['board_unavailable']
+        assert received[0]['args'][0]['room'] == room
+        assert app.room_registry.get(room) is None
+
+    def test_stats_endpoint(self, client):
+        """GET /api/db reports the pool and breaker state."""
+        stats = client.get('/api/db').get_json()
+        assert stats["breaker"] in ('closed', 'open', 'half_open')
+        assert "queued" in stats and "pool_size" in stats
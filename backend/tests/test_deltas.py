@@ -0,0 +1,143 @@
+"""
+Board delta tests.
+These tests verify how delta ops are validated and translated into Mongo updates.
+"""
+
+import pytest
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from deltas import DeltaError, build_delta_requests, validate_ops, version_guard
+
+
+BOARD_ID = ObjectId()
+
+
+class TestDeltaValidation:
+    """Test rejection of malformed delta payloads."""
+
+    def test_empty_ops_rejected(self):
+        """An empty batch is not a valid delta."""
+        with pytest.raises(DeltaError):
+            validate_ops([])
+
+    def test_unknown_field_rejected(self):
+        """Ops may only target the element arrays of a board."""
+        with pytest.raises(DeltaError):
+            validate_ops([{'op': 'remove', 'field': 'title', 'id': 'a'}])
+
+    def test_add_requires_element_id(self):
+        """Added elements must carry the id later ops refer to."""
+        with pytest.raises(DeltaError):
+            validate_ops([{'op': 'add', 'element': {'points': [1, 2]}}])
+
+    def test_modify_cannot_touch_id(self):
+        """Changing an element id through modify is refused."""
+        with pytest.raises(DeltaError):
+            validate_ops([{'op': 'modify', 'id': 'a', 'changes': {'id': 'b'}}])
+
+
+class TestDeltaRequests:
+    """Test the Mongo requests generated for delta ops."""
+
+    def test_version_guard_treats_missing_version_as_zero(self):
+        """Boards saved before versioning match a base version of 0."""
+        guard_filter, guard_update = version_guard(BOARD_ID, 0, None)
+        assert guard_filter == {'_id': BOARD_ID, 'version': {'$in': [0, None]}}
+        assert guard_update['$inc'] == {'version': 1}
+
+    def test_consecutive_adds_are_merged(self):
+        """Adds to the same array become a single $push with $each."""
+        ops = [
+            {'op': 'add', 'element': {'id': 'a', 'points': [0, 0]}},
+            {'op': 'add', 'element': {'id': 'b', 'points': [1, 1]}},
+        ]
+        requests = build_delta_requests(BOARD_ID, 3, ops)
+
+        assert requests[-1] == UpdateOne(
+            {'_id': BOARD_ID, 'version': 3, 'data.id': {'$nin': ['a', 'b']}},
+            {'$push': {'data': {'$each': [ops[0]['element'], ops[1]['element']]}}}
+        )
+        # The first request turns a blank "data" field into an array
+        assert requests[0] == UpdateOne(
+            {'_id': BOARD_ID, 'version': 3, 'data': {'$in': [None, '']}},
+            {'$set': {'data': []}}
+        )
+
+    def test_remove_and_modify_use_element_id(self):
+        """Remove pulls by id and modify uses the positional operator."""
+        ops = [
+            {'op': 'remove', 'id': 'a'},
+            {'op': 'modify', 'field': 'notes', 'id': 'n1', 'changes': {'text': 'hi', 'x': 4}},
+        ]
+        requests = build_delta_requests(BOARD_ID, 1, ops)
+
+        assert requests == [
+            UpdateOne({'_id': BOARD_ID, 'version': 1}, {'$pull': {'data': {'id': 'a'}}}),
+            UpdateOne(
+                {'_id': BOARD_ID, 'version': 1, 'notes.id': 'n1'},
+                {'$set': {'notes.$.text': 'hi', 'notes.$.x': 4}}
+            ),
+        ]
+
+    def test_moving_a_stroke_drops_its_bbox(self):
+        """Changing a stroke's points unsets the stored bbox used by viewport queries."""
+        ops = [{'op': 'modify', 'id': 'a', 'changes': {'points': [0, 0, 5, 5]}}]
+        requests = build_delta_requests(BOARD_ID, 1, ops)
+
+        assert requests == [UpdateOne(
+            {'_id': BOARD_ID, 'version': 1, 'data.id': 'a'},
+            {'$set': {'data.$.points': [0, 0, 5, 5]}, '$unset': {'data.$.bbox': ''}}
+        )]
+
+
+class TestDeltaEndpoint:
+    """Test request validation on the delta endpoint."""
+
+    def test_invalid_board_id(self, client):
+        """A malformed board id is rejected before touching the database."""
+        response = client.patch('/api/boards/not-an-id/delta', json={'version': 0, 'ops': []})
+        assert response.status_code == 400
+
+    def test_missing_version(self, client):
+        """Deltas without a base version cannot be conflict-checked."""
+        response = client.patch(
+            f'/api/boards/{BOARD_ID}/delta',
+            json={'ops': [{'op': 'remove', 'id': 'a'}]}
+        )
+        assert response.status_code == 400
+
+    def test_failed_batch_can_be_retried(self, client, monkeypatch):
+        """A batch that failed halfway gives its version back, and its retry lands every op once."""
+        from benchmark import MemoryCollection, install_collection
+        from stroke_codec import unpack_lines
+        import db
+
+        collection = MemoryCollection()
+        board_id = ObjectId()
+        collection.insert_one({'_id': board_id, 'data': [{'id': 'old', 'points': [0, 0, 1, 1]}], 'version': 2})
+        previous = install_collection(collection)
+        monkeypatch.setattr(db, 'history_collection', None)
+        monkeypatch.setattr(db, 'thumbnails_collection', None)
+        write = collection.bulk_write
+
+        def lose_connection(requests, ordered=True):
+            # The add lands, then the connection drops before the remove
+            write(requests[:-1], ordered)
+            raise RuntimeError('connection lost')
+
+        delta = {'version': 2, 'ops': [{'op': 'add', 'element': {'id': 'new', 'points': [2, 2, 3, 3]}},
+                                       {'op': 'remove', 'id': 'old'}]}
+        try:
+            monkeypatch.setattr(collection, 'bulk_write', lose_connection)
+            assert client.patch(f'/api/boards/{board_id}/delta', json=delta).status_code == 500
+            assert collection.find_one({'_id': board_id})['version'] == 2
+
+            monkeypatch.setattr(collection, 'bulk_write', write)
+            response = client.patch(f'/api/boards/{board_id}/delta', json=delta)
+            assert response.status_code == 200
+            board = collection.find_one({'_id': board_id})
+            assert board['version'] == 3
+            assert [line['id'] for line in unpack_lines(board['data'])] == ['new']
+        finally:
+            install_collection(*previous)
@@ -0,0 +1,307 @@
+"""
+Board element store tests.
+These tests verify that notes and text boxes are stored one document per element and only touched elements are written.
+"""
+
+import copy
+
+import pytest
+from bson import ObjectId
+from pymongo import DeleteMany, DeleteOne
+
+import db
+from elements import STORED_FLAG, ElementStore, element_id_candidates, sync_requests
+from persistence import WriteBehindQueue
+
+
+def _matches(doc, query):
+    for key, cond in query.items():
+        value = doc.get(key)
+        if isinstance(cond, dict) and any(op.startswith("$") for op in cond):
+            if "$in" in cond and value not in cond["$in"]:
+                return False
+            if "$ne" in cond and value == cond["$ne"]:
+                return False
+        elif "." in key:
+            field, sub = key.split(".", 1)
+            if not any(isinstance(e, dict) and _matches(e, {sub: cond}) for e in doc.get(field) or []):
+                return False
+        elif value != cond:
+            return False
+    return True
+
+
+class UpdateResult:
+    def __init__(self, matched):
+        self.matched_count = matched
+
+
+class FakeCollection:
+    """The subset of a pymongo collection board and element writes use, counting writes."""
+
+    def __init__(self, docs=()):
+        self.docs = [dict(doc) for doc in docs]
+        self.writes = 0
+
+    def find(self, query=None, projection=None):
+        return [copy.deepcopy(doc) for doc in self.docs if _matches(doc, query or {})]
+
+    def find_one(self, query=None, projection=None):
+        found = self.find(query)
+        if not found or not projection:
+            return found[0] if found else None
+        for key in projection:
+            if key.endswith(".$"):
+                field = key[:-2]
+                sub = {k.split(".", 1)[1]: v for k, v in query.items() if k.startswith(field + ".")}
+                found[0][field] = [e for e in found[0][field] if _matches(e, sub)][:1]
+        return found[0]
+
+    def find_one_and_update(self, query, update, projection=None, return_document=None):
+        self.update_one(query, update)
+        return self.find_one(query)
+
+    def update_one(self, query, update, upsert=False):
+        self.writes += 1
+        doc = next((d for d in self.docs if _matches(d, query)), None)
+        if doc is None:
+            if not upsert:
+                return UpdateResult(0)
+            doc = {k: v for k, v in query.items() if not isinstance(v, dict)}
+            doc.setdefault("_id", ObjectId())
+            doc.update(copy.deepcopy(update.get("$setOnInsert", {})))
+            self.docs.append(doc)
+        for key, value in update.get("$set", {}).items():
+            if key.startswith("element."):
+                doc["element"][key.split(".", 1)[1]] = value
+            else:
+                doc[key] = copy.deepcopy(value)
+        for key in update.get("$unset", {}):
+            doc.pop(key, None)
+        for key, amount in update.get("$inc", {}).items():
+            doc[key] = (doc.get(key) or 0) + amount
+        for key, value in update.get("$push", {}).items():
+            doc[key] = doc.get(key) or []
+            doc[key].extend(copy.deepcopy(value["$each"]))
+        return UpdateResult(1)
+
+    def delete_many(self, query):
+        self.writes += 1
+        self.docs = [doc for doc in self.docs if not _matches(doc, query)]
+
+    def bulk_write(self, requests, ordered=True):
+        for request in requests:
+            if isinstance(request, DeleteMany):
+                self.delete_many(request._filter)
+            elif isinstance(request, DeleteOne):
+                self.writes += 1
+                doc = next((d for d in self.docs if _matches(d, request._filter)), None)
+                if doc is not None:
+                    self.docs.remove(doc)
+            else:
+                self.update_one(request._filter, request._doc, upsert=bool(request._upsert))
+
+    def aggregate(self, pipeline):
+        counts = {}
+        for doc in self.find(pipeline[0]["$match"]):
+            key = (doc["boardId"], doc["field"])
+            counts[key] = counts.get(key, 0) + 1
+        return [{"_id": {"boardId": board, "field": field}, "count": count} for (board, field), count in counts.items()]
+
+
+def note(note_id, text="", **extra):
+    return dict({"id": note_id, "text": text}, **extra)
+
+
+def elements_of(store, board_id):
+    return store.load([board_id])[board_id]
+
+
+@pytest.fixture
+def stores():
+    boards, elements = FakeCollection(), FakeCollection()
+    store = ElementStore(lambda: elements)
+    return boards, elements, store, WriteBehindQueue(lambda: boards, window=60, elements=store)
+
+
+class TestSync:
+    """Test the diff between stored elements and a saved list."""
+
+    def stored(self, *notes):
+        return [(n["id"], float(index), n) for index, n in enumerate(notes)]
+
+    def test_unchanged_list_writes_nothing(self):
+        a, b = note("a"), note("b")
+        assert sync_requests("board", "notes", self.stored(a, b), [a, b], None) == ([], 2, 0)
+
+    def test_only_changed_and_added_elements_are_written(self):
+        """An edited note and a note inserted between two others are the only writes."""
+        a, b, c = note("a"), note("b"), note("c")
+        requests, unchanged, removed = sync_requests(
+            "board", "notes", self.stored(a, b, c), [a, note("new"), note("b", "edited")], None
+        )
+        assert (unchanged, removed) == (1, 1)
+        assert requests[0] == DeleteMany({"boardId": "board", "field": "notes", "elementId": {"$in": ["c"]}})
+        orders = {request._filter["elementId"]: request._doc["$set"]["order"] for request in requests[1:]}
+        assert orders == {"new": 0.5, "b": 1.0}
+
+    def test_reordered_list_is_renumbered(self):
+        a, b = note("a"), note("b")
+        requests, _, _ = sync_requests("board", "notes", self.stored(a, b), [b, a], None)
+        assert [(r._filter["elementId"], r._doc["$set"]["order"]) for r in requests] == [("b", 0), ("a", 1)]
+
+    def test_elements_without_ids_are_skipped(self):
+        requests, _, _ = sync_requests("board", "notes", [], [note("a"), {"text": "no id"}, note("a"), "x"], None)
+        assert [request._filter["elementId"] for request in requests] == ["a"]
+
+    def test_url_ids_match_numeric_ids(self):
+        assert element_id_candidates("1700000000000") == ["1700000000000", 1700000000000]
+        assert element_id_candidates("007") == ["007"]
+        assert element_id_candidates("note-1") == ["note-1"]
+
+
+class TestWriteBehind:
+    """Test that queued board writes store notes and text boxes apart."""
+
+    def test_new_board_stores_elements_apart(self, stores):
+        boards, elements, store, queue = stores
+        board_id = ObjectId()
+        queue.enqueue_insert({"_id": board_id, "title": "t", "notes": [note("a"), note("b")],
+                              "textBoxes": [{"id": 1, "text": "box"}]})
+        queue.flush()
+
+        board = boards.find_one({"_id": board_id})
+        assert board[STORED_FLAG] is True and "notes" not in board
+        assert len(elements.docs) == 3
+        assert elements_of(store, board_id) == {"notes": [note("a"), note("b")],
+                                                "textBoxes": [{"id": 1, "text": "box"}]}
+
+    def test_save_writes_only_the_changed_note(self, stores):
+        """A full save of 100 notes with one edit writes one element document."""
+        boards, elements, store, queue = stores
+        board_id = ObjectId()
+        notes = [note(f"n{i}", str(i)) for i in range(100)]
+        queue.enqueue_insert({"_id": board_id, "title": "t", "notes": notes, "textBoxes": []})
+        queue.flush()
+
+        elements.writes = 0
+        notes[50] = note("n50", "edited")
+        queue.enqueue(board_id, {"notes": notes}, {"version": 1})
+        queue.flush()
+        assert elements.writes == 1
+        assert elements_of(store, board_id)["notes"] == notes
+        assert "notes" not in boards.find_one({"_id": board_id})
+
+    def test_legacy_board_is_migrated(self, stores):
+        """The first save of a board embedding its arrays moves both fields over."""
+        boards, elements, store, queue = stores
+        board_id = ObjectId()
+        boards.docs.append({"_id": board_id, "notes": [note("a")], "textBoxes": [{"id": 1, "text": "kept"}]})
+        queue.enqueue(board_id, {"notes": [note("a"), note("b")]})
+        queue.flush()
+
+        board = boards.find_one({"_id": board_id})
+        assert board[STORED_FLAG] is True
+        assert "notes" not in board and "textBoxes" not in board
+        assert elements_of(store, board_id) == {"notes": [note("a"), note("b")],
+                                                "textBoxes": [{"id": 1, "text": "kept"}]}
+        assert board_id in store.stored
+
+    def test_disabled_store_keeps_arrays_embedded(self, stores):
+        boards, elements, store, queue = stores
+        store.enabled = False
+        board_id = ObjectId()
+        queue.enqueue_insert({"_id": board_id, "notes": [note("a")]})
+        queue.flush()
+        assert boards.find_one({"_id": board_id})["notes"] == [note("a")]
+        assert elements.docs == []
+
+    def test_element_write_failure_requeues(self, stores):
+        """Nothing is written to the board while its elements failed to land."""
+        boards, elements, store, queue = stores
+        board_id = ObjectId()
+
+        def fail(requests, ordered=True):
+            raise RuntimeError("connection lost")
+        elements.bulk_write = fail
+        queue.enqueue_insert({"_id": board_id, "notes": [note("a")]})
+        assert queue.flush() == 0
+        assert boards.docs == [] and board_id in queue.pending
+
+
+class TestElementRoutes:
+    """Test the per-element endpoints and delta ops on stored elements."""
+
+    @pytest.fixture
+    def board(self, monkeypatch):
+        import routes.boards
+        from elements import board_elements
+        from persistence import board_writes
+
+        board_id = ObjectId()
+        boards = FakeCollection([{"_id": board_id, "userId": "u", "title": "t", "data": [], "version": 4,
+                                  "notes": [note("a", "first")], "textBoxes": [{"id": 1700000000000, "text": "box"}]}])
+        elements = FakeCollection()
+        monkeypatch.setattr(db, "boards_collection", boards)
+        monkeypatch.setattr(db, "elements_collection", elements)
+        monkeypatch.setattr(db, "history_collection", None)
+        monkeypatch.setattr(routes.boards, "boards_collection", boards)
+        monkeypatch.setattr(board_writes, "window", 0)
+        changes = []
+        monkeypatch.setattr(board_elements, "on_change", lambda room, op: changes.append((room, op["op"])))
+        yield str(board_id), boards, elements, changes
+        board_elements.stored.discard(board_id)
+
+    def test_add_update_delete(self, client, board):
+        """Each call writes one element document and takes the next board version."""
+        board_id, boards, elements, changes = board
+        response = client.post(f"/api/boards/{board_id}/elements/notes", json={"element": note("b", "second")})
+        assert response.status_code == 201
+        assert response.get_json()["version"] == 5
+        # The board was migrated on first use
+        assert "notes" not in boards.docs[0] and len(elements.docs) == 3
+
+        elements.writes = 0
+        response = client.patch(f"/api/boards/{board_id}/elements/notes/a", json={"changes": {"text": "edited"}})
+        assert response.status_code == 200
+        assert elements.writes == 1
+
+        # Text box ids are numbers; the URL form still finds them
+        assert client.delete(f"/api/boards/{board_id}/elements/textBoxes/1700000000000").status_code == 200
+
+        data = client.get(f"/api/boards/{board_id}").get_json()
+        assert data["notes"] == [note("a", "edited"), note("b", "second")]
+        assert data["textBoxes"] == []
+        assert data["version"] == 7
+        assert changes == [(board_id, "add"), (board_id, "modify"), (board_id, "remove")]
+
+    def test_rejected_changes(self, client, board):
+        board_id = board[0]
+        url = f"/api/boards/{board_id}/elements"
+        assert client.post(f"{url}/notes", json={"element": note("a")}).status_code == 409
+        assert client.patch(f"{url}/notes/missing", json={"changes": {"text": "x"}}).status_code == 404
+        assert client.patch(f"{url}/notes/a", json={"changes": {"id": "b"}}).status_code == 400
+        assert client.post(f"{url}/data", json={"element": note("x")}).status_code == 404
+        assert client.delete(f"/api/boards/{ObjectId()}/elements/notes/a").status_code == 404
+
+    def test_delta_ops_on_stored_elements(self, client, board):
+        """Note ops in a delta batch write element documents; stroke ops still update the board."""
+        board_id, boards, elements, changes = board
+        response = client.patch(f"/api/boards/{board_id}/delta", json={"version": 4, "ops": [
+            {"op": "add", "field": "notes", "element": note("c", "third")},
+            {"op": "modify", "field": "notes", "id": "a", "changes": {"x": 10}},
+            {"op": "add", "element": {"id": "s", "points": [0, 0, 5, 5]}},
+        ]})
+        assert response.status_code == 200
+        assert [doc["element"] for doc in elements.docs if doc["field"] == "notes"] == [
+            note("a", "first", x=10), note("c", "third")
+        ]
+        assert len(boards.docs[0]["data"]) == 1
+        assert changes == [(board_id, "add"), (board_id, "modify")]
+
+    def test_summary_counts_stored_elements(self, client, board):
+        board_id, boards, elements, changes = board
+        client.post(f"/api/boards/{board_id}/elements/notes", json={"element": note("b")})
+        from elements import board_elements
+        summaries = board_elements.count_into([{"_id": ObjectId(board_id), STORED_FLAG: True}])
+        assert (summaries[0]["noteCount"], summaries[0]["textBoxCount"]) == (2, 1)
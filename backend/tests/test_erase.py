@@ -0,0 +1,188 @@
+"""
+Server-side erase tests.
+These tests verify eraser hit testing, stroke splitting and the erased deltas sent to a room.
+"""
+
+import math
+
+import pytest
+
+import erase
+from erase import EraseError, erase_strokes, parse_erase_path, split_line, _capsules
+from room_state import RoomState
+from tiles import TileIndex, line_bounds
+
+
+def line(line_id, points, width=2):
+    return {'id': line_id, 'points': points, 'strokeWidth': width, 'color': '#000'}
+
+
+def indexed(*lines):
+    index = TileIndex(tile_size=100)
+    for stroke in lines:
+        index.insert(stroke['id'], line_bounds(stroke))
+    return {stroke['id']: stroke for stroke in lines}, index
+
+
+class TestParseErasePath:
+    """Test erase_path payload validation."""
+
+    def test_pairs_and_radius(self):
+        """A flat path becomes (x, y) pairs."""
+        assert parse_erase_path({'path': [1, 2, 3, 4], 'radius': 5}) == ([(1, 2), (3, 4)], 5.0)
+
+    @pytest.mark.parametrize('payload', [
+        {'path': [1, 2, 3], 'radius': 5},
+        {'path': [1, float('nan')], 'radius': 5},
+        {'path': [1, 2], 'radius': 0},
+        {'path': [1, 2], 'radius': 10 ** 6},
+        {'path': 'x', 'radius': 5},
+    ])
+    def test_rejects_malformed(self, payload):
+        """Odd, non-finite or oversized input is rejected."""
+        with pytest.raises(EraseError):
+            parse_erase_path(payload)
+
+
+class TestSplitLine:
+    """Test hit testing and splitting of a single stroke."""
+
+    def test_untouched(self):
+        """Strokes farther than radius plus half their width are not hit."""
+        stroke = line('a', [0, 0, 100, 0], width=2)
+        assert split_line(stroke, _capsules([(50, 12)]), 10) is None
+        assert split_line(stroke, _capsules([(50, 10.5)]), 10) is not None
+
+    def test_split_in_the_middle(self):
+        """Erasing across a stroke leaves two pieces cut at the eraser's edge."""
+        stroke = line('a', [0, 0, 100, 0], width=0)
+        pieces = split_line(stroke, _capsules([(50, -20), (50, 20)]), 10)
+        assert [piece['points'] for piece in pieces] == [[0, 0, 40.0, 0.0], [60.0, 0.0, 100, 0]]
+        assert all(piece['id'] != 'a' and piece['color'] == '#000' for piece in pieces)
+
+    def test_inner_vertices_kept(self):
+        """Vertices outside the erased range are kept as they were."""
+        stroke = line('a', [0, 0, 10, 0, 20, 0, 30, 0, 40, 0], width=0)
+        pieces = split_line(stroke, _capsules([(40, 0)]), 5)
+        assert pieces[0]['points'] == [0, 0, 10, 0, 20, 0, 30, 0, 35.0, 0.0]
+
+    def test_erased_whole(self):
+        """A stroke entirely under the eraser leaves no pieces."""
+        assert split_line(line('a', [0, 0, 4, 0]), _capsules([(0, 0), (4, 0)]), 5) == []
+        assert split_line(line('dot', [3, 3]), _capsules([(0, 0)]), 5) == []
+
+    def test_swept_path_between_points(self):
+        """The eraser covers the whole segment between path points, not just the points."""
+        stroke = line('a', [50, -100, 50, 100], width=0)
+        pieces = split_line(stroke, _capsules([(0, 0), (100, 0)]), 1)
+        assert [piece['points'] for piece in pieces] == [[50, -100, 50.0, -1.0], [50.0, 1.0, 50, 100]]
+
+    def test_numpy_matches_plain_python(self, monkeypatch):
+        """Long strokes hit-tested with numpy are cut at exactly the same places."""
+        pytest.importorskip('numpy')
+        points = []
+        for i in range(500):
+            points.extend([i * 0.5, math.sin(i / 20) * 40])
+        stroke = line('wave', points, width=3)
+        capsules = _capsules([(x, 10 + x % 7) for x in range(0, 250, 6)] + [(120, -60), (120, 60), (120, 60)])
+
+        vectorized = split_line(stroke, capsules, 4)
+        monkeypatch.setattr(erase, 'np', None)
+        plain = split_line(stroke, capsules, 4)
+        assert len(vectorized) > 2
+        assert [piece['points'] for piece in vectorized] == [piece['points'] for piece in plain]
+
+
+class TestEraseStrokes:
+    """Test erasing from an indexed stroke set."""
+
+    def test_only_candidates_from_index_are_tested(self, monkeypatch):
+        """Strokes outside the eraser's tiles are never hit tested."""
+        near = line('near', [0, 0, 50, 0])
+        far = [line(f'far{i}', [1000 + i, 1000, 1010 + i, 1000]) for i in range(50)]
+        lines, index = indexed(near, *far)
+        tested = []
+        original = erase.split_line
+        monkeypatch.setattr(erase, 'split_line', lambda *args: tested.append(args[0]['id']) or original(*args))
+
+        removed, fragments, bounds = erase_strokes(lines, index, [(25, 0)], 5)
+        assert tested == ['near']
+        assert removed == ['near']
+        assert len(fragments['near']) == 2
+        assert bounds == line_bounds(near)
+
+
+class TestRoomErase:
+    """Test erase ops in the room state."""
+
+    def test_pieces_keep_stacking_order(self):
+        """Pieces replace their stroke in place and the index follows."""
+        state = RoomState('r', [line('a', [0, 0, 100, 0]), line('b', [0, 50, 100, 50])])
+        state.apply('line', line('c', [0, 200, 100, 200]))
+
+        op, bounds = state.erase_path([(50, -10), (50, 10)], 5)
+        assert op['op'] == 'erased' and op['data']['removed'] == ['a']
+        lines, _ = state.materialize()
+        assert [stroke['id'] for stroke in lines][2:] == ['b', 'c']
+        assert len(lines) == 4
+        assert 'a' not in state.line_index and len(state.line_index) == 4
+        assert state.dirty
+
+    def test_replicated_op_and_join_replay(self):
+        """Another process applies the same delta; joiners get it in the tail."""
+        origin = RoomState('r', [line('a', [0, 0, 100, 0])])
+        replica = RoomState('r', [line('a', [0, 0, 100, 0])])
+        op, _ = origin.erase_path([(0, 0)], 10)
+        replica.apply('erased', dict(op['data'], room='r'), replicated=True)
+        assert replica.materialize() == origin.materialize()
+        assert origin.join_payload()['ops'][-1]['op'] == 'erased'
+
+    def test_miss_and_template_rooms(self):
+        """Nothing is recorded when nothing is hit or the room has no strokes of its own."""
+        state = RoomState('r', [line('a', [0, 0, 100, 0])])
+        assert state.erase_path([(500, 500)], 5) == (None, None)
+        assert RoomState('t', None).erase_path([(0, 0)], 5) == (None, None)
+        assert state.seq == 0
+
+
+class TestEraseEvents:
+    """Test erase_path over Socket.IO."""
+
+    def test_erase_sends_delta_to_room(self, app_context):
+        """The sender and its peers receive the removed ids and pieces, not the line list."""
+        import app as app_module
+        from app import socketio, app
+
+        client1 = socketio.test_client(app)
+        client2 = socketio.test_client(app)
+        try:
+            client1.emit('join', {'room': 'erase_room'})
+            client2.emit('join', {'room': 'erase_room'})
+            client1.emit('drawing', {'room': 'erase_room', 'line': line('l1', [0, 0, 100, 0])})
+            client1.get_received()
+            client2.get_received()
+
+            ack = client1.emit('erase_path', {'room': 'erase_room', 'path': [50, -10, 50, 10], 'radius': 5},
+                               callback=True)
+            assert ack == {'removed': ['l1']}
+            reply = [r['args'][0] for r in client1.get_received() if r['name'] == 'erased']
+            assert len(reply) == 1
+            assert reply[0]['removed'] == ['l1'] and len(reply[0]['fragments']['l1']) == 2
+
+            app_module.room_fanout.tick()
+            relayed = [event for r in client2.get_received() if r['name'] == 'batch'
+                       for event in r['args'][0]['events'] if event[0] == 'erased']
+            assert relayed[0][1]['removed'] == ['l1']
+            assert 'lines' not in relayed[0][1]
+
+            lines, _ = app_module.room_registry.get('erase_room').materialize()
+            assert len(lines) == 2
+
+            # A miss is still acknowledged; a room that holds no strokes tells the sender to fall back
+            assert client1.emit('erase_path', {'room': 'erase_room', 'path': [500, 500], 'radius': 5},
+                                callback=True) == {'removed': []}
+            assert client1.emit('erase_path', {'room': 'no_room', 'path': [0, 0], 'radius': 5},
+                                callback=True) is False
+        finally:
+            client1.disconnect()
+            client2.disconnect()
@@ -0,0 +1,199 @@
+"""
+Room fan-out tests.
+These tests verify per-tick batching, merging and slow-client backpressure.
+"""
+
+from fanout import RoomFanout
+
+
+class FakeRoom:
+    """Records frames and lets tests mark clients as backed up."""
+
+    def __init__(self, members):
+        self.room_frames = []
+        self.client_frames = []
+        self.backlogs = {}
+        self.member_sids = members
+
+    def fanout(self, **kwargs):
+        return RoomFanout(
+            lambda room, events, skip: self.room_frames.append((room, events, skip)),
+            lambda sid, room, events: self.client_frames.append((sid, room, events)),
+            lambda sid: self.backlogs.get(sid, 0),
+            lambda room: self.member_sids,
+            **kwargs
+        )
+
+
+def stroke(points):
+    return {'room': 'r', 'line': {'id': 'l1', 'points': points}}
+
+
+class TestRoomFanout:
+    """Test batching of room events."""
+
+    def test_one_frame_per_room_per_tick(self):
+        """Events from several senders share a single frame."""
+        room = FakeRoom(['a', 'b', 'c'])
+        fanout = room.fanout()
+        fanout.queue('r', 'a', 'note_added', {'note': {'id': 'n1'}})
+        fanout.queue('r', 'b', 'note_added', {'note': {'id': 'n2'}})
+
+        assert fanout.tick() == 1
+        assert len(room.room_frames) == 1
+        _, events, skip = room.room_frames[0]
+        assert [e[2] for e in events] == ['a', 'b']
+        assert skip == []
+
+    def test_superseded_stroke_updates_are_merged(self):
+        """Only the newest in-progress update of a stroke is sent."""
+        room = FakeRoom(['a', 'b'])
+        fanout = room.fanout()
+        fanout.queue('r', 'a', 'drawing', stroke([0, 0]))
+        fanout.queue('r', 'a', 'drawing', stroke([0, 0, 1, 1]))
+        fanout.tick()
+
+        events = room.room_frames[0][1]
+        assert events == [['drawing', stroke([0, 0, 1, 1]), 'a']]
+        assert fanout.metrics['events_merged'] == 1
+
+    def test_empty_tick_sends_nothing(self):
+        """Rooms without new events produce no frames."""
+        room = FakeRoom(['a'])
+        assert room.fanout().tick() == 0
+        assert room.room_frames == []
+
+
+class TestBackpressure:
+    """Test handling of clients whose outbound queue is backed up."""
+
+    def test_slow_client_is_skipped_then_caught_up(self):
+        """A slow client gets one merged frame once its queue drains."""
+        room = FakeRoom(['a', 'slow'])
+        room.backlogs['slow'] = 100
+        fanout = room.fanout(max_backlog=10)
+
+        fanout.queue('r', 'a', 'drawing', stroke([0, 0]))
+        fanout.tick()
+        fanout.queue('r', 'a', 'drawing', stroke([0, 0, 2, 2]))
+        fanout.tick()
+        assert room.room_frames[0][2] == ['slow']
+        assert room.client_frames == []
+
+        room.backlogs['slow'] = 0
+        fanout.tick()
+        assert room.client_frames == [('slow', 'r', [['drawing', stroke([0, 0, 2, 2]), 'a']])]
+
+    def test_hopelessly_slow_client_is_resynced(self):
+        """Past the deferral cap the client is told to reload the room."""
+        room = FakeRoom(['a', 'slow'])
+        room.backlogs['slow'] = 100
+        fanout = room.fanout(max_backlog=10, max_deferred=1)
+
+        fanout.queue('r', 'a', 'note_added', {'note': {'id': 'n1'}})
+        fanout.queue('r', 'a', 'note_added', {'note': {'id': 'n2'}})
+        fanout.tick()
+
+        assert room.client_frames == [('slow', 'r', None)]
+        assert fanout.metrics['resyncs'] == 1
+
+
+class TestFanoutEvents:
+    """Test batch delivery over Socket.IO."""
+
+    def test_peers_receive_merged_batch(self, app_context):
+        """Two updates of one stroke reach the peer as a single batched event."""
+        import eventlet
+        from app import socketio, app
+
+        client1 = socketio.test_client(app)
+        client2 = socketio.test_client(app)
+        try:
+            client1.emit('join', {'room': 'fanout_room'})
+            client2.emit('join', {'room': 'fanout_room'})
+            client1.emit('drawing', {'room': 'fanout_room', 'line': {'id': 'f1', 'points': [1, 2]}})
+            client1.emit('drawing', {'room': 'fanout_room', 'line': {'id': 'f1', 'points': [1, 2, 3, 4]}})
+            eventlet.sleep(0.1)
+
+            frames = [r['args'][0] for r in client2.get_received() if r['name'] == 'batch']
+            events = [event for frame in frames for event in frame['events']]
+            assert [e[1]['line']['points'] for e in events] == [[1, 2, 3, 4]]
+        finally:
+            client1.disconnect()
+            client2.disconnect()
+
+
+def stroke_at(line_id, x, y):
+    return {'room': 'r', 'line': {'id': line_id, 'points': [x, y, x + 1, y + 1]}}
+
+
+class TestViewportFanout:
+    """Test forwarding strokes only to subscribers whose viewport they intersect."""
+
+    def test_offscreen_stroke_is_held_back(self):
+        """A viewer only gets strokes inside its viewport; others get everything."""
+        room = FakeRoom(['a', 'viewer', 'plain'])
+        fanout = room.fanout()
+        fanout.set_viewport('r', 'viewer', [0, 0, 100, 100])
+
+        fanout.queue('r', 'a', 'drawing', stroke_at('in', 10, 10), [10, 10, 11, 11])
+        fanout.queue('r', 'a', 'drawing', stroke_at('out', 900, 900), [900, 900, 901, 901])
+        fanout.tick()
+
+        assert room.room_frames[0][2] == ['viewer']
+        assert len(room.room_frames[0][1]) == 2
+        assert room.client_frames == [('viewer', 'r', [['drawing', stroke_at('in', 10, 10), 'a']])]
+        assert fanout.metrics['viewport_skips'] == 1
+
+    def test_panning_reveals_held_strokes(self):
+        """Moving the viewport over a held stroke sends it."""
+        room = FakeRoom(['a', 'viewer'])
+        fanout = room.fanout()
+        fanout.set_viewport('r', 'viewer', [0, 0, 100, 100])
+        fanout.queue('r', 'a', 'drawing', stroke_at('out', 900, 900), [900, 900, 901, 901])
+        fanout.tick()
+        assert room.client_frames == []
+
+        fanout.set_viewport('r', 'viewer', [850, 850, 950, 950])
+        assert room.client_frames == [('viewer', 'r', [['drawing', stroke_at('out', 900, 900), 'a']])]
+        assert fanout.held_offscreen('r', 'viewer') == []
+
+    def test_erase_supersedes_held_strokes(self):
+        """Erase carries the surviving lines, so held strokes are dropped."""
+        room = FakeRoom(['a', 'viewer'])
+        fanout = room.fanout()
+        fanout.set_viewport('r', 'viewer', [0, 0, 100, 100])
+        fanout.queue('r', 'a', 'drawing', stroke_at('out', 900, 900), [900, 900, 901, 901])
+        fanout.tick()
+        assert len(fanout.held_offscreen('r', 'viewer')) == 1
+
+        fanout.queue('r', 'a', 'erase', {'room': 'r', 'lines': []})
+        fanout.tick()
+        assert fanout.held_offscreen('r', 'viewer') == []
+
+    def test_drop_offscreen(self):
+        """Held strokes can be discarded, e.g. once they were erased on the server."""
+        room = FakeRoom(['a', 'viewer'])
+        fanout = room.fanout()
+        fanout.set_viewport('r', 'viewer', [0, 0, 100, 100])
+        fanout.queue('r', 'a', 'drawing', stroke_at('gone', 900, 900), [900, 900, 901, 901])
+        fanout.queue('r', 'a', 'drawing', stroke_at('kept', 800, 800), [800, 800, 801, 801])
+        fanout.tick()
+
+        fanout.drop_offscreen('r', lambda event, data: data['line']['id'] == 'gone')
+        assert fanout.held_offscreen('r', 'viewer') == [stroke_at('kept', 800, 800)]
+        fanout.drop_offscreen('r', lambda event, data: True)
+        assert fanout.offscreen == {}
+
+    def test_forget_clears_viewport(self):
+        """Disconnected clients leave no viewport or held events behind."""
+        room = FakeRoom(['a', 'viewer'])
+        fanout = room.fanout()
+        fanout.set_viewport('r', 'viewer', [0, 0, 100, 100])
+        fanout.queue('r', 'a', 'drawing', stroke_at('out', 900, 900), [900, 900, 901, 901])
+        fanout.tick()
+
+        fanout.forget('viewer')
+        assert fanout.viewports == {}
+        assert fanout.offscreen == {}
+        assert room.client_frames == []
@@ -0,0 +1,158 @@
+"""
+Connection and health check tests.
+These tests verify the background MongoDB connector and the liveness/readiness endpoints.
+"""
+
+import pytest
+from pymongo.errors import ServerSelectionTimeoutError
+
+import db
+from db import LazyCollection, MongoConnection
+from db_pool import DBUnavailable
+
+
+class FakeClient:
+    """Answers pings according to a shared `up` flag."""
+
+    def __init__(self, status):
+        self.status = status
+        self.collections = {}
+        self.admin = self
+
+    def command(self, name):
+        if not self.status['up']:
+            raise ServerSelectionTimeoutError("No servers found")
+        return {'ok': 1}
+
+    def __getitem__(self, name):
+        return self.collections.setdefault(name, self)
+
+    def find_one(self, query=None):
+        return None
+
+
+def make_connection(status):
+    created = []
+
+    def factory(uri):
+        client = FakeClient(status)
+        created.append(client)
+        return client
+
+    connection = MongoConnection(uri='mongodb://fake', client_factory=factory)
+    return connection, created
+
+
+class TestMongoConnection:
+    """Test connection state transitions."""
+
+    def test_disabled_without_uri(self):
+        """No MONGO_URI means no background thread and a disabled state."""
+        connection = MongoConnection(uri=None)
+        connection.start()
+        assert connection.state == 'disabled'
+        assert connection.thread is None
+
+    def test_connects_after_failed_attempt(self, monkeypatch):
+        """Failed attempts are recorded; the first success opens the database."""
+        status = {'up': False}
+        connection, created = make_connection(status)
+        indexed = []
+        monkeypatch.setattr(db, 'ensure_indexes', indexed.append)
+
+        assert connection.check() is False
+        assert connection.state == 'connecting'
+        assert 'No servers found' in connection.health()['error']
+        with pytest.raises(DBUnavailable):
+            connection.collection('whiteboards')
+
+        status['up'] = True
+        assert connection.check() is True
+        assert connection.state == 'connected'
+        assert connection.connected.is_set()
+        assert connection.health()['error'] is None
+        assert connection.collection('whiteboards') is not None
+        # One client for the process, indexes ensured once
+        assert len(created) == 1
+        assert len(indexed) == 1
+
+    def test_unreachable_after_connected(self, monkeypatch):
+        """A failed ping after connecting marks the database unreachable until it answers."""
+        status = {'up': True}
+        connection, _ = make_connection(status)
+        monkeypatch.setattr(db, 'ensure_indexes', lambda collection: None)
+        connection.check()
+
+        status['up'] = False
+        connection.check()
+        assert connection.state == 'unreachable'
+        status['up'] = True
+        connection.check()
+        assert connection.state == 'connected'
+
+    def test_lazy_collection_waits_for_connection(self, monkeypatch):
+        """Collections can be imported before MongoDB is reached."""
+        status = {'up': False}
+        connection, _ = make_connection(status)
+        monkeypatch.setattr(connection, 'start', lambda: None)
+        monkeypatch.setattr(db, 'ensure_indexes', lambda collection: None)
+        collection = LazyCollection(connection, 'whiteboards')
+        with pytest.raises(DBUnavailable):
+            collection.find_one
+        status['up'] = True
+        connection.check()
+        assert collection.find_one is not None
+
+    def test_failed_index_does_not_skip_the_rest(self):
+        """Every index is attempted even when an earlier one fails."""
+        created = []
+
+        class Collection:
+            def create_index(self, keys, name, **options):
+                if name == 'userId_updatedAt':
+                    raise RuntimeError('index build failed')
+                created.append(name)
+
+        failed = db.ensure_indexes({name: Collection() for name, _, _ in db.INDEXES})
+        assert failed == ['userId_updatedAt']
+        assert len(created) == len(db.INDEXES) - 1
+
+
+class TestHealthEndpoints:
+    """Test liveness and readiness."""
+
+    @pytest.fixture
+    def connection(self, monkeypatch):
+        connection = MongoConnection(uri='mongodb://fake', client_factory=lambda uri: FakeClient({'up': True}))
+        # Probes must read the cached state, never ping
+        monkeypatch.setattr(connection, 'check', lambda: pytest.fail("health endpoint pinged MongoDB"))
+        monkeypatch.setattr(db, 'connection', connection)
+        return connection
+
+    def test_liveness(self, client, connection):
+        """Liveness does not depend on MongoDB."""
+        response = client.get('/api/health/live')
+        assert response.status_code == 200
+        assert response.get_json()['status'] == 'alive'
+
+    def test_not_ready_while_connecting(self, client, connection):
+        """Readiness fails until MongoDB has answered."""
+        response = client.get('/api/health/ready')
+        assert response.status_code == 503
+        data = response.get_json()
+        assert data['status'] == 'not_ready'
+        assert data['database']['state'] == 'connecting'
+
+    def test_ready_when_connected(self, client, connection):
+        """Readiness passes once the connector reached MongoDB."""
+        connection.state = 'connected'
+        response = client.get('/api/health/ready')
+        assert response.status_code == 200
+        assert response.get_json()['status'] == 'ready'
+
+    def test_health_reports_cached_state(self, client, connection):
+        """The legacy health endpoint stays up and reports the last check."""
+        connection.last_error = 'No servers found'
+        data = client.get('/api/health').get_json()
+        assert data['status'] == 'healthy'
+        assert data['database'] == 'error: No servers found'
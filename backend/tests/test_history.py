@@ -0,0 +1,284 @@
+"""
+Board history tests.
+These tests verify element diffs, checkpointed journaling, time-travel reads and retention.
+"""
+
+import copy
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+import db
+from history import BoardHistory, apply_ops, diff_elements, diff_state
+from persistence import WriteBehindQueue
+
+
+def _matches(doc, query):
+    for key, cond in query.items():
+        value = doc.get(key)
+        if isinstance(cond, dict):
+            for op, arg in cond.items():
+                if op == "$in" and value not in arg:
+                    return False
+                if op == "$lt" and not value < arg:
+                    return False
+                if op == "$lte" and not value <= arg:
+                    return False
+                if op == "$gt" and not value > arg:
+                    return False
+        elif value != cond:
+            return False
+    return True
+
+
+class FakeCursor:
+    """Sort, skip and limit over a list of documents."""
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, key, direction=1):
+        self.docs.sort(key=lambda doc: doc[key], reverse=direction < 0)
+        return self
+
+    def skip(self, count):
+        self.docs = self.docs[count:]
+        return self
+
+    def limit(self, count):
+        self.docs = self.docs[:count] if count else self.docs
+        return self
+
+    def __iter__(self):
+        return iter(self.docs)
+
+
+class DeleteResult:
+    def __init__(self, count):
+        self.deleted_count = count
+
+
+class FakeCollection:
+    """The subset of a pymongo collection the journal and board writes use."""
+
+    def __init__(self, docs=()):
+        self.docs = [dict(doc) for doc in docs]
+
+    def find(self, query=None, projection=None):
+        return FakeCursor([copy.deepcopy(doc) for doc in self.docs if _matches(doc, query or {})])
+
+    def find_one(self, query=None, projection=None, sort=None):
+        found = self.find(query)
+        if sort:
+            found.sort(*sort[0])
+        return next(iter(found), None)
+
+    def count_documents(self, query, limit=0):
+        return len(self.find(query).limit(limit).docs)
+
+    def insert_many(self, docs, ordered=True):
+        self.docs.extend(copy.deepcopy(doc) for doc in docs)
+
+    def delete_many(self, query):
+        kept = [doc for doc in self.docs if not _matches(doc, query)]
+        deleted = len(self.docs) - len(kept)
+        self.docs = kept
+        return DeleteResult(deleted)
+
+    def bulk_write(self, requests, ordered=True):
+        for request in requests:
+            target = next((d for d in self.docs if d["_id"] == request._filter["_id"]), None)
+            if target is None:
+                target = dict(request._doc.get("$setOnInsert", {}), _id=request._filter["_id"])
+                self.docs.append(target)
+                continue
+            target.update(request._doc.get("$set", {}))
+            for key, amount in request._doc.get("$inc", {}).items():
+                target[key] = target.get(key, 0) + amount
+
+
+def note(note_id, text):
+    return {"id": note_id, "text": text}
+
+
+def journaled(boards, history, **kwargs):
+    journal = BoardHistory(lambda: history, **kwargs)
+    return journal, WriteBehindQueue(lambda: boards, window=60, journal=journal)
+
+
+class TestDiff:
+    """Test element diffs and their replay."""
+
+    @pytest.mark.parametrize("old, new", [
+        ([note("a", "1"), note("b", "2")], [note("a", "1"), note("b", "3"), note("c", "4")]),
+        ([note("a", "1"), note("b", "2"), note("c", "3")], [note("c", "3")]),
+        ([note("a", "1")], [note("z", "0"), note("a", "1"), note("m", "5")]),
+        ([{"id": "a", "text": "1", "color": "red"}], [{"id": "a", "text": "1"}]),
+        ([note("a", "1"), note("b", "2")], [note("b", "2"), note("a", "1")]),
+        ([{"text": "no id"}], [{"text": "changed"}]),
+        ("", [note("a", "1")]),
+    ])
+    def test_round_trip(self, old, new):
+        """Applying the diff of two lists to the first gives the second."""
+        state = {"notes": [dict(element) for element in old] if isinstance(old, list) else old}
+        apply_ops(state, diff_elements("notes", old, new))
+        assert state["notes"] == new
+
+    def test_small_edit_is_small(self):
+        """Changing one note of many records only that note's changed keys."""
+        old = [note(str(i), "x") for i in range(100)]
+        new = [dict(n) for n in old]
+        new[40]["text"] = "y"
+        assert diff_elements("notes", old, new) == [
+            {"op": "modify", "field": "notes", "id": "40", "changes": {"text": "y"}}
+        ]
+
+    def test_reorder_falls_back_to_set(self):
+        """Reordered elements cannot be described by ops, so the list is stored whole."""
+        ops = diff_elements("notes", [note("a", "1"), note("b", "2")], [note("b", "2"), note("a", "1")])
+        assert [op["op"] for op in ops] == ["set"]
+
+    def test_metadata_changes(self):
+        """Changed metadata is reported separately from element ops."""
+        ops, changed = diff_state({"title": "a", "notes": []}, {"title": "b", "notes": []})
+        assert ops == [] and changed == {"title": "b"}
+
+
+class TestJournal:
+    """Test journaling write-behind flushes."""
+
+    def test_flushes_record_versions_and_checkpoints(self):
+        """Each flush is one version; a checkpoint lands every `checkpoint_every` versions."""
+        board_id = ObjectId()
+        boards = FakeCollection([{"_id": board_id, "title": "t", "notes": [], "version": 0}])
+        history = FakeCollection()
+        journal, writes = journaled(boards, history, checkpoint_every=3)
+
+        for i in range(1, 8):
+            writes.enqueue(board_id, {"notes": [note(str(n), "x") for n in range(i)]}, {"version": 1})
+            writes.flush()
+
+        kinds = sorted((entry["version"], entry["type"]) for entry in history.docs)
+        assert [v for v, kind in kinds if kind == "checkpoint"] == [0, 3, 6]
+        assert [v for v, kind in kinds if kind == "ops"] == list(range(1, 8))
+        assert journal.board_at(board_id, 5)["notes"] == [note(str(n), "x") for n in range(5)]
+        assert journal.board_at(board_id, 0)["notes"] == []
+
+    def test_unchanged_write_leaves_no_entry(self):
+        """Autosaves that change nothing only bump the version."""
+        board_id = ObjectId()
+        boards = FakeCollection([{"_id": board_id, "notes": [note("a", "1")], "version": 4}])
+        history = FakeCollection()
+        journal, writes = journaled(boards, history)
+
+        writes.enqueue(board_id, {"notes": [note("a", "1")], "updatedAt": datetime.utcnow()}, {"version": 1})
+        writes.flush()
+        assert [entry["type"] for entry in history.docs] == ["checkpoint"]
+        assert journal.metrics["unchanged_writes"] == 1
+
+    def test_new_board_starts_with_checkpoint(self):
+        """Created boards are journaled whole."""
+        board_id = ObjectId()
+        boards, history = FakeCollection(), FakeCollection()
+        journal, writes = journaled(boards, history)
+        writes.enqueue_insert({"_id": board_id, "title": "new", "notes": [], "version": 0})
+        writes.flush()
+        assert journal.board_at(board_id, 0) == {"title": "new", "notes": []}
+
+    def test_journal_failure_does_not_fail_write(self, monkeypatch):
+        """Board writes land even when the history collection fails."""
+        board_id = ObjectId()
+        boards = FakeCollection([{"_id": board_id, "notes": [], "version": 0}])
+        history = FakeCollection()
+        journal, writes = journaled(boards, history)
+        monkeypatch.setattr(history, "insert_many", lambda *a, **k: (_ for _ in ()).throw(RuntimeError("down")))
+
+        writes.enqueue(board_id, {"notes": [note("a", "1")]}, {"version": 1})
+        assert writes.flush() == 1
+        assert boards.docs[0]["notes"] == [note("a", "1")]
+        assert journal.metrics["errors"] == 1
+        assert board_id not in journal.checkpointed
+
+
+class TestCompaction:
+    """Test the retention policy."""
+
+    def test_entry_limit_keeps_a_replayable_base(self):
+        """Old entries go, but never the checkpoint the kept ones replay from."""
+        board_id = ObjectId()
+        boards = FakeCollection([{"_id": board_id, "notes": [], "version": 0}])
+        history = FakeCollection()
+        journal, writes = journaled(boards, history, checkpoint_every=5, max_entries=8)
+
+        for i in range(1, 21):
+            writes.enqueue(board_id, {"notes": [note("a", str(i))]}, {"version": 1})
+            writes.flush()
+
+        versions = sorted(entry["version"] for entry in history.docs if entry["type"] == "ops")
+        assert min(versions) > 5
+        assert journal.board_at(board_id, 20)["notes"] == [note("a", "20")]
+        assert journal.board_at(board_id, 3) is None
+
+    def test_retention_period(self):
+        """Entries before the newest expired checkpoint are deleted."""
+        board_id = ObjectId()
+        old = datetime.utcnow() - timedelta(days=60)
+        history = FakeCollection([
+            {"boardId": board_id, "version": 0, "type": "checkpoint", "state": {}, "at": old},
+            {"boardId": board_id, "version": 1, "type": "ops", "ops": [], "set": {}, "at": old},
+            {"boardId": board_id, "version": 2, "type": "checkpoint", "state": {}, "at": old},
+            {"boardId": board_id, "version": 3, "type": "ops", "ops": [], "set": {}, "at": datetime.utcnow()},
+        ])
+        journal = BoardHistory(lambda: history, retention_days=30)
+        assert journal.compact(board_id) == 2
+        assert sorted(entry["version"] for entry in history.docs) == [2, 3]
+
+
+class TestHistoryRoutes:
+    """Test the history, version and restore endpoints."""
+
+    @pytest.fixture
+    def board(self, monkeypatch):
+        import routes.boards
+        from persistence import board_writes
+
+        board_id = ObjectId()
+        boards = FakeCollection([{"_id": board_id, "userId": "u", "title": "t", "notes": [], "data": [],
+                                  "version": 0, "createdAt": None}])
+        history = FakeCollection()
+        monkeypatch.setattr(db, "history_collection", history)
+        monkeypatch.setattr(db, "boards_collection", boards)
+        # Notes stay embedded in the board document here, see test_elements.py for the element store
+        monkeypatch.setattr(db, "elements_collection", None)
+        monkeypatch.setattr(routes.boards, "boards_collection", boards)
+        monkeypatch.setattr(board_writes, "window", 0)
+        restored = []
+        monkeypatch.setattr(board_writes.journal, "on_restore", lambda room, state: restored.append(room))
+        for text in ("one", "two", "three"):
+            board_writes.enqueue(board_id, {"notes": [note("n", text)]}, {"version": 1})
+        return str(board_id), restored
+
+    def test_history_listing(self, client, board):
+        """Versions are listed newest first with op counts, and paginate by version."""
+        board_id, _ = board
+        data = client.get(f"/api/boards/{board_id}/history?limit=2").get_json()
+        assert [v["version"] for v in data["versions"]] == [3, 2]
+        assert data["versions"][0]["ops"] == {"modify": 1}
+        rest = client.get(f"/api/boards/{board_id}/history?limit=2&cursor={data['nextCursor']}").get_json()
+        assert [v["version"] for v in rest["versions"]] == [1]
+        assert rest["nextCursor"] is None
+
+    def test_version_and_restore(self, client, board):
+        """A past version can be read and restored as a new version."""
+        board_id, restored = board
+        response = client.get(f"/api/boards/{board_id}/versions/1")
+        assert response.status_code == 200
+        assert response.get_json()["notes"] == [note("n", "one")]
+        assert client.get(f"/api/boards/{board_id}/versions/9").status_code == 404
+
+        response = client.post(f"/api/boards/{board_id}/restore", json={"version": 1})
+        assert response.status_code == 200
+        assert response.get_json()["version"] == 4
+        assert restored == [board_id]
+        assert client.get(f"/api/boards/{board_id}/versions/4").get_json()["notes"] == [note("n", "one")]
@@ -0,0 +1,268 @@
+"""
+Background job tests.
+These tests verify queueing, claiming, retries and lease takeover of jobs, chunked deletes that resume
+where a failed attempt stopped, and the account deletion and job status endpoints.
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+import db
+from jobs import FAILED, QUEUED, RUNNING, SUCCEEDED, Job, JobLost, JobRunner, job_runner
+from maintenance import delete_in_chunks
+
+
+def matches(doc, query):
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(matches(doc, branch) for branch in condition):
+                return False
+            continue
+        if key == "$and":
+            if not all(matches(doc, branch) for branch in condition):
+                return False
+            continue
+        value = doc.get(key)
+        if not (isinstance(condition, dict) and condition and all(op.startswith("$") for op in condition)):
+            if value != condition:
+                return False
+            continue
+        for op, arg in condition.items():
+            if op == "$in" and value not in arg:
+                return False
+            if op == "$ne" and value == arg:
+                return False
+            if op == "$exists" and (key in doc) != arg:
+                return False
+            if op in ("$lt", "$lte", "$gt", "$gte"):
+                if value is None:
+                    return False
+                if op == "$lt" and not value < arg or op == "$lte" and not value <= arg:
+                    return False
+                if op == "$gt" and not value > arg or op == "$gte" and not value >= arg:
+                    return False
+    return True
+
+
+class Result:
+    def __init__(self, matched_count=0, deleted_count=0):
+        self.matched_count = matched_count
+        self.deleted_count = deleted_count
+
+
+class Cursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, key, direction=1):
+        self.docs.sort(key=lambda doc: doc[key], reverse=direction < 0)
+        return self
+
+    def limit(self, limit):
+        self.docs = self.docs[:limit]
+        return self
+
+    def __iter__(self):
+        return iter(self.docs)
+
+
+class FakeCollection:
+    """The queries jobs and chunked deletes run, over documents keyed by _id."""
+
+    def __init__(self, docs=()):
+        self.docs = {doc["_id"]: dict(doc) for doc in docs}
+
+    def find(self, query, projection=None):
+        return Cursor([dict(doc) for doc in self.docs.values() if matches(doc, query)])
+
+    def find_one(self, query, projection=None):
+        return next(iter(self.find(query)), None)
+
+    def insert_one(self, doc):
+        self.docs[doc["_id"]] = dict(doc)
+
+    def update_one(self, query, update):
+        doc = self.find_one(query)
+        if doc is None:
+            return Result()
+        self._apply(self.docs[doc["_id"]], update)
+        return Result(matched_count=1)
+
+    def find_one_and_update(self, query, update, sort=None, return_document=None):
+        docs = list(self.find(query).sort(*sort[0]) if sort else self.find(query))
+        if not docs:
+            return None
+        doc = self.docs[docs[0]["_id"]]
+        self._apply(doc, update)
+        return dict(doc)
+
+    def delete_many(self, query):
+        ids = [doc_id for doc_id, doc in self.docs.items() if matches(doc, query)]
+        for doc_id in ids:
+            del self.docs[doc_id]
+        return Result(deleted_count=len(ids))
+
+    def _apply(self, doc, update):
+        for key, value in update.get("$set", {}).items():
+            target, _, field = key.rpartition(".")
+            (doc.setdefault(target, {}) if target else doc)[field] = value
+        for key, amount in update.get("$inc", {}).items():
+            doc[key] = doc.get(key, 0) + amount
+
+
+class Clock:
+    def __init__(self):
+        self.now = datetime(2026, 1, 1)
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += timedelta(seconds=seconds)
+
+
+@pytest.fixture
+def runner():
+    clock = Clock()
+    runner = JobRunner(lambda: jobs, lease=60, max_attempts=2, retry_delay=10, clock=clock)
+    jobs = FakeCollection()
+    return runner, jobs, clock
+
+
+class TestJobRunner:
+    """Test claiming, retrying and finishing jobs."""
+
+    def test_job_runs_once(self, runner):
+        """A queued job is claimed, runs and keeps its result; jobs with the same key are not queued twice."""
+        runner, jobs, clock = runner
+        calls = []
+
+        @runner.handler("echo")
+        def echo(job):
+            calls.append(job.params)
+            job.update({"steps": 1})
+            return {"echo": job.params["value"]}
+
+        queued = runner.enqueue("echo", {"value": 1}, key="echo:1")
+        # Queueing leaves running jobs to the server's worker
+        assert runner.worker is None
+        assert runner.enqueue("echo", {"value": 1}, key="echo:1")["_id"] == queued["_id"]
+        assert runner.run_one() is True
+        assert runner.run_one() is False
+
+        doc = jobs.docs[queued["_id"]]
+        assert calls == [{"value": 1}]
+        assert (doc["status"], doc["result"], doc["progress"], doc["attempts"]) == (SUCCEEDED, {"echo": 1},
+                                                                                   {"steps": 1}, 1)
+        assert doc["expiresAt"] > clock.now
+        assert runner.enqueue("echo", {"value": 1}, key="echo:1")["_id"] != queued["_id"]
+        with pytest.raises(ValueError):
+            runner.enqueue("unknown")
+
+    def test_failed_job_retried_with_backoff(self, runner):
+        """A failing job is queued again after retry_delay, then marked failed after max_attempts."""
+        runner, jobs, clock = runner
+
+        @runner.handler("broken")
+        def broken(job):
+            raise RuntimeError("boom")
+
+        job_id = runner.enqueue("broken")["_id"]
+        runner.run_one()
+        doc = jobs.docs[job_id]
+        assert (doc["status"], doc["error"], doc["runAfter"]) == (QUEUED, "boom", clock.now + timedelta(seconds=10))
+        assert runner.run_one() is False
+
+        clock.advance(10)
+        runner.run_one()
+        assert (jobs.docs[job_id]["status"], jobs.docs[job_id]["attempts"]) == (FAILED, 2)
+        assert (runner.metrics["retried"], runner.metrics["failed"]) == (1, 1)
+
+    def test_expired_lease_taken_over(self, runner):
+        """A job whose worker stopped reporting is run again, and the old worker loses it."""
+        runner, jobs, clock = runner
+        runner.handler("noop")(lambda job: None)
+        job_id = runner.enqueue("noop")["_id"]
+        stalled = Job(runner, runner.claim())
+
+        assert runner.run_one() is False
+        clock.advance(61)
+        assert runner.run_one() is True
+        assert jobs.docs[job_id]["status"] == SUCCEEDED
+        with pytest.raises(JobLost):
+            stalled.update({"steps": 1})
+
+    def test_chunked_delete_resumes(self, runner):
+        """Deletes go one _id range at a time, and a retry carries on after the last finished chunk."""
+        runner, jobs, clock = runner
+        user_docs = [{"_id": ObjectId(), "userId": "u1"} for _ in range(5)]
+        boards = FakeCollection(user_docs + [{"_id": ObjectId(), "userId": "u2"}])
+        seen = []
+
+        @runner.handler("delete")
+        def delete(job):
+            def before_delete(ids):
+                seen.append(ids)
+                if len(seen) == 2 and job.attempts == 1:
+                    raise RuntimeError("lost connection")
+            delete_in_chunks(job, boards, {"userId": "u1"}, "deleted", before_delete, batch_size=2)
+            return job.progress["deleted"]
+
+        job_id = runner.enqueue("delete")["_id"]
+        runner.run_one()
+        assert jobs.docs[job_id]["status"] == QUEUED
+        assert jobs.docs[job_id]["progress"] == {"deleted": 2}
+        assert len(boards.docs) == 4
+
+        clock.advance(10)
+        runner.run_one()
+        doc = jobs.docs[job_id]
+        assert (doc["status"], doc["result"]) == (SUCCEEDED, 5)
+        assert [doc["userId"] for doc in boards.docs.values()] == ["u2"]
+        assert seen == [[d["_id"] for d in user_docs[i:i + 2]] for i in (0, 2, 2, 4)]
+
+
+class TestJobRoutes:
+    """Test account deletion through a job and the job status endpoint."""
+
+    @pytest.fixture
+    def stores(self, monkeypatch):
+        jobs = FakeCollection()
+        boards = FakeCollection([
+            {"_id": ObjectId(), "userId": "u1", "title": "a"},
+            {"_id": ObjectId(), "userId": "u1", "title": "b"},
+            {"_id": ObjectId(), "owner": "u1", "name": "w"},
+            {"_id": ObjectId(), "userId": "u2", "title": "c"},
+        ])
+        monkeypatch.setattr(db, "jobs_collection", jobs)
+        monkeypatch.setattr(db, "boards_collection", boards)
+        monkeypatch.setattr(db, "whiteboards", boards)
+        for name in ("history_collection", "elements_collection", "thumbnails_collection"):
+            monkeypatch.setattr(db, name, None)
+        return jobs, boards
+
+    def test_delete_all_data(self, client, stores):
+        """Deletion answers 202 with a job to poll; the job removes the user's boards and whiteboards."""
+        jobs, boards = stores
+        response = client.delete("/api/user/u1/delete-all-data")
+        assert response.status_code == 202
+        job = response.get_json()["job"]
+        assert job["status"] == QUEUED
+        assert response.get_json()["statusUrl"] == f"/api/jobs/{job['id']}"
+        assert client.delete("/api/user/u1/delete-all-data").get_json()["job"]["id"] == job["id"]
+
+        jobs.docs[ObjectId(job["id"])]["status"] = RUNNING
+        assert client.get(f"/api/jobs/{job['id']}").get_json()["status"] == RUNNING
+        jobs.docs[ObjectId(job["id"])]["status"] = QUEUED
+
+        assert job_runner.run_one() is True
+        status = client.get(f"/api/jobs/{job['id']}").get_json()
+        assert status["status"] == SUCCEEDED
+        assert status["result"] == {"deletedBoards": 2, "deletedWhiteboards": 1}
+        assert [doc["userId"] for doc in boards.docs.values()] == ["u2"]
+
+    def test_job_status_errors(self, client, stores):
+        assert client.get("/api/jobs/nope").status_code == 400
+        assert client.get(f"/api/jobs/{ObjectId()}").status_code == 404
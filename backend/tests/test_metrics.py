@@ -0,0 +1,130 @@
+"""
+Metrics and logging tests.
+These tests verify the Prometheus text output and the structured log formats.
+"""
+
+import io
+import json
+import logging
+
+import pytest
+
+from log import JSONFormatter, StructuredLogger, TextFormatter
+from metrics import Registry, record_stats
+
+
+@pytest.fixture
+def registry():
+    return Registry()
+
+
+class TestRegistry:
+    """Test metric types and the exposition format."""
+
+    def test_counter_with_labels(self, registry):
+        """Counters accumulate per label set."""
+        events = registry.counter('events_total', 'Events', ['event'])
+        events.inc(event='draw')
+        events.inc(2, event='draw')
+        events.inc(event='erase')
+        text = registry.render()
+        assert '# TYPE events_total counter' in text
+        assert 'events_total{event="draw"} 3' in text
+        assert 'events_total{event="erase"} 1' in text
+
+    def test_wrong_labels_rejected(self, registry):
+        """Label names must match the declared ones."""
+        events = registry.counter('events_total', 'Events', ['event'])
+        with pytest.raises(ValueError):
+            events.inc(room='r1')
+
+    def test_histogram_buckets_are_cumulative(self, registry):
+        """Bucket counts include every smaller bucket, ending with +Inf."""
+        latency = registry.histogram('latency_seconds', 'Latency', buckets=(0.1, 1))
+        for value in (0.05, 0.5, 0.5, 5):
+            latency.observe(value)
+        text = registry.render()
+        assert 'latency_seconds_bucket{le="0.1"} 1' in text
+        assert 'latency_seconds_bucket{le="1"} 3' in text
+        assert 'latency_seconds_bucket{le="+Inf"} 4' in text
+        assert 'latency_seconds_count 4' in text
+        assert 'latency_seconds_sum 6.05' in text
+
+    def test_histogram_timer(self, registry):
+        """time() observes the duration of the block."""
+        latency = registry.histogram('latency_seconds', 'Latency', ['event'])
+        with latency.time(event='draw'):
+            pass
+        assert 'latency_seconds_count{event="draw"} 1' in registry.render()
+
+    def test_collectors_run_at_scrape(self, registry):
+        """Collectors set gauges before rendering; failing ones are skipped."""
+        rooms = registry.gauge('rooms', 'Rooms')
+
+        @registry.collector
+        def broken():
+            raise RuntimeError('boom')
+
+        registry.collector(lambda: rooms.set(4))
+        assert 'rooms 4' in registry.render()
+
+    def test_record_stats_skips_non_numeric(self):
+        """Only numeric stats become gauge samples."""
+        from metrics import COMPONENT_STATS
+        record_stats('test_component', {'queued': 3, 'enabled': True, 'name': 'x'})
+        text = '\n'.join(COMPONENT_STATS.render())
+        assert 'canvas_component_stat{component="test_component",stat="queued"} 3' in text
+        assert 'stat="enabled"' not in text
+
+
+class TestMetricsEndpoint:
+    """Test GET /api/metrics."""
+
+    def test_exposes_request_metrics(self, client):
+        """Requests are timed and show up in the scrape."""
+        client.get('/api/health')
+        response = client.get('/api/metrics')
+        assert response.status_code == 200
+        assert response.mimetype == 'text/plain'
+        text = response.get_data(as_text=True)
+        assert 'canvas_http_request_duration_seconds_count{method="GET",route="/api/health",status="200"}' in text
+        assert 'canvas_greenlets' in text
+        assert 'canvas_rooms' in text
+
+    def test_socket_events_counted(self, socketio_client, client):
+        """Socket.IO handlers are counted and timed by event."""
+        socketio_client.emit('join', {'room': 'metrics-room'})
+        text = client.get('/api/metrics').get_data(as_text=True)
+        assert 'canvas_socketio_events_total{event="join"}' in text
+        assert 'canvas_socketio_handler_duration_seconds_count{event="join"}' in text
+
+
+class TestStructuredLogger:
+    """Test the text and JSON log formats."""
+
+    def _logger(self, formatter):
+        stream = io.StringIO()
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(formatter)
+        logger = logging.getLogger('canvasconnect.test_metrics')
+        logger.handlers[:] = [handler]
+        logger.setLevel(logging.DEBUG)
+        logger.propagate = False
+        return StructuredLogger(logger), stream
+
+    def test_text_format(self):
+        """Fields follow the message as key=value pairs."""
+        log, stream = self._logger(TextFormatter())
+        log.info("Board updated", board='b1', title='My board')
+        line = stream.getvalue().strip()
+        assert 'INFO canvasconnect.test_metrics: Board updated' in line
+        assert line.endswith('board=b1 title="My board"')
+
+    def test_json_format(self):
+        """Fields become keys of a JSON object."""
+        log, stream = self._logger(JSONFormatter())
+        log.warning("Rejected stroke", room='r1', points=12)
+        entry = json.loads(stream.getvalue())
+        assert entry['level'] == 'WARNING'
+        assert entry['msg'] == 'Rejected stroke'
+        assert entry['room'] == 'r1' and entry['points'] == 12
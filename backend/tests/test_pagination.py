@@ -0,0 +1,161 @@
+"""
+Board listing pagination tests.
+These tests verify cursor encoding and the filters used to fetch the next page.
+"""
+
+from datetime import datetime, timezone
+
+import pytest
+from bson import ObjectId
+
+from models import board_summary_to_dict
+from pagination import (
+    cursor_filter, decode_cursor, encode_cursor, parse_limit, with_cursor
+)
+
+
+class TestCursor:
+    """Test opaque page cursors."""
+
+    def test_round_trip(self):
+        """A cursor decodes back to the document's sort key."""
+        oid = ObjectId()
+        updated = datetime(2024, 5, 1, 12, 30, 0, 123000, tzinfo=timezone.utc)
+        assert decode_cursor(encode_cursor({'_id': oid, 'updatedAt': updated})) == (updated, oid)
+
+    def test_naive_datetimes_are_utc(self):
+        """Datetimes read back from MongoDB without tzinfo are treated as UTC."""
+        oid = ObjectId()
+        updated = datetime(2024, 5, 1, 12, 30)
+        decoded, _ = decode_cursor(encode_cursor({'_id': oid, 'updatedAt': updated}))
+        assert decoded == updated.replace(tzinfo=timezone.utc)
+
+    def test_undated_board(self):
+        """Boards without updatedAt page by _id alone."""
+        oid = ObjectId()
+        cursor = encode_cursor({'_id': oid})
+        assert cursor_filter(cursor) == {'updatedAt': None, '_id': {'$lt': oid}}
+
+    def test_invalid_cursor(self):
+        """Garbage cursors are rejected."""
+        with pytest.raises(ValueError):
+            decode_cursor('nonsense')
+
+
+class TestPageQuery:
+    """Test building the next-page query."""
+
+    def test_first_page_keeps_query(self):
+        """Without a cursor the base query is used unchanged."""
+        assert with_cursor({'userId': 'u1'}, None) == {'userId': 'u1'}
+
+    def test_next_page_follows_cursor(self):
+        """Later pages select older boards, same-time ties by _id, then undated boards."""
+        oid = ObjectId()
+        updated = datetime(2024, 5, 1, tzinfo=timezone.utc)
+        query = with_cursor({'userId': 'u1'}, encode_cursor({'_id': oid, 'updatedAt': updated}))
+        assert query == {'$and': [{'userId': 'u1'}, {'$or': [
+            {'updatedAt': {'$lt': updated}},
+            {'updatedAt': updated, '_id': {'$lt': oid}},
+            {'updatedAt': None},
+        ]}]}
+
+    def test_parse_limit(self):
+        """Limits default, clamp to the maximum and reject bad values."""
+        assert parse_limit(None) == 50
+        assert parse_limit('10') == 10
+        assert parse_limit('5000') == 200
+        with pytest.raises(ValueError):
+            parse_limit('0')
+        with pytest.raises(ValueError):
+            parse_limit('ten')
+
+
+class TestBoardSummary:
+    """Test the listing representation of a board."""
+
+    def test_counts_replace_content(self):
+        """Summaries report element counts instead of the elements."""
+        summary = board_summary_to_dict({
+            '_id': ObjectId(), 'userId': 'u1', 'title': 'Board',
+            'lineCount': 3, 'noteCount': 1, 'textBoxCount': 0,
+        })
+        assert summary['counts'] == {'lines': 3, 'notes': 1, 'textBoxes': 0}
+        assert 'data' not in summary
+
+
+class FakeCursor:
+    """Minimal pymongo cursor over an in-memory result."""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.closed = False
+
+    def sort(self, spec):
+        return self
+
+    def limit(self, count):
+        self.docs = self.docs[:count]
+        return self
+
+    def __iter__(self):
+        return iter(self.docs)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeWhiteboards:
+    """Collection double answering find() newest first, as ID_SORT would."""
+
+    def __init__(self, docs):
+        self.docs = sorted(docs, key=lambda d: d['_id'], reverse=True)
+        self.queries = []
+
+    def find(self, query, projection=None):
+        self.queries.append((query, projection))
+        return FakeCursor(list(self.docs))
+
+
+class TestWhiteboardListing:
+    """Test the merged owned and shared whiteboard listing."""
+
+    @pytest.fixture
+    def boards(self, monkeypatch):
+        import routes.boards
+        docs = [
+            {'_id': ObjectId(), 'owner': 'u1', 'name': 'Mine', 'sharedWith': ['u2']},
+            {'_id': ObjectId(), 'owner': 'u2', 'name': 'Theirs', 'sharedWith': ['u1']},
+            {'_id': ObjectId(), 'owner': 'u1', 'name': 'Newest', 'sharedWith': []},
+        ]
+        fake = FakeWhiteboards(docs)
+        monkeypatch.setattr(routes.boards, 'whiteboards', fake)
+        return fake
+
+    def test_single_or_query(self, client, boards):
+        """Owned and shared boards come from one query without canvas data."""
+        response = client.get('/api/whiteboards/u1')
+        body = response.get_json()
+
+        assert response.status_code == 200
+        assert [b['name'] for b in body['whiteboards']] == ['Newest', 'Theirs', 'Mine']
+        assert [b['role'] for b in body['whiteboards']] == ['owner', 'shared', 'owner']
+        assert body['nextCursor'] is None
+        assert len(boards.queries) == 1
+        query, projection = boards.queries[0]
+        assert query == {'$or': [{'owner': 'u1'}, {'sharedWith': 'u1'}]}
+        assert 'data' not in projection
+
+    def test_pages_follow_cursor(self, client, boards):
+        """A full page reports the cursor for the next one."""
+        body = client.get('/api/whiteboards/u1?limit=2').get_json()
+
+        assert len(body['whiteboards']) == 2
+        assert body['nextCursor'] == body['whiteboards'][-1]['_id']
+        client.get(f"/api/whiteboards/u1?cursor={body['nextCursor']}")
+        assert boards.queries[-1][0]['$and'][1] == {'_id': {'$lt': ObjectId(body['nextCursor'])}}
+
+    def test_invalid_cursor(self, client, boards):
+        """Malformed cursors are rejected before querying."""
+        assert client.get('/api/whiteboards/u1?cursor=zzz').status_code == 400
+        assert boards.queries == []
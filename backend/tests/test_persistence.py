@@ -0,0 +1,167 @@
+"""
+Write-behind persistence tests.
+These tests verify that board writes are coalesced and flushed in bulk.
+"""
+
+import pytest
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from persistence import WriteBehindQueue
+
+
+class RecordingCollection:
+    """Collection double that records bulk_write calls."""
+
+    def __init__(self, fail=False):
+        self.batches = []
+        self.fail = fail
+        # {request index: error code} failing the next bulk_write after the other writes landed
+        self.write_errors = {}
+
+    def bulk_write(self, requests, ordered=True):
+        if self.fail:
+            raise RuntimeError('connection lost')
+        self.batches.append(requests)
+        if self.write_errors:
+            errors = [{'index': index, 'code': code, 'errmsg': 'failed'} for index, code in self.write_errors.items()]
+            self.write_errors = {}
+            raise BulkWriteError({'writeErrors': errors})
+
+
+@pytest.fixture
+def collection():
+    return RecordingCollection()
+
+
+@pytest.fixture
+def queue(collection):
+    # A long window keeps the background flusher from racing the assertions
+    return WriteBehindQueue(lambda: collection, window=60)
+
+
+class TestWriteBehindQueue:
+    """Test coalescing and flushing of queued writes."""
+
+    def test_updates_to_same_board_are_coalesced(self, queue, collection):
+        """Several saves of one board become a single UpdateOne."""
+        board_id = ObjectId()
+        queue.enqueue(board_id, {'data': [1]}, {'version': 1})
+        queue.enqueue(board_id, {'data': [1, 2], 'title': 'T'}, {'version': 1})
+
+        assert queue.flush() == 1
+        assert collection.batches == [[
+            UpdateOne({'_id': board_id}, {'$set': {'data': [1, 2], 'title': 'T'}, '$inc': {'version': 2}})
+        ]]
+        assert queue.stats()['coalesced'] == 1
+
+    def test_updates_fold_into_pending_insert(self, queue, collection):
+        """Edits to a board that was never written become part of its insert."""
+        board_id = ObjectId()
+        queue.enqueue_insert({'_id': board_id, 'title': 'New', 'version': 0})
+        queue.enqueue(board_id, {'title': 'Renamed'}, {'version': 1})
+
+        queue.flush()
+        assert collection.batches == [[
+            UpdateOne({'_id': board_id}, {'$setOnInsert': {'title': 'Renamed', 'version': 1}}, upsert=True)
+        ]]
+
+    def test_pending_writes_overlay_reads(self, queue):
+        """Reads see queued changes before they are flushed."""
+        board_id = ObjectId()
+        queue.enqueue(board_id, {'title': 'Queued'}, {'version': 1})
+
+        board = queue.apply_pending(board_id, {'_id': board_id, 'title': 'Stored', 'version': 4})
+        assert board['title'] == 'Queued'
+        assert board['version'] == 5
+
+    def test_reads_during_a_flush_are_not_cached(self, collection):
+        """A board cached while its batch was being written is dropped once the write finishes."""
+        from board_cache import BoardCache
+
+        cache = BoardCache()
+        queue = WriteBehindQueue(lambda: collection, window=60, cache=cache)
+        board_id = ObjectId()
+        write = collection.bulk_write
+
+        def bulk_write(requests, ordered=True):
+            # A reader between the pop and the write sees the stored, old board
+            cache.put(str(board_id), b'{"title": "Old"}', generation=cache.generation())
+            return write(requests, ordered)
+
+        collection.bulk_write = bulk_write
+        queue.enqueue(board_id, {'title': 'New'}, {'version': 1})
+        queue.flush()
+        assert cache.get(str(board_id)) is None
+
+    def test_failed_flush_is_requeued(self):
+        """Writes survive a failed flush and are retried with later edits."""
+        collection = RecordingCollection(fail=True)
+        queue = WriteBehindQueue(lambda: collection, window=60)
+        board_id = ObjectId()
+        queue.enqueue(board_id, {'data': [1]}, {'version': 1})
+
+        assert queue.flush() == 0
+        queue.enqueue(board_id, {'title': 'T'}, {'version': 1})
+        collection.fail = False
+        queue.flush()
+
+        assert collection.batches == [[
+            UpdateOne({'_id': board_id}, {'$set': {'data': [1], 'title': 'T'}, '$inc': {'version': 2}})
+        ]]
+        assert queue.stats()['flush_errors'] == 1
+
+    def test_partial_failure_retries_only_transient_errors(self, queue, collection):
+        """Writes that landed are not sent again; transient failures are retried, permanent ones dropped."""
+        landed, retried, too_large = ObjectId(), ObjectId(), ObjectId()
+        for board_id in (landed, retried, too_large):
+            queue.enqueue(board_id, {'title': 'T'}, {'version': 1})
+        collection.write_errors = {1: 189, 2: 10334}
+
+        assert queue.flush() == 1
+        assert queue.flush() == 1
+        assert collection.batches[-1] == [
+            UpdateOne({'_id': retried}, {'$set': {'title': 'T'}, '$inc': {'version': 1}})
+        ]
+        assert queue.stats()['dropped_writes'] == 1
+        assert queue.stats()['queue_depth'] == 0
+
+    def test_zero_window_writes_inline(self, collection):
+        """A zero window disables batching."""
+        queue = WriteBehindQueue(lambda: collection, window=0)
+        queue.enqueue(ObjectId(), {'title': 'T'})
+
+        assert len(collection.batches) == 1
+        assert queue.stats()['queue_depth'] == 0
+
+
+class TestQueuedBoardSaves:
+    """Board saves that go through the write-behind queue."""
+
+    def test_missing_board_is_not_found(self, client):
+        """Saving a board that does not exist is answered with 404 instead of being queued."""
+        from benchmark import MemoryCollection, install_collection
+
+        previous = install_collection(MemoryCollection())
+        try:
+            response = client.put('/api/boards/update', json={'boardId': str(ObjectId()), 'title': 'x'})
+            assert response.status_code == 404
+        finally:
+            install_collection(*previous)
+
+    def test_queued_insert_can_be_saved(self, client):
+        """A board created moments ago is found through its queued insert."""
+        from benchmark import MemoryCollection, install_collection
+        from persistence import board_writes
+
+        collection = MemoryCollection()
+        previous = install_collection(collection)
+        board_id = ObjectId()
+        try:
+            board_writes.enqueue_insert({'_id': board_id, 'userId': 'u', 'title': 't', 'version': 0, 'data': []})
+            response = client.put('/api/boards/update', json={'boardId': str(board_id), 'title': 'renamed'})
+            assert response.status_code == 200
+        finally:
+            board_writes.flush(board_id)
+            install_collection(*previous)
@@ -0,0 +1,120 @@
+"""
+Presence tests.
+These tests verify the per-room presence table, delta frames and idle expiry.
+"""
+
+from presence import Presence, parse_presence
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def presence(idle_ttl=30):
+    frames = []
+    clock = FakeClock()
+    return Presence(lambda room, frame: frames.append((room, frame)), idle_ttl=idle_ttl, clock=clock), frames, clock
+
+
+class TestParsePresence:
+    """Test presence payload validation."""
+
+    def test_fields(self):
+        """Positions are rounded, text is truncated and junk is ignored."""
+        fields = parse_presence({'x': 10.4, 'y': 20.6, 'tool': 'pen', 'name': 'n' * 100, 'color': 5})
+        assert fields == {'x': 10, 'y': 21, 'tool': 'pen', 'name': 'n' * 64}
+        assert parse_presence({'x': float('nan'), 'y': 1}) == {}
+        assert parse_presence({'x': None}) == {'x': None, 'y': None}
+
+
+class TestPresence:
+    """Test aggregation into delta frames."""
+
+    def test_one_frame_per_room_per_tick(self):
+        """Many updates between ticks become one frame with each user's latest changes."""
+        table, frames, _ = presence()
+        for x in range(10):
+            table.update('r', 'a', {'x': x, 'y': 0, 'tool': 'pen'})
+        table.update('r', 'b', {'x': 5, 'y': 5})
+        assert table.tick() == 1
+        room, frame = frames[0]
+        assert room == 'r'
+        assert frame['users'] == {'a': {'x': 9, 'y': 0, 'tool': 'pen'}, 'b': {'x': 5, 'y': 5}}
+        assert frame['removed'] == [] and frame['seq'] == 1
+
+    def test_only_changed_fields_are_sent(self):
+        """Later frames carry just the fields that changed; unchanged updates send nothing."""
+        table, frames, _ = presence()
+        table.update('r', 'a', {'x': 1, 'y': 1, 'tool': 'pen'})
+        table.tick()
+        table.update('r', 'a', {'x': 2, 'y': 1, 'tool': 'pen'})
+        table.tick()
+        assert frames[1][1]['users'] == {'a': {'x': 2}}
+
+        table.update('r', 'a', {'x': 2, 'y': 1})
+        assert table.tick() == 0
+        assert table.metrics['unchanged_updates'] == 1
+
+    def test_idle_users_expire(self):
+        """Users without updates for the idle TTL are removed and peers are told."""
+        table, frames, clock = presence(idle_ttl=5)
+        table.update('r', 'a', {'x': 1, 'y': 1})
+        table.update('r', 'b', {'x': 1, 'y': 1})
+        table.tick()
+        clock.now = 4
+        table.update('r', 'b', {'x': 2, 'y': 2})
+        clock.now = 6
+        table.tick()
+        assert frames[-1][1]['removed'] == ['a']
+        assert table.snapshot('r')['users'] == {'b': {'x': 2, 'y': 2}}
+
+        clock.now = 20
+        table.tick()
+        assert frames[-1][1]['removed'] == ['b']
+        assert table.rooms == {}
+
+    def test_snapshot_and_leave(self):
+        """Joiners get the full table; leaving is announced in the next frame."""
+        table, frames, _ = presence()
+        table.update('r', 'a', {'x': 1, 'y': 1, 'viewport': [0, 0, 10, 10]})
+        table.tick()
+        assert table.snapshot('r') == {'room': 'r', 'seq': 1,
+                                       'users': {'a': {'x': 1, 'y': 1, 'viewport': [0, 0, 10, 10]}}}
+        table.remove_all('a')
+        table.tick()
+        assert frames[-1][1] == {'room': 'r', 'seq': 2, 'users': {}, 'removed': ['a']}
+
+
+class TestPresenceEvents:
+    """Test presence over Socket.IO."""
+
+    def test_cursor_reaches_room_in_frame(self, app_context):
+        """Members get a presence_state on join and presence frames on each tick."""
+        import app as app_module
+        from app import socketio, app
+
+        client1 = socketio.test_client(app)
+        client2 = socketio.test_client(app)
+        try:
+            client1.emit('join', {'room': 'presence_room'})
+            client2.emit('join', {'room': 'presence_room'})
+            states = [r['args'][0] for r in client2.get_received() if r['name'] == 'presence_state']
+            assert states[0]['users'] == {}
+
+            client1.emit('presence', {'room': 'presence_room', 'x': 12, 'y': 34, 'tool': 'pen'})
+            client1.emit('presence', {'room': 'presence_room', 'x': 13, 'y': 34})
+            # Not a member of this room: ignored
+            client2.emit('presence', {'room': 'elsewhere', 'x': 1, 'y': 1})
+            app_module.presence.tick()
+
+            frames = [r['args'][0] for r in client2.get_received() if r['name'] == 'presence']
+            assert len(frames) == 1
+            assert list(frames[0]['users'].values()) == [{'x': 13, 'y': 34, 'tool': 'pen'}]
+            assert 'elsewhere' not in app_module.presence.rooms
+        finally:
+            client1.disconnect()
+            client2.disconnect()
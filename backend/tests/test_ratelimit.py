@@ -0,0 +1,135 @@
+"""
+Rate limit tests.
+These tests verify token buckets, socket event limits, REST write limits and size caps.
+"""
+
+import pytest
+
+from ratelimit import RateLimiter, count_points
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestRateLimiter:
+    """Test token bucket accounting."""
+
+    def test_burst_then_refill(self):
+        """A full bucket allows a burst, then refills at the configured rate."""
+        clock = FakeClock()
+        limiter = RateLimiter({'drawing': (10, 3)}, enabled=True, clock=clock)
+        assert [limiter.hit('drawing', 'a') for _ in range(3)] == [0, 0, 0]
+        assert limiter.hit('drawing', 'a') == pytest.approx(0.1)
+        # Other keys have their own bucket
+        assert limiter.hit('drawing', 'b') == 0
+
+        clock.now = 0.1
+        assert limiter.hit('drawing', 'a') == 0
+        assert limiter.stats()['limited_drawing'] == 1
+
+    def test_limited_streak_reported_once(self):
+        """Only the first refusal of a streak is flagged, so clients are told once."""
+        limiter = RateLimiter({'event': (1, 1)}, enabled=True, clock=FakeClock())
+        limiter.hit('event', 'a')
+        assert [limiter.check('event', 'a')[1] for _ in range(3)] == [True, False, False]
+
+    def test_bucket_count_is_bounded(self):
+        """The least recently used buckets are dropped past the cap."""
+        limiter = RateLimiter({'event': (1, 1)}, enabled=True, max_buckets=2, clock=FakeClock())
+        for key in ('a', 'b', 'c'):
+            limiter.hit('event', key)
+        assert list(limiter.buckets) == [('event', 'b'), ('event', 'c')]
+        limiter.forget('b')
+        assert list(limiter.buckets) == [('event', 'c')]
+
+    def test_disabled(self):
+        """RATE_LIMITS=off allows everything."""
+        limiter = RateLimiter({'event': (0, 1)}, enabled=False)
+        assert all(limiter.hit('event', 'a') == 0 for _ in range(5))
+
+    def test_count_points(self):
+        """Malformed strokes count as no points."""
+        assert count_points([{'points': [0, 0, 1, 1]}, {'points': 'x'}, None]) == 2
+        assert count_points(None) == 0
+
+
+class TestSocketLimits:
+    """Test limits on Socket.IO events."""
+
+    def test_flood_is_dropped_and_reported(self, app_context, monkeypatch):
+        """Events past the burst are not relayed; the sender is told once."""
+        from app import socketio, app
+        from ratelimit import socket_limits
+
+        monkeypatch.setattr(socket_limits, 'enabled', True)
+        monkeypatch.setitem(socket_limits.limits, 'signaling', (0.001, 3))
+        sender = socketio.test_client(app)
+        target = socketio.test_client(app)
+        try:
+            target_sid = socketio.server.manager.sid_from_eio_sid(target.eio_sid, '/')
+            sender.emit('voice-join', {'room': 'limits'})
+            target.emit('voice-join', {'room': 'limits'})
+            for i in range(6):
+                sender.emit('voice-offer', {'room': 'limits', 'targetUserId': target_sid, 'offer': i})
+            received = [r['args'][0]['offer'] for r in target.get_received() if r['name'] == 'voice-offer']
+            assert received == [0, 1, 2]
+            notices = [r['args'][0] for r in sender.get_received() if r['name'] == 'rate_limited']
+            assert len(notices) == 1 and notices[0]['event'] == 'voice-offer'
+        finally:
+            sender.disconnect()
+            target.disconnect()
+
+    def test_oversized_stroke_is_dropped(self, app_context, monkeypatch):
+        """Strokes with more points than MAX_STROKE_POINTS never reach the room."""
+        import app as app_module
+        from app import socketio, app
+
+        monkeypatch.setattr(app_module, 'MAX_STROKE_POINTS', 4)
+        client = socketio.test_client(app)
+        try:
+            client.emit('join', {'room': 'limit_room'})
+            client.emit('drawing', {'room': 'limit_room', 'line': {'id': 'big', 'points': list(range(20))}})
+            client.emit('drawing', {'room': 'limit_room', 'line': {'id': 'ok', 'points': [0, 0, 1, 1]}})
+            lines, _ = app_module.room_registry.get('limit_room').materialize()
+            assert [line['id'] for line in lines] == ['ok']
+        finally:
+            client.disconnect()
+
+
+class TestRestLimits:
+    """Test limits on REST writes."""
+
+    def test_writes_past_the_burst_get_429(self, client, monkeypatch):
+        """Reads are never limited; writes past the burst get 429 with Retry-After."""
+        from ratelimit import rest_limits
+
+        monkeypatch.setattr(rest_limits, 'enabled', True)
+        monkeypatch.setitem(rest_limits.limits, 'write', (0.5, 2))
+        statuses = [client.put('/api/boards/update', json={'boardId': 'bad'}).status_code for _ in range(3)]
+        assert statuses == [400, 400, 429]
+        response = client.put('/api/boards/update', json={'boardId': 'bad'})
+        assert response.headers['Retry-After'] == '2'
+        assert client.get('/api/limits').status_code == 200
+
+    def test_too_many_points(self, client, monkeypatch):
+        """Full saves over MAX_BOARD_POINTS are refused before anything is queued."""
+        import routes.boards
+
+        monkeypatch.setattr(routes.boards, 'MAX_BOARD_POINTS', 3)
+        response = client.put('/api/boards/update', json={
+            'boardId': '507f1f77bcf86cd799439011', 'data': [{'id': 'a', 'points': list(range(8))}]
+        })
+        assert response.status_code == 413
+        assert response.get_json()['points'] == 4
+
+    def test_body_size_cap(self, client, monkeypatch):
+        """Bodies over MAX_CONTENT_LENGTH get 413."""
+        from app import app
+        monkeypatch.setitem(app.config, 'MAX_CONTENT_LENGTH', 100)
+        response = client.put('/api/boards/update', json={'boardId': 'x' * 200})
+        assert response.status_code == 413
@@ -0,0 +1,236 @@
+"""
+Board rendering tests.
+These tests verify the rasterizer, PNG output, version-keyed thumbnail and export caching, and the image endpoints.
+"""
+
+import struct
+import zlib
+
+import pytest
+from bson import ObjectId
+
+import db
+from render import encode_png, parse_color, render_board
+from stroke_codec import pack_lines
+from thumbnails import BoardImages, RenderPool
+
+
+def decode_png(png):
+    """(width, height, rows of (r, g, b) pixels) of an unfiltered RGB PNG from encode_png."""
+    assert png[:8] == b'\x89PNG\r\n\x1a\n'
+    width, height = struct.unpack('>II', png[16:24])
+    offset, data = 8, b''
+    while offset < len(png):
+        length, kind = struct.unpack('>I4s', png[offset:offset + 8])
+        if kind == b'IDAT':
+            data += png[offset + 8:offset + 8 + length]
+        offset += 12 + length
+    raw = zlib.decompress(data)
+    stride = width * 3 + 1
+    rows = [raw[row * stride + 1:(row + 1) * stride] for row in range(height)]
+    return width, height, [[tuple(row[i:i + 3]) for i in range(0, len(row), 3)] for row in rows]
+
+
+def stroke(points, color="#ff0000", width=4, **extra):
+    return dict({"id": ObjectId().__str__(), "points": points, "color": color, "strokeWidth": width,
+                 "opacity": 1, "isHighlight": False, "globalCompositeOperation": "source-over"}, **extra)
+
+
+class FakeCollection:
+    """find_one / update_one / delete_many over documents keyed by _id."""
+
+    def __init__(self, docs=()):
+        self.docs = {doc["_id"]: dict(doc) for doc in docs}
+        self.reads = 0
+
+    def find_one(self, query, projection=None):
+        self.reads += 1
+        doc = self.docs.get(query["_id"])
+        return dict(doc) if doc is not None else None
+
+    def update_one(self, query, update, upsert=False):
+        doc = self.docs.get(query["_id"])
+        if doc is None or doc.get("version", 0) <= query["version"]["$lte"]:
+            self.docs[query["_id"]] = dict(doc or {"_id": query["_id"]}, **update["$set"])
+
+    def delete_many(self, query):
+        for doc_id in query["_id"]["$in"]:
+            self.docs.pop(doc_id, None)
+
+
+class TestRender:
+    """Test rasterizing boards into PNGs."""
+
+    def test_png_round_trip(self):
+        """encode_png writes a valid PNG of the given pixels."""
+        pixels = bytearray([255, 0, 0, 0, 255, 0, 0, 0, 255, 255, 255, 255])
+        width, height, rows = decode_png(encode_png(2, 2, pixels))
+        assert (width, height) == (2, 2)
+        assert rows == [[(255, 0, 0), (0, 255, 0)], [(0, 0, 255), (255, 255, 255)]]
+
+    @pytest.mark.parametrize("value, expected", [
+        ("#f00", (255, 0, 0, 1.0)),
+        ("#00ff0080", (0, 255, 0, 128 / 255)),
+        ("rgba(0, 0, 255, 0.5)", (0, 0, 255, 0.5)),
+        ("White", (255, 255, 255, 1.0)),
+        ("not a color", (0, 0, 0, 1.0)),
+    ])
+    def test_parse_color(self, value, expected):
+        assert parse_color(value) == expected
+
+    def test_export_draws_strokes_at_scale(self):
+        """An export is the content's bounding box; strokes land where they were drawn."""
+        board = {"data": [stroke([100, 100, 300, 100])], "background": "#ffffff"}
+        png, width, height = render_board(board)
+        _, _, rows = decode_png(png)
+        assert (width, height) == (252, 52)
+        assert rows[height // 2][width // 2] == (255, 0, 0)
+        assert rows[2][width // 2] == (255, 255, 255)
+
+        _, half_width, _ = render_board(board, scale=0.5)
+        assert half_width == 126
+
+    def test_packed_strokes_and_eraser(self):
+        """Stored (packed) strokes render the same; eraser strokes uncover the background."""
+        line = stroke([0, 0, 100, 0], color="#000000", width=10)
+        eraser = stroke([50, -20, 50, 20], color="#000000", width=10, globalCompositeOperation="destination-out")
+        _, _, plain = decode_png(render_board({"data": [line]})[0])
+        _, _, packed = decode_png(render_board({"data": pack_lines([line])})[0])
+        assert plain == packed
+
+        _, _, erased = decode_png(render_board({"data": [line, eraser]})[0])
+        middle = len(erased) // 2
+        assert erased[middle][29 + 20] == (0, 0, 0)
+        assert erased[middle][29 + 50] == (255, 255, 255)
+
+    def test_translucent_stroke_blends_once(self):
+        """A stroke crossing itself keeps one opacity instead of darkening where it overlaps."""
+        loop = stroke([0, 0, 40, 0, 40, 40, 0, 0, 40, 0], color="#000000", width=6, opacity=0.5)
+        _, _, rows = decode_png(render_board({"data": [loop]})[0])
+        assert rows[24][24 + 20] == (128, 128, 128)
+
+    def test_notes_and_text_boxes(self):
+        """Notes are filled with their color and text is laid out as bars inside them."""
+        board = {"notes": [{"id": "n", "x": 0, "y": 0, "text": "hello", "color": "#00ff00"}],
+                 "textBoxes": [{"id": "t", "x": 300, "y": 0, "text": "hi", "style": {"fontSize": "20px"}}]}
+        png, width, height = render_board(board)
+        _, _, rows = decode_png(png)
+        assert rows[24 + 100][24 + 170] == (0, 255, 0)
+        assert rows[24 + 12 + 8][24 + 14] != (0, 255, 0)
+        assert width == 24 + 300 + 200 + 24
+
+    def test_thumbnail_fits_frame(self):
+        """Thumbnails have a fixed size, whatever the board's extent."""
+        board = {"data": [stroke([0, 0, 10000, 5000], width=50)], "background": "#101010"}
+        width, height, rows = decode_png(render_board(board, 320, 180)[0])
+        assert (width, height) == (320, 180)
+        assert rows[0][0] == (16, 16, 16)
+        assert rows[90][160] == (255, 0, 0)
+
+    def test_empty_board(self):
+        _, width, height = render_board({})
+        assert (width, height) == (800, 450)
+        assert render_board({}, 320, 180)[1:] == (320, 180)
+
+
+class TestBoardImages:
+    """Test thumbnail and export caching by board version."""
+
+    @pytest.fixture
+    def images(self):
+        board_id = ObjectId()
+        boards = FakeCollection([{"_id": board_id, "data": [stroke([0, 0, 50, 50])], "version": 3}])
+        thumbnails = FakeCollection()
+        images = BoardImages(lambda: thumbnails, lambda: boards, RenderPool(workers=0), delay=0)
+        return images, board_id, boards, thumbnails
+
+    def test_thumbnail_rendered_once_per_version(self, images):
+        """The first request renders and stores the thumbnail; later ones are served from cache."""
+        images, board_id, boards, thumbnails = images
+        assert images.thumbnail(board_id)["version"] == 3
+        assert thumbnails.docs[board_id]["version"] == 3
+        assert images.thumbnail(board_id, 3)["version"] == 3
+        assert images.metrics["thumbnails_rendered"] == 1
+
+        boards.docs[board_id]["version"] = 4
+        assert images.thumbnail(board_id)["version"] == 3
+        assert images.thumbnail(board_id, 4)["version"] == 4
+        assert images.metrics["thumbnails_rendered"] == 2
+
+    def test_stored_thumbnail_is_shared(self, images):
+        """A thumbnail stored by another process is served without rendering."""
+        images, board_id, boards, thumbnails = images
+        thumbnails.docs[board_id] = {"_id": board_id, "version": 3, "png": b"png"}
+        assert images.thumbnail(board_id, 3)["png"] == b"png"
+        assert images.metrics["renders"] == 0
+
+    def test_changed_boards_rerender_on_tick(self, images):
+        """Scheduled boards are re-rendered by the ticker; missing boards are skipped."""
+        images, board_id, boards, thumbnails = images
+        images.renderer = object()
+        images.schedule([board_id, ObjectId()])
+        assert images.tick() == 1
+        assert thumbnails.docs[board_id]["version"] == 3
+        assert images.dirty == {}
+
+    def test_exports_cached_by_version_and_scale(self, images):
+        images, board_id, boards, thumbnails = images
+        assert images.export(board_id, 1.0)[0] == 3
+        images.export(board_id, 1.0)
+        images.export(board_id, 2.0)
+        assert (images.metrics["exports_rendered"], images.metrics["export_hits"]) == (2, 1)
+        boards.docs[board_id]["version"] = 4
+        assert images.export(board_id, 1.0)[0] == 4
+
+        images.forget([board_id])
+        assert images.exports == {} and images.export_bytes == 0
+        assert board_id not in thumbnails.docs
+
+    def test_process_pool(self):
+        """Renders run in worker processes."""
+        pool = RenderPool(workers=1)
+        try:
+            png, width, height = pool.run(render_board, {"data": [stroke([0, 0, 10, 10])]}, 32, 18)
+        finally:
+            pool.shutdown()
+        assert (width, height) == (32, 18)
+        assert decode_png(png)[:2] == (32, 18)
+
+
+class TestImageRoutes:
+    """Test the thumbnail and export endpoints."""
+
+    @pytest.fixture
+    def board(self, monkeypatch):
+        import routes.boards
+        from thumbnails import board_images
+
+        board_id = ObjectId()
+        boards = FakeCollection([{"_id": board_id, "data": [stroke([0, 0, 50, 50])], "version": 2}])
+        monkeypatch.setattr(routes.boards, "boards_collection", boards)
+        monkeypatch.setattr(db, "boards_collection", boards)
+        monkeypatch.setattr(db, "thumbnails_collection", FakeCollection())
+        monkeypatch.setattr(board_images.pool, "workers", 0)
+        yield str(board_id)
+        board_images.forget([board_id])
+
+    def test_thumbnail(self, client, board):
+        """Thumbnails are PNGs with a per-version ETag, answered with 304 when unchanged."""
+        response = client.get(f"/api/boards/{board}/thumbnail")
+        assert response.status_code == 200
+        assert response.mimetype == "image/png"
+        assert decode_png(response.data)[:2] == (320, 180)
+        etag = response.headers["ETag"]
+        assert f"{board}-2" in etag
+
+        response = client.get(f"/api/boards/{board}/thumbnail", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert client.get(f"/api/boards/{ObjectId()}/thumbnail").status_code == 404
+        assert client.get("/api/boards/nope/thumbnail").status_code == 400
+
+    def test_export(self, client, board):
+        response = client.get(f"/api/boards/{board}/export.png?scale=2&download=1")
+        assert response.status_code == 200
+        assert decode_png(response.data)[:2] == (204, 204)
+        assert "attachment" in response.headers["Content-Disposition"]
+        assert client.get(f"/api/boards/{board}/export.png?scale=100").status_code == 400
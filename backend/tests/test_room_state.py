@@ -0,0 +1,209 @@
+"""
+Room state tests.
+These tests verify the in-memory op log, compaction, snapshot-on-join and per-element room flushes.
+"""
+
+from bson import ObjectId
+
+import db
+from benchmark import MemoryCollection, install_collection
+from room_state import RoomRegistry, RoomState, load_room_from_board
+from stroke_codec import unpack_lines
+
+
+class TestRoomState:
+    """Test op recording and compaction of a single room."""
+
+    def test_line_updates_replace_by_id(self):
+        """In-progress stroke updates supersede earlier points for the same id."""
+        state = RoomState('room', [], [])
+        state.apply('line', {'id': 'a', 'points': [0, 0]})
+        state.apply('line', {'id': 'a', 'points': [0, 0, 5, 5]})
+
+        lines, _ = state.materialize()
+        assert lines == [{'id': 'a', 'points': [0, 0, 5, 5]}]
+
+    def test_compaction_folds_tail_into_snapshot(self):
+        """Once the tail reaches the threshold it is folded into the snapshot."""
+        state = RoomState('room', [], [], compact_every=2)
+        state.apply('note_added', {'id': 'n1', 'text': 'a'})
+        assert len(state.ops) == 1
+
+        state.apply('note_updated', {'id': 'n1', 'text': 'b'})
+        payload = state.join_payload()
+        assert payload['ops'] == []
+        assert payload['snapshot']['notes'] == [{'id': 'n1', 'text': 'b'}]
+        assert payload['snapshot']['seq'] == payload['seq'] == 2
+
+    def test_erase_replaces_lines(self):
+        """Erase carries the surviving lines, which become the snapshot."""
+        state = RoomState('room', [{'id': 'a'}, {'id': 'b'}], [])
+        state.apply('line', {'id': 'c'})
+        state.apply('erase', [{'id': 'b'}])
+
+        lines, _ = state.materialize()
+        assert lines == [{'id': 'b'}]
+        assert state.join_payload()['ops'] == []
+
+    def test_template_rooms_do_not_own_lines(self):
+        """Rooms seeded without strokes never write the board's data field."""
+        state = RoomState('room', None, [])
+        lines, notes = state.materialize()
+        assert lines is None
+        assert notes == []
+
+    def test_strokes_without_ids_are_kept(self):
+        """Strokes drawn before strokes carried ids get one instead of being dropped."""
+        state = RoomState('room', [{'points': [0, 0, 1, 1]}, {'id': 'a'}], [])
+        lines, _ = state.materialize()
+        assert len(lines) == 2
+        assert lines[0]['id'] is not None and lines[0]['points'] == [0, 0, 1, 1]
+
+    def test_changes_since_last_save(self):
+        """A flush writes only what changed since the last one; changed notes are modified in place."""
+        state = RoomState('room', [{'id': 'a'}, {'id': 'b'}], [{'id': 'n1', 'text': 'a'}])
+        state.apply('line', {'id': 'c'})
+        state.apply('erased', {'removed': ['a'], 'fragments': {}})
+        state.apply('note_updated', {'id': 'n1', 'text': 'b'})
+        ops, saved = state.changes()
+        assert ops == [
+            {'op': 'remove', 'field': 'data', 'id': 'a'},
+            {'op': 'remove', 'field': 'data', 'id': 'c'},
+            {'op': 'add', 'field': 'data', 'element': {'id': 'c'}},
+            {'op': 'modify', 'field': 'notes', 'id': 'n1', 'changes': {'text': 'b'}},
+        ]
+
+        state.mark_saved(saved)
+        assert state.changes()[0] == []
+        state.apply('note_deleted', 'n1')
+        assert state.changes()[0] == [{'op': 'remove', 'field': 'notes', 'id': 'n1'}]
+
+        # Ops already stored on the board, e.g. by the element endpoints, are not written again
+        state.apply('note_added', {'id': 'n2'}, saved=True)
+        assert state.changes()[0] == [{'op': 'remove', 'field': 'notes', 'id': 'n1'}]
+
+
+class TestRoomRegistry:
+    """Test loading and background flushing of rooms."""
+
+    def test_loader_runs_once_per_room(self):
+        """Only the first join of a room reads the board."""
+        calls = []
+
+        def loader(room):
+            calls.append(room)
+            return [{'id': 'a'}], []
+
+        registry = RoomRegistry()
+        registry.join('room', 'sid1', loader)
+        registry.join('room', 'sid2', loader)
+        assert calls == ['room']
+
+    def test_flush_writes_dirty_rooms_and_evicts_idle(self):
+        """Dirty rooms are written once and empty rooms are dropped."""
+        written = []
+        registry = RoomRegistry()
+        state = registry.join('room', 'sid1')
+        state.apply('line', {'id': 'a'})
+        registry.leave('room', 'sid1')
+
+        registry.flush(lambda room, ops: written.append((room, ops)), idle_ttl=0)
+        assert written == [('room', [{'op': 'remove', 'field': 'data', 'id': 'a'},
+                                     {'op': 'add', 'field': 'data', 'element': {'id': 'a'}}])]
+        assert registry.get('room') is None
+
+    def test_failed_flush_is_retried(self):
+        """Changes that failed to land are written again on the next flush."""
+        def failing(room, ops):
+            raise RuntimeError("down")
+
+        written = []
+        registry = RoomRegistry()
+        state = registry.join('room', 'sid1')
+        state.apply('line', {'id': 'a'})
+        assert registry.flush(failing) == 0
+        assert state.dirty
+        registry.flush(lambda room, ops: written.append(ops))
+        assert len(written) == 1 and written[0][-1]['element'] == {'id': 'a'}
+
+    def test_load_stores_ids_of_strokes(self):
+        """Ids given to id-less strokes on load are stored with the board, keeping its version."""
+        collection = MemoryCollection()
+        board_id = ObjectId()
+        collection.insert_one({"_id": board_id, "data": [{"points": [0, 0, 5, 5]}], "version": 3})
+        lines, _ = load_room_from_board(collection, str(board_id))
+        stored = collection.find_one({"_id": board_id})
+        assert stored["version"] == 3
+        assert [line["id"] for line in unpack_lines(stored["data"])] == [lines[0]["id"]]
+
+    def test_load_includes_queued_saves(self):
+        """A save still waiting in the write-behind queue is part of the room's state."""
+        from persistence import board_writes
+
+        collection = MemoryCollection()
+        board_id = ObjectId()
+        collection.insert_one({"_id": board_id, "data": [], "notes": [], "version": 1})
+        previous = install_collection(collection)
+        try:
+            board_writes.enqueue(board_id, {"notes": [{"id": "n1", "text": "hi"}]}, {"version": 1})
+            _, notes = load_room_from_board(collection, str(board_id))
+            assert notes == [{"id": "n1", "text": "hi"}]
+        finally:
+            board_writes.flush(board_id)
+            install_collection(*previous)
+
+
+class TestRoomStateEvents:
+    """Test snapshot delivery over Socket.IO."""
+
+    def test_join_receives_snapshot_and_tail(self, app_context):
+        """A late joiner receives strokes drawn before it joined."""
+        from app import socketio, app
+
+        client1 = socketio.test_client(app)
+        client2 = socketio.test_client(app)
+        try:
+            client1.emit('join', {'room': 'snapshot_room'})
+            client1.emit('drawing', {'room': 'snapshot_room', 'line': {'id': 'l1', 'points': [1, 2]}})
+
+            client2.emit('join', {'room': 'snapshot_room'})
+            received = [r for r in client2.get_received() if r['name'] == 'load_board_state']
+            assert len(received) == 1
+
+            payload = received[0]['args'][0]
+            assert payload['ops'][-1]['data']['id'] == 'l1'
+        finally:
+            client1.disconnect()
+            client2.disconnect()
+
+    def test_flush_keeps_writes_made_outside_the_room(self, app_context, monkeypatch):
+        """A room flush writes its own elements only: legacy strokes and concurrent REST writes survive."""
+        import app as app_module
+        from app import socketio, app
+
+        collection = MemoryCollection()
+        board_id = ObjectId()
+        collection.insert_one({"_id": board_id, "userId": "u", "title": "t", "version": 1,
+                               "data": [{"points": [0, 0, 5, 5], "color": "#000"}], "notes": []})
+        elements = MemoryCollection()
+        previous = install_collection(collection, elements)
+        monkeypatch.setattr(db, "history_collection", None)
+        monkeypatch.setattr(db, "thumbnails_collection", None)
+        client = socketio.test_client(app)
+        try:
+            room = str(board_id)
+            client.emit('join', {'room': room})
+            client.emit('drawing', {'room': room, 'line': {'id': 'l1', 'points': [1, 2, 3, 4]}})
+            # A note added over REST while the room is live
+            response = app.test_client().post(f"/api/boards/{room}/elements/notes",
+                                              json={"element": {"id": "n1", "text": "hi"}})
+            assert response.status_code == 201
+
+            app_module.room_registry.flush(app_module.write_room_ops)
+            board = collection.find_one({"_id": board_id})
+            assert len(unpack_lines(board["data"])) == 2
+            assert board["version"] == 3
+            assert [doc["elementId"] for doc in elements.find({"boardId": board_id})] == ["n1"]
+        finally:
+            client.disconnect()
+            install_collection(*previous)
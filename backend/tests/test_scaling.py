@@ -0,0 +1,68 @@
+"""
+Multi-process Socket.IO tests.
+These tests verify the message queue wiring with the in-process stand-in.
+"""
+
+import eventlet
+import socketio
+
+from room_state import RoomState
+from scaling import LocalPubSubManager, create_client_manager
+
+
+def start_server(channel):
+    manager = LocalPubSubManager(channel=channel)
+    server = socketio.Server(client_manager=manager, async_mode='eventlet')
+    # Normally done on the first client connection
+    server.manager_initialized = True
+    manager.initialize()
+    return server, manager
+
+
+class TestClientManagerSelection:
+    """Test picking a client manager from the queue URL."""
+
+    def test_no_queue_runs_single_process(self):
+        """Without a queue URL the default in-memory manager is used."""
+        assert create_client_manager('') is None
+
+    def test_local_queue(self):
+        """local:// selects the in-process stand-in."""
+        assert isinstance(create_client_manager('local://'), LocalPubSubManager)
+
+
+class TestLocalPubSub:
+    """Test room events crossing process boundaries through the stand-in queue."""
+
+    def test_remote_emits_reach_the_hook(self):
+        """Emits from one server are handed to the other server's hook only."""
+        server_a, manager_a = start_server('test-remote-emits')
+        server_b, manager_b = start_server('test-remote-emits')
+        seen_a, seen_b = [], []
+        manager_a.on_remote_emit = lambda event, data: seen_a.append((event, data))
+        manager_b.on_remote_emit = lambda event, data: seen_b.append((event, data))
+        eventlet.sleep(0.01)
+
+        line = {'room': 'r', 'line': {'id': 'l1', 'points': [0, 0]}}
+        server_a.emit('drawing', line, to='r')
+        eventlet.sleep(0.05)
+
+        assert seen_b == [('drawing', line)]
+        assert seen_a == []
+
+    def test_replicated_ops_are_not_flushed_twice(self):
+        """Only the process that received an op from its client persists it."""
+        state = RoomState('room', [], [])
+        state.apply('line', {'id': 'l1'}, replicated=True)
+
+        assert not state.dirty
+        assert state.materialize()[0] == [{'id': 'l1'}]
+
+    def test_replace_from_peer_state(self):
+        """A freshly loaded room adopts a peer's snapshot plus tail."""
+        peer = RoomState('room', [{'id': 'a'}], [])
+        peer.apply('line', {'id': 'b'})
+        state = RoomState('room', [], [])
+        state.replace_from(peer.join_payload())
+
+        assert state.materialize()[0] == [{'id': 'a'}, {'id': 'b'}]
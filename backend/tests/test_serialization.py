@@ -0,0 +1,60 @@
+"""
+JSON serialization tests.
+These tests verify that both backends encode board payloads the same way.
+"""
+
+from datetime import datetime, timezone
+
+import pytest
+from bson import ObjectId
+
+import serialization
+from serialization import OrjsonBackend, StdlibBackend
+
+BACKENDS = [StdlibBackend]
+if serialization.orjson is not None:
+    BACKENDS.append(OrjsonBackend)
+
+
+class TestBackends:
+    """Test the orjson and stdlib encoders."""
+
+    @pytest.mark.parametrize('backend', BACKENDS)
+    def test_bson_types(self, backend):
+        """ObjectIds become strings and naive datetimes are marked UTC."""
+        oid = ObjectId()
+        payload = {'id': oid, 'createdAt': datetime(2024, 5, 1, 12, 30)}
+        assert backend.loads(backend.dumps_bytes(payload)) == {
+            'id': str(oid),
+            'createdAt': '2024-05-01T12:30:00+00:00',
+        }
+
+    @pytest.mark.parametrize('backend', BACKENDS)
+    def test_aware_datetime(self, backend):
+        """Aware datetimes keep their offset."""
+        value = datetime(2024, 5, 1, tzinfo=timezone.utc)
+        assert backend.loads(backend.dumps_bytes([value])) == ['2024-05-01T00:00:00+00:00']
+
+    def test_backends_agree(self):
+        """Both backends decode to the same document."""
+        payload = {'data': [{'id': 'l1', 'points': [1, 2.5, 3, 4]}], 'title': 'Übersicht', 'n': None}
+        decoded = [backend.loads(backend.dumps_bytes(payload)) for backend in BACKENDS]
+        assert all(d == payload for d in decoded)
+
+    def test_unknown_types_fail(self):
+        """Types without an encoding raise TypeError."""
+        for backend in BACKENDS:
+            with pytest.raises(TypeError):
+                backend.dumps_bytes({'x': object()})
+
+
+class TestFlaskProvider:
+    """Test the Flask JSON provider."""
+
+    def test_jsonify_handles_object_ids(self, app_context):
+        """jsonify encodes ObjectIds without manual conversion."""
+        from flask import jsonify
+        oid = ObjectId()
+        response = jsonify({'id': oid})
+        assert response.mimetype == 'application/json'
+        assert response.get_json() == {'id': str(oid)}
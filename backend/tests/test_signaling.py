@@ -0,0 +1,155 @@
+"""
+WebRTC signaling tests.
+These tests verify voice room membership, ICE candidate batching and target validation.
+"""
+
+import pytest
+
+from signaling import CandidateRelay, VoiceRooms
+
+
+def candidate(n):
+    return {'candidate': f'candidate:{n} 1 udp 2122260223 10.0.0.{n} 5000 typ host', 'sdpMid': '0',
+            'sdpMLineIndex': 0}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def relay(window=0.05):
+    sent = []
+    clock = FakeClock()
+    return CandidateRelay(lambda *args: sent.append(args), window=window, clock=clock), sent, clock
+
+
+class TestVoiceRooms:
+    """Test voice room membership."""
+
+    def test_join_returns_existing_peers(self):
+        """Each joiner learns the members already present."""
+        rooms = VoiceRooms()
+        assert rooms.join('r', 'a') == []
+        assert rooms.join('r', 'b') == ['a']
+        assert rooms.join('r', 'c') == ['a', 'b']
+        assert rooms.shared('r', 'a', 'c')
+        assert not rooms.shared('other', 'a', 'c')
+
+    def test_leave_all(self):
+        """Disconnects leave every room and empty rooms are dropped."""
+        rooms = VoiceRooms()
+        rooms.join('r1', 'a')
+        rooms.join('r2', 'a')
+        rooms.join('r2', 'b')
+        assert rooms.leave_all('a') == ['r1', 'r2']
+        assert rooms.members == {'r2': {'b'}}
+        assert not rooms.leave('r2', 'a')
+
+
+class TestCandidateRelay:
+    """Test batching and deduplication of ICE candidates."""
+
+    def test_candidates_within_window_share_one_message(self):
+        """Candidates for one pair are sent together once the window passes."""
+        candidates, sent, clock = relay()
+        candidates.queue('a', 'b', 'r', [candidate(1)])
+        candidates.queue('a', 'b', 'r', [candidate(2), candidate(3)])
+        candidates.queue('a', 'c', 'r', [candidate(1)])
+        assert candidates.tick() == 0
+
+        clock.now = 0.05
+        assert candidates.tick() == 2
+        assert sent[0] == ('a', 'b', 'r', [candidate(1), candidate(2), candidate(3)])
+        assert candidates.stats()['candidates_sent'] == 4
+
+    def test_duplicates_dropped_until_next_offer(self):
+        """A candidate is relayed once per negotiation."""
+        candidates, sent, _ = relay(window=0)
+        assert candidates.queue('a', 'b', 'r', [candidate(1), candidate(1)]) == 1
+        assert candidates.queue('a', 'b', 'r', [candidate(1)]) == 0
+        assert candidates.metrics['duplicates'] == 2
+
+        candidates.restart('a', 'b')
+        assert candidates.queue('a', 'b', 'r', [candidate(1)]) == 1
+        assert len(sent) == 2
+
+    def test_pending_sent_ahead_of_offer(self):
+        """Restarting flushes what is pending so it is not reordered behind the offer."""
+        candidates, sent, _ = relay()
+        candidates.queue('a', 'b', 'r', [candidate(1)])
+        candidates.restart('a', 'b')
+        assert sent == [('a', 'b', 'r', [candidate(1)])]
+
+    def test_per_pair_cap(self):
+        """Candidates past the cap are dropped."""
+        candidates, _, _ = relay()
+        candidates.max_candidates = 2
+        assert candidates.queue('a', 'b', 'r', [candidate(n) for n in range(5)]) == 2
+        assert candidates.metrics['dropped'] == 3
+
+    def test_forget(self):
+        """Leaving drops state for pairs with the given peers only."""
+        candidates, sent, _ = relay()
+        candidates.queue('a', 'b', 'r', [candidate(1)])
+        candidates.queue('c', 'a', 'r', [candidate(1)])
+        candidates.queue('b', 'c', 'r', [candidate(1)])
+        candidates.forget('a', ['b'])
+        assert set(candidates.pending) == {('c', 'a'), ('b', 'c')}
+        candidates.forget('a')
+        assert set(candidates.pending) == {('b', 'c')}
+        assert sent == []
+
+
+class TestSignalingEvents:
+    """Test voice signaling over Socket.IO."""
+
+    @pytest.fixture
+    def peers(self, app_context):
+        from app import socketio, app
+        clients = [socketio.test_client(app) for _ in range(3)]
+        yield clients, [socketio.server.manager.sid_from_eio_sid(c.eio_sid, '/') for c in clients]
+        for client in clients:
+            if client.is_connected():
+                client.disconnect()
+
+    def test_joiner_gets_peer_list(self, peers):
+        """One voice-peers message lists the members already in the room."""
+        clients, sids = peers
+        for client in clients:
+            client.emit('voice-join', {'room': 'v1'})
+        replies = [r['args'][0] for r in clients[2].get_received() if r['name'] == 'voice-peers']
+        assert replies == [{'room': 'v1', 'peers': sorted(sids[:2])}]
+
+    def test_candidates_batched_and_validated(self, peers):
+        """Candidates reach a room member in one message; outsiders get nothing."""
+        import app as app_module
+
+        clients, sids = peers
+        clients[0].emit('voice-join', {'room': 'v2'})
+        clients[1].emit('voice-join', {'room': 'v2'})
+        for n in range(3):
+            clients[0].emit('ice-candidate', {'room': 'v2', 'targetUserId': sids[1], 'candidate': candidate(n)})
+        clients[0].emit('ice-candidate', {'room': 'v2', 'targetUserId': sids[1], 'candidates': [candidate(0)]})
+        clients[0].emit('ice-candidate', {'room': 'v2', 'targetUserId': sids[2], 'candidate': candidate(9)})
+        app_module.candidate_relay.flush_pair(sids[0], sids[1])
+
+        batches = [r['args'][0] for r in clients[1].get_received() if r['name'] == 'ice-candidates']
+        assert batches == [{'userId': sids[0], 'room': 'v2', 'candidates': [candidate(n) for n in range(3)]}]
+        assert not [r for r in clients[2].get_received() if r['name'].startswith('ice-candidate')]
+
+    def test_disconnect_leaves_voice_room(self, peers):
+        """Peers learn about members that drop without voice-leave."""
+        import app as app_module
+
+        clients, sids = peers
+        clients[0].emit('voice-join', {'room': 'v3'})
+        clients[1].emit('voice-join', {'room': 'v3'})
+        clients[1].get_received()
+        clients[0].disconnect()
+        left = [r['args'][0] for r in clients[1].get_received() if r['name'] == 'user-left']
+        assert left == [{'room': 'v3', 'userId': sids[0]}]
+        assert app_module.voice_rooms.members['v3'] == {sids[1]}
@@ -0,0 +1,113 @@
+"""
+Stroke simplification tests.
+These tests verify point decimation and the offline compaction pass.
+"""
+
+import math
+import random
+
+import pytest
+from bson import ObjectId
+
+import simplify
+from simplify import (
+    douglas_peucker, radial_distance, simplify_lines, tolerance_for_zoom
+)
+
+
+class TestSimplification:
+    """Test the decimation stages on flat point lists."""
+
+    def test_collinear_points_collapse_to_endpoints(self):
+        """Points on a straight segment carry no shape information."""
+        points = []
+        for i in range(50):
+            points.extend([i, i * 2])
+        assert douglas_peucker(points, 0.5) == [0, 0, 49, 98]
+
+    def test_corners_are_kept(self):
+        """A point further than the tolerance from the chord is kept."""
+        points = [0, 0, 5, 0, 10, 0, 10, 5, 10, 10]
+        assert douglas_peucker(points, 0.5) == [0, 0, 10, 0, 10, 10]
+
+    def test_radial_pass_keeps_endpoints(self):
+        """Dense samples are dropped but the stroke keeps its ends."""
+        points = [0, 0, 0.1, 0, 0.2, 0, 0.3, 0, 5, 0]
+        assert radial_distance(points, 1) == [0, 0, 5, 0]
+
+    def test_numpy_keeps_the_same_points(self, monkeypatch):
+        """Long strokes simplified with numpy match the plain Python pass point for point."""
+        pytest.importorskip('numpy')
+        rng = random.Random(7)
+        points = []
+        for i in range(3000):
+            points.extend([i * 0.8 + rng.uniform(-1, 1), math.sin(i / 40) * 200 + rng.uniform(-1, 1)])
+        points.extend([2400, 0, 2400, 0, 2400, 0])
+
+        vectorized = douglas_peucker(points, 0.5)
+        monkeypatch.setattr(simplify, 'np', None)
+        assert vectorized == douglas_peucker(points, 0.5)
+        assert 2 < len(vectorized) // 2 < 3003
+
+    def test_tolerance_scales_with_zoom(self):
+        """Zoomed-in strokes are simplified with a finer tolerance."""
+        assert tolerance_for_zoom(2, base=1) == 0.5
+        assert tolerance_for_zoom('bad', base=1) == 1
+
+
+class TestSimplifyLines:
+    """Test simplification of a board's data array."""
+
+    def test_reports_points_before_and_after(self):
+        """Strokes are simplified and counted; other elements are untouched."""
+        stroke = {'id': 'a', 'points': [0, 0, 1, 0, 2, 0, 3, 0, 4, 0]}
+        template = {'id': 'k', 'type': 'kanban-column'}
+        data, before, after = simplify_lines([stroke, template], tolerance=0.5)
+
+        assert data == [{'id': 'a', 'points': [0, 0, 4, 0]}, template]
+        assert (before, after) == (5, 2)
+
+    def test_non_list_data_is_returned_as_is(self):
+        """Legacy string data is left alone."""
+        assert simplify_lines('[]', tolerance=0.5) == ('[]', 0, 0)
+
+    def test_kept_strokes_are_not_simplified(self):
+        """Strokes listed in `keep` pass through and are not counted."""
+        stored = {'id': 'a', 'points': [0, 0, 1, 0, 2, 0]}
+        drawn = {'id': 'b', 'points': [0, 0, 1, 0, 2, 0]}
+        data, before, after = simplify_lines([stored, drawn], tolerance=0.5, keep={'a'})
+
+        assert data == [stored, {'id': 'b', 'points': [0, 0, 2, 0]}]
+        assert (before, after) == (3, 2)
+
+
+class TestBoardSaves:
+    """Full-board saves simplify only the strokes they add."""
+
+    def test_stored_strokes_keep_their_points(self, client, monkeypatch):
+        """A stroke already on the board keeps its points; a new one is simplified."""
+        from benchmark import MemoryCollection, install_collection
+        from persistence import board_writes
+        from stroke_codec import pack_lines, unpack_lines
+        import db
+
+        collection = MemoryCollection()
+        board_id = ObjectId()
+        stored = {'id': 'a', 'points': [0, 0, 1, 0.2, 2, 0, 3, 0.2, 4, 0], 'color': '#000000', 'strokeWidth': 2}
+        collection.insert_one({'_id': board_id, 'userId': 'u', 'title': 't', 'version': 1,
+                               'data': pack_lines([stored])})
+        previous = install_collection(collection)
+        monkeypatch.setattr(db, 'history_collection', None)
+        monkeypatch.setattr(db, 'thumbnails_collection', None)
+        try:
+            drawn = dict(stored, id='b')
+            response = client.put('/api/boards/update', json={
+                'boardId': str(board_id), 'data': [stored, drawn], 'zoom': 0.25})
+            assert response.status_code == 200
+            board_writes.flush(board_id)
+
+            lines = {line['id']: line for line in unpack_lines(collection.find_one({'_id': board_id})['data'])}
+            assert len(lines['a']['points']) == len(stored['points'])
+            assert len(lines['b']['points']) < len(stored['points'])
+        finally:
+            install_collection(*previous)
@@ -0,0 +1,110 @@
+"""
+Binary stroke codec tests.
+These tests verify encoding, validation and storage packing of strokes.
+"""
+
+import json
+
+import pytest
+
+import stroke_codec
+from stroke_codec import (
+    StrokeCodecError, decode_stroke, encode_stroke, pack_lines, unpack_lines
+)
+
+
+def make_line(points, **overrides):
+    line = {
+        'id': 'stroke-1',
+        'points': points,
+        'color': '#ff00aa',
+        'strokeWidth': 4,
+        'opacity': 0.5,
+        'isHighlight': True,
+        'globalCompositeOperation': 'multiply',
+    }
+    line.update(overrides)
+    return line
+
+
+class TestStrokeCodec:
+    """Test the binary stroke round trip."""
+
+    def test_round_trip(self):
+        """Decoding returns the line with points quantized to a tenth of a pixel."""
+        line = make_line([10.04, 20.25, 11, 21, 400, -3000.1])
+        decoded = decode_stroke(encode_stroke(line))
+
+        assert decoded == dict(line, points=[10, 20.2, 11, 21, 400, -3000.1])
+
+    def test_wide_jumps_round_trip(self):
+        """Jumps that overflow int16 deltas switch to int32."""
+        line = make_line([0, 0, 50000, -50000])
+        assert decode_stroke(encode_stroke(line))['points'] == [0, 0, 50000, -50000]
+
+    def test_binary_is_smaller_than_json(self):
+        """Long strokes shrink several-fold compared to JSON."""
+        points = []
+        for i in range(1000):
+            points.extend([100 + i * 0.37, 200 + (i % 17) * 1.13])
+        line = make_line([round(p, 2) for p in points])
+
+        assert len(encode_stroke(line)) * 3 < len(json.dumps(line))
+
+    def test_unsupported_fields_rejected(self):
+        """Lines with extra fields cannot be packed without losing them."""
+        with pytest.raises(StrokeCodecError):
+            encode_stroke(make_line([0, 0], tension=0.5))
+
+    def test_truncated_payload_rejected(self):
+        """Decoding validates the point data length."""
+        payload = encode_stroke(make_line([0, 0, 1, 1, 2, 2]))
+        with pytest.raises(StrokeCodecError):
+            decode_stroke(payload[:-1])
+
+    def test_point_cap_applies_to_encoding_only(self, monkeypatch):
+        """Strokes over MAX_STROKE_POINTS are not packed, but ones stored under a larger cap still decode."""
+        line = make_line([0, 0, 1, 1, 2, 2])
+        payload = encode_stroke(line)
+        monkeypatch.setattr(stroke_codec, 'MAX_STROKE_POINTS', 2)
+
+        with pytest.raises(StrokeCodecError):
+            encode_stroke(line)
+        assert decode_stroke(payload)['points'] == [0, 0, 1, 1, 2, 2]
+
+
+class TestStrokeStorage:
+    """Test packing strokes into a board's data field."""
+
+    def test_pack_keeps_id_and_falls_back_to_json(self):
+        """Packed strokes keep their id; unsupported lines stay as they are."""
+        custom = {'id': 'custom', 'points': [0, 0], 'color': 'red'}
+        packed = pack_lines([make_line([1, 2, 3, 4]), custom])
+
+        assert packed[0]['id'] == 'stroke-1'
+        assert isinstance(packed[0]['stroke'], bytes)
+        assert packed[1] is custom
+
+    def test_unpack_applies_positional_updates(self):
+        """Fields set next to a packed stroke override the decoded values."""
+        packed = pack_lines([make_line([1, 2, 3, 4])])
+        packed[0]['color'] = '#000000'
+
+        assert unpack_lines(packed)[0]['color'] == '#000000'
+
+    def test_decoded_strokes_are_cached_by_bytes(self, monkeypatch):
+        """A stroke read again, from any copy of its bytes, is not decoded again; each read gets its own dict."""
+        cache = stroke_codec.DecodedStrokes(max_points=3)
+        monkeypatch.setattr(stroke_codec, 'decoded_strokes', cache)
+        packed = pack_lines([make_line([1, 2, 3, 4])])
+        packed[0]['color'] = '#000000'
+
+        first = unpack_lines(packed)[0]
+        again = unpack_lines([dict(packed[0], stroke=bytes(packed[0]['stroke']))])[0]
+        assert first == again and first is not again
+        assert first['color'] == '#000000'
+        assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+        # Points beyond the bound evict the least recently used strokes
+        unpack_lines(pack_lines([make_line([5, 6, 7, 8], id='other')]))
+        assert cache.stats() == {'hits': 1, 'misses': 2, 'evictions': 1, 'entries': 1, 'points': 2}
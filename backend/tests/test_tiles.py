@@ -0,0 +1,113 @@
+"""
+Spatial tiling tests.
+These tests verify element bounds, viewport parsing and the tile index.
+"""
+
+import pytest
+
+from stroke_codec import pack_lines, unpack_lines
+from tiles import TileIndex, element_bounds, in_viewport, parse_viewport
+
+
+class TestBounds:
+    """Test bounding boxes of board elements."""
+
+    def test_line_bounds_include_stroke_width(self):
+        """Strokes are padded by half their width."""
+        line = {'id': 'l1', 'points': [10, 20, 30, 5], 'strokeWidth': 4}
+        assert element_bounds(line) == [8, 3, 32, 22]
+
+    def test_note_bounds(self):
+        """Notes and text boxes use their position and size."""
+        assert element_bounds({'id': 'n1', 'x': 5, 'y': 6, 'width': 10, 'height': 20}) == [5, 6, 15, 26]
+
+    def test_elements_without_geometry(self):
+        """Elements without coordinates have no bounds and are always kept."""
+        element = {'id': 'odd'}
+        assert element_bounds(element) is None
+        assert in_viewport([element], [0, 0, 1, 1]) == [element]
+
+    def test_packed_lines_store_bbox(self):
+        """Packed strokes carry a bbox that is stripped again on unpacking."""
+        line = {'id': 'l1', 'points': [0, 0, 100, 50], 'color': '#000000', 'strokeWidth': 2}
+        packed = pack_lines([line])
+        assert packed[0]['bbox'] == [-1, -1, 101, 51]
+        assert 'bbox' not in unpack_lines(packed)[0]
+
+
+class TestViewport:
+    """Test viewport parsing and filtering."""
+
+    def test_parse(self):
+        """x/y/width/height become a rectangle."""
+        assert parse_viewport({'x': '10', 'y': '-5', 'width': '100', 'height': '50'}) == [10, -5, 110, 45]
+
+    @pytest.mark.parametrize('values', [
+        {'x': 0, 'y': 0, 'width': 10},
+        {'x': 0, 'y': 0, 'width': 0, 'height': 10},
+        {'x': 'nan', 'y': 0, 'width': 10, 'height': 10},
+        {'x': 0, 'y': 0, 'width': 10 ** 9, 'height': 10},
+    ])
+    def test_invalid(self, values):
+        """Missing, empty, non-finite and oversized viewports are rejected."""
+        with pytest.raises(ValueError):
+            parse_viewport(values)
+
+    def test_filter(self):
+        """Only intersecting elements are returned."""
+        near = {'id': 'a', 'points': [5, 5, 10, 10]}
+        far = {'id': 'b', 'points': [5000, 5000, 5010, 5010]}
+        assert in_viewport([near, far], [0, 0, 100, 100]) == [near]
+
+
+class TestTileIndex:
+    """Test the grid index."""
+
+    def test_query_finds_intersecting_keys(self):
+        """Queries return the keys whose rectangle intersects."""
+        index = TileIndex(tile_size=100)
+        index.insert('a', [0, 0, 50, 50])
+        index.insert('b', [250, 250, 400, 400])
+        assert index.query([40, 40, 60, 60]) == {'a'}
+        assert index.query([0, 0, 1000, 1000]) == {'a', 'b'}
+        assert index.query([60, 60, 90, 90]) == set()
+
+    def test_reinsert_moves_key(self):
+        """Inserting a key again replaces its rectangle."""
+        index = TileIndex(tile_size=100)
+        index.insert('a', [0, 0, 10, 10])
+        index.insert('a', [500, 500, 510, 510])
+        assert index.query([0, 0, 10, 10]) == set()
+        assert index.query([505, 505, 506, 506]) == {'a'}
+
+    def test_remove(self):
+        """Removed keys leave no empty tiles behind."""
+        index = TileIndex(tile_size=100)
+        index.insert('a', [0, 0, 150, 150])
+        index.remove('a')
+        assert len(index) == 0
+        assert index.tiles == {}
+
+    def test_huge_rect_is_not_spread_over_tiles(self):
+        """A rectangle over the tile limit is one overflow entry that queries still find."""
+        index = TileIndex(tile_size=100)
+        index.insert('small', [0, 0, 10, 10])
+        index.insert('huge', [-1e9, -1e9, 1e9, 1e9])
+        assert index.oversized == {'huge'}
+        assert len(index.tiles) == 1
+        assert index.query([5, 5, 6, 6]) == {'small', 'huge'}
+        assert index.query([5e8, 5e8, 5e8 + 1, 5e8 + 1]) == {'huge'}
+
+        index.insert('huge', [300, 300, 310, 310])
+        assert index.oversized == set()
+        index.remove('huge')
+        assert index.query([0, 0, 1e3, 1e3]) == {'small'}
+
+
+class TestViewportEndpoint:
+    """Test request validation on the viewport endpoint."""
+
+    def test_missing_viewport(self, client):
+        """A viewport rectangle is required."""
+        response = client.get('/api/boards/507f1f77bcf86cd799439011/viewport?x=0&y=0')
+        assert response.status_code == 400
@@ -0,0 +1,308 @@
+import atexit
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from bson import Binary
+from pymongo.errors import DuplicateKeyError
+
+import db
+from db_pool import DBUnavailable
+from elements import STORED_FLAG, board_elements
+from log import get_logger
+from persistence import board_writes
+from render import THUMBNAIL_HEIGHT, THUMBNAIL_WIDTH, render_board
+
+log = get_logger('thumbnails')
+
+# Processes rendering thumbnails and exports; 0 renders in the calling thread
+RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS', 2))
+# How render processes are started: "spawn" (default) or "fork"
+RENDER_START_METHOD = os.environ.get('RENDER_START_METHOD', 'spawn')
+# Seconds a render may take before the request waiting on it gives up
+RENDER_TIMEOUT = float(os.environ.get('RENDER_TIMEOUT', 30))
+# Seconds after a board changes before its thumbnail is re-rendered, so a burst of autosaves renders once
+THUMBNAIL_DELAY = float(os.environ.get('THUMBNAIL_DELAY', 10))
+# Thumbnails kept in memory, on top of the stored copies
+THUMBNAIL_CACHE_ENTRIES = int(os.environ.get('THUMBNAIL_CACHE_ENTRIES', 1024))
+# Bytes of rendered exports kept in memory
+EXPORT_CACHE_MAX_BYTES = int(os.environ.get('EXPORT_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+
+# Export scales accepted by GET /api/boards/<boardId>/export.png
+EXPORT_MIN_SCALE = 0.1
+EXPORT_MAX_SCALE = 4.0
+
+# Board fields a render reads
+RENDER_PROJECTION = {"data": 1, "notes": 1, "textBoxes": 1, "background": 1, "version": 1, STORED_FLAG: 1}
+
+
+class RenderPool:
+    """Runs renders in worker processes, so rasterizing never blocks the event loop.
+
+    Workers are started on first use; a pool that lost a worker is replaced
+    on the next render. With `workers` set to 0 renders run inline.
+    """
+
+    def __init__(self, workers=RENDER_WORKERS, start_method=RENDER_START_METHOD, timeout=RENDER_TIMEOUT):
+        self.workers = workers
+        self.start_method = start_method
+        self.timeout = timeout
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def run(self, fn, *args, **kwargs):
+        if self.workers <= 0:
+            return fn(*args, **kwargs)
+        executor = self._executor()
+        try:
+            return executor.submit(fn, *args, **kwargs).result(timeout=self.timeout)
+        except concurrent.futures.process.BrokenProcessPool:
+            with self.lock:
+                if self.executor is executor:
+                    self.executor = None
+            raise
+
+    def shutdown(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = concurrent.futures.ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context(self.start_method)
+                )
+                # Under eventlet the executor's own exit hook never runs and the
+                # interpreter would wait forever on the idle workers
+                atexit.unregister(self.shutdown)
+                atexit.register(self.shutdown)
+                log.info("Render pool started", workers=self.workers, start_method=self.start_method)
+            return self.executor
+
+
+class BoardImages:
+    """Thumbnails and exports of boards, rendered in a RenderPool and cached by board version.
+
+    Thumbnails are stored in MongoDB, one per board along with the version
+    they show, so the dashboard loads a few KB image per card instead of the
+    board. Changed boards are marked dirty and a background thread
+    re-renders the ones first marked at least `delay` seconds ago. Exports
+    are rendered on request and kept in a byte-bounded LRU keyed by board,
+    version and scale.
+    """
+
+    def __init__(self, collection_getter, boards_getter, pool, delay=THUMBNAIL_DELAY,
+                 max_thumbnails=THUMBNAIL_CACHE_ENTRIES, max_export_bytes=EXPORT_CACHE_MAX_BYTES,
+                 clock=time.monotonic):
+        self.collection_getter = collection_getter
+        self.boards_getter = boards_getter
+        self.pool = pool
+        self.delay = delay
+        self.max_thumbnails = max_thumbnails
+        self.max_export_bytes = max_export_bytes
+        self.clock = clock
+        # board id -> when it was first marked since its last render
+        self.dirty = {}
+        # board id -> {"version", "png"}
+        self.thumbnails = OrderedDict()
+        # (board id, version, scale) -> png
+        self.exports = OrderedDict()
+        self.export_bytes = 0
+        self.lock = threading.Lock()
+        self.renderer = None
+        self.metrics = {
+            "renders": 0,
+            "render_errors": 0,
+            "render_ms_total": 0.0,
+            "thumbnail_hits": 0,
+            "thumbnails_rendered": 0,
+            "export_hits": 0,
+            "exports_rendered": 0,
+        }
+
+    def schedule(self, board_ids):
+        """Mark boards whose content changed; their thumbnails are re-rendered after `delay`."""
+        now = self.clock()
+        with self.lock:
+            for board_id in board_ids:
+                self.dirty.setdefault(board_id, now)
+            if self.renderer is None and self.dirty:
+                self.renderer = threading.Thread(target=self.run_forever, daemon=True)
+                self.renderer.start()
+
+    def thumbnail(self, board_id, min_version=None):
+        """{"version", "png"} of a board's thumbnail, or None if the board does not exist.
+
+        The thumbnail is rendered now when there is none yet, or when the
+        newest one predates `min_version`.
+        """
+        def fresh(entry):
+            return entry is not None and (min_version is None or entry["version"] >= min_version)
+
+        with self.lock:
+            entry = self.thumbnails.get(board_id)
+            if entry is not None:
+                self.thumbnails.move_to_end(board_id)
+        if not fresh(entry):
+            entry = self._load_thumbnail(board_id) or entry
+        if fresh(entry):
+            self.metrics["thumbnail_hits"] += 1
+            return entry
+        return self.render_thumbnail(board_id)
+
+    def render_thumbnail(self, board_id):
+        board = self._load_board(board_id, RENDER_PROJECTION)
+        if board is None:
+            return None
+        png = self._render(board, THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT)[0]
+        entry = {"version": board.get("version", 0), "png": png}
+        self.metrics["thumbnails_rendered"] += 1
+        self._remember_thumbnail(board_id, entry)
+        collection = self.collection_getter()
+        if collection is not None:
+            try:
+                # Only an older rendering is replaced; a newer one stored by another process wins
+                collection.update_one(
+                    {"_id": board_id, "version": {"$lte": entry["version"]}},
+                    {"$set": {"version": entry["version"], "png": Binary(png), "renderedAt": datetime.utcnow()}},
+                    upsert=True
+                )
+            except DuplicateKeyError:
+                pass
+        return entry
+
+    def export(self, board_id, scale=1.0):
+        """(version, png) of the whole board at `scale`, or None if the board does not exist."""
+        head = self._load_board(board_id, {"version": 1})
+        if head is None:
+            return None
+        key = (board_id, head.get("version", 0), scale)
+        with self.lock:
+            png = self.exports.get(key)
+            if png is not None:
+                self.exports.move_to_end(key)
+        if png is not None:
+            self.metrics["export_hits"] += 1
+            return key[1], png
+
+        board = self._load_board(board_id, RENDER_PROJECTION)
+        if board is None:
+            return None
+        key = (board_id, board.get("version", 0), scale)
+        png = self._render(board, scale=scale)[0]
+        self.metrics["exports_rendered"] += 1
+        if len(png) <= self.max_export_bytes:
+            with self.lock:
+                if key not in self.exports:
+                    self.exports[key] = png
+                    self.export_bytes += len(png)
+                while self.export_bytes > self.max_export_bytes:
+                    _, dropped = self.exports.popitem(last=False)
+                    self.export_bytes -= len(dropped)
+        return key[1], png
+
+    def forget(self, board_ids):
+        """Drop images of deleted boards."""
+        board_ids = list(board_ids)
+        with self.lock:
+            for board_id in board_ids:
+                self.dirty.pop(board_id, None)
+                self.thumbnails.pop(board_id, None)
+            for key in [key for key in self.exports if key[0] in board_ids]:
+                self.export_bytes -= len(self.exports.pop(key))
+        collection = self.collection_getter()
+        if collection is not None and board_ids:
+            collection.delete_many({"_id": {"$in": board_ids}})
+
+    def tick(self):
+        """Re-render thumbnails of boards that are due; returns how many were rendered."""
+        now = self.clock()
+        with self.lock:
+            due = [board_id for board_id, marked in self.dirty.items() if now - marked >= self.delay]
+            for board_id in due:
+                del self.dirty[board_id]
+        rendered = 0
+        for i, board_id in enumerate(due):
+            try:
+                if self.render_thumbnail(board_id) is not None:
+                    rendered += 1
+            except DBUnavailable as e:
+                # Retried on a later tick, along with the boards not reached yet
+                log.warning("Deferred thumbnail renders", boards=len(due) - i, error=str(e))
+                with self.lock:
+                    for board_id in due[i:]:
+                        self.dirty.setdefault(board_id, now)
+                break
+            except Exception as e:
+                log.error("Failed to render thumbnail", board=str(board_id), error=str(e))
+        return rendered
+
+    def run_forever(self):
+        while True:
+            time.sleep(max(self.delay / 2, 0.5))
+            try:
+                self.tick()
+            except Exception as e:
+                log.exception("Error rendering thumbnails", error=str(e))
+
+    def stats(self):
+        with self.lock:
+            dirty, thumbnails, exports = len(self.dirty), len(self.thumbnails), len(self.exports)
+        renders = self.metrics["renders"]
+        return dict(
+            self.metrics,
+            render_ms_total=round(self.metrics["render_ms_total"], 3),
+            avg_render_ms=round(self.metrics["render_ms_total"] / renders, 3) if renders else 0.0,
+            dirty=dirty,
+            thumbnails_cached=thumbnails,
+            exports_cached=exports,
+            export_bytes=self.export_bytes,
+            workers=self.pool.workers,
+        )
+
+    def _load_board(self, board_id, projection):
+        boards = self.boards_getter()
+        board = boards.find_one({"_id": board_id}, projection) if boards is not None else None
+        board = board_elements.attach_one(board)
+        # Autosaves still waiting in the write-behind queue are part of the board
+        return board_writes.apply_pending(board_id, board)
+
+    def _load_thumbnail(self, board_id):
+        collection = self.collection_getter()
+        doc = collection.find_one({"_id": board_id}) if collection is not None else None
+        if doc is None:
+            return None
+        entry = {"version": doc.get("version", 0), "png": bytes(doc["png"])}
+        self._remember_thumbnail(board_id, entry)
+        return entry
+
+    def _remember_thumbnail(self, board_id, entry):
+        with self.lock:
+            current = self.thumbnails.get(board_id)
+            if current is not None and current["version"] > entry["version"]:
+                return
+            self.thumbnails[board_id] = entry
+            self.thumbnails.move_to_end(board_id)
+            while len(self.thumbnails) > self.max_thumbnails:
+                self.thumbnails.popitem(last=False)
+
+    def _render(self, board, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            result = self.pool.run(render_board, board, *args, **kwargs)
+        except Exception:
+            self.metrics["render_errors"] += 1
+            raise
+        self.metrics["renders"] += 1
+        self.metrics["render_ms_total"] += (time.perf_counter() - started) * 1000
+        return result
+
+
+render_pool = RenderPool()
+board_images = BoardImages(lambda: db.thumbnails_collection, lambda: db.boards_collection, render_pool)
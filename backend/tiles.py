@@ -0,0 +1,174 @@
+import math
+import os
+
+# Edge length, in canvas units, of the grid cells viewports are indexed by
+TILE_SIZE = float(os.environ.get('TILE_SIZE', 1024))
+# Largest viewport side accepted, so one subscription cannot span every tile
+MAX_VIEWPORT_SIZE = float(os.environ.get('MAX_VIEWPORT_SIZE', 20000))
+# Tiles one rectangle is filed under; larger rectangles go to an overflow set every query scans
+MAX_TILES_PER_RECT = int(os.environ.get('MAX_TILES_PER_RECT', 256))
+
+
+def _number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def line_bounds(line):
+    """[min_x, min_y, max_x, max_y] of a line's flat points, padded by half its width."""
+    points = line.get('points')
+    if not isinstance(points, list) or len(points) < 2:
+        return None
+    xs = points[0:len(points) - 1:2]
+    ys = points[1::2]
+    if not all(_number(v) for v in xs) or not all(_number(v) for v in ys):
+        return None
+    width = line.get('strokeWidth', 0)
+    pad = width / 2 if _number(width) else 0
+    return [min(xs) - pad, min(ys) - pad, max(xs) + pad, max(ys) + pad]
+
+
+def element_bounds(element):
+    """Bounding box of a stroke, note or text box, or None when it has no geometry."""
+    if not isinstance(element, dict):
+        return None
+    bbox = element.get('bbox')
+    if 'points' not in element and isinstance(bbox, list) and len(bbox) == 4:
+        return bbox
+    if 'points' in element:
+        return line_bounds(element)
+    x, y = element.get('x'), element.get('y')
+    if not _number(x) or not _number(y):
+        return None
+    width, height = element.get('width', 0), element.get('height', 0)
+    width = width if _number(width) else 0
+    height = height if _number(height) else 0
+    return [x, y, x + width, y + height]
+
+
+def intersects(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def parse_viewport(values):
+    """Viewport rectangle from x/y/width/height values (query args or a socket payload)."""
+    try:
+        x, y = float(values['x']), float(values['y'])
+        width, height = float(values['width']), float(values['height'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("Viewport needs numeric x, y, width and height")
+    if not all(math.isfinite(v) for v in (x, y, width, height)):
+        raise ValueError("Viewport must be finite")
+    if not 0 < width <= MAX_VIEWPORT_SIZE or not 0 < height <= MAX_VIEWPORT_SIZE:
+        raise ValueError("Viewport size out of range")
+    return [x, y, x + width, y + height]
+
+
+def in_viewport(elements, rect):
+    """Elements intersecting `rect`; elements without geometry are always kept."""
+    if not isinstance(elements, list):
+        return elements
+    kept = []
+    for element in elements:
+        bounds = element_bounds(element)
+        if bounds is None or intersects(bounds, rect):
+            kept.append(element)
+    return kept
+
+
+def viewport_filter(field, rect):
+    """Aggregation expression keeping the elements of `field` whose stored bbox meets `rect`.
+
+    Elements without a bbox are kept for the caller to check in Python.
+    """
+    bbox = "$$el.bbox"
+    return {"$cond": [
+        {"$isArray": f"${field}"},
+        {"$filter": {"input": f"${field}", "as": "el", "cond": {"$or": [
+            {"$ne": [{"$type": bbox}, "array"]},
+            {"$and": [
+                {"$lte": [{"$arrayElemAt": [bbox, 0]}, rect[2]]},
+                {"$gte": [{"$arrayElemAt": [bbox, 2]}, rect[0]]},
+                {"$lte": [{"$arrayElemAt": [bbox, 1]}, rect[3]]},
+                {"$gte": [{"$arrayElemAt": [bbox, 3]}, rect[1]]},
+            ]},
+        ]}}},
+        f"${field}",
+    ]}
+
+
+def tile_span(bounds, tile_size=TILE_SIZE):
+    """(x0, y0, x1, y1) tile coordinates of the corners of `bounds`."""
+    return (math.floor(bounds[0] / tile_size), math.floor(bounds[1] / tile_size),
+            math.floor(bounds[2] / tile_size), math.floor(bounds[3] / tile_size))
+
+
+def tile_count(bounds, tile_size=TILE_SIZE):
+    x0, y0, x1, y1 = tile_span(bounds, tile_size)
+    return max(0, x1 - x0 + 1) * max(0, y1 - y0 + 1)
+
+
+def tile_range(bounds, tile_size=TILE_SIZE):
+    x0, y0, x1, y1 = tile_span(bounds, tile_size)
+    return [(tx, ty) for tx in range(x0, x1 + 1) for ty in range(y0, y1 + 1)]
+
+
+class TileIndex:
+    """Uniform grid mapping keys to the tiles their rectangle covers.
+
+    Queries only look at the tiles a rectangle touches, then check the exact
+    rectangles, so their cost does not grow with entries elsewhere on the canvas.
+    Rectangles spanning more than `max_tiles` tiles are kept in `oversized`
+    instead, which every query checks, so one huge stroke costs a single
+    entry rather than millions of tiles.
+    """
+
+    def __init__(self, tile_size=TILE_SIZE, max_tiles=MAX_TILES_PER_RECT):
+        self.tile_size = tile_size
+        self.max_tiles = max_tiles
+        self.tiles = {}
+        self.rects = {}
+        self.oversized = set()
+
+    def __len__(self):
+        return len(self.rects)
+
+    def __contains__(self, key):
+        return key in self.rects
+
+    def keys(self):
+        return list(self.rects)
+
+    def insert(self, key, rect):
+        self.remove(key)
+        self.rects[key] = rect
+        if tile_count(rect, self.tile_size) > self.max_tiles:
+            self.oversized.add(key)
+            return
+        for tile in tile_range(rect, self.tile_size):
+            self.tiles.setdefault(tile, set()).add(key)
+
+    def remove(self, key):
+        rect = self.rects.pop(key, None)
+        if rect is None:
+            return
+        if key in self.oversized:
+            self.oversized.discard(key)
+            return
+        for tile in tile_range(rect, self.tile_size):
+            keys = self.tiles.get(tile)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tiles[tile]
+
+    def query(self, bounds):
+        """Keys whose rectangle intersects `bounds`."""
+        if tile_count(bounds, self.tile_size) > len(self.tiles):
+            # Huge queries cover more tiles than are occupied; scan the entries instead
+            return {key for key, rect in self.rects.items() if intersects(rect, bounds)}
+        found = {key for key in self.oversized if intersects(self.rects[key], bounds)}
+        for tile in tile_range(bounds, self.tile_size):
+            for key in self.tiles.get(tile, ()):
+                if key not in found and intersects(self.rects[key], bounds):
+                    found.add(key)
+        return found
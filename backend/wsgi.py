@@ -1,5 +1,10 @@
 import os
 from app import app, socketio
+from jobs import job_runner
+from log import get_logger
+
+# Run background jobs queued by requests, CLI commands, or a process that exited mid-job
+job_runner.start()
 
 # For gunicorn deployment
 app_instance = app
@@ -10,9 +15,11 @@ application = app
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 10000))  # Default to 10000 for Render
     
-    print("Starting CanvasConnect Backend Server...")
-    print(f"Server will be available on port: {port}")
-    print("Environment:", os.environ.get("FLASK_ENV", "development"))
+    get_logger('wsgi').info(
+        "Starting CanvasConnect Backend Server",
+        port=port,
+        environment=os.environ.get("FLASK_ENV", "development")
+    )
     
     # Use socketio.run for direct execution
     socketio.run(app, 
@@ -7,6 +7,10 @@ let connectionCheckInterval;
 let microphoneMuted = true;
 let audioMuted = false;
 
+// Outgoing ICE candidates per peer, sent together once gathering pauses
+let pendingCandidates = {};
+const CANDIDATE_BATCH_MS = 50;
+
 // Global volume control (0.0 to 1.0)
 let globalVolume = 1.0;
 
@@ -103,6 +107,8 @@ export function leaveVoiceRoom() {
     }
   });
   peerConnections = {};
+  Object.values(pendingCandidates).forEach(pending => clearTimeout(pending.timer));
+  pendingCandidates = {};
   
   // Stop local audio stream
   if (localStream) {
@@ -229,8 +235,11 @@ function setupSocketListeners() {
   // When receiving an answer to our offer
   window.socket.on("voice-answer", handleVoiceAnswer);
   
-  // When receiving an ICE candidate from another peer
-  window.socket.on("ice-candidate", handleIceCandidate);
+  // When receiving ICE candidates from another peer, batched by the server
+  window.socket.on("ice-candidates", handleIceCandidates);
+
+  // Members already in the room, sent once when we join
+  window.socket.on("voice-peers", handleVoicePeers);
   
   // When a user leaves the room
   window.socket.on("user-left", handleUserLeft);
@@ -245,7 +254,8 @@ function removeSocketListeners() {
   window.socket.off("user-joined", handleUserJoined);
   window.socket.off("voice-offer", handleVoiceOffer);
   window.socket.off("voice-answer", handleVoiceAnswer);
-  window.socket.off("ice-candidate", handleIceCandidate);
+  window.socket.off("ice-candidates", handleIceCandidates);
+  window.socket.off("voice-peers", handleVoicePeers);
   window.socket.off("user-left", handleUserLeft);
   
   console.log("Socket event listeners removed");
@@ -265,6 +275,21 @@ async function handleUserJoined(data) {
   }
 }
 
+// Connect to the members that were in the room before us
+async function handleVoicePeers(data) {
+  console.log(`Voice room has ${data.peers.length} other members`);
+  for (const userId of data.peers) {
+    createPeerConnection(userId);
+    // Same rule as handleUserJoined, seen from the other side
+    if (window.socket && window.socket.id < userId) {
+      await createAndSendOffer(userId);
+    }
+  }
+  if (window.updateParticipants) {
+    window.updateParticipants();
+  }
+}
+
 // Create and send an offer to a peer
 async function createAndSendOffer(userId) {
   const peerConnection = peerConnections[userId];
@@ -365,16 +390,32 @@ async function handleVoiceAnswer(data) {
   }
 }
 
-// Handle receiving an ICE candidate from another peer
-async function handleIceCandidate(data) {
-  try {
-    const peerConnection = peerConnections[data.userId];
-    if (peerConnection) {
-      await peerConnection.addIceCandidate(new RTCIceCandidate(data.candidate));
-      console.log(`Added ICE candidate from ${data.userId}`);
+// Handle receiving a batch of ICE candidates from another peer
+async function handleIceCandidates(data) {
+  const peerConnection = peerConnections[data.userId];
+  if (!peerConnection) return;
+  for (const candidate of data.candidates) {
+    try {
+      await peerConnection.addIceCandidate(new RTCIceCandidate(candidate));
+    } catch (error) {
+      console.error(`Error adding ICE candidate from ${data.userId}:`, error);
     }
-  } catch (error) {
-    console.error(`Error adding ICE candidate from ${data.userId}:`, error);
+  }
+}
+
+// Send the candidates gathered for a peer in one message
+function flushCandidates(userId) {
+  const pending = pendingCandidates[userId];
+  if (!pending) return;
+  clearTimeout(pending.timer);
+  delete pendingCandidates[userId];
+  if (window.socket && pending.candidates.length > 0) {
+    window.socket.emit("ice-candidate", {
+      targetUserId: userId,
+      userId: window.socket.id,
+      candidates: pending.candidates,
+      room: currentRoomId
+    });
   }
 }
 
@@ -382,6 +423,11 @@ async function handleIceCandidate(data) {
 function handleUserLeft(data) {
   console.log(`User left voice chat: ${data.userId}`);
   
+  if (pendingCandidates[data.userId]) {
+    clearTimeout(pendingCandidates[data.userId].timer);
+    delete pendingCandidates[data.userId];
+  }
+
   // Close the peer connection
   if (peerConnections[data.userId]) {
     peerConnections[data.userId].close();
@@ -425,17 +471,19 @@ function createPeerConnection(userId) {
     console.warn("No local stream available to add to peer connection");
   }
   
-  // When we have a new ICE candidate, send it to the peer
+  // Candidates arrive in bursts; collect them and send each burst as one message
   peerConnection.onicecandidate = (event) => {
-    if (event.candidate && window.socket) {
-      window.socket.emit("ice-candidate", {
-        targetUserId: userId,
-        userId: window.socket.id,
-        candidate: event.candidate,
-        room: currentRoomId
-      });
-      console.log(`Sent ICE candidate to ${userId}`);
+    if (!event.candidate) {
+      // Gathering finished, nothing more to wait for
+      flushCandidates(userId);
+      return;
+    }
+    let pending = pendingCandidates[userId];
+    if (!pending) {
+      pending = pendingCandidates[userId] = { candidates: [] };
+      pending.timer = setTimeout(() => flushCandidates(userId), CANDIDATE_BATCH_MS);
     }
+    pending.candidates.push(event.candidate.toJSON ? event.candidate.toJSON() : event.candidate);
   };
   
   // When the connection state changes
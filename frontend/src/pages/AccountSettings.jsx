@@ -83,9 +83,17 @@ export default function AccountSettings() {
 
   const fetchUserStats = async (userId) => {
     try {
-      const response = await axios.get(`${API_BASE_URL}/api/boards/user/${userId}`);
-      const boards = response.data;
-      
+      // The board list is paginated; follow X-Next-Cursor until the last page
+      const boards = [];
+      let cursor = null;
+      do {
+        const response = await axios.get(`${API_BASE_URL}/api/boards/user/${userId}`, {
+          params: cursor ? { cursor } : {}
+        });
+        boards.push(...response.data);
+        cursor = response.headers['x-next-cursor'] || null;
+      } while (cursor);
+
       setUserStats({
         boardCount: boards.length,
         collaboratorCount: boards.reduce((acc, board) => acc + (board.collaborators?.length || 0), 0),
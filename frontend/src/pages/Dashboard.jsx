@@ -58,18 +58,36 @@ export default function Dashboard() {
     return () => unsubscribe();
   }, [navigate]);
 
+  // The board list is paginated; follow X-Next-Cursor until the last page
+  const fetchAllBoards = async (userId) => {
+    const allBoards = [];
+    let cursor = null;
+    do {
+      const res = await axios.get(`${API_BASE_URL}/api/boards/user/${userId}`, {
+        params: cursor ? { cursor } : {}
+      });
+      allBoards.push(...res.data);
+      cursor = res.headers['x-next-cursor'] || null;
+    } while (cursor);
+    return allBoards;
+  };
+
   const fetchUserData = async (userId) => {
     setLoading(true);
     try {
       // Fetch real data from backend
-      const [boardsRes, activityRes] = await Promise.all([
-        axios.get(`${API_BASE_URL}/api/boards/user/${userId}`).catch(() => ({ data: [] })),
+      const [userBoards, activityRes] = await Promise.all([
+        fetchAllBoards(userId).catch(() => []),
         axios.get(`${API_BASE_URL}/api/activity/user/${userId}`).catch(() => ({ data: [] }))
       ]);
       
       // Add enhanced properties to real boards
-      const enhancedBoards = boardsRes.data.map(board => ({
+      const enhancedBoards = userBoards.map(board => ({
         ...board,
+        // Rendered by the backend per board version; mock boards have no version and show their initial
+        thumbnail: board.version !== undefined
+          ? `${API_BASE_URL}/api/boards/${board.id}/thumbnail?v=${board.version}`
+          : null,
         isFavorite: false, // You can add favorites functionality later
         isArchived: false,
         collaborators: [], // Add collaborators functionality later
@@ -227,7 +245,8 @@ export default function Dashboard() {
           break;
         
         case "export":
-          console.log("Export functionality not implemented yet");
+          // Full-size PNG of the whole board, downloaded by the browser
+          window.open(`${API_BASE_URL}/api/boards/${boardId}/export.png?download=1`, "_blank");
           break;
         
         case "move":
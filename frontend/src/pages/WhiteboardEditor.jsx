@@ -64,6 +64,8 @@ const socket = (typeof window !== 'undefined' && window.socket)
 if (typeof window !== 'undefined') window.socket = socket;
 
 const MODES = { DRAW: "draw", ERASE: "erase", HIGHLIGHT: "highlight" };
+// How long an erase waits for the server's answer before its local result is sent instead
+const ERASE_ACK_TIMEOUT = 3000;
 
 // Debounce utility for performance optimization
 const debounce = (func, wait) => {
@@ -78,6 +80,93 @@ const debounce = (func, wait) => {
   };
 };
 
+// Throttle utility: at most one call per `wait` ms, always ending with the latest arguments
+const throttle = (func, wait) => {
+  let last = 0;
+  let timeout = null;
+  let pending = null;
+  return function throttled(...args) {
+    pending = args;
+    const remaining = wait - (Date.now() - last);
+    if (remaining <= 0) {
+      clearTimeout(timeout);
+      timeout = null;
+      last = Date.now();
+      func(...pending);
+    } else if (!timeout) {
+      timeout = setTimeout(() => {
+        timeout = null;
+        last = Date.now();
+        func(...pending);
+      }, remaining);
+    }
+  };
+};
+
+// Apply a presence frame: changed fields per user, and users that left or went idle
+const mergePresence = (cursors, { users = {}, removed = [] } = {}, selfId) => {
+  const next = { ...cursors };
+  removed.forEach(userId => { delete next[userId]; });
+  Object.entries(users).forEach(([userId, changes]) => {
+    if (userId !== selfId) next[userId] = { ...next[userId], ...changes };
+  });
+  return next;
+};
+
+// Apply a server-side erase: erased strokes are dropped or replaced in place by their remaining pieces
+const spliceErased = (lines, { removed = [], fragments = {} } = {}) => {
+  const gone = new Set(removed.map(String));
+  const next = [];
+  const seen = new Set();
+  lines.forEach(line => {
+    const key = String(line.id);
+    if (!gone.has(key)) {
+      next.push(line);
+      return;
+    }
+    seen.add(key);
+    next.push(...(fragments[key] || []));
+  });
+  // Strokes this client was never shown still leave their pieces behind
+  Object.keys(fragments).forEach(key => {
+    if (!seen.has(key)) next.push(...fragments[key]);
+  });
+  return next;
+};
+
+// Apply a note op (note_added / note_updated / note_deleted) to a Map of notes by id
+const applyNoteOp = (notes, op, payload) => {
+  if (op === 'note_added') notes.set(payload.id, payload);
+  else if (op === 'note_updated') notes.set(payload.id, { ...notes.get(payload.id), ...payload });
+  else if (op === 'note_deleted') notes.delete(payload);
+};
+
+// A note event from a peer or a REST change, applied to the notes array
+const applyNoteEvent = (notes, event, data) => {
+  const payload = event === 'note_deleted' ? data?.noteId : data?.note;
+  if (payload == null) return notes;
+  const keyed = new Map(notes.map(note => [note.id, note]));
+  applyNoteOp(keyed, event, payload);
+  return Array.from(keyed.values());
+};
+
+// Rebuild room state from the server's snapshot plus the ops recorded after it
+const replayRoomState = (data) => {
+  if (!data?.snapshot) return { lines: data?.lines, notes: data?.notes };
+  const lines = new Map(data.snapshot.lines.map(line => [line.id, line]));
+  const notes = new Map(data.snapshot.notes.map(note => [note.id, note]));
+  (data.ops || []).forEach(({ op, data: payload }) => {
+    if (op === 'line') lines.set(payload.id, payload);
+    else if (op.startsWith('note_')) applyNoteOp(notes, op, payload);
+    else if (op === 'erased') {
+      const remaining = spliceErased(Array.from(lines.values()), payload);
+      lines.clear();
+      remaining.forEach(line => lines.set(line.id, line));
+    }
+  });
+  return { lines: Array.from(lines.values()), notes: Array.from(notes.values()) };
+};
+
 // Line smoothing utilities for ultra-smooth drawing experience
 const getDistance = (p1, p2) => {
   return Math.sqrt(Math.pow(p2.x - p1.x, 2) + Math.pow(p2.y - p1.y, 2));
@@ -165,6 +254,9 @@ export default function WhiteboardEditor() {
   const { id } = useParams(); // Whiteboard ID from route
   const navigate = useNavigate();
   const [lines, setLines] = useState([]);
+  // Latest lines for socket callbacks that outlive the render they were created in
+  const linesRef = useRef(lines);
+  linesRef.current = lines;
   const [notes, setNotes] = useState([]); // Added notes state
   const [templateData, setTemplateData] = useState([]); // Template-specific data
   const [templateType, setTemplateType] = useState("whiteboard"); // Board template type
@@ -184,6 +276,8 @@ export default function WhiteboardEditor() {
   const [showBackgroundPanel, setShowBackgroundPanel] = useState(false);
   const [showExportPanel, setShowExportPanel] = useState(false);
   const [connectedUsers, setConnectedUsers] = useState([]);
+  // Other users' cursors by socket id, merged from presence frames
+  const [remoteCursors, setRemoteCursors] = useState({});
   const [isVoiceEnabled, setIsVoiceEnabled] = useState(false);
   const [isMicEnabled, setIsMicEnabled] = useState(false);
   const [isAudioEnabled, setIsAudioEnabled] = useState(true);
@@ -492,25 +586,42 @@ export default function WhiteboardEditor() {
     console.log("Creating new text box:", newBox);
     setTextBoxes([...textBoxes, newBox]);
     setSelectedBox(newBox.id);
-    
-    // Force immediate save after creating text box
-    setTimeout(() => {
-      console.log("Force saving after text box creation");
-      axios.put(`${API_BASE_URL}/api/boards/update`, {
-        boardId: id,
-        data: lines,
-        notes: notes,
-        textBoxes: [...textBoxes, newBox],
-        background: backgroundColor,
-        templateType: templateType
-      }).then(response => {
-        console.log("Force save successful:", response.data);
-      }).catch(error => {
-        console.error("Force save failed:", error);
+
+    // Only the new box is stored, not the whole list
+    axios.post(`${API_BASE_URL}/api/boards/${id}/elements/textBoxes`, { element: newBox })
+      .catch(error => {
+        console.error("Text box save failed:", error);
       });
-    }, 100);
   };
 
+  // Text box edits not sent yet, merged per box and sent as one PATCH per box once editing pauses
+  const textBoxChangesRef = useRef({ board: null, changes: {}, timer: null });
+
+  const flushTextBoxChanges = () => {
+    const pending = textBoxChangesRef.current;
+    clearTimeout(pending.timer);
+    pending.timer = null;
+    const { board, changes } = pending;
+    pending.changes = {};
+    Object.entries(changes).forEach(([boxId, boxChanges]) => {
+      axios.patch(`${API_BASE_URL}/api/boards/${board}/elements/textBoxes/${boxId}`, { changes: boxChanges })
+        .catch(error => {
+          console.error("Text box save failed:", error);
+        });
+    });
+  };
+
+  const queueTextBoxChange = (boxId, changes) => {
+    const pending = textBoxChangesRef.current;
+    if (pending.board !== id) flushTextBoxChanges();
+    pending.board = id;
+    pending.changes[boxId] = { ...pending.changes[boxId], ...changes };
+    clearTimeout(pending.timer);
+    pending.timer = setTimeout(flushTextBoxChanges, 500);
+  };
+
+  useEffect(() => () => flushTextBoxChanges(), []);
+
   const handleCanvasClick = (e) => {
     // If clicking on canvas and not in text mode, clear text box selection
     if (selectedTool !== 'text' && !e.target.closest('.text-box')) {
@@ -537,23 +648,7 @@ export default function WhiteboardEditor() {
       box.id === isEditing ? { ...box, text: value } : box
     );
     setTextBoxes(updatedTextBoxes);
-    
-    // Force immediate save after text change
-    setTimeout(() => {
-      console.log("Force saving after text change");
-      axios.put(`${API_BASE_URL}/api/boards/update`, {
-        boardId: id,
-        data: lines,
-        notes: notes,
-        textBoxes: updatedTextBoxes,
-        background: backgroundColor,
-        templateType: templateType
-      }).then(response => {
-        console.log("Text change save successful:", response.data);
-      }).catch(error => {
-        console.error("Text change save failed:", error);
-      });
-    }, 500);
+    queueTextBoxChange(isEditing, { text: value });
   };
 
   const handleTextBlur = () => {
@@ -634,6 +729,7 @@ export default function WhiteboardEditor() {
           : box
       )
     );
+    queueTextBoxChange(selectedBox, { x: Math.max(0, newX), y: Math.max(0, newY) });
   };
 
   const handleTextMouseUp = () => {
@@ -658,6 +754,7 @@ export default function WhiteboardEditor() {
           : box
       )
     );
+    queueTextBoxChange(selectedBox, { x: Math.max(0, newX), y: Math.max(0, newY) });
     // Avoid scrolling while dragging
     e.preventDefault();
     e.stopPropagation();
@@ -701,6 +798,8 @@ export default function WhiteboardEditor() {
 
   const updateStyle = (property, value) => {
     if (!selectedBox) return;
+    const currentBox = textBoxes.find(box => box.id === selectedBox);
+    if (currentBox) queueTextBoxChange(selectedBox, { style: { ...currentBox.style, [property]: value } });
     
     setTextBoxes(boxes =>
       boxes.map(box =>
@@ -732,74 +831,87 @@ export default function WhiteboardEditor() {
   const deleteSelected = () => {
     if (selectedBox) {
       setTextBoxes(boxes => boxes.filter(box => box.id !== selectedBox));
+      delete textBoxChangesRef.current.changes[selectedBox];
+      axios.delete(`${API_BASE_URL}/api/boards/${id}/elements/textBoxes/${selectedBox}`)
+        .catch(error => {
+          console.error("Text box delete failed:", error);
+        });
       setSelectedBox(null);
     }
   };
 
-  // Enhanced eraser function with better line intersection detection
-  const eraseAtPosition = (x, y) => {
-    const eraserRadius = eraserSize / 2;
-    const linesToRemove = [];
-
-    lines.forEach((line, lineIndex) => {
-      const points = line.points;
-      let shouldErase = false;
-
-      // Check each line segment for intersection with eraser circle
-      for (let i = 0; i < points.length - 2; i += 2) {
-        const x1 = points[i];
-        const y1 = points[i + 1];
-        const x2 = points[i + 2];
-        const y2 = points[i + 3];
-
-        // Distance from eraser center to line segment
-        const distance = distanceToLineSegment(x, y, x1, y1, x2, y2);
-        
-        if (distance <= eraserRadius + (line.strokeWidth / 2)) {
-          shouldErase = true;
-          break;
+  // Eraser points not yet sent, and the strokes erased locally since the last send.
+  // The server erases along the same path and answers with the strokes it removed or split
+  const erasePathRef = useRef({ points: [], erased: new Map(), timer: null });
+  // Ids of the pieces this client's erases cut from a stroke, so redoing the stroke replaces them
+  const erasedPiecesRef = useRef(new Map());
+
+  const flushErasePath = () => {
+    const pending = erasePathRef.current;
+    clearTimeout(pending.timer);
+    pending.timer = null;
+    if (pending.points.length < 2) return;
+    const erased = pending.erased;
+    pending.erased = new Map();
+    socket.timeout(ERASE_ACK_TIMEOUT).emit(
+      'erase_path',
+      { room: id, path: pending.points, radius: eraserSize / 2 },
+      (err, result) => {
+        if (err || !result) {
+          // The room could not erase (template board, not joined, rate limited): send the local result
+          if (erased.size > 0) socket.emit('erase', { room: id, lines: linesRef.current });
+          return;
         }
+        // Strokes the server left alone come back; pieces of split ones arrive with 'erased'
+        const removed = new Set(result.removed.map(String));
+        const kept = [...erased.values()].filter(line => !removed.has(String(line.id)));
+        if (kept.length === 0) return;
+        const keptIds = new Set(kept.map(line => String(line.id)));
+        setLines(prev => [...prev.filter(line => !keptIds.has(String(line.id))), ...kept]);
+        setRedoStack(prev => prev.filter(line => !keptIds.has(String(line.id))));
       }
+    );
+    // The next batch starts at the last point so the swept path has no gaps
+    pending.points = pending.points.slice(-2);
+  };
 
-      if (shouldErase) {
-        linesToRemove.push(lineIndex);
-      }
-    });
+  // Remove the strokes under the eraser at once; the server's answer reconciles them
+  const eraseAtPosition = (x, y) => {
+    const pending = erasePathRef.current;
+    pending.points.push(x, y);
+    if (!pending.timer) pending.timer = setTimeout(flushErasePath, 33); // 30fps for erase operations
 
-    // Remove lines that intersect with eraser
-    if (linesToRemove.length > 0) {
-      const newLines = lines.filter((_, index) => !linesToRemove.includes(index));
-      const removedLines = lines.filter((_, index) => linesToRemove.includes(index));
-      
-      setLines(newLines);
-      setRedoStack([...redoStack, ...removedLines]);
-      
-      // Emit eraser action to other users
-      socket.emit('erasing', {
-        room: id,
-        removedIndices: linesToRemove
-      });
+    const radius = eraserSize / 2;
+    const hit = new Set(linesRef.current.filter(line =>
+      distanceToLine(x, y, line.points) <= radius + (line.strokeWidth || 0) / 2
+    ));
+    if (hit.size === 0) return;
+    hit.forEach(line => pending.erased.set(String(line.id), line));
+    // Pointer moves before the next render must not hit these strokes again
+    linesRef.current = linesRef.current.filter(line => !hit.has(line));
+    setLines(prev => prev.filter(line => !hit.has(line)));
+    // Erased strokes can be brought back with redo, as before erasing moved to the server
+    setRedoStack(prev => [...prev, ...hit]);
+  };
+
+  // Shortest distance from a point to a stroke's polyline
+  const distanceToLine = (px, py, points) => {
+    if (!Array.isArray(points) || points.length < 2) return Infinity;
+    if (points.length < 4) return Math.hypot(px - points[0], py - points[1]);
+    let min = Infinity;
+    for (let i = 0; i < points.length - 2; i += 2) {
+      const x1 = points[i], y1 = points[i + 1];
+      const dx = points[i + 2] - x1, dy = points[i + 3] - y1;
+      const lenSq = dx * dx + dy * dy;
+      const t = lenSq === 0 ? 0 : Math.max(0, Math.min(1, ((px - x1) * dx + (py - y1) * dy) / lenSq));
+      min = Math.min(min, Math.hypot(px - (x1 + t * dx), py - (y1 + t * dy)));
     }
+    return min;
   };
 
-  // Helper function to calculate distance from point to line segment
-  const distanceToLineSegment = (px, py, x1, y1, x2, y2) => {
-    const dx = x2 - x1;
-    const dy = y2 - y1;
-    const length = Math.sqrt(dx * dx + dy * dy);
-    
-    if (length === 0) {
-      // Line segment is actually a point
-      return Math.sqrt((px - x1) * (px - x1) + (py - y1) * (py - y1));
-    }
-    
-    // Calculate the projection of point onto line segment
-    const t = Math.max(0, Math.min(1, ((px - x1) * dx + (py - y1) * dy) / (length * length)));
-    const projX = x1 + t * dx;
-    const projY = y1 + t * dy;
-    
-    // Distance from point to projection
-    return Math.sqrt((px - projX) * (px - projX) + (py - projY) * (py - projY));
+  const endErasePath = () => {
+    flushErasePath();
+    erasePathRef.current.points = [];
   };
 
   useEffect(() => {
@@ -831,6 +943,7 @@ export default function WhiteboardEditor() {
         const newW = Math.max(minW, resizeState.startW + dx);
         const newH = Math.max(minH, resizeState.startH + dy);
         setTextBoxes((boxes) => boxes.map((b) => b.id === resizeState.boxId ? { ...b, width: newW, height: newH } : b));
+        queueTextBoxChange(resizeState.boxId, { width: newW, height: newH });
       }
     };
 
@@ -861,6 +974,7 @@ export default function WhiteboardEditor() {
         const newW = Math.max(minW, resizeState.startW + dx);
         const newH = Math.max(minH, resizeState.startH + dy);
         setTextBoxes((boxes) => boxes.map((b) => b.id === resizeState.boxId ? { ...b, width: newW, height: newH } : b));
+        queueTextBoxChange(resizeState.boxId, { width: newW, height: newH });
         e.preventDefault();
       }
     };
@@ -935,6 +1049,8 @@ export default function WhiteboardEditor() {
   // Enhanced Voice communication with better error handling
   const localStreamRef = useRef(null);
   const peerConnectionsRef = useRef({});
+  // Outgoing ICE candidates per peer, sent as one message once gathering pauses
+  const pendingCandidatesRef = useRef({});
   const socketRef = useRef(null);
   
   const [voiceStatus, setVoiceStatus] = useState('disconnected'); // disconnected, connecting, ready, error
@@ -1041,10 +1157,30 @@ export default function WhiteboardEditor() {
       await handleVoiceAnswer(data);
     });
 
-    socket.on('ice-candidate', async (data) => {
-      addVoiceDebug(`Received ICE candidate from: ${data.userId}`);
-      await handleIceCandidate(data);
+    socket.on('ice-candidates', async (data) => {
+      await handleIceCandidates(data);
     });
+
+    // Members already in the voice room; they send us offers when they see us join
+    socket.on('voice-peers', (data) => {
+      addVoiceDebug(`Voice room has ${data.peers.length} other members`);
+      setConnectedUsers(data.peers);
+    });
+  };
+
+  // Send the ICE candidates gathered for a peer as one message
+  const flushCandidates = (userId) => {
+    const pending = pendingCandidatesRef.current[userId];
+    if (!pending) return;
+    clearTimeout(pending.timer);
+    delete pendingCandidatesRef.current[userId];
+    if (pending.candidates.length > 0) {
+      socket.emit('ice-candidate', {
+        targetUserId: userId,
+        candidates: pending.candidates,
+        room: id
+      });
+    }
   };
 
   const createPeerConnection = async (userId, shouldCreateOffer = false) => {
@@ -1081,13 +1217,16 @@ export default function WhiteboardEditor() {
 
       // Handle ICE candidates
       pc.onicecandidate = (event) => {
-        if (event.candidate) {
-          socket.emit('ice-candidate', {
-            targetUserId: userId,
-            candidate: event.candidate,
-            room: id
-          });
+        if (!event.candidate) {
+          flushCandidates(userId);
+          return;
         }
+        let pending = pendingCandidatesRef.current[userId];
+        if (!pending) {
+          pending = pendingCandidatesRef.current[userId] = { candidates: [] };
+          pending.timer = setTimeout(() => flushCandidates(userId), 50);
+        }
+        pending.candidates.push(event.candidate.toJSON ? event.candidate.toJSON() : event.candidate);
       };
 
       pc.onconnectionstatechange = () => {
@@ -1143,14 +1282,15 @@ export default function WhiteboardEditor() {
     }
   };
 
-  const handleIceCandidate = async (data) => {
-    try {
-      const pc = peerConnectionsRef.current[data.userId];
-      if (pc) {
-        await pc.addIceCandidate(new RTCIceCandidate(data.candidate));
+  const handleIceCandidates = async (data) => {
+    const pc = peerConnectionsRef.current[data.userId];
+    if (!pc) return;
+    for (const candidate of data.candidates) {
+      try {
+        await pc.addIceCandidate(new RTCIceCandidate(candidate));
+      } catch (err) {
+        addVoiceDebug(`Error handling ICE candidate: ${err.message}`);
       }
-    } catch (err) {
-      addVoiceDebug(`Error handling ICE candidate: ${err.message}`);
     }
   };
 
@@ -1178,6 +1318,8 @@ export default function WhiteboardEditor() {
     // Clean up peer connections
     Object.values(peerConnectionsRef.current).forEach(pc => pc.close());
     peerConnectionsRef.current = {};
+    Object.values(pendingCandidatesRef.current).forEach(pending => clearTimeout(pending.timer));
+    pendingCandidatesRef.current = {};
 
     // Stop local stream
     if (localStreamRef.current) {
@@ -1274,13 +1416,11 @@ export default function WhiteboardEditor() {
   useEffect(() => {
     const interval = setInterval(() => {
       if (lines.length > 0 || templateData.length > 0 || textBoxes.length > 0 || notes.length > 0) {
-        console.log("Auto-saving with textBoxes:", textBoxes);
         const dataToSave = templateData.length > 0 ? templateData : lines;
+        // Notes are saved by the room and text boxes one by one as they change, so neither is resent here
         axios.put(`${API_BASE_URL}/api/boards/update`, {
           boardId: id,
           data: dataToSave, // Send data directly, not stringified
-          notes: notes,
-          textBoxes: textBoxes,
           background: backgroundColor,
           templateType: templateType
         }).then(response => {
@@ -1302,20 +1442,83 @@ export default function WhiteboardEditor() {
       socket.on('drawing', (data) => {
         setLines(prev => [...prev, data.line]);
       });
+
+      // The server coalesces room events into one frame per tick
+      socket.on('batch', (frame) => {
+        (frame?.events || []).forEach(([event, payload, sender]) => {
+          if (sender === socket.id) return;
+          if (event === 'drawing' && payload?.line) {
+            setLines(prev => [...prev, payload.line]);
+          } else if (event === 'erased') {
+            setLines(prev => spliceErased(prev, payload));
+          } else if (event === 'erase' && Array.isArray(payload?.lines)) {
+            // A peer whose room could not erase sends the lines it has left
+            setLines(payload.lines);
+          } else if (event.startsWith('note_')) {
+            setNotes(prev => applyNoteEvent(prev, event, payload));
+          }
+        });
+      });
+
+      // Notes changed through the REST element endpoints
+      ['note_added', 'note_updated', 'note_deleted'].forEach(event => {
+        socket.on(event, (data) => {
+          if (data?.room !== id) return;
+          setNotes(prev => applyNoteEvent(prev, event, data));
+        });
+      });
+
+      // Result of an erase: the strokes it hit and what is left of them
+      socket.on('erased', (data) => {
+        Object.entries(data?.fragments || {}).forEach(([key, pieces]) => {
+          erasedPiecesRef.current.set(key, pieces.map(piece => String(piece.id)));
+        });
+        setLines(prev => spliceErased(prev, data));
+      });
   
       socket.on('load_board_state', (data) => {
-        // Apply initial load only once to prevent overwriting active local drawing
-        if (!initialBoardLoadedRef.current) {
-          if (data?.lines) setLines(data.lines);
-          if (data?.notes) setNotes(data.notes);
+        // Apply initial load only once to prevent overwriting active local drawing,
+        // unless the server asks a lagging client to resync
+        if (!initialBoardLoadedRef.current || data?.resync) {
+          const { lines: roomLines, notes: roomNotes } = replayRoomState(data);
+          if (roomLines) setLines(roomLines);
+          if (roomNotes) setNotes(roomNotes);
           initialBoardLoadedRef.current = true;
         }
       });
   
+      // The board could not be read (database degraded); join again shortly
+      let rejoinTimer = null;
+      // Live cursors: the full table on join, then one delta frame per tick
+      socket.on('presence_state', (data) => {
+        if (data?.room !== id) return;
+        setRemoteCursors(mergePresence({}, data, socket.id));
+      });
+      socket.on('presence', (frame) => {
+        if (frame?.room !== id) return;
+        setRemoteCursors(prev => mergePresence(prev, frame, socket.id));
+      });
+
+      socket.on('board_unavailable', (data) => {
+        if (data?.room !== id) return;
+        clearTimeout(rejoinTimer);
+        rejoinTimer = setTimeout(() => socket.emit('join', { room: id }), (data.retryAfter || 1) * 1000);
+      });
+  
       return () => {
+        clearTimeout(rejoinTimer);
         socket.emit('leave', { room: id });
         socket.off('drawing');
+        socket.off('batch');
+        socket.off('note_added');
+        socket.off('note_updated');
+        socket.off('note_deleted');
+        socket.off('erased');
         socket.off('load_board_state');
+        socket.off('presence_state');
+        socket.off('presence');
+        socket.off('board_unavailable');
+        setRemoteCursors({});
       };
     }
   }, [id]);  
@@ -1346,6 +1549,26 @@ export default function WhiteboardEditor() {
     return () => window.removeEventListener('resize', onResize);
   }, [clampPan, zoom, isToolbarOpen]);
   
+  // Tell the server which part of the canvas is visible (plus half a screen of
+  // margin each way) so strokes drawn elsewhere are only sent once panned into view
+  const emitViewport = useMemo(
+    () => debounce((offset, scale, size) => {
+      const s = Math.max(scale, 0.001);
+      socket.emit('viewport', {
+        room: id,
+        x: (-offset.x - size.width / 2) / s,
+        y: (-offset.y - size.height / 2) / s,
+        width: (size.width * 2) / s,
+        height: (size.height * 2) / s
+      });
+    }, 150),
+    [id]
+  );
+
+  useEffect(() => {
+    emitViewport(panOffset, zoom, stageSize);
+  }, [emitViewport, panOffset, zoom, stageSize]);
+
   // Initial compute after mount (once refs have layout)
   useEffect(() => {
     const hh = headerRef.current?.offsetHeight || 0;
@@ -1360,6 +1583,7 @@ export default function WhiteboardEditor() {
     try {
       console.log("Manual save with textBoxes:", textBoxes);
       setSaveStatus('saving');
+      flushTextBoxChanges();
       await axios.put(`${API_BASE_URL}/api/boards/update`, {
         boardId: id,
         data: lines,
@@ -1400,10 +1624,9 @@ export default function WhiteboardEditor() {
     [id]
   );
 
-  const throttledEraseEmit = useCallback(
-    debounce((lines) => {
-      socket.emit('erase', { room: id, lines });
-    }, 33), // 30fps for erase operations
+  // Cursor position for peers; the server batches presence per tick anyway
+  const emitPresence = useMemo(
+    () => throttle((x, y, tool) => socket.emit('presence', { room: id, x, y, tool }), 100),
     [id]
   );
 
@@ -1479,7 +1702,8 @@ export default function WhiteboardEditor() {
   const handleRedo = () => {
     if (redoStack.length === 0) return;
     const restored = redoStack[redoStack.length - 1];
-    setLines([...lines, restored]);
+    const pieces = new Set(erasedPiecesRef.current.get(String(restored.id)) || []);
+    setLines([...lines.filter(line => !pieces.has(String(line.id))), restored]);
     setRedoStack(redoStack.slice(0, -1));
   };
 
@@ -1529,25 +1753,26 @@ export default function WhiteboardEditor() {
       text: note.text + ' (Copy)'
     };
     setNotes([...notes, newNote]);
+    socket.emit('note_added', { room: id, note: newNote });
   };
 
-  const handleNoteChange = (id, newText) => {
-    const updatedNote = notes.find(note => note.id === id);
+  const handleNoteChange = (noteId, newText) => {
+    const updatedNote = notes.find(note => note.id === noteId);
     if (updatedNote) {
       updatedNote.text = newText;
-      setNotes(notes.map((note) => (note.id === id ? updatedNote : note)));
+      setNotes(notes.map((note) => (note.id === noteId ? updatedNote : note)));
       socket.emit('note_updated', { room: id, note: updatedNote });
     }
   };
 
-  const handleNoteDrag = (id, e) => {
-    const updatedNote = notes.find(note => note.id === id);
+  const handleNoteDrag = (noteId, e) => {
+    const updatedNote = notes.find(note => note.id === noteId);
     if (updatedNote) {
       updatedNote.x = e.target.x();
       updatedNote.y = e.target.y();
       
       const newNotes = notes.map((note) => {
-        if (note.id === id) {
+        if (note.id === noteId) {
           return updatedNote;
         }
         return note;
@@ -1648,6 +1873,12 @@ export default function WhiteboardEditor() {
 
   const clearBoard = () => {
     if (window.confirm('Are you sure you want to clear the entire whiteboard? This action cannot be undone.')) {
+      notes.forEach(note => socket.emit('note_deleted', { room: id, noteId: note.id }));
+      textBoxes.forEach(box => {
+        axios.delete(`${API_BASE_URL}/api/boards/${id}/elements/textBoxes/${box.id}`)
+          .catch(error => console.error("Text box delete failed:", error));
+      });
+      textBoxChangesRef.current.changes = {};
       setLines([]);
       setNotes([]);
       setTextBoxes([]);
@@ -1701,6 +1932,7 @@ export default function WhiteboardEditor() {
       isDrawing.current = true;
       const isHighlight = mode === MODES.HIGHLIGHT;
       const newLine = {
+        id: uuidv4(),
         points: [adjustedX, adjustedY],
         color: isHighlight ? highlighterColor : strokeColor,
         strokeWidth: isHighlight ? highlighterWidth : strokeWidth,
@@ -1737,6 +1969,7 @@ export default function WhiteboardEditor() {
     // Adjust for pan and zoom
     const adjustedX = (point.x - panOffset.x) / zoom;
     const adjustedY = (point.y - panOffset.y) / zoom;
+    emitPresence(adjustedX, adjustedY, mode === MODES.DRAW ? selectedTool : mode);
 
     // Erasing
     if (mode === MODES.ERASE) {
@@ -1774,6 +2007,7 @@ export default function WhiteboardEditor() {
       return;
     }
     isDrawing.current = false;
+    if (isErasing) endErasePath();
     setIsErasing(false);
   };
 
@@ -1819,14 +2053,7 @@ export default function WhiteboardEditor() {
     if (mode === MODES.ERASE) {
       isDrawing.current = false;
       setIsErasing(true);
-      const newLines = lines.filter(line => {
-        const lineDistance = getDistanceToLine(adjustedX, adjustedY, line.points);
-        return lineDistance > eraserSize / 2;
-      });
-      if (newLines.length !== lines.length) {
-        setLines(newLines);
-        socket.emit('erase', { room: id, lines: newLines });
-      }
+      eraseAtPosition(adjustedX, adjustedY);
       return;
     }
 
@@ -1898,14 +2125,7 @@ export default function WhiteboardEditor() {
     const adjustedY = (point.y - panOffset.y) / zoom;
 
     if (isErasing) {
-      const newLines = lines.filter(line => {
-        const lineDistance = getDistanceToLine(adjustedX, adjustedY, line.points);
-        return lineDistance > eraserSize / 2;
-      });
-      if (newLines.length !== lines.length) {
-        setLines(newLines);
-        throttledEraseEmit(newLines);
-      }
+      eraseAtPosition(adjustedX, adjustedY);
       return;
     }
 
@@ -1929,6 +2149,7 @@ export default function WhiteboardEditor() {
       endStroke();
     }
     isDrawing.current = false;
+    if (isErasing) endErasePath();
     setIsErasing(false);
   };
 
@@ -1985,47 +2206,6 @@ export default function WhiteboardEditor() {
     }
   };
 
-  // Helper function to calculate distance from point to line
-  const getDistanceToLine = (px, py, linePoints) => {
-    if (linePoints.length < 4) return Infinity;
-    
-    let minDistance = Infinity;
-    for (let i = 0; i < linePoints.length - 2; i += 2) {
-      const x1 = linePoints[i];
-      const y1 = linePoints[i + 1];
-      const x2 = linePoints[i + 2];
-      const y2 = linePoints[i + 3];
-      
-      const distance = getDistancePointToLineSegment(px, py, x1, y1, x2, y2);
-      minDistance = Math.min(minDistance, distance);
-    }
-    
-    return minDistance;
-  };
-
-  const getDistancePointToLineSegment = (px, py, x1, y1, x2, y2) => {
-    const A = px - x1;
-    const B = py - y1;
-    const C = x2 - x1;
-    const D = y2 - y1;
-
-    const dot = A * C + B * D;
-    const lenSq = C * C + D * D;
-    
-    if (lenSq === 0) return Math.sqrt(A * A + B * B);
-    
-    let param = dot / lenSq;
-    param = Math.max(0, Math.min(1, param));
-
-    const xx = x1 + param * C;
-    const yy = y1 + param * D;
-
-    const dx = px - xx;
-    const dy = py - yy;
-    
-    return Math.sqrt(dx * dx + dy * dy);
-  };
-
   // Template renderer
   const renderTemplateComponents = () => {
     return templateData.map(item => {
@@ -2914,6 +3094,7 @@ export default function WhiteboardEditor() {
             className="z-0"
             onMouseDown={selectedTool === 'text' ? undefined : handleMouseDown}
             onMouseMove={selectedTool === 'text' ? undefined : handleMouseMove}
+            onMouseLeave={() => emitPresence(null, null)}
             onMouseUp={selectedTool === 'text' ? undefined : handleMouseUp}
             onTouchStart={selectedTool === 'text' ? undefined : handleTouchStart}
             onTouchMove={selectedTool === 'text' ? undefined : handleTouchMove}
@@ -3053,6 +3234,29 @@ export default function WhiteboardEditor() {
                   />
                 </React.Fragment>
               ))}
+
+              {/* Other users' cursors */}
+              {Object.entries(remoteCursors).map(([userId, cursor]) => (
+                cursor.x == null ? null : (
+                  <React.Fragment key={`cursor-${userId}`}>
+                    <Circle
+                      x={cursor.x}
+                      y={cursor.y}
+                      radius={5 / zoom}
+                      fill={cursor.color || '#6366f1'}
+                      listening={false}
+                    />
+                    <Text
+                      x={cursor.x + 8 / zoom}
+                      y={cursor.y + 8 / zoom}
+                      text={cursor.name || cursor.tool || userId.slice(0, 4)}
+                      fontSize={11 / zoom}
+                      fill={cursor.color || '#6366f1'}
+                      listening={false}
+                    />
+                  </React.Fragment>
+                )
+              ))}
             </Layer>
           </Stage>
 
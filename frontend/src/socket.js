@@ -78,10 +78,10 @@ socket.on("voice-answer", async ({ answer }) => {
   }
 });
 
-// Handle incoming ICE candidates
-socket.on("ice-candidate", ({ candidate }) => {
-  if (peerConnection && candidate) {
-    peerConnection.addIceCandidate(new RTCIceCandidate(candidate));
+// Handle incoming ICE candidates, batched per sender by the server
+socket.on("ice-candidates", ({ candidates }) => {
+  if (peerConnection && candidates) {
+    candidates.forEach(candidate => peerConnection.addIceCandidate(new RTCIceCandidate(candidate)));
   }
 });
 